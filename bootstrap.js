@@ -75,7 +75,16 @@ var bootstrap = {
             dump("error happen :" + e.toString());
             return str;
         }
-        
+        return bootstrap.fixupStyleSheet(obj);
+    },
+
+    // Returns the fixup rules for the parsed stylesheet obj, as CSS text.
+    fixupStyleSheet : function(obj) {
+        return css.stringify(bootstrap.createFixupStyleSheet(obj));
+    },
+
+    // Returns the fixup rules for the parsed stylesheet obj, as a stylesheet to stringify.
+    createFixupStyleSheet : function(obj) {
         var fixupRules = [], fixupDeclarations, prop, value;
         for(var rule, i = 0; rule = obj.stylesheet.rules[i]; i++){
             insertFixupDeclarations(rule);
@@ -84,21 +93,33 @@ var bootstrap = {
            // rule.type, rule.selectors, rule.declarations (rule.comment, rule.media)
             if(rule.declarations){
                 fixupDeclarations = [];
+                // the fixup and rule declarations by property, in that order, for
+                // hasDeclaration() and getValueForProperty()
+                var fixupIndex = Object.create(null), ruleIndex = bootstrap.indexDeclarations(Object.create(null), rule.declarations);
+                var declarationsFor = function(property){
+                    return (fixupIndex[property] || []).concat(ruleIndex[property] || []);
+                };
+                var addFixupDeclaration = function(property, value){
+                    var fixup = {type:'declaration', property:property, value:value, _fxjsdefined:true};
+                    fixupDeclarations.push(fixup);
+                    bootstrap.indexDeclarations(fixupIndex, [fixup]);
+                };
                 for(var decl, j = 0; decl = rule.declarations[j]; j++){
                    // decl.type, decl.property, decl.value
                    prop = '', value = '';
+                   var dispatch = bootstrap.fixupDispatchFor(decl.property);
                    // sometimes sites include a background fallback colour but in the *same* declaration as -webkit-gradient.
                    // It is better practise to have a separate 'background' declaration for the fallback colour. Let's add it.
-                   if(decl.property === 'background' && /(url\((.*)\s*)-webkit-/.test(decl.value)){
+                   if(dispatch.background && /(url\((.*)\s*)-webkit-/.test(decl.value)){
                         dump("regexp 1 = " + bootstrap.trimSpaceAndPunc(RegExp.$1));
-                        fixupDeclarations.push({type:'declaration', property:'background', value:bootstrap.trimSpaceAndPunc(RegExp.$1), _fxjsdefined:true});
+                        addFixupDeclaration('background', bootstrap.trimSpaceAndPunc(RegExp.$1));
                         decl.value = decl.value.replace(/(url\((.*)\s*)-webkit-/, '-webkit-');
                    }
-                   if(decl.property === 'background' && /(#\w{3,6})\s*-webkit-/.test(decl.value)){ // TODO: in reality, the color and -webkit-foo() could be in any order.. is this a problem?
-                        fixupDeclarations.push({type:'declaration', property:'background', value:RegExp.$1, _fxjsdefined:true});
+                   if(dispatch.background && /(#\w{3,6})\s*-webkit-/.test(decl.value)){ // TODO: in reality, the color and -webkit-foo() could be in any order.. is this a problem?
+                        addFixupDeclaration('background', RegExp.$1);
                         decl.value = decl.value.replace(/(#\w{3,6})\s*-webkit-/, '-webkit-');
                    }
-                    if(decl.property === 'display' && /box$/.test(decl.value) || /(box-|flex-)/.test(decl.property)){
+                    if(dispatch.display && /box$/.test(decl.value) || dispatch.flexbox){
                         var tmp = bootstrap.createFixupFlexboxDeclaration(decl, rule.declarations);
                         prop = tmp.property, value = tmp.value;
                     }else if(/-webkit-gradient/i.test(decl.value)){
@@ -106,35 +127,33 @@ var bootstrap = {
                         prop = tmp.property, value = tmp.value;
                     }else{
 
-                        if(/-webkit-/.test(decl.property)){
-                           prop = decl.property.substr(8);
-                        }
+                        prop = dispatch.unprefixed;
 
                         if(/-webkit-/.test(decl.value)){
                             value = decl.value.replace(/-webkit-/g, '');
                         }
                     }
                     if (!prop && !value) {
-                        fixupDeclarations.push({type:'declaration', property:decl.property, value:decl.value, _fxjsdefined:true});
+                        addFixupDeclaration(decl.property, decl.value);
                     }
                     if(prop || value){
                         prop = prop || decl.property;
                         value = value || decl.value
                         // We follow the standards - better not to pseudo-standardise -webkit-something
-                        if(bootstrap.allW3CSSProperties.indexOf(prop) === -1)continue;
+                        if(!bootstrap.isW3CProperty(prop))continue;
                         
-                        if(bootstrap.hasDeclaration(fixupDeclarations.concat(rule.declarations), prop, value, false, true))continue;
+                        if(bootstrap.hasDeclaration(declarationsFor(prop), prop, value, false, true))continue;
                         if(bootstrap.warnAgainstPotentiallyOverwrittenValues){
-                            var existingValue = bootstrap.getValueForProperty(fixupDeclarations.concat(rule.declarations), prop, false);
+                            var existingValue = bootstrap.getValueForProperty(declarationsFor(prop), prop, false);
                             if(existingValue !== undefined && !/(-webkit-|box)/.test(existingValue)){ // now it gets complicated. There is a declaration for the property we want to add, but the value is different..
                                 // console.log('Whoa, Sir! We want to add "' + prop + ':' + value +'", but found "' + prop + ':' + existingValue +'"');
     
                             }                       
                         }
-                        fixupDeclarations.push({type:'declaration', property:prop, value:value, _fxjsdefined:true});
+                        addFixupDeclaration(prop, value);
                         // extra gotcha: per Gecko's reading of the spec, border-image will only appear if border-style or border-width is set..
-                        if(prop === 'border-image' && bootstrap.getValueForProperty(fixupDeclarations.concat(rule.declarations), 'border-style', false) === undefined){
-                            fixupDeclarations.push({type:'declaration', property:'border-style', value:'solid', _fxjsdefined:true});
+                        if(prop === 'border-image' && bootstrap.getValueForProperty(declarationsFor('border-style'), 'border-style', false) === undefined){
+                            addFixupDeclaration('border-style', 'solid');
                         }
                     }
                 }// done iterating declarations in this rule
@@ -149,10 +168,304 @@ var bootstrap = {
         }
         var fixupStyleSheet = {"type": "stylesheet", stylesheet: {rules: []}};
         bootstrap.copyJSDefinedStyles(obj, fixupStyleSheet);
-        var cssStr = css.stringify(fixupStyleSheet);
+        return fixupStyleSheet;
+    },
+
+    // Called by browser.js instead of createFixupRulesFromCSSFileContent(), so that a
+    // stylesheet we've seen before (e.g. from a popular CDN) isn't parsed and fixed again.
+    // persist is false for private browsing, whose stylesheets mustn't reach the profile.
+    fixupCSSFileContent : function(str, persist) {
+        var cache = bootstrap.fixupCache;
+        if(!str){
+            return bootstrap.createFixupRulesFromCSSFileContent(str);
+        }
+        cache.init();
+        var key = cache.hash(str);
+        var cssStr = cache.get(key);
+        if(cssStr === undefined){
+            cssStr = bootstrap.createFixupRulesFromCSSFileContent(str);
+            cache.put(key, cssStr, persist !== false);
+        }
         return cssStr;
     },
 
+    // Incremental createFixupRulesFromCSSFileContent(), for browser.js to fix up a
+    // stylesheet while it downloads. feed(str) returns the fixup rules for the top-level
+    // rules complete so far, and close() the rest. Together they make what the whole
+    // stylesheet would, except that from a rule that doesn't parse on, the text is passed
+    // through as is (rather than all of it), and so is a rule whose fixup throws.
+    createFixupStream : function() {
+        var buf = '', head = '', out = [], separator = '';
+        var started = false, done = false, retryAt = 0;
+        function emit(str) {
+            if(str){
+                out.push(separator + str);
+                separator = '\n\n';
+            }
+        }
+        function fixupNode(node, str) {
+            try{
+                return bootstrap.fixupStyleSheet({type: 'stylesheet', stylesheet: {rules: [node]}});
+            }catch(e){
+                dump("error happen :" + e.toString());
+                return str;
+            }
+        }
+        function pump(closing) {
+            if(done){
+                buf = '';
+                return;
+            }
+            if(!started){
+                // wait to see whether it starts with "<!--"
+                if(!closing && buf.length - /^\s*/.exec(buf)[0].length < 4){
+                    return;
+                }
+                var m = /^\s*<!--/.exec(buf);
+                if(m){
+                    head = m[0];
+                    buf = buf.slice(head.length);
+                }
+                started = true;
+            }
+            var str = closing ? buf.replace(/-->\s*$/, '') : buf;
+            while(true){
+                try{
+                    var next = css.parse(str, {next: true});
+                }catch(e){
+                    if(closing){
+                        dump("error happen :" + e.toString());
+                        emit(head + buf);
+                        done = true;
+                    }
+                    break;
+                }
+                if(!next.node){
+                    done = closing || next.length < str.length;
+                    break;
+                }
+                if(!closing && !bootstrap.isCompleteCSSNode(str, next.length)){
+                    break;
+                }
+                emit(fixupNode(next.node, str.slice(0, next.length)));
+                head = '';
+                str = str.slice(next.length);
+                buf = buf.slice(next.length);
+            }
+            if(done){
+                buf = '';
+            }
+            retryAt = 2 * buf.length;
+        }
+        function flush() {
+            var str = out.join('');
+            out = [];
+            return str;
+        }
+        return {
+            feed : function(str) {
+                buf += str;
+                // parsing an unfinished rule again for every chunk would be quadratic;
+                // wait until the text has doubled
+                if(buf.length >= retryAt){
+                    pump(false);
+                }
+                return flush();
+            },
+            close : function() {
+                pump(true);
+                return flush();
+            }
+        };
+    },
+
+    // Whether the node css.parse(str, {next: true}) found in the first length characters
+    // of str stays the same however str continues. css-parse's patterns all run up to the
+    // '}' ending a rule, except for strings (up to the closing quote or the end of the
+    // line), parentheses in values (up to ')'), and @import, @charset and @namespace (up
+    // to ';' or a newline), so those have to end within str too.
+    isCompleteCSSNode : function(str, length) {
+        if(length >= str.length){
+            return false;
+        }
+        var ends = [["'", /['\n\r\u2028\u2029]/], ['"', /["\n\r\u2028\u2029]/], ['(', /\)/], ['@', /[;\n]/]];
+        for(var i = 0; i < ends.length; i++){
+            var start = str.lastIndexOf(ends[i][0], length - 1);
+            if(start !== -1 && !ends[i][1].test(str.slice(start + 1))){
+                return false;
+            }
+        }
+        return true;
+    },
+
+    // Content-addressed LRU cache of createFixupRulesFromCSSFileContent() results, keyed by
+    // the SHA-1 of the stylesheet. Entries are kept in memory up to maxBytes, and saved to
+    // the profile so they survive restarts. The packed cache (cssfixer-cache.json, made by
+    // mozharness/scripts/cssfixer_fixup.py at repack time) is read-only and never evicted.
+    // Bump VERSION whenever the fixups change, so stale results are dropped.
+    fixupCache : {
+        VERSION : 1,
+        maxBytes : 4 * 1024 * 1024,
+        saveDelay : 10000,
+        storeFileName : 'cssfixer-cache.json',
+        packedURL : 'chrome://browser/content/cssfixer-cache.json',
+
+        _initialized : false,
+        _entries : {},   // key => {key, value, size, persist, prev, next}
+        _head : null,    // most recently used
+        _tail : null,    // least recently used
+        _bytes : 0,
+        _packed : {},
+        _saveTimer : null,
+
+        init : function() {
+            var cache = bootstrap.fixupCache;
+            if(cache._initialized)return;
+            cache._initialized = true;
+            cache._entries = Object.create(null);
+            cache._packed = Object.create(null);
+            cache.loadPacked();
+            cache.loadStore();
+        },
+
+        hash : function(str) {
+            var ch = Cc["@mozilla.org/security/hash;1"].createInstance(Ci.nsICryptoHash);
+            var stream = Cc["@mozilla.org/io/string-input-stream;1"].createInstance(Ci.nsIStringInputStream);
+            stream.setData(str, str.length); // str is a binary string, one byte per char
+            ch.init(ch.SHA1);
+            ch.updateFromStream(stream, 0xffffffff);
+            var digest = ch.finish(false), hex = '';
+            for(var i = 0; i < digest.length; i++){
+                hex += ('0' + digest.charCodeAt(i).toString(16)).slice(-2);
+            }
+            return hex;
+        },
+
+        get : function(key) {
+            var cache = bootstrap.fixupCache;
+            if(key in cache._packed)return cache._packed[key];
+            var entry = cache._entries[key];
+            if(!entry)return undefined;
+            cache._unlink(entry);
+            cache._link(entry);
+            return entry.value;
+        },
+
+        put : function(key, value, persist) {
+            var cache = bootstrap.fixupCache;
+            if(key in cache._packed)return;
+            cache._insert(key, value, persist);
+            if(persist)cache.scheduleSave();
+        },
+
+        _insert : function(key, value, persist) {
+            var cache = bootstrap.fixupCache;
+            var entry = cache._entries[key];
+            if(entry){
+                cache._unlink(entry);
+                cache._bytes -= entry.size;
+            }
+            entry = {key:key, value:value, size:key.length + value.length, persist:persist, prev:null, next:null};
+            if(entry.size > cache.maxBytes){
+                delete cache._entries[key];
+                return;
+            }
+            cache._entries[key] = entry;
+            cache._link(entry);
+            cache._bytes += entry.size;
+            while(cache._bytes > cache.maxBytes){
+                var oldest = cache._tail;
+                cache._unlink(oldest);
+                delete cache._entries[oldest.key];
+                cache._bytes -= oldest.size;
+            }
+        },
+
+        _link : function(entry) { // insert as most recently used
+            var cache = bootstrap.fixupCache;
+            entry.prev = null;
+            entry.next = cache._head;
+            if(cache._head)cache._head.prev = entry;
+            cache._head = entry;
+            if(!cache._tail)cache._tail = entry;
+        },
+
+        _unlink : function(entry) {
+            var cache = bootstrap.fixupCache;
+            if(entry.prev)entry.prev.next = entry.next;
+            else cache._head = entry.next;
+            if(entry.next)entry.next.prev = entry.prev;
+            else cache._tail = entry.prev;
+            entry.prev = entry.next = null;
+        },
+
+        // Cache files are {"version": VERSION, "entries": [[key, value], ...]}, least
+        // recently used first.
+        load : function(json, packed) {
+            var cache = bootstrap.fixupCache;
+            try{
+                var data = JSON.parse(json);
+            }catch(e){
+                dump("cssfixer: can't parse cache: " + e);
+                return;
+            }
+            if(!data || data.version !== cache.VERSION || !(data.entries instanceof Array))return;
+            for(var i = 0; i < data.entries.length; i++){
+                var key = data.entries[i][0], value = data.entries[i][1];
+                if(typeof key !== 'string' || typeof value !== 'string')continue;
+                if(packed){
+                    cache._packed[key] = value;
+                }else if(!(key in cache._entries)){ // don't clobber anything fixed since startup
+                    cache._insert(key, value, true);
+                }
+            }
+        },
+
+        serialize : function() {
+            var cache = bootstrap.fixupCache, entries = [];
+            for(var entry = cache._tail; entry; entry = entry.prev){
+                if(entry.persist)entries.push([entry.key, entry.value]);
+            }
+            return JSON.stringify({version:cache.VERSION, entries:entries});
+        },
+
+        loadPacked : function() {
+            var request = Cc["@mozilla.org/xmlextras/xmlhttprequest;1"].createInstance(Ci.nsIXMLHttpRequest);
+            request.open("GET", bootstrap.fixupCache.packedURL, true);
+            request.overrideMimeType("application/json");
+            request.onload = function(){
+                bootstrap.fixupCache.load(request.responseText, true);
+            };
+            request.onerror = function(){}; // repacks without a packed cache are fine
+            request.send(null);
+        },
+
+        storePath : function() {
+            return OS.Path.join(OS.Constants.Path.profileDir, bootstrap.fixupCache.storeFileName);
+        },
+
+        loadStore : function() {
+            var cache = bootstrap.fixupCache;
+            OS.File.read(cache.storePath()).then(function(bytes){
+                cache.load(new TextDecoder().decode(bytes), false);
+            }, function(reason){
+                if(!(reason instanceof OS.File.Error && reason.becauseNoSuchFile)){
+                    dump("cssfixer: can't read cache: " + reason);
+                }
+            });
+        },
+
+        scheduleSave : function() {
+            var cache = bootstrap.fixupCache;
+            if(cache._saveTimer)return;
+            cache._saveTimer = setTimeout(function(){
+                cache._saveTimer = null;
+                var path = cache.storePath();
+                OS.File.writeAtomic(path, new TextEncoder().encode(cache.serialize()), {tmpPath: path + ".tmp"});
+            }, cache.saveDelay);
+        }
+    },
+
     createFixupRulesFromCSS : function(str,doc) {
         try{
             var obj = css.parse(bootstrap.stripHTMLComments(str));
@@ -427,6 +740,55 @@ var bootstrap = {
         return {type:'declaration', property:prop, value:newValue, _fxjsdefined:true};
     },
 
+    // What createFixupStyleSheet() does with a declaration depends on its property, so
+    // that's worked out once per property name and kept here.
+    fixupDispatch : Object.create(null),
+    fixupDispatchSize : 0,
+    maxFixupDispatchSize : 4096,
+
+    fixupDispatchFor : function(property){
+        var key = String(property), dispatch = bootstrap.fixupDispatch[key];
+        if(!dispatch){
+            if(bootstrap.fixupDispatchSize >= bootstrap.maxFixupDispatchSize){
+                bootstrap.fixupDispatch = Object.create(null);
+                bootstrap.fixupDispatchSize = 0;
+            }
+            dispatch = bootstrap.fixupDispatch[key] = {
+                background: property === 'background',
+                display: property === 'display',
+                flexbox: /(box-|flex-)/.test(property),
+                unprefixed: /-webkit-/.test(property) ? property.substr(8) : ''
+            };
+            bootstrap.fixupDispatchSize++;
+        }
+        return dispatch;
+    },
+
+    // allW3CSSProperties as an object, for isW3CProperty()
+    w3cProperties : null,
+
+    isW3CProperty : function(prop){
+        if(!bootstrap.w3cProperties){
+            bootstrap.w3cProperties = Object.create(null);
+            bootstrap.allW3CSSProperties.forEach(function(name){
+                bootstrap.w3cProperties[name] = true;
+            });
+        }
+        return bootstrap.w3cProperties[prop] === true;
+    },
+
+    // Adds declarations to index, an object mapping each property to its declarations
+    // in order; comments have no property, so they're left out.
+    indexDeclarations : function(index, declarations){
+        for(var i=0;i<declarations.length;i++){
+            var property = declarations[i].property;
+            if(typeof property === 'string'){
+                (index[property] || (index[property] = [])).push(declarations[i]);
+            }
+        }
+        return index;
+    },
+
     getValueForProperty : function(declarations, property, prefixAgnostic){
         for(var i=0;i<declarations.length;i++){
            if(declarations[i].property == property || (prefixAgnostic && declarations[i].property.substr(8) == property)) return declarations[i].value;
@@ -508,7 +870,7 @@ var bootstrap = {
         for(var rule, i = 0; rule = sheet1.stylesheet.rules[i]; i++){
             var clone = cloneJSDefined(rule);
             if(clone.declarations && clone.declarations.length || clone.rules && clone.rules.length){
-                sheet2.stylesheet.rules = sheet2.stylesheet.rules.concat(clone)
+                sheet2.stylesheet.rules.push(clone);
             }
         }
         function cloneJSDefined(rule){
@@ -178,6 +178,18 @@ function CCIN(cName, ifaceName) {
 function TracingListener() {
     this.originalListener = null;
     this.receivedData = [];   // array for incoming data.
+    this.fixupStream = null;  // bootstrap.createFixupStream(), or false if buffering.
+    this.offset = 0;          // how much we've passed on to originalListener.
+}
+
+// With the cssfixer.streaming pref, stylesheets are fixed up a rule at a time as they
+// arrive, rather than all at once when they're complete. That skips bootstrap.fixupCache.
+function isCSSFixupStreamingEnabled() {
+  try {
+    return Services.prefs.getBoolPref("cssfixer.streaming");
+  } catch (e) {
+    return false;
+  }
 }
 
 TracingListener.prototype =
@@ -189,7 +201,18 @@ TracingListener.prototype =
                 "nsIBinaryInputStream");
           binaryInputStream.setInputStream(inputStream);
           var data = binaryInputStream.readBytes(count);
-          this.receivedData.push(data);
+          if (this.fixupStream === null) {
+            this.fixupStream = this.isCSSFile(request) && isCSSFixupStreamingEnabled() &&
+              bootstrap.createFixupStream();
+          }
+          if (this.fixupStream) {
+            data = this.fixupStream.feed(data);
+            if (data) {
+              this.writeData(request, context, data);
+            }
+          } else {
+            this.receivedData.push(data);
+          }
         } else {
           this.originalListener.onDataAvailable(request, context,
             inputStream, offset, count);
@@ -202,41 +225,44 @@ TracingListener.prototype =
 
     onStopRequest: function(request, context, statusCode)
     {
-        // Get entire response
-        if (request.URI && request.URI.path && request.URI.path.indexOf(".css") >= 0) {
+        if (this.fixupStream) {
+          var rest = this.fixupStream.close();
+          if (rest) {
+            this.writeData(request, context, rest);
+          }
+        } else if (this.isCSSFile(request)) {
+          // Get entire response
           var responseSource = this.receivedData.join('');
           this.receivedData = [];
-          responseSource = bootstrap.createFixupRulesFromCSSFileContent(responseSource);
-          
-          var storageStream = CCIN("@mozilla.org/storagestream;1", "nsIStorageStream");
-          var binaryOutputStream = CCIN("@mozilla.org/binaryoutputstream;1",
-                "nsIBinaryOutputStream");
-          if (responseSource.length <= 8192) {
-            storageStream.init(8192, responseSource.length, null);
-          } else if(responseSource.length <= 16384) {
-            storageStream.init(16384, responseSource.length, null);
-          } else if(responseSource.length <= 32768) {
-            storageStream.init(32768, responseSource.length, null);
-          } else if(responseSource.length <= 65536) {
-            storageStream.init(65536, responseSource.length, null);
-          } else if(responseSource.length <= 131072) {
-            storageStream.init(131072, responseSource.length, null);
-          } else if(responseSource.length <= 262144) {
-            storageStream.init(262144, responseSource.length, null);
-          }else if(responseSource.length <= 524288) {
-            storageStream.init(524288, responseSource.length, null);
-          }else if(responseSource.length <= 1048576) {
-            storageStream.init(1048576, responseSource.length, null);
-          }
-
-          binaryOutputStream.setOutputStream(storageStream.getOutputStream(0));
-          binaryOutputStream.writeBytes(responseSource, responseSource.length);
-          this.originalListener.onDataAvailable(request, context,
-            storageStream.newInputStream(0), 0, responseSource.length);
+          var persist = !(request instanceof Ci.nsIPrivateBrowsingChannel && request.isChannelPrivate);
+          responseSource = bootstrap.fixupCSSFileContent(responseSource, persist);
+          this.writeData(request, context, responseSource);
         }
         this.originalListener.onStopRequest(request, context, statusCode);
     },
 
+    isCSSFile: function(request) {
+        return request.URI && request.URI.path && request.URI.path.indexOf(".css") >= 0;
+    },
+
+    // Pass data, a binary string, on to originalListener.
+    writeData: function(request, context, data) {
+        var storageStream = CCIN("@mozilla.org/storagestream;1", "nsIStorageStream");
+        var binaryOutputStream = CCIN("@mozilla.org/binaryoutputstream;1",
+              "nsIBinaryOutputStream");
+        var segmentSize = 8192;
+        while (segmentSize < data.length && segmentSize < 1048576) {
+          segmentSize *= 2;
+        }
+        storageStream.init(segmentSize, data.length, null);
+
+        binaryOutputStream.setOutputStream(storageStream.getOutputStream(0));
+        binaryOutputStream.writeBytes(data, data.length);
+        this.originalListener.onDataAvailable(request, context,
+          storageStream.newInputStream(0), this.offset, data.length);
+        this.offset += data.length;
+    },
+
     QueryInterface: function (aIID) {
         if (aIID.equals(Ci.nsIStreamListener) ||
             aIID.equals(Ci.nsISupports)) {
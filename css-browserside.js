@@ -492,6 +492,17 @@
       });
     }
   
+    // With options.next, parse just the first top-level node (and any comments before
+    // it), for streaming. Returns {node, length}, where length is how much of `css` was
+    // consumed; node is undefined at the end of the stylesheet.
+    if (options.next) {
+      var length = css.length;
+      whitespace();
+      comments();
+      var node = css.charAt(0) != '}' && (atrule() || rule()) || undefined;
+      return { node: node, length: length - css.length };
+    }
+  
     return stylesheet();
   };
   
@@ -13,6 +13,13 @@ if os.name == 'nt':
         FILE_ATTRIBUTE_NORMAL, FILE_ATTRIBUTE_DIRECTORY
     from win32api import FindFiles
 
+try:
+    # mozharness, next to us, deletes trees on several threads.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from mozharness.base.deleter import delete_tree
+except ImportError:
+    delete_tree = None
+
 clobber_suffix = '.deleteme'
 
 
@@ -70,6 +77,10 @@ def rmdirRecursive(dir):
         rmdirRecursiveWindows(dir)
         return
 
+    if delete_tree is not None:
+        delete_tree(dir)
+        return
+
     if not os.path.exists(dir):
         # This handles broken links
         if os.path.islink(dir):
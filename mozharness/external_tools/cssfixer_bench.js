@@ -0,0 +1,109 @@
+// Time css-browserside.js and bootstrap.js on a corpus of stylesheets under
+// node, for mozharness/scripts/cssfixer_bench.py.
+//
+// Usage: node --expose-gc cssfixer_bench.js bootstrap.js css-browserside.js manifest.json results.json
+//
+// manifest.json is {"iterations": N, "warmup": N, "stylesheets": [{"name": ..., "path": ...}],
+// "bundles": [{"name": ..., "path": ...}]}. results.json gets a list of {"name", "bytes",
+// "rules", "phases"} objects, where phases maps each phase to {"ms": [one time per
+// iteration], "heap_bytes": [...]}. For stylesheets, the phases are
+//
+//   parse      css.parse()
+//   fixup      bootstrap.createFixupStyleSheet(), i.e. insertFixupDeclarations() and
+//              copyJSDefinedStyles()
+//   compile    css.stringify() of the fixup rules
+//   sourcemap  css.stringify() of the fixup rules with {sourcemap: true}, from a parse
+//              with positions
+//
+// and for bundles, versions of css-browserside.js such as the one shake_bundle() makes,
+//
+//   startup    compiling and running the bundle in a new global, as loadSubScript() does
+//
+// heap_bytes is how much the heap grew during the phase, after a full GC; that's a lower
+// bound on what it allocated, but a good one as long as the young generation is big
+// enough that no GC happens in between.
+var fs = require('fs');
+var vm = require('vm');
+
+var sandbox = {dump: function() {}};
+sandbox.window = sandbox;
+var context = vm.createContext(sandbox);
+vm.runInContext(fs.readFileSync(process.argv[3], 'utf8') +
+                '\nwindow.cssbrowserside = cssbrowserside;', context);
+vm.runInContext(fs.readFileSync(process.argv[2], 'utf8') +
+                '\nwindow.bootstrap = bootstrap;', context);
+
+var bootstrap = sandbox.bootstrap;
+var css = sandbox.css;
+var gc = global.gc || function() {};
+
+function measure(phase, results, fn) {
+    gc();
+    var heap = process.memoryUsage().heapUsed;
+    var start = process.hrtime();
+    var value = fn();
+    var time = process.hrtime(start);
+    results[phase].ms.push(time[0] * 1e3 + time[1] / 1e6);
+    results[phase].heap_bytes.push(Math.max(process.memoryUsage().heapUsed - heap, 0));
+    return value;
+}
+
+function newPhases() {
+    var phases = {};
+    ['parse', 'fixup', 'compile', 'sourcemap'].forEach(function(phase) {
+        phases[phase] = {ms: [], heap_bytes: []};
+    });
+    return phases;
+}
+
+function bench(stylesheet, iterations, warmup) {
+    // The binary string TracingListener would see.
+    var str = fs.readFileSync(stylesheet.path).toString('latin1');
+    var phases = newPhases();
+    var rules = 0;
+    for (var i = 0; i < warmup + iterations; i++) {
+        var results = i < warmup ? newPhases() : phases;
+        var obj = measure('parse', results, function() {
+            return css.parse(bootstrap.stripHTMLComments(str));
+        });
+        rules = obj.stylesheet.rules.length;
+        var fixupStyleSheet = measure('fixup', results, function() {
+            return bootstrap.createFixupStyleSheet(obj);
+        });
+        measure('compile', results, function() {
+            return css.stringify(fixupStyleSheet);
+        });
+        obj = css.parse(bootstrap.stripHTMLComments(str),
+                        {position: true, source: stylesheet.name});
+        fixupStyleSheet = bootstrap.createFixupStyleSheet(obj);
+        measure('sourcemap', results, function() {
+            return css.stringify(fixupStyleSheet, {sourcemap: true});
+        });
+    }
+    return {name: stylesheet.name, bytes: str.length, rules: rules, phases: phases};
+}
+
+function benchStartup(bundle, iterations, warmup) {
+    var str = fs.readFileSync(bundle.path, 'utf8');
+    var phases = {startup: {ms: [], heap_bytes: []}};
+    for (var i = 0; i < warmup + iterations; i++) {
+        var results = i < warmup ? {startup: {ms: [], heap_bytes: []}} : phases;
+        // A different source every time, so V8 can't reuse the compiled code.
+        var source = str + '\n// ' + i + '\nwindow.cssbrowserside = cssbrowserside;';
+        measure('startup', results, function() {
+            var global = {};
+            global.window = global;
+            vm.runInContext(source, vm.createContext(global));
+            return global;
+        });
+    }
+    return {name: bundle.name, bytes: str.length, rules: 0, phases: phases};
+}
+
+var manifest = JSON.parse(fs.readFileSync(process.argv[4], 'utf8'));
+var output = manifest.stylesheets.map(function(stylesheet) {
+    return bench(stylesheet, manifest.iterations, manifest.warmup || 0);
+}).concat((manifest.bundles || []).map(function(bundle) {
+    return benchStartup(bundle, manifest.iterations, manifest.warmup || 0);
+}));
+fs.writeFileSync(process.argv[5], JSON.stringify(output));
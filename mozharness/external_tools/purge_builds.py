@@ -24,6 +24,16 @@ import shutil
 import sys
 from fnmatch import fnmatch
 
+try:
+    # mozharness, next to us, deletes trees on several threads.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from mozharness.base.deleter import delete_tree, query_pending_deletions
+except ImportError:
+    delete_tree = None
+
+    def query_pending_deletions(pending_dir=None):
+        return []
+
 DEFAULT_BASE_DIRS = ["..", "/scratchbox/users/cltbld/home/cltbld/build"]
 
 clobber_suffix = '.deleteme'
@@ -45,6 +55,16 @@ else:
         return r.f_frsize * r.f_bavail
 
 
+def availablespace(p, pending_dir=None):
+    """Returns the number of bytes free under directory `p`, counting
+    what the mozharness deletions in progress on its file system are
+    about to free"""
+    device = os.stat(p).st_dev
+    pending = [d['bytes_left'] or 0 for d in query_pending_deletions(pending_dir)
+               if d['alive'] and d.get('device') == device]
+    return freespace(p) + sum(pending)
+
+
 def mtime_sort(p1, p2):
     "sorting function for sorting a list of paths by mtime"
     return cmp(os.path.getmtime(p1), os.path.getmtime(p2))
@@ -82,6 +102,10 @@ def rmdirRecursive(dir):
         rmdirRecursiveWindows(dir)
         return
 
+    if delete_tree is not None:
+        delete_tree(dir)
+        return
+
     if not os.path.exists(dir):
         # This handles broken links
         if os.path.islink(dir):
@@ -116,14 +140,17 @@ def rmdirRecursive(dir):
     os.rmdir(dir)
 
 
-def purge(base_dirs, gigs, ignore, max_age, dry_run=False):
+def purge(base_dirs, gigs, ignore, max_age, dry_run=False, pending_dir=None):
     """Delete directories under `base_dirs` until `gigs` GB are free.
 
     Delete any directories older than max_age.
 
-    Will not delete directories listed in the ignore list."""
+    Will not delete directories listed in the ignore list, or that
+    mozharness is deleting in the background (see pending_dir)."""
     gigs *= 1024 * 1024 * 1024
 
+    in_flight = set([d['path'] for d in query_pending_deletions(pending_dir)
+                     if d['alive']])
     dirs = []
     for base_dir in base_dirs:
         if os.path.exists(base_dir):
@@ -131,7 +158,7 @@ def purge(base_dirs, gigs, ignore, max_age, dry_run=False):
                 if any([fnmatch(d, pattern) for pattern in ignore]):
                     continue
                 p = os.path.join(base_dir, d)
-                if not os.path.isdir(p):
+                if not os.path.isdir(p) or os.path.abspath(p) in in_flight:
                     continue
                 mtime = os.path.getmtime(p)
                 dirs.append((mtime, p))
@@ -144,7 +171,7 @@ def purge(base_dirs, gigs, ignore, max_age, dry_run=False):
         # If we're newer than max_age, and don't need any more free space,
         # we're all done here
         if (not max_age) or (mtime > max_age):
-            if freespace(base_dirs[0]) >= gigs:
+            if availablespace(base_dirs[0], pending_dir) >= gigs:
                 break
 
         print "Deleting", d
@@ -163,7 +190,7 @@ def purge(base_dirs, gigs, ignore, max_age, dry_run=False):
                 print >>sys.stderr, "Couldn't purge %s properly. Skipping." % d
 
 
-def purge_hg_shares(share_dir, gigs, max_age, dry_run=False):
+def purge_hg_shares(share_dir, gigs, max_age, dry_run=False, pending_dir=None):
     """Deletes old hg directories under share_dir"""
     # Find hg directories
     hg_dirs = []
@@ -176,7 +203,7 @@ def purge_hg_shares(share_dir, gigs, max_age, dry_run=False):
                 dirs.remove(d)
 
     # Now we have a list of hg directories, call purge on them
-    purge(hg_dirs, gigs, [], max_age, dry_run)
+    purge(hg_dirs, gigs, [], max_age, dry_run, pending_dir)
 
     # Clean up empty directories
     for d in hg_dirs:
@@ -221,6 +248,10 @@ will be listed in the order in which they would be deleted.''')
             has an mtime older than this, it will be deleted, regardless of how
             much free space is required.  Set to 0 to disable.''')
 
+    parser.add_option('', '--pending-deletions-dir', dest='pending_dir',
+                      help='''where mozharness records the deletions it has in
+            progress; what they're about to free counts as free space''')
+
     options, base_dirs = parser.parse_args()
 
     if len(base_dirs) < 1:
@@ -237,22 +268,25 @@ will be listed in the order in which they would be deleted.''')
     else:
         cutoff_time = None
 
-    purge(base_dirs, options.size, options.skip, cutoff_time, options.dry_run)
+    purge(base_dirs, options.size, options.skip, cutoff_time, options.dry_run,
+          options.pending_dir)
 
     # Try to cleanup shared hg repos. We run here even if we've freed enough
     # space so we can be sure and delete repositories older than max_age
     if 'HG_SHARE_BASE_DIR' in os.environ:
         purge_hg_shares(os.environ['HG_SHARE_BASE_DIR'],
-                        options.size, cutoff_time, options.dry_run)
+                        options.size, cutoff_time, options.dry_run,
+                        options.pending_dir)
 
-    after = freespace(base_dirs[0]) / (1024 * 1024 * 1024.0)
+    after = availablespace(base_dirs[0], options.pending_dir) / (1024 * 1024 * 1024.0)
 
     # Try to cleanup the current dir if we still need space and it will
     # actually help.
     if after < options.size:
         # We skip the tools dir here because we've usually just cloned it.
-        purge(['.'], options.size, ['tools'], cutoff_time, options.dry_run)
-        after = freespace(base_dirs[0]) / (1024 * 1024 * 1024.0)
+        purge(['.'], options.size, ['tools'], cutoff_time, options.dry_run,
+              options.pending_dir)
+        after = availablespace(base_dirs[0], options.pending_dir) / (1024 * 1024 * 1024.0)
 
     if after < options.size:
         print "Error: unable to free %1.2f GB of space. " % options.size + \
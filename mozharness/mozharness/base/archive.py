@@ -0,0 +1,483 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Generic archive helpers.
+
+rewrite_zip() streams a zip archive into a new one in a single pass.
+Members that aren't replaced are copied byte-for-byte, without being
+decompressed or recompressed, so rewriting a big apk to swap out one
+member costs little more than copying the file.
+
+extract_zip() and extract_tar_stream() unpack archives without external
+tools.  extract_zip() only reads the members it extracts, so it works
+on a remote zip (see download.RangeFile) without fetching the rest;
+extract_tar_stream() never seeks, so it can unpack a tarball as it
+downloads.
+
+A ZipIndex is the list of a zip's members, saved next to the archive;
+with it, extract_zip_members() can find and extract a few members of a
+big archive on several threads, each with its own file object.
+"""
+
+import copy
+import errno
+import fnmatch
+import os
+import shutil
+import stat
+import struct
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+
+try:
+    import simplejson as json
+    assert json
+except ImportError:
+    import json
+
+# How much compressed data to copy at a time.
+COPY_BLOCK_SIZE = 1024 ** 2
+
+# Saved ZipIndexes are named after their archive, plus this.
+INDEX_SUFFIX = '.index.json'
+
+# Header ID of the zip64 extended information extra field.
+ZIP64_EXTRA_ID = 0x0001
+
+
+def _strip_zip64_extra(extra):
+    """Remove any zip64 extra field from `extra'; ZipInfo.FileHeader()
+    adds its own when the member needs one.
+    """
+    result = ''
+    i = 0
+    while i + 4 <= len(extra):
+        header_id, length = struct.unpack('<HH', extra[i:i + 4])
+        if header_id != ZIP64_EXTRA_ID:
+            result += extra[i:i + 4 + length]
+        i += 4 + length
+    return result
+
+
+def _clone_zipinfo(zinfo, filename=None):
+    new_info = zipfile.ZipInfo(filename or zinfo.filename, zinfo.date_time)
+    for attr in zipfile.ZipInfo.__slots__:
+        if attr in ('filename', 'orig_filename', 'date_time'):
+            continue
+        if hasattr(zinfo, attr):
+            setattr(new_info, attr, getattr(zinfo, attr))
+    new_info.extra = _strip_zip64_extra(zinfo.extra)
+    # The sizes and CRC are known up front, so there's no need for a
+    # trailing data descriptor.
+    new_info.flag_bits &= ~0x08
+    return new_info
+
+
+def _add_zipinfo(dest_zip, zinfo):
+    dest_zip.filelist.append(zinfo)
+    dest_zip.NameToInfo[zinfo.filename] = zinfo
+    dest_zip._didModify = True
+
+
+def _seek_member_data(fp, zinfo):
+    """Move fp, an open zip archive, to the start of the member's data,
+    past its local header.
+    """
+    fp.seek(zinfo.header_offset)
+    fheader = fp.read(zipfile.sizeFileHeader)
+    if len(fheader) != zipfile.sizeFileHeader or \
+            fheader[0:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipfile("Bad local file header for %s" % zinfo.filename)
+    fheader = struct.unpack(zipfile.structFileHeader, fheader)
+    fp.seek(fheader[zipfile._FH_FILENAME_LENGTH] +
+            fheader[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+
+
+def copy_zip_member(src_zip, dest_zip, zinfo, arcname=None):
+    """Copy the member described by `zinfo' from the open ZipFile
+    `src_zip' into the open (writable) ZipFile `dest_zip', without
+    decompressing it.
+
+    Raises zipfile.BadZipfile if the member's local header or data is
+    damaged.
+    """
+    fp = src_zip.fp
+    _seek_member_data(fp, zinfo)
+
+    new_info = _clone_zipinfo(zinfo, filename=arcname)
+    new_info.header_offset = dest_zip.fp.tell()
+    dest_zip.fp.write(new_info.FileHeader())
+    remaining = zinfo.compress_size
+    while remaining > 0:
+        block = fp.read(min(remaining, COPY_BLOCK_SIZE))
+        if not block:
+            raise zipfile.BadZipfile("Truncated data for %s" % zinfo.filename)
+        dest_zip.fp.write(block)
+        remaining -= len(block)
+    _add_zipinfo(dest_zip, new_info)
+
+
+def rewrite_zip(src, dest, replace=None, remove=None,
+                compress_type=zipfile.ZIP_STORED):
+    """Write a copy of the zip archive `src' to `dest' in one pass.
+
+    `src' and `dest' can be paths or file objects.
+
+    `replace' is a dict of {member_name: contents}.  Members already in
+    `src' are rewritten in place, keeping their compression type;
+    members that aren't are appended, compressed with `compress_type'
+    (stored by default, like `zip -0').
+
+    `remove' is a list of fnmatch patterns; matching members are left
+    out of `dest'.
+
+    Every other member is copied as-is.
+
+    Returns the list of member names written to `dest'.
+    """
+    replace = dict(replace or {})
+    remove = remove or []
+    names = []
+    src_zip = zipfile.ZipFile(src, 'r')
+    try:
+        dest_zip = zipfile.ZipFile(dest, 'w', allowZip64=True)
+        try:
+            for zinfo in src_zip.infolist():
+                name = zinfo.filename
+                if [p for p in remove if fnmatch.fnmatch(name, p)]:
+                    continue
+                if name in replace:
+                    new_info = zipfile.ZipInfo(name, zinfo.date_time)
+                    new_info.compress_type = zinfo.compress_type
+                    new_info.external_attr = zinfo.external_attr
+                    new_info.create_system = zinfo.create_system
+                    dest_zip.writestr(new_info, replace.pop(name))
+                else:
+                    copy_zip_member(src_zip, dest_zip, zinfo)
+                names.append(name)
+            date_time = time.localtime(time.time())[:6]
+            for name in sorted(replace.keys()):
+                new_info = zipfile.ZipInfo(name, date_time)
+                new_info.compress_type = compress_type
+                new_info.external_attr = 0644 << 16L
+                dest_zip.writestr(new_info, replace[name])
+                names.append(name)
+        finally:
+            dest_zip.close()
+    finally:
+        src_zip.close()
+    return names
+
+
+# Extraction {{{1
+def safe_member_path(extract_to, name):
+    """Where member `name' goes in extract_to, or None if that's
+    outside extract_to.
+    """
+    root = os.path.normpath(os.path.abspath(extract_to))
+    path = os.path.normpath(os.path.join(root, name))
+    if os.path.isabs(name) or not path.startswith(root + os.sep):
+        return None
+    return path
+
+
+def match_members(names, patterns=None):
+    """The names that match any of the unzip-style wildcard `patterns',
+    in order; all of them if there are no patterns.
+    """
+    if not patterns:
+        return list(names)
+    return [name for name in names
+            if [p for p in patterns if fnmatch.fnmatchcase(name, p)]]
+
+
+def _makedirs(path):
+    if os.path.isdir(path):
+        return
+    try:
+        os.makedirs(path)
+    except OSError, e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+
+def open_zip_member(fp, zinfo):
+    """A file object for the contents of the member `zinfo' of the zip
+    archive open as fp, found through its offset alone, so that
+    several threads can read members with a file object each.
+    """
+    if zinfo.flag_bits & 0x1:
+        raise zipfile.BadZipfile("%s is encrypted" % zinfo.filename)
+    _seek_member_data(fp, zinfo)
+    return zipfile.ZipExtFile(fp, 'r', zinfo)
+
+
+def extract_zip_member(zip_file, zinfo, extract_to):
+    """Extract the member `zinfo' of the open ZipFile `zip_file' into
+    extract_to, with its permissions.  Returns its path, or None if it
+    would be outside extract_to.
+    """
+    return _extract_member(zip_file.open, zinfo, extract_to)
+
+
+def _extract_member(open_member, zinfo, extract_to):
+    path = safe_member_path(extract_to, zinfo.filename)
+    if path is None:
+        return None
+    if zinfo.filename.endswith('/'):
+        _makedirs(path)
+        return path
+    _makedirs(os.path.dirname(path))
+    mode = zinfo.external_attr >> 16
+    if os.path.lexists(path) and not os.path.isdir(path):
+        # Replace it rather than write through a link or into a
+        # read-only file.
+        os.remove(path)
+    src = open_member(zinfo)
+    try:
+        if stat.S_ISLNK(mode) and hasattr(os, 'symlink'):
+            os.symlink(src.read(), path)
+            return path
+        dest = open(path, 'wb')
+        try:
+            shutil.copyfileobj(src, dest, COPY_BLOCK_SIZE)
+        finally:
+            dest.close()
+    finally:
+        src.close()
+    if mode & 0777:
+        os.chmod(path, mode & 0777)
+    _set_member_mtime(path, zinfo)
+    return path
+
+
+def _set_member_mtime(path, zinfo):
+    """Give the file at path the member's date and time, which zips
+    keep in local time, like unzip does.
+    """
+    try:
+        mtime = time.mktime(tuple(zinfo.date_time) + (0, 0, -1))
+    except (OverflowError, ValueError, TypeError):
+        return
+    os.utime(path, (mtime, mtime))
+
+
+def extract_zip(src, extract_to, patterns=None):
+    """Extract the members of the zip archive `src' (a path or file
+    object) that match the unzip-style `patterns' into extract_to,
+    overwriting what's there, like `unzip -o'.
+
+    Returns the list of member names extracted.
+    """
+    names = []
+    zip_file = zipfile.ZipFile(src, 'r', allowZip64=True)
+    try:
+        members = match_members(zip_file.namelist(), patterns)
+        for name in members:
+            if extract_zip_member(zip_file, zip_file.getinfo(name), extract_to):
+                names.append(name)
+    finally:
+        zip_file.close()
+    return names
+
+
+# ZipIndex {{{1
+class ZipIndex(object):
+    """The members of a zip archive, by top-level directory, read from
+    its central directory once and saved next to it (see
+    query_zip_index()), so finding the members a test suite needs
+    doesn't mean reading the whole list again.
+    """
+    # The ZipInfo attributes that extraction needs.
+    FIELDS = ('filename', 'header_offset', 'compress_size', 'file_size',
+              'compress_type', 'CRC', 'external_attr', 'flag_bits',
+              'date_time')
+
+    def __init__(self, members, key=None):
+        self.members = members
+        self.key = key
+        self.by_directory = {}
+        for zinfo in members:
+            self.by_directory.setdefault(zinfo.filename.split('/')[0], []).append(zinfo)
+
+    @classmethod
+    def from_zip(cls, src, key=None):
+        """Read the index of the zip archive `src' (a path or file
+        object).
+        """
+        zip_file = zipfile.ZipFile(src, 'r', allowZip64=True)
+        try:
+            return cls(zip_file.infolist(), key=key)
+        finally:
+            zip_file.close()
+
+    @classmethod
+    def load(cls, path, key=None):
+        """The index saved at path, or None if it's missing, unreadable
+        or was saved with a different key.
+        """
+        try:
+            fh = open(path)
+            try:
+                data = json.load(fh)
+            finally:
+                fh.close()
+            if data['key'] != key:
+                return None
+            members = []
+            for values in data['members']:
+                if len(values) != len(cls.FIELDS):
+                    # Saved with other fields.
+                    return None
+                zinfo = zipfile.ZipInfo(values[0])
+                for name, value in zip(cls.FIELDS[1:], values[1:]):
+                    setattr(zinfo, name, value)
+                zinfo.date_time = tuple(zinfo.date_time)
+                members.append(zinfo)
+        except (IOError, OSError, ValueError, KeyError, TypeError, IndexError):
+            return None
+        return cls(members, key=key)
+
+    def save(self, path):
+        data = {
+            'key': self.key,
+            'members': [[getattr(zinfo, name) for name in self.FIELDS]
+                        for zinfo in self.members],
+        }
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        fh = open(tmp_path, 'w')
+        try:
+            json.dump(data, fh)
+        finally:
+            fh.close()
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+
+    def query_members(self, patterns=None):
+        """The ZipInfos of the members that match the unzip-style
+        `patterns', in archive order; all of them if there are none.
+        """
+        if not patterns:
+            return list(self.members)
+        candidates = []
+        for pattern in patterns:
+            top = pattern.split('/')[0]
+            if [c for c in '*?[' if c in top]:
+                candidates = self.members
+                break
+            candidates.extend(self.by_directory.get(top, []))
+        members = dict([(id(zinfo), zinfo) for zinfo in candidates])
+        matching = [zinfo for zinfo in members.values()
+                    if [p for p in patterns if fnmatch.fnmatchcase(zinfo.filename, p)]]
+        return sorted(matching, key=lambda zinfo: zinfo.header_offset)
+
+
+def query_zip_index(path):
+    """The ZipIndex of the zip archive at path, from path.index.json if
+    that's up to date, or else read from the archive and saved there.
+    """
+    st = os.stat(path)
+    key = [st.st_size, st.st_mtime]
+    index_path = path + INDEX_SUFFIX
+    index = ZipIndex.load(index_path, key=key)
+    if index is None:
+        index = ZipIndex.from_zip(path, key=key)
+        try:
+            index.save(index_path)
+        except (IOError, OSError):
+            # e.g. a read-only directory; it's only a cache.
+            pass
+    return index
+
+
+def extract_zip_members(open_archive, members, extract_to, num_workers=1):
+    """Extract the `members' (ZipInfos, e.g. from a ZipIndex) of a zip
+    archive into extract_to, on up to num_workers threads.
+
+    open_archive() returns a new file object for the archive; every
+    thread opens its own, and extracts a run of members that are next
+    to each other in the archive.
+
+    Returns the list of member names extracted.
+    """
+    members = sorted(members, key=lambda zinfo: zinfo.header_offset)
+    num_workers = max(1, min(num_workers, len(members)))
+    # Split the members into runs of about the same compressed size.
+    total = sum([zinfo.compress_size for zinfo in members]) or 1
+    runs = [[] for _ in range(num_workers)]
+    done = 0
+    for zinfo in members:
+        runs[min(num_workers - 1, done * num_workers // total)].append(zinfo)
+        done += zinfo.compress_size
+    extracted = [[] for _ in runs]
+    errors = []
+
+    def extract_run(index):
+        try:
+            fp = open_archive()
+            try:
+                for zinfo in runs[index]:
+                    if _extract_member(lambda zinfo: open_zip_member(fp, zinfo),
+                                       zinfo, extract_to):
+                        extracted[index].append(zinfo.filename)
+            finally:
+                fp.close()
+        except:
+            errors.append(sys.exc_info())
+    threads = []
+    for index in range(1, num_workers):
+        thread = threading.Thread(target=extract_run, args=(index, ))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    extract_run(0)
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(1)
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return sum(extracted, [])
+
+
+def extract_tar_stream(fileobj, extract_to, compression=''):
+    """Extract the tar archive read from `fileobj' into extract_to as it
+    arrives, without seeking.  compression is '', 'gz' or 'bz2'.
+
+    Returns the list of member names extracted.
+    """
+    names = []
+    directories = []
+    tar = tarfile.open(fileobj=fileobj, mode='r|%s' % compression)
+    try:
+        for member in tar:
+            if safe_member_path(extract_to, member.name) is None:
+                continue
+            if member.isdir():
+                # Set its permissions once everything inside it is
+                # there, like tarfile.extractall().
+                directories.append(member)
+                member = copy.copy(member)
+                member.mode = 0700
+            tar.extract(member, extract_to)
+            names.append(member.name)
+        directories.sort(key=lambda member: member.name, reverse=True)
+        for member in directories:
+            path = os.path.join(extract_to, member.name)
+            tar.chown(member, path)
+            tar.utime(member, path)
+            tar.chmod(member, path)
+    finally:
+        tar.close()
+    return names
+
+
+# __main__ {{{1
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,663 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""A download cache shared by the jobs on a host.
+
+Files are kept by content, in objects/<hash type>/<hex digest>, and
+made read-only.  index/ maps a URL to the object it was last downloaded
+as, along with the validators (ETag, Last-Modified, Content-Length) the
+server sent for it, so a URL whose validators haven't changed is
+served from the cache; a file with a known checksum doesn't need the
+server at all.
+
+Cached files are reflinked or hardlinked into place, and only copied
+if neither works.  The least recently used objects are removed once
+the cache is bigger than its max_size.  Changes to the cache happen
+under an flock() of <cache dir>/lock, where there is one.
+
+A VirtualenvCache keeps frozen copies of virtualenvs the same way, in
+venvs/<key>, and hardlinks them into place.  A Wheelhouse keeps the
+wheels a module was built into as ArtifactCache objects, and lists
+them in wheels/<key>.json.
+"""
+
+from contextlib import contextmanager
+import errno
+import hashlib
+import os
+import shutil
+import stat
+import sys
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import simplejson as json
+    assert json
+except ImportError:
+    import json
+
+from mozharness.base.deleter import delete_tree
+from mozharness.base.incremental import hash_file
+
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3
+
+DEFAULT_VENV_CACHE_SIZE = 5 * 1024 ** 3
+
+# The response headers that identify a version of a URL.
+VALIDATORS = ('etag', 'last-modified', 'content-length')
+
+# From linux/fs.h.
+FICLONE = 0x40049409
+
+
+def reflink(src, dest):
+    """Make dest a copy-on-write clone of src.  Raises IOError or
+    OSError if the platform or file system can't.
+    """
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, "reflinks aren't supported", dest)
+    src_fh = open(src, 'rb')
+    try:
+        dest_fh = open(dest, 'wb')
+        try:
+            fcntl.ioctl(dest_fh.fileno(), FICLONE, src_fh.fileno())
+        finally:
+            dest_fh.close()
+    except (IOError, OSError):
+        if os.path.exists(dest):
+            os.remove(dest)
+        raise
+    finally:
+        src_fh.close()
+
+
+def link_or_copy(src, dest):
+    """Put a copy of src at dest as cheaply as possible.  Returns how:
+    'reflink', 'hardlink' or 'copy'.
+    """
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        reflink(src, dest)
+        return 'reflink'
+    except (IOError, OSError):
+        pass
+    if hasattr(os, 'link'):
+        try:
+            os.link(src, dest)
+            return 'hardlink'
+        except OSError:
+            pass
+    shutil.copyfile(src, dest)
+    return 'copy'
+
+
+def copy_file(src, dest, link_mode='copy'):
+    """Copy src to dest, with its mode and times, like shutil.copy2.
+    link_mode 'reflink' makes a copy-on-write clone if it can, and
+    'hardlink' a hardlink, falling back to a reflink.  Returns how:
+    'hardlink', 'reflink' or 'copy'.
+    """
+    if os.path.lexists(dest):
+        # Don't write through a hardlink to someone else's file.
+        os.remove(dest)
+    if link_mode == 'hardlink' and hasattr(os, 'link'):
+        try:
+            # os.link() would link a symlink itself.
+            os.link(os.path.realpath(src), dest)
+            return 'hardlink'
+        except OSError:
+            pass
+    if link_mode in ('hardlink', 'reflink'):
+        try:
+            reflink(src, dest)
+            shutil.copystat(src, dest)
+            return 'reflink'
+        except (IOError, OSError):
+            pass
+    shutil.copy2(src, dest)
+    return 'copy'
+
+
+def copy_tree(src, dest, link_mode='copy', ignore=()):
+    """Copy the tree at src to dest with copy_file(), keeping symlinks
+    as symlinks.  ignore is a list of paths relative to src to leave
+    out.  Returns (files, bytes) copied.
+    """
+    ignore = set([os.path.normpath(path) for path in ignore])
+    files = size = 0
+    for root, dirs, names in os.walk(src):
+        rel_root = os.path.relpath(root, src)
+        dest_root = os.path.normpath(os.path.join(dest, rel_root))
+        if not os.path.isdir(dest_root):
+            os.makedirs(dest_root)
+        for name in dirs[:]:
+            rel_path = os.path.normpath(os.path.join(rel_root, name))
+            if rel_path in ignore or os.path.islink(os.path.join(root, name)):
+                # os.walk() doesn't follow symlinks; copy them below.
+                dirs.remove(name)
+                if rel_path not in ignore:
+                    names.append(name)
+        for name in names:
+            rel_path = os.path.normpath(os.path.join(rel_root, name))
+            if rel_path in ignore:
+                continue
+            path = os.path.join(root, name)
+            dest_path = os.path.join(dest_root, name)
+            if os.path.islink(path):
+                if os.path.lexists(dest_path):
+                    os.remove(dest_path)
+                os.symlink(os.readlink(path), dest_path)
+            else:
+                copy_file(path, dest_path, link_mode=link_mode)
+                size += os.path.getsize(dest_path)
+            files += 1
+    return files, size
+
+
+@contextmanager
+def flocked(lock_path):
+    """Hold an flock() of lock_path, where there is one."""
+    fh = open(lock_path, 'a')
+    try:
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        yield
+    finally:
+        # closing releases the lock
+        fh.close()
+
+
+# ArtifactCache {{{1
+class ArtifactCache(object):
+    """The cache in `cache_dir':
+
+        cache = ArtifactCache(cache_dir, max_size=20 * 1024 ** 3)
+        if not cache.fetch(file_name, url=url, validators=validators):
+            download(url, file_name)
+            cache.store(file_name, url=url, validators=validators)
+
+    validators is a dict of VALIDATORS to the values a server sent for
+    url, e.g. from a HEAD request.
+
+    fetch() makes files with copy_file() and link_mode.  The default
+    reflink or copy is the job's own, writable file; a hardlink is the
+    cached object itself, so it's read-only and mustn't be changed.
+    """
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE,
+                 link_mode='reflink'):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        self.link_mode = link_mode
+        self.objects_dir = os.path.join(self.cache_dir, 'objects')
+        self.index_dir = os.path.join(self.cache_dir, 'index')
+        self.tmp_dir = os.path.join(self.cache_dir, 'tmp')
+        for path in (self.objects_dir, self.index_dir, self.tmp_dir):
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError, e:
+                    # another job made it first
+                    if e.errno != errno.EEXIST:
+                        raise
+
+    def locked(self):
+        return flocked(os.path.join(self.cache_dir, 'lock'))
+
+    def query_object_path(self, digest, hash_type='sha512'):
+        return os.path.join(self.objects_dir, hash_type, digest[:2], digest)
+
+    def query_index_path(self, url):
+        key = hashlib.sha1(url).hexdigest()
+        return os.path.join(self.index_dir, key[:2], key + '.json')
+
+    def _usable_validators(self, validators):
+        if not validators or not (validators.get('etag') or
+                                  validators.get('last-modified')):
+            return None
+        return dict([(name, validators.get(name)) for name in VALIDATORS])
+
+    def read_index(self, url):
+        path = self.query_index_path(url)
+        try:
+            fh = open(path)
+            try:
+                entry = json.load(fh)
+            finally:
+                fh.close()
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get('url') != url:
+            return None
+        return entry
+
+    def lookup(self, url=None, validators=None, checksum=None,
+               hash_type='sha512'):
+        """The path of the cached object for `checksum', or for this
+        version of `url', or None.
+        """
+        if checksum:
+            path = self.query_object_path(checksum, hash_type)
+            if os.path.exists(path):
+                return path
+            return None
+        validators = self._usable_validators(validators)
+        if url is None or validators is None:
+            return None
+        entry = self.read_index(url)
+        if entry is None or entry.get('validators') != validators:
+            return None
+        path = self.query_object_path(entry['object'], entry.get('hash_type', 'sha512'))
+        if os.path.exists(path):
+            return path
+        return None
+
+    def fetch(self, dest, url=None, validators=None, checksum=None,
+              hash_type='sha512'):
+        """Put the cached copy at dest.  Returns how ('reflink',
+        'hardlink' or 'copy'), or None if it isn't cached.
+        """
+        with self.locked():
+            path = self.lookup(url, validators, checksum, hash_type)
+            if path is None:
+                return None
+            method = copy_file(path, dest, link_mode=self.link_mode)
+            # Recently used; see evict().
+            os.utime(path, None)
+        if method != 'hardlink':
+            os.chmod(dest, stat.S_IMODE(os.stat(dest).st_mode) | stat.S_IWUSR)
+        return method
+
+    def store(self, src, url=None, validators=None, checksum=None,
+              hash_type='sha512', keep_src=True):
+        """Add src to the cache, as `checksum' if that's set, and as
+        this version of `url' if there are validators for it.  Evicts
+        old objects if the cache is now too big.  Returns the path of
+        the object.
+
+        The object is a reflink or copy of src, so src stays writable
+        and writing to it can't change the cache.  If src isn't kept,
+        keep_src=False lets the object be a hardlink to it.
+        """
+        if not checksum:
+            checksum, hash_type = hash_file(src, 'sha512'), 'sha512'
+        path = self.query_object_path(checksum, hash_type)
+        validators = self._usable_validators(validators)
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        os.close(fd)
+        try:
+            if keep_src:
+                copy_file(src, tmp_path, link_mode='reflink')
+            else:
+                link_or_copy(src, tmp_path)
+            os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            with self.locked():
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                if os.path.exists(path):
+                    os.utime(path, None)
+                else:
+                    os.rename(tmp_path, path)
+                if url is not None and validators is not None:
+                    self._write_index(url, {
+                        'url': url,
+                        'validators': validators,
+                        'object': checksum,
+                        'hash_type': hash_type,
+                    })
+                self.evict()
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path
+
+    def _write_index(self, url, entry):
+        index_path = self.query_index_path(url)
+        if not os.path.isdir(os.path.dirname(index_path)):
+            os.makedirs(os.path.dirname(index_path))
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        fh = os.fdopen(fd, 'w')
+        try:
+            json.dump(entry, fh)
+        finally:
+            fh.close()
+        if os.name == 'nt' and os.path.exists(index_path):
+            os.remove(index_path)
+        os.rename(tmp_path, index_path)
+
+    def query_objects(self):
+        """(mtime, size, path) of every object, oldest first."""
+        objects = []
+        for root, dirs, files in os.walk(self.objects_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                objects.append((st.st_mtime, st.st_size, path))
+        return sorted(objects)
+
+    def evict(self):
+        """Remove the least recently used objects until the cache is
+        no bigger than max_size.  Call it under locked().  Returns the
+        paths removed.  Index entries that point at them are ignored
+        from then on.
+        """
+        objects = self.query_objects()
+        total = sum([size for _, size, _ in objects])
+        removed = []
+        for _, size, path in objects:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed.append(path)
+        return removed
+
+
+# VirtualenvCache {{{1
+def _find_path_references(top, path):
+    """Which files under top have `path' in them: returns (paths of
+    text files relative to top, whether any binary files do).
+    """
+    text_files = []
+    in_binary = False
+    for root, dirs, names in os.walk(top):
+        for name in names:
+            file_path = os.path.join(root, name)
+            if os.path.islink(file_path):
+                continue
+            fh = open(file_path, 'rb')
+            try:
+                data = fh.read()
+            finally:
+                fh.close()
+            if path not in data:
+                continue
+            if '\0' in data:
+                in_binary = True
+            else:
+                text_files.append(os.path.relpath(file_path, top))
+    return sorted(text_files), in_binary
+
+
+def _is_rewritten_in_place(rel_path):
+    """Whether pip or activation might write to this file of a
+    virtualenv in place, rather than replace it.
+    """
+    parts = os.path.normpath(rel_path).split(os.sep)
+    return parts[0] in ('bin', 'Scripts') or parts[-1].endswith('.pth')
+
+
+class VirtualenvCache(object):
+    """Frozen copies of virtualenvs in `cache_dir', by key:
+
+        cache = VirtualenvCache(cache_dir)
+        if not cache.fetch(key, venv_path):
+            create_virtualenv(venv_path)
+            cache.store(key, venv_path)
+
+    The key should stand for everything that went into the virtualenv.
+
+    A virtualenv's scripts have its path in them; fetch() rewrites the
+    text files that had the stored virtualenv's path to have the new
+    one.  Virtualenvs with binary files that have their path (e.g.
+    windows launchers) are only fetched to the same path.
+
+    fetch() makes files with copy_file() and link_mode.  Anything that
+    writes to a hardlinked file in place writes to the stored copy too,
+    so with 'hardlink' the files that get written in place (scripts
+    and .pth files) are still copied.
+    """
+    def __init__(self, cache_dir, max_size=DEFAULT_VENV_CACHE_SIZE,
+                 link_mode='reflink'):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        self.link_mode = link_mode
+        self.venvs_dir = os.path.join(self.cache_dir, 'venvs')
+        self.tmp_dir = os.path.join(self.cache_dir, 'tmp')
+        for path in (self.venvs_dir, self.tmp_dir):
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError, e:
+                    # another job made it first
+                    if e.errno != errno.EEXIST:
+                        raise
+
+    def locked(self):
+        return flocked(os.path.join(self.cache_dir, 'lock'))
+
+    def query_template_path(self, key):
+        return os.path.join(self.venvs_dir, key)
+
+    def read_meta(self, template_path):
+        try:
+            fh = open(os.path.join(template_path, 'meta.json'))
+            try:
+                meta = json.load(fh)
+            finally:
+                fh.close()
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(meta, dict) or 'path' not in meta:
+            return None
+        return meta
+
+    def fetch(self, key, dest):
+        """Put the virtualenv stored as `key' at dest.  Returns how many
+        files that took, or None if it isn't cached.
+        """
+        dest = os.path.abspath(dest)
+        template_path = self.query_template_path(key)
+        with self.locked():
+            meta = self.read_meta(template_path)
+            if meta is None or \
+                    (not meta.get('relocatable') and meta['path'] != dest):
+                return None
+            copy_tree(os.path.join(template_path, 'venv'), dest,
+                      link_mode=self.link_mode)
+            if self.link_mode == 'hardlink':
+                for rel_path in meta.get('copy', []):
+                    copy_file(os.path.join(template_path, 'venv', rel_path),
+                              os.path.join(dest, rel_path), link_mode='reflink')
+            # Recently used; see evict().
+            os.utime(os.path.join(template_path, 'meta.json'), None)
+        if meta['path'] != dest:
+            old_path = meta['path'].encode('utf-8')
+            for rel_path in meta.get('rewrite', []):
+                path = os.path.join(dest, rel_path)
+                mode = os.stat(path).st_mode
+                fh = open(path, 'rb')
+                try:
+                    data = fh.read()
+                finally:
+                    fh.close()
+                # Don't write through a hardlink to the template.
+                os.remove(path)
+                fh = open(path, 'wb')
+                try:
+                    fh.write(data.replace(old_path, dest))
+                finally:
+                    fh.close()
+                os.chmod(path, stat.S_IMODE(mode))
+        return meta['files']
+
+    def store(self, key, venv_path, ignore=()):
+        """Add a frozen copy of the virtualenv at venv_path to the cache
+        as `key', leaving out the paths in ignore (relative to
+        venv_path).  Evicts old virtualenvs if the cache is now too
+        big.  Returns the path of the copy.
+        """
+        venv_path = os.path.abspath(venv_path)
+        template_path = self.query_template_path(key)
+        tmp_path = tempfile.mkdtemp(dir=self.tmp_dir)
+        removed = []
+        try:
+            files, size = copy_tree(venv_path, os.path.join(tmp_path, 'venv'),
+                                    link_mode='reflink', ignore=ignore)
+            rewrite, in_binary = _find_path_references(
+                os.path.join(tmp_path, 'venv'), venv_path)
+            copy = []
+            for root, dirs, names in os.walk(os.path.join(tmp_path, 'venv')):
+                for name in names:
+                    rel_path = os.path.relpath(os.path.join(root, name),
+                                               os.path.join(tmp_path, 'venv'))
+                    if _is_rewritten_in_place(rel_path) and \
+                            not os.path.islink(os.path.join(root, name)):
+                        copy.append(rel_path)
+            fh = open(os.path.join(tmp_path, 'meta.json'), 'w')
+            try:
+                json.dump({
+                    'key': key,
+                    'path': venv_path,
+                    'files': files,
+                    'size': size,
+                    'rewrite': rewrite,
+                    'copy': sorted(copy),
+                    'relocatable': not in_binary,
+                }, fh)
+            finally:
+                fh.close()
+            with self.locked():
+                if os.path.exists(template_path):
+                    os.utime(os.path.join(template_path, 'meta.json'), None)
+                else:
+                    os.rename(tmp_path, template_path)
+                removed = self.evict()
+        finally:
+            for path in [tmp_path] + removed:
+                if os.path.exists(path):
+                    delete_tree(path)
+        return template_path
+
+    def query_templates(self):
+        """(mtime, size, path) of every stored virtualenv, oldest
+        first.
+        """
+        templates = []
+        for name in os.listdir(self.venvs_dir):
+            path = os.path.join(self.venvs_dir, name)
+            meta = self.read_meta(path)
+            if meta is None:
+                continue
+            mtime = os.path.getmtime(os.path.join(path, 'meta.json'))
+            templates.append((mtime, meta.get('size', 0), path))
+        return sorted(templates)
+
+    def evict(self):
+        """Move the least recently used virtualenvs out of the cache
+        until it's no bigger than max_size.  Call it under locked().
+        Returns the paths they were moved to, in the cache's tmp dir,
+        for the caller to delete.
+        """
+        templates = self.query_templates()
+        total = sum([size for _, size, _ in templates])
+        removed = []
+        for _, size, path in templates:
+            if total <= self.max_size:
+                break
+            tmp_path = tempfile.mkdtemp(dir=self.tmp_dir)
+            os.rename(path, os.path.join(tmp_path, 'venv'))
+            total -= size
+            removed.append(tmp_path)
+        return removed
+
+
+# Wheelhouse {{{1
+class Wheelhouse(object):
+    """Sets of wheels, by key:
+
+        wheelhouse = Wheelhouse(cache_dir)
+        wheels = wheelhouse.fetch(key, wheel_dir)
+        if wheels is None:
+            wheels = build_wheels(module, wheel_dir)
+            wheelhouse.store(key, wheels)
+
+    The key should stand for everything the wheels were built from.
+    The wheels themselves are kept by content in an ArtifactCache in
+    the same directory, so wheels that several sets share are kept
+    once, and evicted with the least recently used objects.
+    """
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache = ArtifactCache(cache_dir, max_size=max_size)
+        self.wheels_dir = os.path.join(self.cache.cache_dir, 'wheels')
+        if not os.path.isdir(self.wheels_dir):
+            try:
+                os.makedirs(self.wheels_dir)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def query_index_path(self, key):
+        return os.path.join(self.wheels_dir, key + '.json')
+
+    def lookup(self, key):
+        """[(wheel file name, sha512)] of the set stored as `key', or
+        None if it isn't stored, or some of its wheels were evicted.
+        """
+        try:
+            fh = open(self.query_index_path(key))
+            try:
+                wheels = json.load(fh)
+            finally:
+                fh.close()
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(wheels, list):
+            return None
+        for _, digest in wheels:
+            if self.cache.lookup(checksum=digest) is None:
+                return None
+        return wheels
+
+    def fetch(self, key, dest_dir):
+        """Put the wheels stored as `key' in dest_dir.  Returns their
+        paths, or None if they aren't all stored.
+        """
+        wheels = self.lookup(key)
+        if wheels is None:
+            return None
+        if not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+        paths = []
+        for file_name, digest in wheels:
+            path = os.path.join(dest_dir, file_name)
+            if not self.cache.fetch(path, checksum=digest):
+                # evicted since lookup()
+                return None
+            paths.append(path)
+        return paths
+
+    def store(self, key, wheel_paths, keep_src=True):
+        """Add the wheels at wheel_paths to the wheelhouse as `key'.
+        See ArtifactCache.store() for keep_src.
+        """
+        wheels = []
+        for path in wheel_paths:
+            digest = hash_file(path, 'sha512')
+            self.cache.store(path, checksum=digest, keep_src=keep_src)
+            wheels.append((os.path.basename(path), digest))
+        with self.cache.locked():
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache.tmp_dir)
+            fh = os.fdopen(fd, 'w')
+            try:
+                json.dump(wheels, fh)
+            finally:
+                fh.close()
+            index_path = self.query_index_path(key)
+            if os.name == 'nt' and os.path.exists(index_path):
+                os.remove(index_path)
+            os.rename(tmp_path, index_path)
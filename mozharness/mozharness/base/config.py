@@ -25,9 +25,12 @@ TODO:
 """
 
 from copy import deepcopy
+import cPickle
+import hashlib
 from optparse import OptionParser, Option, OptionGroup
 import os
 import sys
+import tempfile
 import urllib2
 import socket
 import time
@@ -38,6 +41,21 @@ except ImportError:
 
 from mozharness.base.log import DEBUG, INFO, WARNING, ERROR, CRITICAL, FATAL
 
+DEFAULT_CONFIG_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.mozharness',
+                                        'config-cache')
+
+# Cached configs that haven't been used for this many seconds are removed.
+CONFIG_CACHE_MAX_AGE = 7 * 24 * 3600
+
+# Bump this when what's cached changes.
+CONFIG_CACHE_VERSION = 1
+
+# The environment variables that cached Python configs are keyed on:
+# those that os.path.expanduser() and the configs read.  Others, like
+# per-job ids, would mean a new cache entry for every job.
+CONFIG_CACHE_ENVIRON = ('HOME', 'USERPROFILE', 'HOMEDRIVE', 'HOMEPATH',
+                        'USER', 'USERNAME', 'LOGNAME', 'PATH', 'ADB_PATH')
+
 
 # optparse {{{1
 class ExtendedOptionParser(OptionParser):
@@ -65,6 +83,8 @@ class ExtendOption(Option):
 
 
 def make_immutable(item):
+    if is_locked(item):
+        return item
     if isinstance(item, list) or isinstance(item, tuple):
         result = LockedTuple(item)
     elif isinstance(item, dict):
@@ -75,6 +95,11 @@ def make_immutable(item):
     return result
 
 
+def is_locked(item):
+    return isinstance(item, LockedTuple) or \
+        (isinstance(item, ReadOnlyDict) and item._lock)
+
+
 class LockedTuple(tuple):
     def __new__(cls, items):
         return tuple.__new__(cls, (make_immutable(x) for x in items))
@@ -84,6 +109,14 @@ class LockedTuple(tuple):
 
 # ReadOnlyDict {{{1
 class ReadOnlyDict(dict):
+    """A dict that can be locked, after which neither it nor anything
+    in it can be changed.
+
+    Locking makes every value immutable, but keeps values that are
+    already locked rather than copying them again, so with_overrides()
+    can make a locked dict with some keys changed that shares the rest.
+    A deepcopy() of a locked dict is writable all the way down.
+    """
     def __init__(self, dictionary):
         self._lock = False
         self.update(dictionary.copy())
@@ -92,10 +125,21 @@ class ReadOnlyDict(dict):
         assert not self._lock, "ReadOnlyDict is locked!"
 
     def lock(self):
-        for (k, v) in self.items():
-            self[k] = make_immutable(v)
+        for k, v in dict.items(self):
+            dict.__setitem__(self, k, make_immutable(v))
         self._lock = True
 
+    def with_overrides(self, overrides):
+        """A locked ReadOnlyDict of this dict's items, updated with
+        `overrides'.  The locked values it doesn't override are shared
+        with this dict rather than copied.
+        """
+        result = ReadOnlyDict.__new__(ReadOnlyDict)
+        dict.update(result, self)
+        dict.update(result, overrides)
+        result.lock()
+        return result
+
     def __setitem__(self, *args):
         self._check_lock()
         return dict.__setitem__(self, *args)
@@ -136,23 +180,26 @@ class ReadOnlyDict(dict):
         return result
 
 # parse_config_file {{{1
+def find_config_file(file_name, search_path=None):
+    """The path of config file `file_name', looking in search_path if
+    it isn't a path already.  Raises IOError if it isn't found.
+    """
+    if os.path.exists(file_name):
+        return file_name
+    if not search_path:
+        search_path = ['.', os.path.join(sys.path[0], '..', 'configs'),
+                       os.path.join(sys.path[0], '..', '..', 'configs')]
+    for path in search_path:
+        if os.path.exists(os.path.join(path, file_name)):
+            return os.path.join(path, file_name)
+    raise IOError("Can't find %s in %s!" % (file_name, search_path))
+
+
 def parse_config_file(file_name, quiet=False, search_path=None,
                       config_dict_name="config"):
     """Read a config file and return a dictionary.
     """
-    file_path = None
-    if os.path.exists(file_name):
-        file_path = file_name
-    else:
-        if not search_path:
-            search_path = ['.', os.path.join(sys.path[0], '..', 'configs'),
-                           os.path.join(sys.path[0], '..', '..', 'configs')]
-        for path in search_path:
-            if os.path.exists(os.path.join(path, file_name)):
-                file_path = os.path.join(path, file_name)
-                break
-        else:
-            raise IOError("Can't find %s in %s!" % (file_name, search_path))
+    file_path = find_config_file(file_name, search_path)
     if file_name.endswith('.py'):
         global_dict = {}
         local_dict = {}
@@ -204,6 +251,128 @@ def download_config_file(url, file_name):
         raise SystemError(-1)
 
 
+# ConfigCache {{{1
+class ConfigCache(object):
+    """The merged contents of lists of config files, pickled in
+    cache_dir so that the next script to load the same files doesn't
+    have to parse them again:
+
+        cache = ConfigCache()
+        key = cache.query_key(config_files)
+        config = cache.load(key)
+        if config is None:
+            config = ...  # parse and merge them
+            cache.store(key, config)
+
+    The key covers each file's path, mtime, size and contents, the
+    current directory and the platform.
+
+    Python configs are code, and may not give the same result every
+    time (e.g. they use the date), so they're only cached with
+    python_configs=True.  Their key also covers the host name and the
+    CONFIG_CACHE_ENVIRON variables.
+    """
+    def __init__(self, cache_dir=None, max_age=CONFIG_CACHE_MAX_AGE,
+                 python_configs=False):
+        self.cache_dir = cache_dir or DEFAULT_CONFIG_CACHE_DIR
+        self.max_age = max_age
+        self.python_configs = python_configs
+
+    def query_key(self, config_files, search_path=None,
+                  config_dict_name="config"):
+        """The key for config_files, or None if they can't be cached
+        (e.g. they're URLs, or Python configs without python_configs).
+        Files that can't be found are keyed as missing.
+        """
+        key = hashlib.sha1()
+        key.update(repr((CONFIG_CACHE_VERSION, sys.version, sys.platform,
+                         os.getcwd(), config_dict_name, search_path)))
+        has_python_config = False
+        for file_name in config_files:
+            if '://' in file_name:
+                return None
+            if file_name.endswith('.py'):
+                if not self.python_configs:
+                    return None
+                has_python_config = True
+            try:
+                file_path = find_config_file(file_name, search_path)
+                st = os.stat(file_path)
+                fh = open(file_path, 'rb')
+                try:
+                    contents = fh.read()
+                finally:
+                    fh.close()
+            except (IOError, OSError):
+                key.update(repr((file_name, None)))
+                continue
+            key.update(repr((file_name, os.path.abspath(file_path),
+                             st.st_mtime, st.st_size)))
+            key.update(hashlib.sha1(contents).hexdigest())
+        if has_python_config:
+            key.update(repr(socket.gethostname()))
+            key.update(repr([(name, os.environ.get(name))
+                             for name in CONFIG_CACHE_ENVIRON]))
+        return key.hexdigest()
+
+    def query_path(self, key):
+        return os.path.join(self.cache_dir, '%s.pickle' % key)
+
+    def load(self, key):
+        """The config stored as `key', or None."""
+        path = self.query_path(key)
+        try:
+            fh = open(path, 'rb')
+            try:
+                config = cPickle.load(fh)
+            finally:
+                fh.close()
+            # Recently used; see store().
+            os.utime(path, None)
+        except Exception:
+            return None
+        if not isinstance(config, dict):
+            return None
+        return config
+
+    def store(self, key, config):
+        """Store config as `key', and remove what hasn't been used in
+        max_age seconds.  Returns None for success, not None for failure
+        (e.g. if config can't be pickled).
+        """
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir, 0700)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        except OSError:
+            return -1
+        try:
+            fh = os.fdopen(fd, 'wb')
+            try:
+                cPickle.dump(config, fh, cPickle.HIGHEST_PROTOCOL)
+            finally:
+                fh.close()
+            if os.name == 'nt' and os.path.exists(self.query_path(key)):
+                os.remove(self.query_path(key))
+            os.rename(tmp_path, self.query_path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return -1
+        self.prune()
+
+    def prune(self):
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                if now - os.path.getmtime(path) > self.max_age:
+                    os.remove(path)
+            except OSError:
+                # another script got there first
+                pass
+
+
 # BaseConfig {{{1
 class BaseConfig(object):
     """Basic config setting/getting.
@@ -267,6 +436,21 @@ class BaseConfig(object):
             dest="opt_config_files", type="string", default=[],
             help="Specify the optional config files"
         )
+        self.config_parser.add_option(
+            "--no-config-cache", action="store_false", dest="config_cache",
+            default=True,
+            help="Parse the config files, rather than using the cached result"
+        )
+        self.config_parser.add_option(
+            "--config-cache-dir", action="store", dest="config_cache_dir",
+            type="string", default=DEFAULT_CONFIG_CACHE_DIR,
+            help="Cache parsed config files here (default %default)"
+        )
+        self.config_parser.add_option(
+            "--cache-python-configs", action="store_true",
+            dest="cache_python_configs", default=False,
+            help="Cache Python config files too, not just JSON ones"
+        )
 
         # Logging
         log_option_group = OptionGroup(self.config_parser, "Logging")
@@ -293,6 +477,10 @@ class BaseConfig(object):
             "--simple-log", action="store_const", const="simple",
             dest="log_type", help="Log using SimpleFileLogger"
         )
+        log_option_group.add_option(
+            "--json-log", action="store_const", const="json",
+            dest="log_type", help="Log using JSONLinesLogger"
+        )
         self.config_parser.add_option_group(log_option_group)
 
         # Actions
@@ -310,6 +498,12 @@ class BaseConfig(object):
             dest="add_actions", metavar="ACTIONS",
             help="Add action %s to the list of actions" % self.all_actions
         )
+        action_option_group.add_option(
+            "--pipeline", action="store_true",
+            dest="pipeline", default=False,
+            help="Stream items through the actions that support it, rather than "
+                 "running each action to completion before the next"
+        )
         action_option_group.add_option(
             "--no-action", action="extend",
             dest="no_actions", metavar="ACTIONS",
@@ -379,6 +573,27 @@ class BaseConfig(object):
             print "Default actions: " + ', '.join(self.default_actions)
         raise SystemExit(0)
 
+    def _parse_config_files(self, config_files, opt_config_files):
+        """Parse and merge config_files, skipping those of
+        opt_config_files that can't be read.
+        """
+        config = {}
+        for cf in config_files:
+            try:
+                if '://' in cf: # config file is an url
+                    file_name = os.path.basename(cf)
+                    file_path = os.path.join(os.getcwd(), file_name)
+                    download_config_file(cf, file_path)
+                    config.update(parse_config_file(file_path))
+                else:
+                    config.update(parse_config_file(cf))
+            except Exception:
+                if cf in opt_config_files:
+                    print("WARNING: optional config file not found %s" % cf)
+                else:
+                    raise
+        return config
+
     def parse_args(self, args=None):
         """Parse command line arguments in a generic way.
         Return the parser object after adding the basic options, so
@@ -398,23 +613,26 @@ class BaseConfig(object):
                 print("Required config file not set! (use --config-file option)")
                 raise SystemExit(-1)
         else:
-            config = {}
             # append opt_config to allow them to overwrite previous configs
             all_config_files = options.config_files + options.opt_config_files
-            for cf in all_config_files:
-                try:
-                    if '://' in cf: # config file is an url
-                        file_name = os.path.basename(cf)
-                        file_path = os.path.join(os.getcwd(), file_name)
-                        download_config_file(cf, file_path)
-                        config.update(parse_config_file(file_path))
-                    else:
-                        config.update(parse_config_file(cf))
-                except Exception:
-                    if cf in options.opt_config_files:
-                        print("WARNING: optional config file not found %s" % cf)
-                    else:
-                        raise
+            cache = key = config = None
+            if options.config_cache:
+                cache = ConfigCache(options.config_cache_dir,
+                                    python_configs=options.cache_python_configs)
+                key = cache.query_key(all_config_files)
+            if key is not None:
+                config = cache.load(key)
+                if config is not None:
+                    for cf in options.opt_config_files:
+                        try:
+                            find_config_file(cf)
+                        except IOError:
+                            print("WARNING: optional config file not found %s" % cf)
+            if config is None:
+                config = self._parse_config_files(all_config_files,
+                                                  options.opt_config_files)
+                if key is not None:
+                    cache.store(key, config)
             self.set_config(config)
         for key in defaults.keys():
             value = getattr(options, key)
@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Deleting big trees without making the job wait for it.
+
+delete_tree() removes a tree on several threads: they list the
+directories (with scandir, where it's installed) and stat what's in
+them, then unlink the files, then remove the directories, deepest
+first.
+
+A DeletionService renames a tree out of the way first, to
+<path>.<pid>.<n>.deleteme next to it, which is atomic and instant, and
+deletes it on a background thread.  Every deletion in progress has a
+JSON file in pending_dir with the device it's on and how many bytes
+it has yet to free, so purge_builds.py can count those bytes as free
+space, and the next DeletionService can finish deletions whose process
+died.
+"""
+
+import errno
+import os
+import Queue
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import simplejson as json
+    assert json
+except ImportError:
+    import json
+
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = getattr(os, 'scandir', None)
+
+DEFAULT_WORKERS = 8
+
+# How many files a thread unlinks at a time.
+CHUNK_SIZE = 256
+
+# How often, in seconds, a deletion's bytes left are written down.
+PROGRESS_INTERVAL = 1.0
+
+TRASH_SUFFIX = '.deleteme'
+
+
+def default_pending_dir():
+    return os.path.join(tempfile.gettempdir(), 'mozharness-deletions')
+
+
+def freed_size(st):
+    """How much disk space removing the file with stat result `st'
+    frees: nothing if it has other hardlinks.
+    """
+    if st.st_nlink > 1:
+        return 0
+    if hasattr(st, 'st_blocks'):
+        return st.st_blocks * 512
+    return st.st_size
+
+
+def is_process_alive(pid):
+    if os.name == 'nt':
+        # os.kill() would kill it; assume it's still running.
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _list_dir(path):
+    """(path, is_dir, lstat) for each entry of the directory `path'."""
+    if scandir is not None:
+        for entry in scandir(path):
+            is_dir = entry.is_dir(follow_symlinks=False)
+            yield (entry.path, is_dir,
+                   None if is_dir else entry.stat(follow_symlinks=False))
+        return
+    for name in os.listdir(path):
+        full_name = os.path.join(path, name)
+        st = os.lstat(full_name)
+        if stat.S_ISDIR(st.st_mode):
+            yield full_name, True, None
+        else:
+            yield full_name, False, st
+
+
+def _ignore_missing(function, path):
+    try:
+        function(path)
+    except OSError, e:
+        if e.errno == errno.ENOENT:
+            return
+        if os.name != 'nt' and e.errno not in (errno.EACCES, errno.EPERM):
+            raise
+        # read-only; try again with write permission
+        os.chmod(path, 0700)
+        function(path)
+
+
+def _scan_tree(path, num_workers):
+    """Returns ([(file path, freed size)], [(depth, directory path)])
+    for the tree at path.
+    """
+    files = []
+    directories = [(0, path)]
+    errors = []
+    queue = Queue.Queue()
+
+    def scan():
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            depth, directory = item
+            try:
+                if not errors:
+                    if not os.access(directory, os.R_OK | os.W_OK | os.X_OK):
+                        os.chmod(directory, 0700)
+                    for full_name, is_dir, st in _list_dir(directory):
+                        if is_dir:
+                            directories.append((depth + 1, full_name))
+                            queue.put((depth + 1, full_name))
+                        else:
+                            files.append((full_name, freed_size(st)))
+            except:
+                errors.append(sys.exc_info())
+            finally:
+                queue.task_done()
+    queue.put((0, path))
+    threads = [threading.Thread(target=scan) for _ in range(num_workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    queue.join()
+    for thread in threads:
+        queue.put(None)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return files, directories
+
+
+def _run_chunks(function, items, num_workers):
+    """Call function(chunk) for chunks of `items' on num_workers
+    threads.
+    """
+    chunks = [items[i:i + CHUNK_SIZE] for i in range(0, len(items), CHUNK_SIZE)]
+    lock = threading.Lock()
+    state = {'next': 0}
+    errors = []
+
+    def run():
+        while not errors:
+            with lock:
+                index = state['next']
+                state['next'] += 1
+            if index >= len(chunks):
+                return
+            try:
+                function(chunks[index])
+            except:
+                errors.append(sys.exc_info())
+    threads = []
+    for _ in range(1, max(1, min(num_workers, len(chunks)))):
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    run()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+
+def delete_tree(path, num_workers=DEFAULT_WORKERS, on_progress=None):
+    """Remove the file or tree at path, on num_workers threads.
+    Symlinks are removed, not followed.
+
+    on_progress(bytes_left) is called once the tree has been scanned,
+    and as files are removed, at most every PROGRESS_INTERVAL seconds.
+
+    Returns (files, bytes): how many files were removed, and how much
+    disk space that freed.
+    """
+    if not os.path.isdir(path) or os.path.islink(path):
+        if not os.path.lexists(path):
+            return 0, 0
+        size = freed_size(os.lstat(path))
+        _ignore_missing(os.remove, path)
+        return 1, size
+    files, directories = _scan_tree(path, num_workers)
+    progress = {'left': sum([file_size for _, file_size in files]), 'reported': 0}
+    lock = threading.Lock()
+    if on_progress is not None:
+        on_progress(progress['left'])
+
+    def remove_files(chunk):
+        for file_name, _ in chunk:
+            _ignore_missing(os.remove, file_name)
+        with lock:
+            progress['left'] -= sum([file_size for _, file_size in chunk])
+            now = time.time()
+            if on_progress is None or \
+                    now - progress['reported'] < PROGRESS_INTERVAL:
+                return
+            progress['reported'] = now
+            on_progress(progress['left'])
+    _run_chunks(remove_files, files, num_workers)
+
+    def remove_directories(chunk):
+        for _, directory in chunk:
+            _ignore_missing(os.rmdir, directory)
+    # Directories of the same depth don't contain each other.
+    by_depth = {}
+    for depth, directory in directories:
+        by_depth.setdefault(depth, []).append((depth, directory))
+    for depth in sorted(by_depth, reverse=True):
+        _run_chunks(remove_directories, by_depth[depth], num_workers)
+    return len(files), sum([file_size for _, file_size in files])
+
+
+def query_pending_deletions(pending_dir=None):
+    """The records of the deletions in progress in pending_dir: dicts
+    of 'path', 'pid', 'device' and 'bytes_left' (None until the tree has
+    been scanned).  Records of processes that are gone have 'alive'
+    False.
+    """
+    pending_dir = pending_dir or default_pending_dir()
+    if not os.path.isdir(pending_dir):
+        return []
+    records = []
+    for name in sorted(os.listdir(pending_dir)):
+        if not name.endswith('.json'):
+            continue
+        record_path = os.path.join(pending_dir, name)
+        try:
+            fh = open(record_path)
+            try:
+                record = json.load(fh)
+            finally:
+                fh.close()
+        except (IOError, OSError, ValueError):
+            continue
+        if not isinstance(record, dict) or 'path' not in record:
+            continue
+        record['record_path'] = record_path
+        record['alive'] = is_process_alive(record.get('pid'))
+        records.append(record)
+    return records
+
+
+# DeletionService {{{1
+class DeletionService(object):
+    """Delete trees in the background:
+
+        service = DeletionService()
+        service.delete(path)    # path is gone now
+        ...
+        service.wait()          # and so is the space it took up
+
+    log_fn, if set, is called with a message about each finished
+    deletion, from the thread that did it.
+    """
+    def __init__(self, pending_dir=None, num_workers=DEFAULT_WORKERS,
+                 log_fn=None):
+        self.pending_dir = os.path.abspath(pending_dir or default_pending_dir())
+        self.num_workers = num_workers
+        self.log_fn = log_fn
+        self.threads = {}
+        self.errors = []
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def query_trash_path(self, path):
+        with self._lock:
+            self._count += 1
+            count = self._count
+        return '%s.%d.%d%s' % (path.rstrip(os.sep), os.getpid(), count,
+                               TRASH_SUFFIX)
+
+    def delete(self, path):
+        """Move path out of the way and start deleting it.  Raises
+        OSError if it can't be renamed, e.g. if it's a mount point.
+        Returns where it was moved to.
+        """
+        path = os.path.abspath(path)
+        trash_path = self.query_trash_path(path)
+        os.rename(path, trash_path)
+        self._start(trash_path)
+        return trash_path
+
+    def sweep(self):
+        """Start deleting what processes that have died left behind.
+        Returns the paths.
+        """
+        swept = []
+        for record in query_pending_deletions(self.pending_dir):
+            if record['alive']:
+                continue
+            if os.path.exists(record['record_path']):
+                os.remove(record['record_path'])
+            if os.path.lexists(record['path']) and record['path'] not in self.threads:
+                self._start(record['path'])
+                swept.append(record['path'])
+        return swept
+
+    def _write_record(self, record_path, record):
+        fd, tmp_path = tempfile.mkstemp(dir=self.pending_dir)
+        fh = os.fdopen(fd, 'w')
+        try:
+            json.dump(record, fh)
+        finally:
+            fh.close()
+        if os.name == 'nt' and os.path.exists(record_path):
+            os.remove(record_path)
+        os.rename(tmp_path, record_path)
+
+    def _start(self, trash_path):
+        if not os.path.isdir(self.pending_dir):
+            try:
+                os.makedirs(self.pending_dir)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        record_path = os.path.join(
+            self.pending_dir, '%s.json' % os.path.basename(trash_path))
+        record = {
+            'path': trash_path,
+            'pid': os.getpid(),
+            'device': os.lstat(trash_path).st_dev,
+            'bytes_left': None,
+        }
+        self._write_record(record_path, record)
+
+        def on_progress(bytes_left):
+            record['bytes_left'] = bytes_left
+            self._write_record(record_path, record)
+
+        def run():
+            start = time.time()
+            try:
+                files, size = delete_tree(trash_path, self.num_workers,
+                                          on_progress)
+            except:
+                self.errors.append((trash_path, sys.exc_info()))
+                return
+            elapsed = max(time.time() - start, 0.001)
+            if os.path.exists(record_path):
+                os.remove(record_path)
+            if self.log_fn is not None:
+                self.log_fn("Deleted %s: %d files, %.1f MB in %.1fs (%.1f MB/s)" %
+                            (trash_path, files, size / 1048576.0, elapsed,
+                             size / 1048576.0 / elapsed))
+        thread = threading.Thread(target=run)
+        # Don't hold up exiting; sweep() finishes the job next time.
+        thread.daemon = True
+        self.threads[trash_path] = thread
+        thread.start()
+
+    def query_pending(self):
+        """The paths still being deleted."""
+        return sorted([path for path, thread in self.threads.items()
+                       if thread.is_alive()])
+
+    def wait(self):
+        """Wait for the deletions to finish.  Returns a list of
+        (path, exc_info) of those that failed.
+        """
+        for thread in self.threads.values():
+            while thread.is_alive():
+                thread.join(1)
+        return self.errors
@@ -0,0 +1,532 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""HTTP downloads over pooled keep-alive connections, with Range
+requests.
+
+A Download is fetched into `<file>.part', and its progress is kept in
+`<file>.part.json': the URL, the validator (ETag or Last-Modified) of
+the bytes so far, the length, and how far each segment got.  If it's
+interrupted, the next attempt only fetches what's missing, with
+If-Range, so that a file that changed on the server starts over.  A
+large file can be fetched as several segments at once.
+
+URLs other than http(s) are fetched with urllib2, in one piece.
+
+A RangeFile reads parts of a remote file, e.g. a few members of a zip,
+without downloading the rest.
+"""
+
+import copy
+import errno
+import httplib
+import os
+import socket
+import sys
+import threading
+import urllib
+import urllib2
+import urlparse
+
+try:
+    import simplejson as json
+    assert json
+except ImportError:
+    import json
+
+from mozharness.base.incremental import hash_file
+
+# How much to read at a time.
+BLOCK_SIZE = 1024 ** 2
+
+# Files are only split into segments at least this big.
+MIN_SEGMENT_SIZE = 8 * 1024 ** 2
+
+MAX_REDIRECTS = 5
+DEFAULT_TIMEOUT = 30
+
+PART_SUFFIX = '.part'
+STATE_SUFFIX = '.part.json'
+
+
+class RangesNotSupported(Exception):
+    """The server can't send parts of the file."""
+    pass
+
+
+class _RestartDownload(Exception):
+    """The server ignored a Range request, so the bytes so far can't
+    be used.
+    """
+    pass
+
+
+# ConnectionPool {{{1
+class PooledResponse(object):
+    """An httplib response, whose connection goes back to the pool once
+    the body has been read.
+    """
+    def __init__(self, pool, key, conn, response, url):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self, amt=None):
+        try:
+            data = self.response.read(amt)
+        except httplib.HTTPException, e:
+            self.close()
+            raise urllib2.URLError("Error reading %s: %s" % (self.url, repr(e)))
+        if not data or self.response.isclosed():
+            self.close()
+        return data
+
+    def close(self):
+        """Return the connection to the pool if the whole body was
+        read, or drop it if not.
+        """
+        if self.conn is None:
+            return
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.put(self.key, self.conn)
+        else:
+            self.conn.close()
+        self.conn = None
+
+
+class ConnectionPool(object):
+    """Idle keep-alive connections, by scheme, host and port.  Safe to
+    share between threads.
+    """
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_idle=8):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.connections_made = 0
+
+    def _connect(self, key):
+        scheme, host, port = key
+        proxy = None
+        if not urllib.proxy_bypass(host):
+            proxy = urllib.getproxies().get(scheme)
+        if scheme == 'https':
+            connection_class = httplib.HTTPSConnection
+        else:
+            connection_class = httplib.HTTPConnection
+        if proxy:
+            proxy = urlparse.urlsplit(proxy)
+            conn = connection_class(proxy.hostname, proxy.port,
+                                    timeout=self.timeout)
+            if scheme == 'https':
+                conn.set_tunnel(host, port)
+            else:
+                conn.proxied = True
+        else:
+            conn = connection_class(host, port, timeout=self.timeout)
+        with self.lock:
+            self.connections_made += 1
+        return conn
+
+    def get(self, key):
+        """Returns (connection, reused)."""
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._connect(key), False
+
+    def put(self, key, conn):
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _send(self, key, method, url, headers):
+        conn, reused = self.get(key)
+        try:
+            return conn, self._send_on(conn, method, url, headers)
+        except (httplib.HTTPException, socket.error), e:
+            conn.close()
+            if not reused or isinstance(e, socket.timeout):
+                raise
+        # The server closed the idle connection; try a new one.
+        conn = self._connect(key)
+        try:
+            return conn, self._send_on(conn, method, url, headers)
+        except:
+            conn.close()
+            raise
+
+    def _send_on(self, conn, method, url, headers):
+        if getattr(conn, 'proxied', False):
+            path = url
+        else:
+            parsed = urlparse.urlsplit(url)
+            path = urlparse.urlunsplit(('', '', parsed.path or '/', parsed.query, ''))
+        conn.request(method, path, headers=headers)
+        return conn.getresponse()
+
+    def request(self, url, headers=None, method='GET'):
+        """Send a request, following redirects.
+
+        Returns a PooledResponse, whose url is the one it came from.
+        Raises urllib2.HTTPError for an error status, and
+        urllib2.URLError if the server can't be reached.
+        """
+        headers = dict(headers or {})
+        for _ in range(MAX_REDIRECTS + 1):
+            parsed = urlparse.urlsplit(url)
+            if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+                raise urllib2.URLError("Can't request %s" % url)
+            port = parsed.port
+            if port is None:
+                if parsed.scheme == 'https':
+                    port = httplib.HTTPS_PORT
+                else:
+                    port = httplib.HTTP_PORT
+            key = (parsed.scheme, parsed.hostname, port)
+            try:
+                conn, response = self._send(key, method, url, headers)
+            except socket.timeout:
+                raise
+            except (httplib.HTTPException, socket.error), e:
+                raise urllib2.URLError(e)
+            response = PooledResponse(self, key, conn, response, url)
+            if response.status in (301, 302, 303, 307, 308) and \
+                    response.getheader('location'):
+                response.read()
+                response.close()
+                url = urlparse.urljoin(url, response.getheader('location'))
+                continue
+            if response.status >= 400:
+                response.read()
+                response.close()
+                raise urllib2.HTTPError(url, response.status, response.reason,
+                                        response.response.msg, None)
+            return response
+        raise urllib2.URLError("Too many redirects for %s" % url)
+
+
+# RangeFile {{{1
+class RangeFile(object):
+    """A read-only, seekable file object for the remote file at `url',
+    which fetches what's read with Range requests, at least block_size
+    bytes at a time.
+
+    Raises RangesNotSupported if the server doesn't take Range requests,
+    and urllib2.URLError if the file changes while it's being read.
+    """
+    def __init__(self, pool, url, block_size=BLOCK_SIZE):
+        self.pool = pool
+        self.url = url
+        self.name = url
+        self.block_size = block_size
+        response = pool.request(url, method='HEAD')
+        response.close()
+        length = response.getheader('content-length')
+        if response.getheader('accept-ranges') != 'bytes' or length is None or \
+                response.getheader('content-encoding'):
+            raise RangesNotSupported("%s doesn't support Range requests" % url)
+        self.length = int(length)
+        self.validator = response.getheader('etag') or \
+            response.getheader('last-modified')
+        self.pos = 0
+        self.buffer_start = 0
+        self.buffer = ''
+        self.bytes_fetched = 0
+        self.requests = 0
+
+    def reopen(self):
+        """Another RangeFile for the same file, with a position of its
+        own, e.g. for another thread.
+        """
+        other = copy.copy(self)
+        other.pos = other.buffer_start = 0
+        other.buffer = ''
+        other.bytes_fetched = other.requests = 0
+        return other
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.length
+        if offset < 0:
+            raise IOError(errno.EINVAL, "Negative seek in %s" % self.url)
+        self.pos = offset
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        end = self.length
+        if size is not None and size >= 0:
+            end = min(self.pos + size, self.length)
+        chunks = []
+        while self.pos < end:
+            offset = self.pos - self.buffer_start
+            if offset < 0 or offset >= len(self.buffer):
+                self._fill(self.pos, max(end - self.pos, self.block_size))
+                offset = 0
+            chunk = self.buffer[offset:offset + end - self.pos]
+            chunks.append(chunk)
+            self.pos += len(chunk)
+        return ''.join(chunks)
+
+    def _fill(self, start, size):
+        end = min(start + size, self.length)
+        headers = {'Range': 'bytes=%d-%d' % (start, end - 1)}
+        if self.validator:
+            headers['If-Range'] = self.validator
+        response = self.pool.request(self.url, headers=headers)
+        if response.status != 206:
+            response.close()
+            raise urllib2.URLError("%s changed while it was being read" % self.url)
+        data = response.read()
+        response.close()
+        if len(data) != end - start:
+            raise urllib2.URLError("Got %d of bytes %d-%d of %s" %
+                                   (len(data), start, end - 1, self.url))
+        self.buffer_start = start
+        self.buffer = data
+        self.bytes_fetched += len(data)
+        self.requests += 1
+
+    def close(self):
+        self.buffer = ''
+
+
+# Download {{{1
+class Download(object):
+    """Fetch `url' to `file_name':
+
+        Download(pool, url, file_name, segments=4).run()
+
+    A file of known length from a server that takes Range requests
+    can be resumed, and split into up to `segments' parts of at least
+    min_segment_size bytes, which are fetched at once.  If `checksum'
+    is set, the file's `hash_type' hex digest has to match it.
+    """
+    def __init__(self, pool, url, file_name, segments=1, checksum=None,
+                 hash_type='sha512', min_segment_size=None,
+                 block_size=BLOCK_SIZE):
+        self.pool = pool
+        self.url = url
+        self.file_name = file_name
+        self.part_name = file_name + PART_SUFFIX
+        self.state_name = file_name + STATE_SUFFIX
+        self.segments = max(1, segments)
+        self.checksum = checksum
+        self.hash_type = hash_type
+        if min_segment_size is None:
+            min_segment_size = MIN_SEGMENT_SIZE
+        self.min_segment_size = min_segment_size
+        self.block_size = block_size
+        self.state = None
+        self.resumed_bytes = 0
+
+    def run(self):
+        """Returns file_name.  Raises urllib2.URLError, socket.error or
+        IOError on failure, keeping whatever can be resumed.
+        """
+        if urlparse.urlsplit(self.url).scheme not in ('http', 'https'):
+            self._fetch_whole(urllib2.urlopen(self.url, timeout=self.pool.timeout))
+        else:
+            try:
+                self._fetch()
+            except _RestartDownload:
+                self.discard()
+                self._fetch()
+        self._finish()
+        return self.file_name
+
+    def read_state(self):
+        """The saved progress of an earlier attempt at this download,
+        or None.
+        """
+        if not os.path.exists(self.part_name) or not os.path.exists(self.state_name):
+            return None
+        try:
+            fh = open(self.state_name)
+            try:
+                state = json.load(fh)
+            finally:
+                fh.close()
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(state, dict) or state.get('url') != self.url or \
+                os.path.getsize(self.part_name) != state.get('length'):
+            return None
+        return state
+
+    def write_state(self):
+        fh = open(self.state_name, 'w')
+        try:
+            json.dump(self.state, fh)
+        finally:
+            fh.close()
+
+    def discard(self):
+        """Forget any earlier progress."""
+        self.state = None
+        for path in (self.state_name, self.part_name):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _fetch(self):
+        self.state = self.read_state()
+        response = None
+        if self.state is None:
+            self.discard()
+            response = self.pool.request(self.url)
+            length = response.getheader('content-length')
+            validator = response.getheader('etag') or \
+                response.getheader('last-modified')
+            if response.status != 200 or length is None or not validator or \
+                    response.getheader('accept-ranges') != 'bytes' or \
+                    response.getheader('content-encoding'):
+                # Not resumable.
+                self._fetch_whole(response)
+                return
+            length = int(length)
+            self.state = {
+                'url': self.url,
+                'validator': validator,
+                'length': length,
+                'segments': self._split(length),
+            }
+            fh = open(self.part_name, 'wb')
+            try:
+                fh.truncate(length)
+            finally:
+                fh.close()
+            self.write_state()
+        else:
+            self.resumed_bytes = sum([done for _, _, done in self.state['segments']])
+        pending = [segment for segment in self.state['segments']
+                   if segment[0] + segment[2] < segment[1]]
+        try:
+            self._fetch_segments(pending, response)
+        finally:
+            if response is not None:
+                response.close()
+            self.write_state()
+
+    def _split(self, length):
+        count = min(self.segments, max(1, length // self.min_segment_size))
+        bounds = [length * i // count for i in range(count + 1)]
+        return [[bounds[i], bounds[i + 1], 0] for i in range(count)]
+
+    def _fetch_segments(self, pending, response):
+        """Fetch the first segment in this thread, from `response' if
+        it's the start of the file, and the rest in their own threads.
+        """
+        errors = []
+
+        def fetch(segment, response=None):
+            try:
+                self._fetch_segment(segment, response)
+            except:
+                errors.append(sys.exc_info())
+        threads = []
+        for segment in pending[1:]:
+            thread = threading.Thread(target=fetch, args=(segment, ))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        if pending:
+            if pending[0][0] + pending[0][2] == 0:
+                fetch(pending[0], response)
+            else:
+                fetch(pending[0])
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+        for exc_info in errors:
+            if exc_info[0] is _RestartDownload:
+                raise exc_info[0], exc_info[1], exc_info[2]
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+
+    def _fetch_segment(self, segment, response=None):
+        start, end = segment[0], segment[1]
+        if response is None:
+            response = self.pool.request(self.url, headers={
+                'Range': 'bytes=%d-%d' % (start + segment[2], end - 1),
+                'If-Range': self.state['validator'],
+            })
+            content_range = response.getheader('content-range', '')
+            if response.status != 206 or \
+                    not content_range.startswith('bytes %d-' % (start + segment[2])):
+                response.close()
+                raise _RestartDownload("%s didn't return the range asked for" % self.url)
+        fh = open(self.part_name, 'r+b')
+        try:
+            fh.seek(start + segment[2])
+            while start + segment[2] < end:
+                block = response.read(min(self.block_size, end - start - segment[2]))
+                if not block:
+                    raise urllib2.URLError("Download incomplete; got %d of bytes %d-%d of %s" %
+                                           (segment[2], start, end - 1, self.url))
+                fh.write(block)
+                segment[2] += len(block)
+        finally:
+            fh.close()
+            response.close()
+
+    def _fetch_whole(self, response):
+        """Stream a response that can't be resumed into the .part file."""
+        length = None
+        if hasattr(response, 'getheader'):
+            length = response.getheader('content-length')
+        elif response.info().get('content-length') is not None:
+            length = response.info()['content-length']
+        got_length = 0
+        fh = open(self.part_name, 'wb')
+        try:
+            while True:
+                block = response.read(self.block_size)
+                if not block:
+                    break
+                fh.write(block)
+                got_length += len(block)
+        finally:
+            fh.close()
+            response.close()
+        if length is not None and got_length != int(length):
+            raise urllib2.URLError("Download incomplete; content-length was %s, but only received %d" %
+                                   (length, got_length))
+
+    def _finish(self):
+        if self.checksum:
+            digest = hash_file(self.part_name, self.hash_type)
+            if digest != self.checksum:
+                self.discard()
+                raise urllib2.URLError("%s has %s %s; expected %s" %
+                                       (self.url, self.hash_type, digest, self.checksum))
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
+        os.rename(self.part_name, self.file_name)
+        if os.path.exists(self.state_name):
+            os.remove(self.state_name)
+        self.state = None
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Incremental builds: reuse outputs whose inputs haven't changed.
+
+The inputs of an output are a dict of name to JSON-able value, e.g.
+the hashes of the files it's made from and the settings and tools that
+affect it.  write_input_manifest() records them in a manifest next to
+the output, along with the hash of the output itself, and
+is_output_current() checks that both still match.
+"""
+
+import hashlib
+import inspect
+import os
+
+try:
+    import simplejson as json
+    assert json
+except ImportError:
+    import json
+
+from mozharness.base.log import ERROR
+
+# How much of a file to hash at a time.
+HASH_BLOCK_SIZE = 1024 ** 2
+
+MANIFEST_SUFFIX = '.inputs.json'
+
+
+def hash_file(path, hash_type='sha1'):
+    """The hex digest of the file at `path', or None if it can't be
+    read.
+    """
+    m = hashlib.new(hash_type)
+    try:
+        fh = open(path, 'rb')
+    except (IOError, OSError):
+        return None
+    try:
+        while True:
+            block = fh.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            m.update(block)
+    finally:
+        fh.close()
+    return m.hexdigest()
+
+
+def hash_sources(modules, hash_type='sha1'):
+    """One hex digest for the source files of `modules', so that
+    changing the code that makes an output makes it out of date.
+    """
+    m = hashlib.new(hash_type)
+    for module in modules:
+        path = inspect.getsourcefile(module) or module.__file__
+        m.update('%s %s\n' % (os.path.basename(path), hash_file(path)))
+    return m.hexdigest()
+
+
+# InputManifestMixin {{{1
+class InputManifestMixin(object):
+    """Needs BaseScript's logging and file helpers.
+    """
+    def query_input_manifest_path(self, output_path):
+        return output_path + MANIFEST_SUFFIX
+
+    def read_input_manifest(self, output_path):
+        """The {"inputs", "output"} manifest written for output_path, or
+        None if there isn't a readable one.
+        """
+        manifest_path = self.query_input_manifest_path(output_path)
+        if not os.path.exists(manifest_path):
+            return None
+        try:
+            fh = open(manifest_path)
+            try:
+                manifest = json.load(fh)
+            finally:
+                fh.close()
+        except (IOError, OSError, ValueError), e:
+            self.warning("Ignoring unreadable %s: %s" % (manifest_path, str(e)))
+            return None
+        if not isinstance(manifest, dict) or 'inputs' not in manifest:
+            self.warning("Ignoring malformed %s" % manifest_path)
+            return None
+        return manifest
+
+    def is_output_current(self, output_path, inputs):
+        """True if output_path was made from `inputs' and hasn't changed
+        since.
+        """
+        manifest = self.read_input_manifest(output_path)
+        if manifest is None:
+            return False
+        # Compare them as they'd be written: tuples (e.g. LockedTuples
+        # from a locked config) come back from the manifest as lists.
+        inputs = json.loads(json.dumps(inputs))
+        if manifest['inputs'] != inputs:
+            changed = sorted([name for name in set(inputs) | set(manifest['inputs'])
+                              if inputs.get(name) != manifest['inputs'].get(name)])
+            self.info("%s is out of date; changed: %s" %
+                      (output_path, ', '.join(changed)))
+            return False
+        if hash_file(output_path) != manifest.get('output'):
+            self.info("%s is missing or has been modified." % output_path)
+            return False
+        return True
+
+    def write_input_manifest(self, output_path, inputs, error_level=ERROR):
+        """Record that output_path was made from `inputs'.
+        Returns None for success, not None for failure
+        """
+        output_hash = hash_file(output_path)
+        if output_hash is None:
+            self.log("Can't hash %s!" % output_path, level=error_level)
+            return -1
+        if self.write_to_file(self.query_input_manifest_path(output_path),
+                              json.dumps({'inputs': inputs, 'output': output_hash},
+                                         indent=2, sort_keys=True),
+                              verbose=False, error_level=error_level) is None:
+            return -1
+
+    def remove_output(self, output_path, error_level=ERROR):
+        """Remove output_path and its manifest, so a failed rebuild
+        doesn't leave the previous output behind to be reused.
+        Returns None for success, not None for failure
+        """
+        for path in (self.query_input_manifest_path(output_path), output_path):
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError, e:
+                    self.log("Can't remove %s: %s" % (path, str(e)),
+                             level=error_level)
+                    return -1
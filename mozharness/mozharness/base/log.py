@@ -11,12 +11,25 @@ TODO:
 - log rotation config
 """
 
+import atexit
+from contextlib import contextmanager
 from datetime import datetime
 import logging
 import os
+import re
+import sre_constants
+import sre_parse
 import sys
+import threading
+import time
 import traceback
 
+try:
+    import simplejson as json
+    assert json
+except ImportError:
+    import json
+
 # Define our own FATAL_LEVEL
 FATAL_LEVEL = logging.CRITICAL + 10
 logging.addLevelName(FATAL_LEVEL, 'FATAL')
@@ -25,6 +38,12 @@ logging.addLevelName(FATAL_LEVEL, 'FATAL')
 DEBUG, INFO, WARNING, ERROR, CRITICAL, FATAL, IGNORE = (
     'debug', 'info', 'warning', 'error', 'critical', 'fatal', 'ignore')
 
+# Where buffer_log() sends each thread's LogMixin messages.
+_thread_log = threading.local()
+
+# What log records are about, e.g. the action; see set_log_context().
+_log_context = {}
+
 
 # LogMixin {{{1
 class LogMixin(object):
@@ -48,8 +67,9 @@ class LogMixin(object):
                 print message
 
     def log(self, message, level=INFO, exit_code=-1):
-        if self.log_obj:
-            return self.log_obj.log_message(
+        log_obj = getattr(_thread_log, 'log_obj', None) or self.log_obj
+        if log_obj:
+            return log_obj.log_message(
                 message, level=level,
                 exit_code=exit_code,
                 post_fatal_callback=self._post_fatal,
@@ -120,6 +140,182 @@ class LogMixin(object):
         pass
 
 
+# log context {{{1
+def set_log_context(**kwargs):
+    """Set what the script's log records are about from now on, e.g.
+    set_log_context(action='build').  A value of None unsets it.
+    """
+    for key, value in kwargs.items():
+        if value is None:
+            _log_context.pop(key, None)
+        else:
+            _log_context[key] = value
+
+
+def query_log_context():
+    """What this thread's log records are about: the script's
+    context, and this thread's log_context()s.
+    """
+    merged = dict(_log_context)
+    merged.update(getattr(_thread_log, 'context', None) or {})
+    return merged
+
+
+@contextmanager
+def log_context(**kwargs):
+    """Add to what this thread's log records are about inside the
+    with block:
+
+        with log_context(command=command_id):
+            ...
+    """
+    previous = getattr(_thread_log, 'context', None)
+    context = dict(previous or {})
+    context.update(kwargs)
+    _thread_log.context = context
+    try:
+        yield
+    finally:
+        _thread_log.context = previous
+
+
+# LogBuffer {{{1
+class LogBuffer(object):
+    """A log_obj that keeps messages, so they can be logged later in
+    one piece with replay().
+
+    A fatal message is kept and raises SystemExit, as fatal() would,
+    but the script's _post_fatal() only runs when it's replayed.
+    """
+    def __init__(self):
+        self.records = []
+        # the log context of each record
+        self.contexts = []
+        self.has_fatal = False
+        self.lock = threading.Lock()
+
+    def log_message(self, message, level=INFO, exit_code=-1, post_fatal_callback=None):
+        context = query_log_context()
+        with self.lock:
+            self.records.append((message, level, exit_code))
+            self.contexts.append(context)
+            if level == FATAL:
+                self.has_fatal = True
+        if level == FATAL:
+            raise SystemExit(exit_code)
+
+    def replay(self, log_mixin):
+        """Log the kept messages through log_mixin.log(), and forget
+        them.  Replaying a fatal message exits.
+        """
+        with self.lock:
+            records, self.records = self.records, []
+            contexts, self.contexts = self.contexts, []
+        for (message, level, exit_code), context in zip(records, contexts):
+            with log_context(**context):
+                log_mixin.log(message, level=level, exit_code=exit_code)
+
+
+@contextmanager
+def buffer_log(log_buffer):
+    """Send every LogMixin message logged in this thread to
+    log_buffer instead of the object's log_obj:
+
+        with buffer_log(log_buffer):
+            self.run_command(...)
+    """
+    previous = getattr(_thread_log, 'log_obj', None)
+    _thread_log.log_obj = log_buffer
+    try:
+        yield log_buffer
+    finally:
+        _thread_log.log_obj = previous
+
+
+# ErrorListMatcher {{{1
+def _required_literal(regex):
+    """The longest run of plain text at the top level of the compiled
+    `regex', which every match has to contain, or None.
+    """
+    if not hasattr(regex, 'pattern') or regex.flags & re.IGNORECASE:
+        return None
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except (sre_constants.error, TypeError):
+        return None
+    best = run = u''
+    for op, av in list(parsed) + [(None, None)]:
+        if op is sre_constants.LITERAL and av < 128:
+            run += unichr(av)
+        else:
+            if len(run) > len(best):
+                best = run
+            run = u''
+    return best or None
+
+
+def _is_ascii(s):
+    try:
+        s.encode('ascii')
+    except (UnicodeError, AttributeError):
+        return False
+    return True
+
+
+class ErrorListMatcher(object):
+    """Finds the first entry of an error_list that matches a line.
+
+    Most lines match nothing, so rather than trying every entry on
+    every line, every 'substr', and the longest bit of plain text that
+    every match of a 'regex' contains, go into one regex.  Only lines
+    that it finds something in are checked against the whole list;
+    the rest are only checked against the entries without such text.
+    """
+    # Shorter text would be in too many lines to be worth looking for.
+    min_literal_length = 3
+
+    def __init__(self, error_list):
+        self.error_list = error_list
+        self.list_length = len(error_list)
+        # entries with neither 'substr' nor 'regex'
+        self.malformed = []
+        self.unfiltered = []
+        literals = set()
+        for i, error_check in enumerate(error_list):
+            if 'substr' in error_check:
+                literal = error_check['substr']
+            elif 'regex' in error_check:
+                literal = _required_literal(error_check['regex'])
+            else:
+                self.malformed.append(i)
+                continue
+            if literal and len(literal) >= self.min_literal_length and \
+                    _is_ascii(literal):
+                literals.add(unicode(literal))
+            else:
+                self.unfiltered.append(i)
+        self.prefilter = None
+        if literals:
+            self.prefilter = re.compile(
+                u'|'.join([re.escape(l) for l in sorted(literals)]))
+
+    def match(self, line):
+        """The index of the first entry that matches `line', or None."""
+        if self.prefilter is not None and self.prefilter.search(line):
+            indexes = xrange(self.list_length)
+        else:
+            indexes = self.unfiltered
+        for i in indexes:
+            error_check = self.error_list[i]
+            if 'substr' in error_check:
+                if error_check['substr'] in line:
+                    return i
+            elif 'regex' in error_check:
+                if error_check['regex'].search(line):
+                    return i
+        return None
+
+
 # OutputParser {{{1
 class OutputParser(LogMixin):
     """ Helper object to parse command output.
@@ -153,37 +349,44 @@ pre-context-line setting in error_list.)
         self.num_pre_context_lines = 0
         self.num_post_context_lines = 0
         self.worst_log_level = INFO
+        self.error_list_matcher = None
+
+    def query_error_list_matcher(self):
+        """The ErrorListMatcher for self.error_list, which is compiled
+        again if it's been replaced or added to.
+        """
+        matcher = getattr(self, 'error_list_matcher', None)
+        if matcher is None or matcher.error_list is not self.error_list or \
+                matcher.list_length != len(self.error_list):
+            matcher = self.error_list_matcher = ErrorListMatcher(self.error_list)
+        return matcher
 
     def parse_single_line(self, line):
-        for error_check in self.error_list:
-            # TODO buffer for context_lines.
-            match = False
-            if 'substr' in error_check:
-                if error_check['substr'] in line:
-                    match = True
-            elif 'regex' in error_check:
-                if error_check['regex'].search(line):
-                    match = True
-            else:
-                self.warning("error_list: 'substr' and 'regex' not in %s" %
-                             error_check)
-            if match:
-                log_level = error_check.get('level', INFO)
-                if self.log_output:
-                    message = ' %s' % line
-                    if error_check.get('explanation'):
-                        message += '\n %s' % error_check['explanation']
-                    if error_check.get('summary'):
-                        self.add_summary(message, level=log_level)
-                    else:
-                        self.log(message, level=log_level)
-                if log_level in (ERROR, CRITICAL, FATAL):
-                    self.num_errors += 1
-                if log_level == WARNING:
-                    self.num_warnings += 1
-                self.worst_log_level = self.worst_level(log_level,
-                                                        self.worst_log_level)
+        matcher = self.query_error_list_matcher()
+        index = matcher.match(line)
+        for i in matcher.malformed:
+            if index is not None and i > index:
                 break
+            self.warning("error_list: 'substr' and 'regex' not in %s" %
+                         self.error_list[i])
+        if index is not None:
+            # TODO buffer for context_lines.
+            error_check = self.error_list[index]
+            log_level = error_check.get('level', INFO)
+            if self.log_output:
+                message = ' %s' % line
+                if error_check.get('explanation'):
+                    message += '\n %s' % error_check['explanation']
+                if error_check.get('summary'):
+                    self.add_summary(message, level=log_level)
+                else:
+                    self.log(message, level=log_level)
+            if log_level in (ERROR, CRITICAL, FATAL):
+                self.num_errors += 1
+            if log_level == WARNING:
+                self.num_warnings += 1
+            self.worst_log_level = self.worst_level(log_level,
+                                                    self.worst_log_level)
         else:
             if self.log_output:
                 self.info(' %s' % line)
@@ -390,6 +593,204 @@ class MultiFileLogger(BaseLogger):
                                       log_level=level)
 
 
+# JSONLinesLogger {{{1
+class JSONLinesLogger(BaseLogger):
+    """Log each line as a JSON record, one per line, to
+    <log_name>.jsonl in log_dir:
+
+        {"time":1392312345.123,"level":"info","action":"build","command":3,"line":"..."}
+
+    action and command (a run_command() id) come from the log context,
+    and are null outside of one.  Records are written in batches by a
+    background thread, every flush_interval seconds, rather than each
+    going through logging.  The console still gets the formatted
+    lines.  rebuild_logs(), or `python -m mozharness.base.log', turns
+    the records back into MultiFileLogger's per-level logs.
+    """
+    def __init__(self, logger_name='JSONLines',
+                 log_format='%(asctime)s %(levelname)8s - %(message)s',
+                 log_dir='logs', flush_interval=1.0, **kwargs):
+        BaseLogger.__init__(self, logger_name=logger_name,
+                            log_format=log_format, log_dir=log_dir,
+                            **kwargs)
+        self.flush_interval = flush_interval
+        self.min_level = self.get_logger_level()
+        self._queue = []
+        self._closed = False
+        self._queue_cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self.new_logger(self.logger_name)
+        self.init_message()
+
+    def new_logger(self, logger_name):
+        self.log_files['json'] = '%s.jsonl' % self.log_name
+        self.log_path = os.path.join(self.abs_log_dir, self.log_files['json'])
+        self._fh = open(self.log_path, self.append_to_log and 'a' or 'w')
+        self._writer = threading.Thread(target=self._write_records)
+        self._writer.daemon = True
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _format_record(self, record):
+        timestamp, level, action, command, line = record
+        if isinstance(line, str):
+            line = line.decode('utf-8', 'replace')
+        return '{"time":%.3f,"level":"%s","action":%s,"command":%s,"line":%s}\n' % (
+            timestamp, level, json.dumps(action), json.dumps(command),
+            json.dumps(line))
+
+    def _write_queued(self):
+        # Under self._write_lock, so batches are written in order.
+        with self._queue_cond:
+            records, self._queue = self._queue, []
+        if records:
+            self._fh.write(''.join([self._format_record(r) for r in records]))
+        return records
+
+    def _write_records(self):
+        while True:
+            with self._queue_cond:
+                if not self._queue and not self._closed:
+                    self._queue_cond.wait(self.flush_interval)
+                closed = self._closed
+            with self._write_lock:
+                if self._fh.closed:
+                    return
+                written = self._write_queued()
+                self._fh.flush()
+            if closed and not written:
+                return
+
+    def flush(self):
+        """Write out every record logged so far."""
+        with self._write_lock:
+            if not self._fh.closed:
+                self._write_queued()
+                self._fh.flush()
+
+    def close(self):
+        with self._queue_cond:
+            self._closed = True
+            self._queue_cond.notify()
+        self.flush()
+        with self._write_lock:
+            if not self._fh.closed:
+                self._fh.close()
+
+    def _log_lines(self, lines, level):
+        levelno = self.get_logger_level(level)
+        if levelno < self.min_level:
+            return
+        now = time.time()
+        context = query_log_context()
+        action, command = context.get('action'), context.get('command')
+        with self._queue_cond:
+            for line in lines:
+                self._queue.append((now, level, action, command, line))
+        if self.log_to_console:
+            asctime = time.strftime(self.log_date_format, time.localtime(now))
+            levelname = logging.getLevelName(levelno)
+            sys.stderr.write(''.join([self.log_format % {
+                'asctime': asctime, 'levelname': levelname, 'message': line,
+            } + '\n' for line in lines]))
+
+    def log_message(self, message, level=INFO, exit_code=-1, post_fatal_callback=None):
+        if level == IGNORE:
+            return
+        self._log_lines(message.splitlines(), level)
+        if level == FATAL:
+            if callable(post_fatal_callback):
+                self._log_lines(["Running post_fatal callback..."], FATAL)
+                post_fatal_callback(message=message, exit_code=exit_code)
+            self._log_lines(['Exiting %d' % exit_code], FATAL)
+            self.flush()
+            raise SystemExit(exit_code)
+
+
+def read_json_log(path):
+    """Yield the records of a JSONLinesLogger log as dicts, skipping
+    lines that aren't complete records.
+    """
+    fh = open(path)
+    try:
+        for line in fh:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and 'level' in record:
+                yield record
+    finally:
+        fh.close()
+
+
+def rebuild_logs(path, log_dir=None, log_name=None, log_level=INFO,
+                 log_format='%(asctime)s %(levelname)8s - %(message)s',
+                 date_format='%H:%M:%S', log_to_raw=True):
+    """Write the logs MultiFileLogger would have written from the
+    JSONLinesLogger log at path: <log_name>_<level>.log for each level
+    from log_level up, and <log_name>_raw.log.  log_dir defaults to
+    path's directory and log_name to its name, without '.jsonl'.
+
+    Returns a dict of level (or 'raw') to the path of its log.
+    """
+    log_dir = log_dir or os.path.dirname(os.path.abspath(path))
+    if not log_name:
+        log_name = os.path.basename(path)
+        if log_name.endswith('.jsonl'):
+            log_name = log_name[:-len('.jsonl')]
+    min_level = BaseLogger.LEVELS[log_level]
+    levels = [level for level in BaseLogger.LEVELS
+              if BaseLogger.LEVELS[level] >= min_level]
+    log_paths = dict([(level, os.path.join(log_dir, '%s_%s.log' % (log_name, level)))
+                      for level in levels])
+    if log_to_raw:
+        log_paths['raw'] = os.path.join(log_dir, '%s_raw.log' % log_name)
+    files = dict([(level, open(log_path, 'w'))
+                  for level, log_path in log_paths.items()])
+    try:
+        for record in read_json_log(path):
+            levelno = BaseLogger.LEVELS.get(record['level'])
+            if levelno is None or levelno < min_level:
+                continue
+            line = record.get('line') or ''
+            if isinstance(line, unicode):
+                line = line.encode('utf-8')
+            formatted = log_format % {
+                'asctime': time.strftime(date_format,
+                                         time.localtime(record.get('time', 0))),
+                'levelname': logging.getLevelName(levelno),
+                'message': line,
+            } + '\n'
+            for level in levels:
+                if levelno >= BaseLogger.LEVELS[level]:
+                    files[level].write(formatted)
+            if log_to_raw:
+                files['raw'].write(line + '\n')
+    finally:
+        for fh in files.values():
+            fh.close()
+    return log_paths
+
+
 # __main__ {{{1
 if __name__ == '__main__':
-    pass
+    from optparse import OptionParser
+    parser = OptionParser(usage="""%prog [options] LOG.jsonl
+
+Rebuild the per-level logs from a JSONLinesLogger log.""")
+    parser.add_option("--log-dir", dest="log_dir",
+                      help="Write the logs here (default: next to LOG.jsonl)")
+    parser.add_option("--log-name", dest="log_name",
+                      help="Name the logs LOG_NAME_<level>.log")
+    parser.add_option("--log-level", dest="log_level", default=INFO,
+                      choices=[DEBUG, INFO, WARNING, ERROR, CRITICAL, FATAL],
+                      help="Lowest level to write a log for (default: info)")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Need exactly one log to rebuild from")
+    log_paths = rebuild_logs(args[0], log_dir=options.log_dir,
+                             log_name=options.log_name,
+                             log_level=options.log_level)
+    for key in sorted(log_paths):
+        print log_paths[key]
@@ -7,6 +7,11 @@
 """Generic ways to parallelize jobs.
 """
 
+import multiprocessing
+import Queue
+import sys
+import threading
+
 # ChunkingMixin {{{1
 
 class ChunkingMixin(object):
@@ -34,3 +39,222 @@ class ChunkingMixin(object):
             if c == this_chunk:
                 return possible_list[0:n]
             del possible_list[0:n]
+
+
+# ParallelMixin {{{1
+
+def query_num_workers(config):
+    """config['parallel_workers'], or the number of CPUs if that isn't
+    set.
+    """
+    num_workers = config.get('parallel_workers')
+    if not num_workers:
+        try:
+            num_workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            num_workers = 1
+    return max(1, int(num_workers))
+
+# The script whose methods the pool workers call.  Pool workers are
+# forked, so they see whatever this was set to when the pool started.
+_parallel_script = None
+
+
+def _run_parallel_item(args):
+    """Call one item's method in a pool worker (or in-process).
+
+    Returns a (status, value) tuple: ('ok', return value), ('error',
+    None) for an uncaught exception, which is logged here, or ('exit',
+    exit code) if the method called fatal() or otherwise exited.
+    """
+    method_name, item = args
+    script = _parallel_script
+    try:
+        return ('ok', getattr(script, method_name)(*item))
+    except SystemExit, e:
+        return ('exit', e.code)
+    except Exception:
+        script.exception("Uncaught exception in %s%s" % (method_name, str(item)))
+        return ('error', None)
+
+
+class ParallelMixin(object):
+    """Run a method over a list of independent items, spread across a
+    pool of worker processes.
+
+    Each call runs in its own process, so it can't change the script's
+    state (failures, summaries, config); item methods should return
+    None for success and a failure message otherwise, and let the
+    caller record the results.
+    """
+    def query_parallel_workers(self):
+        """The number of worker processes to use: config['parallel_workers'],
+        or the number of CPUs if that isn't set.
+        """
+        return query_num_workers(self.config)
+
+    def run_parallel(self, method_name, items, num_workers=None,
+                     error_message="Uncaught exception."):
+        """Call getattr(self, method_name)(*item) for every item in
+        `items', using up to `num_workers' processes.
+
+        Returns the list of return values, in the same order as `items'.
+        If a call raises an exception, its return value is
+        `error_message'.  If a call exits (e.g. through fatal()), the
+        script exits once every other item has finished.
+        """
+        global _parallel_script
+        items = [tuple(item) for item in items]
+        if num_workers is None:
+            num_workers = self.query_parallel_workers()
+        num_workers = min(num_workers, len(items))
+        if num_workers > 1 and sys.platform.startswith('win'):
+            # Without fork(), the workers can't inherit the script.
+            self.info("Parallel workers aren't supported on %s; running serially." % sys.platform)
+            num_workers = 1
+        args = [(method_name, item) for item in items]
+        _parallel_script = self
+        try:
+            if num_workers > 1:
+                self.info("Running %s for %d items with %d workers." %
+                          (method_name, len(items), num_workers))
+                pool = multiprocessing.Pool(processes=num_workers)
+                try:
+                    results = pool.map(_run_parallel_item, args, chunksize=1)
+                    pool.close()
+                except:
+                    pool.terminate()
+                    raise
+                finally:
+                    pool.join()
+            else:
+                results = map(_run_parallel_item, args)
+        finally:
+            _parallel_script = None
+        return_values = []
+        exit_code = None
+        for item, (status, value) in zip(items, results):
+            if status == 'exit':
+                exit_code = value
+                self.error("%s%s exited with %s." % (method_name, str(item), str(value)))
+                value = error_message
+            elif status == 'error':
+                value = error_message
+            return_values.append(value)
+        if exit_code is not None:
+            self.fatal("%s exited; stopping." % method_name, exit_code=exit_code)
+        return return_values
+
+
+# Pipeline {{{1
+
+# Queued after the last item, once per downstream worker.
+_PIPELINE_DONE = object()
+
+
+class Pipeline(object):
+    """Stream items through a series of stages.
+
+    `stages' is a list of (name, function, num_workers) tuples.  Every
+    stage gets num_workers threads, which call function(*item) for each
+    item that reaches it.  A function returns None for success, and the
+    item moves on to the next stage's queue; anything else is a failure
+    message, and the item stops there.
+
+    The queues between stages hold at most `queue_size' items, so a
+    fast stage can't get too far ahead of a slow one.
+
+    on_result(name, item, result) is called with every result, and
+    on_exception(name, item) from the except block of any exception a
+    stage function raises (its result is then `error_message').
+    Both are called under the pipeline's lock, one at a time.
+
+    If a stage function exits (e.g. through fatal()), the remaining
+    items are dropped and run() returns its exit code.
+    """
+    def __init__(self, stages, queue_size=1, on_result=None,
+                 on_exception=None, error_message="Uncaught exception."):
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.on_result = on_result
+        self.on_exception = on_exception
+        self.error_message = error_message
+        self.lock = threading.Lock()
+        self.counts = dict([(name, [0, 0]) for name, _, _ in stages])
+        self.exit_code = None
+        self._aborted = threading.Event()
+        self._running_workers = [num_workers for _, _, num_workers in stages]
+
+    def query_counts(self, name):
+        """Returns (success_count, total_count) for stage `name'."""
+        return tuple(self.counts[name])
+
+    def _run_item(self, name, function, item):
+        try:
+            return function(*item)
+        except SystemExit, e:
+            with self.lock:
+                if self.exit_code is None:
+                    self.exit_code = e.code
+            self._aborted.set()
+            return self.error_message
+        except Exception:
+            if self.on_exception:
+                with self.lock:
+                    self.on_exception(name, item)
+            return self.error_message
+
+    def _worker(self, index, in_queue, out_queue):
+        name, function, _ = self.stages[index]
+        while True:
+            item = in_queue.get()
+            if item is _PIPELINE_DONE:
+                break
+            if self._aborted.is_set():
+                # Keep draining, so upstream stages don't block.
+                continue
+            result = self._run_item(name, function, item)
+            with self.lock:
+                self.counts[name][1] += 1
+                if not result:
+                    self.counts[name][0] += 1
+                if self.on_result:
+                    self.on_result(name, item, result)
+            if not result and out_queue is not None:
+                out_queue.put(item)
+        with self.lock:
+            self._running_workers[index] -= 1
+            last_worker = self._running_workers[index] == 0
+        if last_worker and out_queue is not None:
+            for _ in range(self.stages[index + 1][2]):
+                out_queue.put(_PIPELINE_DONE)
+
+    def run(self, items):
+        """Feed `items' (a list of tuples) through the stages, and wait
+        for them to finish.
+
+        Returns None, or the exit code if a stage function exited.
+        """
+        queues = [Queue.Queue(self.queue_size) for _ in self.stages]
+        threads = []
+        for index, (name, _, num_workers) in enumerate(self.stages):
+            if index + 1 < len(self.stages):
+                out_queue = queues[index + 1]
+            else:
+                out_queue = None
+            for i in range(num_workers):
+                thread = threading.Thread(
+                    target=self._worker, name="%s-%d" % (name, i),
+                    args=(index, queues[index], out_queue))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+        for item in items:
+            queues[0].put(tuple(item))
+        for _ in range(self.stages[0][2]):
+            queues[0].put(_PIPELINE_DONE)
+        for thread in threads:
+            # join() without a timeout can't be interrupted by ctrl-c.
+            while thread.is_alive():
+                thread.join(1)
+        return self.exit_code
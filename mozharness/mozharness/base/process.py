@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Reading the output of child processes.
+
+OutputPump reads a process' output a big chunk at a time, as soon as
+it's there, splits it into lines, and hands them to an OutputParser on
+a separate thread through a bounded queue.  The child only has to wait
+for Python when the parser falls more than a queue's worth behind, and
+the pump counts how often that happens.
+"""
+
+import errno
+import os
+import Queue
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from mozharness.base.log import log_context, query_log_context
+
+# How much output to read at a time.
+CHUNK_SIZE = 64 * 1024
+
+# How many chunks' worth of lines can be waiting for the parser.
+QUEUE_SIZE = 64
+
+
+def process_group_kwargs():
+    """Popen() arguments that start the child in its own process group,
+    so OutputPump can kill whatever it spawned along with it.
+    """
+    if os.name == 'nt':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'preexec_fn': os.setsid}
+
+
+def _retry_on_eintr(func, *args):
+    while True:
+        try:
+            return func(*args)
+        except (OSError, IOError, select.error), e:
+            if e.args[0] != errno.EINTR:
+                raise
+
+
+# OutputPump {{{1
+class OutputPump(object):
+    """Pump the output of `proc', a subprocess.Popen with stdout=PIPE,
+    into `parser' until it closes its stdout:
+
+        pump = OutputPump(proc, parser, output_timeout=600)
+        timed_out = pump.run()
+
+    If output_timeout is set and the process goes that many seconds
+    without any output, it's killed and run() returns True.
+
+    After run(), self.stats has how many 'bytes', 'lines' and 'chunks'
+    were read, and the backpressure from the parser: how many times
+    the queue was full ('blocked'), for how long in total
+    ('blocked_seconds'), and the most chunks that were waiting
+    ('max_queued').
+    """
+    def __init__(self, proc, parser, output_timeout=None,
+                 chunk_size=CHUNK_SIZE, queue_size=QUEUE_SIZE):
+        self.proc = proc
+        self.parser = parser
+        self.output_timeout = output_timeout
+        self.chunk_size = chunk_size
+        self.queue = Queue.Queue(maxsize=queue_size)
+        self.stats = {
+            'bytes': 0,
+            'lines': 0,
+            'chunks': 0,
+            'blocked': 0,
+            'blocked_seconds': 0.0,
+            'max_queued': 0,
+        }
+        self.last_output = None
+        self._partial = ''
+        self._parser_exc_info = None
+
+    def run(self):
+        """Returns True if the process was killed for not producing
+        output for output_timeout seconds.
+        """
+        # The parser logs as if from this thread.
+        consumer = threading.Thread(target=self._consume,
+                                    args=(query_log_context(), ))
+        consumer.daemon = True
+        consumer.start()
+        try:
+            timed_out = self._pump()
+        finally:
+            if self._partial:
+                self._put([self._partial])
+                self._partial = ''
+            self.queue.put(None)
+            consumer.join()
+        if self._parser_exc_info:
+            raise self._parser_exc_info[0], self._parser_exc_info[1], \
+                self._parser_exc_info[2]
+        return timed_out
+
+    def _pump(self):
+        fd = self.proc.stdout.fileno()
+        self.last_output = time.time()
+        if os.name == 'nt':
+            return self._pump_blocking(fd)
+        if hasattr(select, 'poll'):
+            poller = select.poll()
+            poller.register(fd, select.POLLIN | select.POLLPRI |
+                            select.POLLHUP | select.POLLERR)
+
+            def wait(timeout):
+                if timeout is not None:
+                    timeout = int(timeout * 1000) + 1
+                return _retry_on_eintr(poller.poll, timeout)
+        else:
+            def wait(timeout):
+                return _retry_on_eintr(select.select, [fd], [], [], timeout)[0]
+        while True:
+            timeout = self._time_left()
+            if timeout is not None and timeout <= 0:
+                self._kill()
+                return True
+            if not wait(timeout):
+                continue
+            data = _retry_on_eintr(os.read, fd, self.chunk_size)
+            if not data:
+                return False
+            self._feed(data)
+
+    def _pump_blocking(self, fd):
+        """Windows can't select() on pipes, so read in this thread and
+        leave the timeout to a watchdog thread.
+        """
+        done = threading.Event()
+        timed_out = []
+
+        def watchdog():
+            while not done.is_set():
+                time_left = self._time_left()
+                if time_left <= 0:
+                    timed_out.append(True)
+                    self._kill()
+                    return
+                done.wait(time_left)
+        if self.output_timeout:
+            watcher = threading.Thread(target=watchdog)
+            watcher.daemon = True
+            watcher.start()
+        try:
+            while True:
+                data = _retry_on_eintr(os.read, fd, self.chunk_size)
+                if not data:
+                    break
+                self._feed(data)
+        finally:
+            done.set()
+        return bool(timed_out)
+
+    def _time_left(self):
+        if not self.output_timeout:
+            return None
+        return self.last_output + self.output_timeout - time.time()
+
+    def _kill(self):
+        """Kill the process and, if it leads its own process group
+        (see process_group_kwargs()), everything else in the group, so
+        a shell's children don't outlive it holding our pipe.
+        """
+        pid = self.proc.pid
+        try:
+            if os.name == 'nt':
+                if subprocess.call(['taskkill', '/F', '/T', '/PID', str(pid)],
+                                   stdout=open(os.devnull, 'w'),
+                                   stderr=subprocess.STDOUT) == 0:
+                    return
+            elif os.getpgid(pid) == pid:
+                os.killpg(pid, signal.SIGKILL)
+                return
+            self.proc.kill()
+        except OSError:
+            # it's already gone
+            pass
+
+    def _feed(self, data):
+        self.last_output = time.time()
+        self.stats['bytes'] += len(data)
+        self.stats['chunks'] += 1
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+        if lines:
+            self._put(lines)
+
+    def _put(self, lines):
+        self.stats['lines'] += len(lines)
+        try:
+            self.queue.put_nowait(lines)
+        except Queue.Full:
+            self.stats['blocked'] += 1
+            start = time.time()
+            self.queue.put(lines)
+            self.stats['blocked_seconds'] += time.time() - start
+        self.stats['max_queued'] = max(self.stats['max_queued'],
+                                       self.queue.qsize())
+
+    def _consume(self, context):
+        with log_context(**context):
+            while True:
+                lines = self.queue.get()
+                if lines is None:
+                    return
+                if self._parser_exc_info:
+                    # keep draining, so the pump doesn't block
+                    continue
+                try:
+                    self.parser.add_lines(lines)
+                except:
+                    self._parser_exc_info = sys.exc_info()
@@ -7,10 +7,25 @@
 '''Python usage, esp. virtualenv.
 '''
 
+import glob
+import hashlib
 import os
 import sys
+import tempfile
+import time
 import traceback
 
+try:
+    import simplejson as json
+    assert json
+except ImportError:
+    import json
+
+from mozharness.base.cache import VirtualenvCache, Wheelhouse, \
+    DEFAULT_MAX_SIZE, DEFAULT_VENV_CACHE_SIZE
+from mozharness.base.parallel import query_num_workers
+from mozharness.base.resources import ResourceSampler, \
+    is_supported as is_resource_sampling_supported
 from mozharness.base.script import (
     PostScriptAction,
     PostScriptRun,
@@ -53,6 +68,18 @@ virtualenv_config_options = [
         "dest": "pip_index",
         "help": "Don't use pip indexes"
     }],
+    [["--venv-cache-dir"], {
+        "action": "store",
+        "dest": "venv_cache_dir",
+        "help": "Keep copies of the virtualenvs this job creates in this directory, "
+                "shared by the jobs on this host, and reuse them"
+    }],
+    [["--wheelhouse-dir"], {
+        "action": "store",
+        "dest": "wheelhouse_dir",
+        "help": "Build modules into wheels kept in this directory, shared by "
+                "the jobs on this host, and install them from there in parallel"
+    }],
 ]
 
 
@@ -63,6 +90,10 @@ class VirtualenvMixin(object):
      * virtualenv_path points to the virtualenv location on disk.
      * virtualenv_modules lists the module names.
      * MODULE_url list points to the module URLs (optional)
+     * venv_cache_dir, if set, is a VirtualenvCache to restore the
+       virtualenv from, or store it in (optional)
+     * wheelhouse_dir, if set, is a Wheelhouse to install pip modules
+       from (optional)
     Requires virtualenv to be in PATH.
     Depends on ScriptMixin
     '''
@@ -71,6 +102,7 @@ class VirtualenvMixin(object):
 
     def __init__(self, *args, **kwargs):
         self._virtualenv_modules = []
+        self._install_times = []
         super(VirtualenvMixin, self).__init__(*args, **kwargs)
 
     def register_virtualenv_module(self, name=None, url=None, method=None,
@@ -196,9 +228,7 @@ class VirtualenvMixin(object):
                 command = [pip, "-v", "install"]
             else:
                 command = [pip, "install"]
-            pypi_url = c.get("pypi_url")
-            if pypi_url:
-                command += ["--pypi-url", pypi_url]
+            command += self._query_pip_index_options()
             if no_deps:
                 command += ["--no-deps"]
             virtualenv_cache_dir = c.get("virtualenv_cache_dir", os.path.join(venv_path, "cache"))
@@ -206,8 +236,6 @@ class VirtualenvMixin(object):
                 command += ["--download-cache", virtualenv_cache_dir]
             for requirement in requirements:
                 command += ["-r", requirement]
-            if c.get('find_links') and not c["pip_index"]:
-                command += ['--no-index']
             for opt in global_options:
                 command += ["--global-option", opt]
         elif install_method == 'easy_install':
@@ -256,16 +284,487 @@ class VirtualenvMixin(object):
 
         # Allow for errors while building modules, but require a
         # return status of 0.
-        if self.run_command(command,
-                            error_list=VirtualenvErrorList,
-                            success_codes=success_codes,
-                            cwd=cwd) != 0:
+        start = time.time()
+        status = self.run_command(command,
+                                  error_list=VirtualenvErrorList,
+                                  success_codes=success_codes,
+                                  cwd=cwd)
+        self._record_install_time(module or ' '.join(requirements),
+                                  install_method or 'pip', time.time() - start)
+        if status != 0:
             if optional:
                 self.warning("Error running install of optional package, %s." %
                              ' '.join(command))
+                return -1
             else:
                 self.fatal("Error running install of package, %s!" % ' '.join(command))
 
+    def _query_pip_index_options(self):
+        c = self.config
+        options = []
+        if c.get("pypi_url"):
+            options += ["--pypi-url", c["pypi_url"]]
+        if c.get('find_links') and not c.get("pip_index", True):
+            options += ['--no-index']
+        return options
+
+    def _record_install_time(self, module, how, seconds):
+        self.info("%s: %s took %.1fs." % (module, how, seconds))
+        self._install_times.append((module, how, seconds))
+
+    def _log_install_times(self, start=0):
+        """Log how long each module recorded since _install_times[start]
+        took to install, slowest first.
+        """
+        totals = {}
+        for module, how, seconds in self._install_times[start:]:
+            totals.setdefault(module, [0, []])
+            totals[module][0] += seconds
+            totals[module][1].append(how)
+        if not totals:
+            return
+        self.info("Module install times:")
+        for module, (seconds, hows) in sorted(totals.items(),
+                                              key=lambda x: -x[1][0]):
+            self.info("  %7.1fs %s (%s)" % (seconds, module, ', '.join(hows)))
+
+    def query_wheelhouse(self):
+        """The Wheelhouse in config['wheelhouse_dir'], or None if that
+        isn't set.
+        """
+        cache_dir = self.config.get('wheelhouse_dir')
+        if not cache_dir:
+            return None
+        if getattr(self, '_wheelhouse', None) is None:
+            self._wheelhouse = Wheelhouse(
+                cache_dir,
+                max_size=self.config.get('wheelhouse_max_size', DEFAULT_MAX_SIZE))
+        return self._wheelhouse
+
+    def _query_install_sources(self, module_url, requirements):
+        """Hashes of what's in the requirements files, and of the tree
+        at module_url if it's a local directory.
+        """
+        dirs = self.query_abs_dirs()
+        sources = []
+        for requirement in requirements:
+            sources.extend(self._query_requirements_sources(requirement))
+        if module_url:
+            path = os.path.join(dirs['abs_work_dir'], module_url)
+            if os.path.isdir(path):
+                sources.append([module_url, self._query_tree_signature(path)])
+        return sources
+
+    def query_wheel_key(self, python_version, install):
+        """A hash of what the wheels for `install' (a dict of
+        install_module() arguments) are built from.
+        """
+        c = self.config
+        module_url = install.get('module_url') or install.get('module')
+        requirements = list(install.get('requirements') or ())
+        items = [python_version, sys.platform, module_url,
+                 list(install.get('global_options') or ()),
+                 self._query_pip_index_options(), c.get('find_links'),
+                 self._query_install_sources(module_url, requirements)]
+        return hashlib.sha1(json.dumps(items)).hexdigest()
+
+    def _can_use_wheels(self, install):
+        return install.get('install_method') in (None, 'pip') and \
+            not install.get('editable') and \
+            bool(install.get('module_url') or install.get('module'))
+
+    def _query_virtualenv_python_version(self):
+        return self.get_output_from_command(
+            [self.query_python_path(), '-c', 'import sys; print(sys.version)'])
+
+    def _build_wheels(self, install, wheel_dir):
+        """pip wheel the module and its dependencies into wheel_dir.
+        Returns None for success.
+        """
+        c = self.config
+        dirs = self.query_abs_dirs()
+        module_url = install.get('module_url') or install.get('module')
+        requirements = install.get('requirements') or ()
+        command = [self.query_python_path('pip'), 'wheel', '--wheel-dir', wheel_dir]
+        command += self._query_pip_index_options()
+        for requirement in requirements:
+            command += ["-r", requirement]
+        for opt in install.get('global_options') or ():
+            command += ["--global-option", opt]
+        for link in c.get('find_links', []):
+            command += ["--find-links", link]
+        command += [module_url]
+        if self.run_command(command, cwd=dirs['abs_work_dir'],
+                            error_list=VirtualenvErrorList) != 0:
+            return -1
+
+    def _normalize_project(self, name):
+        # Wheel names have _ for the - in project names.
+        return name.lower().replace('-', '_')
+
+    def _query_wheel_project(self, path):
+        """The (project, version) of the wheel at path."""
+        # name-version(-build)?-python-abi-platform.whl
+        fields = os.path.basename(path).split('-')
+        return self._normalize_project(fields[0]), fields[1]
+
+    def _query_installed_projects(self):
+        """{project: version} for what's installed in the virtualenv,
+        by `pip freeze'; editable projects' versions are None.
+        """
+        output = self.get_output_from_command(
+            [self.query_python_path('pip'), 'freeze'], silent=True)
+        projects = {}
+        for line in (output or '').splitlines():
+            line = line.strip()
+            if line.startswith('-e') and '#egg=' in line:
+                name = line.split('#egg=')[-1].split('&')[0]
+                # e.g. mozfile-dev
+                projects[self._normalize_project(name.split('-')[0])] = None
+            elif '==' in line and not line.startswith('#'):
+                name, version = line.split('==', 1)
+                projects[self._normalize_project(name)] = version
+        return projects
+
+    def _install_from_wheelhouse(self, wheelhouse, installs, indexes,
+                                 num_workers):
+        """Get wheels for installs[index] for each of `indexes', from
+        the wheelhouse or by building them, and install them on up to
+        num_workers threads.  Returns {index: install_module()-style
+        return value} for the modules it installed; the others need
+        installing without wheels.
+        """
+        dirs = self.query_abs_dirs()
+        python_version = self._query_virtualenv_python_version()
+        keys = dict([(index, self.query_wheel_key(python_version, installs[index]))
+                     for index in indexes])
+        if [index for index in indexes if wheelhouse.lookup(keys[index]) is None]:
+            # Building wheels needs the wheel module in the virtualenv.
+            python = self.query_python_path()
+            if self.run_command([python, '-c', 'import wheel']) != 0 and \
+                    (self.install_module(module='wheel', optional=True) is not None or
+                     self.run_command([python, '-c', 'import wheel']) != 0):
+                self.warning("Can't build wheels; only installing modules "
+                             "that are in the wheelhouse from it.")
+                indexes = [index for index in indexes
+                           if wheelhouse.lookup(keys[index]) is not None]
+        if not indexes:
+            return {}
+        wheel_dir = tempfile.mkdtemp(dir=dirs['abs_work_dir'])
+        try:
+            def fetch_one(kwargs, log_buffer):
+                index = kwargs['index']
+                module = installs[index].get('module') or installs[index].get('module_url')
+                dest_dir = os.path.join(wheel_dir, str(index))
+                start = time.time()
+                wheels = wheelhouse.fetch(keys[index], dest_dir)
+                if wheels is not None:
+                    self._record_install_time(module, 'wheelhouse', time.time() - start)
+                    return wheels
+                self.mkdir_p(dest_dir)
+                if self._build_wheels(installs[index], dest_dir) is not None:
+                    return None
+                wheels = sorted(glob.glob(os.path.join(dest_dir, '*.whl')))
+                if not wheels:
+                    return None
+                # wheel_dir is only read from, then removed.
+                wheelhouse.store(keys[index], wheels, keep_src=False)
+                self._record_install_time(module, 'pip wheel', time.time() - start)
+                return wheels
+            wheel_lists = self._run_buffered_parallel(
+                'wheel fetches', fetch_one,
+                [{'index': index} for index in indexes], num_workers)
+
+            # Every wheel is installed once, without dependencies, by the
+            # first module that needs it, so the installs are independent.
+            # Projects that are already installed at the wheel's version
+            # are left alone.  A module with a wheel for another version
+            # of a project that's installed, or that an earlier module
+            # installs, isn't installed from wheels: it's left for pip to
+            # install afterwards, which keeps the installed version if
+            # it's good enough, as it would one module at a time.
+            present = self._query_installed_projects()
+            installed = {}
+            projects = {}
+            calls = []
+            for index, wheels in zip(indexes, wheel_lists):
+                if wheels is None:
+                    continue
+                mine = []
+                for path in wheels:
+                    project, version = self._query_wheel_project(path)
+                    current = present.get(project, projects.get(project))
+                    if project not in present and project not in projects:
+                        mine.append((project, version, path))
+                    elif current != version:
+                        module = installs[index].get('module') or \
+                            installs[index].get('module_url')
+                        self.info("Not installing %s from wheels: it has %s, "
+                                  "but another %s is installed first." %
+                                  (module, os.path.basename(path), project))
+                        break
+                else:
+                    for project, version, path in mine:
+                        projects[project] = version
+                    calls.append({'index': index,
+                                  'wheels': [path for _, _, path in mine]})
+                    installed[index] = None
+
+            def install_one(kwargs, log_buffer):
+                install = installs[kwargs['index']]
+                if not kwargs['wheels']:
+                    return None
+                module = install.get('module') or install.get('module_url')
+                command = [self.query_python_path('pip'), 'install',
+                           '--no-index', '--no-deps'] + kwargs['wheels']
+                start = time.time()
+                status = self.run_command(command, cwd=dirs['abs_work_dir'],
+                                          error_list=VirtualenvErrorList)
+                self._record_install_time(module, 'wheel install', time.time() - start)
+                if status != 0:
+                    if install.get('optional'):
+                        self.warning("Error running install of optional package, %s." %
+                                     ' '.join(command))
+                        return -1
+                    self.fatal("Error running install of package, %s!" % ' '.join(command))
+            results = self._run_buffered_parallel('wheel installs', install_one,
+                                                  calls, num_workers)
+            for call, result in zip(calls, results):
+                installed[call['index']] = result
+        finally:
+            self.rmtree(wheel_dir)
+        return installed
+
+    def install_modules(self, installs, num_workers=None):
+        """Install several modules: `installs' is a list of dicts of
+        install_module() arguments, which can also have 'two_pass' set
+        to install the module without its dependencies first.  Returns
+        the list of what install_module() returned for each.
+
+        If c['wheelhouse_dir'] is set, pip modules are built into
+        wheels once, which are kept there, and installed from there
+        without going to the package index, on up to num_workers
+        threads (by default config['parallel_workers'], or the number
+        of CPUs).  Modules it can't build wheels for are installed one
+        at a time afterwards, as are editable and easy_install ones,
+        and modules with a wheel for a different version of a project
+        than one that's installed already or by an earlier module.
+        Since those come after the wheels, one that's earlier in
+        `installs' than a module installed from wheels can replace a
+        project version that module's wheels installed.
+
+        How long each module took is logged at the end.
+        """
+        installs = [dict(install) for install in installs]
+        first_time = len(self._install_times)
+        if num_workers is None:
+            num_workers = query_num_workers(self.config)
+        results = [None] * len(installs)
+        remaining = range(len(installs))
+        wheelhouse = self.query_wheelhouse()
+        if wheelhouse is not None:
+            indexes = [index for index in remaining
+                       if self._can_use_wheels(installs[index])]
+            installed = self._install_from_wheelhouse(wheelhouse, installs,
+                                                      indexes, num_workers)
+            for index, result in installed.items():
+                results[index] = result
+            remaining = [index for index in remaining if index not in installed]
+        for index in remaining:
+            install = installs[index]
+            if install.pop('two_pass', False):
+                self.install_module(**dict(install, no_deps=True))
+            results[index] = self.install_module(**install)
+        self._log_install_times(first_time)
+        return results
+
+    def query_virtualenv_cache(self):
+        """The VirtualenvCache in config['venv_cache_dir'], or None if
+        that isn't set.
+        """
+        cache_dir = self.config.get('venv_cache_dir')
+        if not cache_dir:
+            return None
+        if getattr(self, '_virtualenv_cache', None) is None:
+            self._virtualenv_cache = VirtualenvCache(
+                cache_dir,
+                max_size=self.config.get('venv_cache_max_size', DEFAULT_VENV_CACHE_SIZE),
+                link_mode=self.config.get('venv_cache_link_mode', 'reflink'))
+        return self._virtualenv_cache
+
+    def _query_tree_signature(self, path):
+        """A hash of the names and contents of the files under path,
+        for local module directories.  Not their times: those of a tree
+        unpacked from a new archive change even when its files don't.
+        """
+        signature = hashlib.sha1()
+        for root, dirs, files in os.walk(path):
+            # What installing the module leaves behind in its directory.
+            dirs[:] = sorted([d for d in dirs if not d.endswith('.egg-info')])
+            for name in sorted(files):
+                if name.endswith(('.pyc', '.pyo')):
+                    continue
+                file_path = os.path.join(root, name)
+                try:
+                    digest = self._query_file_hash(file_path)
+                except (IOError, OSError):
+                    continue
+                signature.update(repr((os.path.relpath(file_path, path), digest)))
+        return signature.hexdigest()
+
+    def _query_requirements_sources(self, requirement, seen=None):
+        """Hashes of the requirements file at `requirement' (relative
+        to the work dir), of the files it includes with -r, and of the
+        local directories and archives it installs (e.g. -e ../mozbase/x),
+        which can change when the requirements file doesn't.
+        """
+        dirs = self.query_abs_dirs()
+        path = os.path.join(dirs['abs_work_dir'], requirement)
+        if seen is None:
+            seen = set()
+        if path in seen:
+            return []
+        seen.add(path)
+        if not os.path.isfile(path):
+            return [[requirement, None]]
+        sources = [[requirement, self._query_file_hash(path)]]
+        # pip is run from the requirements file's directory when it's
+        # installed on its own, and from the work dir otherwise.
+        base_dirs = [os.path.dirname(path), dirs['abs_work_dir']]
+        fh = open(path)
+        try:
+            lines = fh.read().splitlines()
+        finally:
+            fh.close()
+        for line in lines:
+            line = line.split(' #')[0].strip()
+            if not line or line.startswith('#'):
+                continue
+            option, value = None, line
+            for name in ('-r', '--requirement', '-e', '--editable'):
+                if line.startswith(name) and line[len(name):len(name) + 1] in (' ', '='):
+                    option, value = name, line[len(name) + 1:].strip()
+                    break
+            else:
+                if line.startswith('-') or \
+                        not (line.startswith('.') or '/' in line or os.sep in line):
+                    # Options, and projects from the package index.
+                    continue
+            if value.startswith('file:'):
+                value = value[len('file:'):]
+                if value.startswith('//'):
+                    value = value[2:]
+            elif '://' in value or value.startswith(('git+', 'hg+', 'svn+', 'bzr+')):
+                continue
+            value = value.split('#')[0]
+            if option in ('-r', '--requirement'):
+                sources.extend(self._query_requirements_sources(
+                    os.path.join(os.path.dirname(requirement), value), seen))
+                continue
+            for base_dir in base_dirs:
+                local_path = os.path.normpath(os.path.join(base_dir, value))
+                if os.path.isdir(local_path):
+                    sources.append([value, self._query_tree_signature(local_path)])
+                    break
+                if os.path.isfile(local_path):
+                    sources.append([value, self._query_file_hash(local_path)])
+                    break
+        return sources
+
+    def query_virtualenv_cache_key(self, virtualenv, modules, requirements):
+        """A hash of everything that goes into the virtualenv: the
+        interpreter and virtualenv, the modules and where they come
+        from, and what's in the requirements files and the local module
+        directories.
+        """
+        c = self.config
+        dirs = self.query_abs_dirs()
+        exe = virtualenv[0]
+        if not os.path.isabs(exe):
+            exe = self.which(exe) or exe
+        if os.path.exists(exe):
+            st = os.stat(exe)
+            exe = [os.path.realpath(exe), st.st_size, int(st.st_mtime)]
+        items = {
+            'python': [sys.version, sys.platform, sys.executable],
+            'virtualenv': [exe] + list(virtualenv[1:]),
+            'virtualenv_options': c.get('virtualenv_options'),
+            'virtualenv_python_dll': c.get('virtualenv_python_dll'),
+            'urls': [c.get('%s_url' % module) for module in ('distribute', 'pip')],
+            'pip': [c.get('pypi_url'), c.get('find_links'), c.get('pip_index')],
+            'modules': [],
+            'requirements': [],
+            'sources': {},
+        }
+        if self._is_windows():
+            # The launchers in Scripts have the virtualenv's path.
+            items['path'] = self.query_virtualenv_path()
+        urls = []
+        requirement_files = list(requirements)
+        for module in modules:
+            if isinstance(module, dict):
+                items['modules'].append([module.get('name'), module.get('url'),
+                                         module.get('global_options', [])])
+                urls.append(module.get('url'))
+            else:
+                url = c.get('%s_url' % module, module)
+                items['modules'].append([module, url])
+                urls.append(url)
+        for module in self._virtualenv_modules:
+            items['modules'].append(list(module))
+            urls.append(module[1])
+            requirement_files.extend(module[3] or [])
+        for requirement in requirement_files:
+            items['requirements'].extend(self._query_requirements_sources(requirement))
+        for url in urls:
+            if not url:
+                continue
+            path = os.path.join(dirs['abs_work_dir'], url)
+            if os.path.isdir(path):
+                items['sources'][url] = self._query_tree_signature(path)
+        return hashlib.sha1(json.dumps(items, sort_keys=True)).hexdigest()
+
+    def _query_file_hash(self, path):
+        fh = open(path, 'rb')
+        try:
+            return hashlib.sha1(fh.read()).hexdigest()
+        finally:
+            fh.close()
+
+    def _restore_virtualenv(self, cache, cache_key, venv_path):
+        """Restore the virtualenv from the cache.  Returns True if it
+        was there.
+        """
+        try:
+            files = cache.fetch(cache_key, venv_path)
+        except (IOError, OSError), e:
+            self.warning("Can't restore virtualenv %s from %s: %s" %
+                         (cache_key, cache.cache_dir, str(e)))
+            self.rmtree(venv_path)
+            return False
+        if files is None:
+            self.info("Virtualenv %s isn't in %s." % (cache_key, cache.cache_dir))
+            return False
+        self.info("Restored virtualenv %s from %s (%d files)." %
+                  (cache_key, cache.cache_dir, files))
+        return True
+
+    def _store_virtualenv(self, cache, cache_key, venv_path):
+        ignore = []
+        pip_cache_dir = self.config.get("virtualenv_cache_dir",
+                                        os.path.join(venv_path, "cache"))
+        if pip_cache_dir:
+            rel_path = os.path.relpath(os.path.abspath(pip_cache_dir), venv_path)
+            if not rel_path.startswith(os.pardir):
+                ignore.append(rel_path)
+        try:
+            cache.store(cache_key, venv_path, ignore=ignore)
+        except (IOError, OSError), e:
+            self.warning("Can't store virtualenv %s in %s: %s" %
+                         (cache_key, cache.cache_dir, str(e)))
+            return -1
+        self.info("Stored virtualenv %s in %s." % (cache_key, cache.cache_dir))
+
     def create_virtualenv(self, modules=(), requirements=()):
         """
         Create a python virtualenv.
@@ -311,6 +810,10 @@ class VirtualenvMixin(object):
                 '/path/to/requirements1.txt',
                 '/path/to/requirements2.txt'
             ]
+
+        If c['venv_cache_dir'] is set, a virtualenv made from the same
+        interpreter, modules and requirements before is restored from
+        there instead, and a new one is stored there.
         """
         c = self.config
         dirs = self.query_abs_dirs()
@@ -324,6 +827,21 @@ class VirtualenvMixin(object):
             # allow for [python, virtualenv] in config
             virtualenv = [virtualenv]
 
+        if not modules:
+            modules = c.get('virtualenv_modules', [])
+        if not requirements:
+            requirements = c.get('virtualenv_requirements', [])
+        cache = None
+        if not os.path.exists(self.query_python_path()):
+            cache = self.query_virtualenv_cache()
+        if cache is not None:
+            cache_key = self.query_virtualenv_cache_key(virtualenv, modules,
+                                                        requirements)
+            if self._restore_virtualenv(cache, cache_key, venv_path):
+                self.info("Done creating virtualenv %s." % venv_path)
+                self.package_versions(log_output=True)
+                return
+
         # https://bugs.launchpad.net/virtualenv/+bug/352844/comments/3
         # https://bugzilla.mozilla.org/show_bug.cgi?id=700415#c50
         if c.get('virtualenv_python_dll'):
@@ -353,13 +871,10 @@ class VirtualenvMixin(object):
                              cwd=dirs['abs_work_dir'],
                              error_list=VirtualenvErrorList,
                              halt_on_failure=True)
-        if not modules:
-            modules = c.get('virtualenv_modules', [])
-        if not requirements:
-            requirements = c.get('virtualenv_requirements', [])
+        installs = []
         if not modules and requirements:
-            self.install_module(requirements=requirements,
-                                install_method='pip')
+            installs.append({'requirements': requirements,
+                             'install_method': 'pip'})
         for module in modules:
             module_url = module
             global_options = []
@@ -377,25 +892,25 @@ class VirtualenvMixin(object):
             install_method = 'pip'
             if module_name in ('pywin32',):
                 install_method = 'easy_install'
-            self.install_module(module=module_name,
-                                module_url=module_url,
-                                install_method=install_method,
-                                requirements=requirements,
-                                global_options=global_options)
+            installs.append({'module': module_name,
+                             'module_url': module_url,
+                             'install_method': install_method,
+                             'requirements': requirements,
+                             'global_options': global_options})
 
         for module, url, method, requirements, optional, two_pass, editable in \
                 self._virtualenv_modules:
-            if two_pass:
-                self.install_module(
-                    module=module, module_url=url,
-                    install_method=method, requirements=requirements or (),
-                    optional=optional, no_deps=True, editable=editable
-                )
-            self.install_module(
-                module=module, module_url=url,
-                install_method=method, requirements=requirements or (),
-                optional=optional, editable=editable
-            )
+            installs.append({'module': module, 'module_url': url,
+                             'install_method': method,
+                             'requirements': requirements or (),
+                             'optional': optional, 'two_pass': two_pass,
+                             'editable': editable})
+        failed = [result for result in self.install_modules(installs)
+                  if result is not None]
+
+        if cache is not None and not failed:
+            # An optional module that failed may work next time.
+            self._store_virtualenv(cache, cache_key, venv_path)
 
         self.info("Done creating virtualenv %s." % venv_path)
 
@@ -411,28 +926,51 @@ class VirtualenvMixin(object):
 class ResourceMonitoringMixin(object):
     """Provides resource monitoring capabilities to scripts.
 
-    When this class is in the inheritance chain, resource usage stats of the
-    executing script will be recorded.
+    When this class is in the inheritance chain, a ResourceSampler
+    records the resource usage of the script from /proc, from before
+    BaseScript.__init__() runs until the end of the run: CPU, I/O and
+    memory over time, per action, and per command run_command() runs.
+    The totals are logged at the end, and everything is written to
+    resource-usage.json in the log dir.
 
-    This class requires the VirtualenvMixin in order to install a package used
-    for recording resource usage.
+    Where there's no /proc, mozsystemmonitor's SystemResourceMonitor
+    records the totals and those of each action instead.  That needs
+    the VirtualenvMixin, to install psutil and mozsystemmonitor, so it
+    only starts once the virtualenv has been created.
 
-    While we would like to record resource usage for the entirety of a script,
-    since we require an external package, we can only record resource usage
-    after that package is installed (as part of creating the virtualenv).
-    That's just the way things have to be.
+    Config items:
+     * resource_sample_interval: seconds between samples (default 1)
     """
     def __init__(self, *args, **kwargs):
-        super(ResourceMonitoringMixin, self).__init__(*args, **kwargs)
-
-        self.register_virtualenv_module('psutil==0.7.1', method='pip',
-                                        optional=True)
-        self.register_virtualenv_module('mozsystemmonitor==0.0.0',
-                                        method='pip', optional=True)
         self._resource_monitor = None
+        self._resource_sampling = is_resource_sampling_supported()
+        sampling_error = None
+        if self._resource_sampling:
+            try:
+                monitor = ResourceSampler()
+                monitor.start()
+                self._resource_monitor = monitor
+            except (IOError, OSError, ValueError, KeyError, IndexError), e:
+                # Logging isn't set up yet; see below.
+                sampling_error = e
+                self._resource_sampling = False
+        super(ResourceMonitoringMixin, self).__init__(*args, **kwargs)
+        if sampling_error is not None:
+            self.warning("Can't sample resource usage from /proc: %s; "
+                         "falling back to mozsystemmonitor." % str(sampling_error))
+        if self._resource_sampling:
+            self._resource_monitor.set_interval(self.config.get(
+                'resource_sample_interval', self._resource_monitor.interval))
+        else:
+            self.register_virtualenv_module('psutil==0.7.1', method='pip',
+                                            optional=True)
+            self.register_virtualenv_module('mozsystemmonitor==0.0.0',
+                                            method='pip', optional=True)
 
     @PostScriptAction('create-virtualenv')
     def _start_resource_monitoring(self, action, success=None):
+        if self._resource_sampling:
+            return
         self.activate_virtualenv()
 
         # Resource Monitor requires Python 2.7, however it's currently optional.
@@ -453,7 +991,8 @@ class ResourceMonitoringMixin(object):
 
     @PreScriptAction
     def _resource_record_pre_action(self, action):
-        # Resource monitor isn't available until after create-virtualenv.
+        # Without /proc, the resource monitor isn't available until
+        # after create-virtualenv.
         if not self._resource_monitor:
             return
 
@@ -461,7 +1000,6 @@ class ResourceMonitoringMixin(object):
 
     @PostScriptAction
     def _resource_record_post_action(self, action, success=None):
-        # Resource monitor isn't available until after create-virtualenv.
         if not self._resource_monitor:
             return
 
@@ -476,14 +1014,76 @@ class ResourceMonitoringMixin(object):
         # mozsystemmonitor is fixed. See bug 895388.
         try:
             self._resource_monitor.stop()
-            self._log_resource_usage()
+            if self._resource_sampling:
+                self._log_resource_usage()
+                self._write_resource_profile()
+            else:
+                self._log_system_resource_usage()
         except Exception:
             self.warning("Exception when reporting resource usage: %s" %
                          traceback.format_exc())
 
+    def _write_resource_profile(self):
+        dirs = self.query_abs_dirs()
+        self.mkdir_p(dirs['abs_log_dir'])
+        path = os.path.join(dirs['abs_log_dir'], 'resource-usage.json')
+        self._resource_monitor.write_profile(path)
+        self.info("Wrote resource usage profile to %s." % path)
+
     def _log_resource_usage(self):
         rm = self._resource_monitor
 
+        if rm.start_time is None:
+            return
+
+        def log_usage(prefix, usage):
+            message = '{prefix} - Wall time: {duration:.0f}s; ' \
+                'CPU: {cpu_percent}; ' \
+                'Read bytes: {io_read_bytes}; Write bytes: {io_write_bytes}; ' \
+                'Read time: {io_read_time}; Write time: {io_write_time}'
+
+            cpu_percent = usage['cpu_percent']
+            cpu_percent_str = str(round(cpu_percent)) + '%' if cpu_percent else "Can't collect data"
+            io = usage['io']
+
+            self.info(
+                message.format(
+                    prefix=prefix, duration=usage['duration'],
+                    cpu_percent=cpu_percent_str, io_read_bytes=io['read_bytes'],
+                    io_write_bytes=io['write_bytes'], io_read_time=io['read_time'],
+                    io_write_time=io['write_time']
+                )
+            )
+
+        log_usage('Total resource usage', rm.aggregate())
+        peak_rss = rm.query_peak_rss()
+        self.info("Peak RSS: %.1f MB for the process tree; %.1f MB for the "
+                  "biggest command" % (peak_rss['tree'] / 1048576.0,
+                                       peak_rss['children'] / 1048576.0))
+
+        phases = []
+        for phase in [p[0] for p in rm.phases]:
+            if phase not in phases:
+                phases.append(phase)
+        for phase in phases:
+            usage = rm.aggregate(phase)
+            if usage is not None:
+                log_usage(phase, usage)
+
+        commands = sorted(rm.commands, key=lambda c: -c['cpu_time'])[:10]
+        if commands and commands[0]['cpu_time']:
+            self.info("Commands that used the most CPU time:")
+            for command in commands:
+                if not command['cpu_time']:
+                    break
+                self.info("  %7.1fs CPU, %7.1f MB peak RSS: %s" %
+                          (command['cpu_time'], command['peak_rss'] / 1048576.0,
+                           command['name'][:200]))
+
+    def _log_system_resource_usage(self):
+        """_log_resource_usage() for a SystemResourceMonitor."""
+        rm = self._resource_monitor
+
         if rm.start_time is None:
             return
 
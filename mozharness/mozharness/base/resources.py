@@ -0,0 +1,506 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Sampling the resources a script uses, from /proc.
+
+A ResourceSampler reads the system's CPU times, disk I/O and memory,
+and the CPU time and RSS of the script's process tree, on a background
+thread every `interval' seconds.  Phases (the script's actions) mark
+out spans of the samples.  Processes registered with track_process(),
+as run_command() does for the commands it runs, get their own CPU
+time, I/O and peak RSS, counting their descendants.  A command that no
+other tracked command ran alongside gets its exact CPU time from
+getrusage() once it has been waited for; otherwise, one that runs for
+less than an interval may finish between samples unmeasured.
+
+Only Linux has /proc; elsewhere is_supported() is False.
+"""
+
+import os
+import resource
+import threading
+import time
+
+try:
+    import simplejson as json
+    assert json
+except ImportError:
+    import json
+
+PROC = '/proc'
+
+# Bump this when the profile's format changes.
+PROFILE_VERSION = 1
+
+CPU_FIELDS = ('user', 'nice', 'system', 'idle', 'iowait', 'irq',
+              'softirq', 'steal')
+
+# Block devices that aren't disks, or are made of other disks that are
+# already counted.
+IGNORED_DEVICES = ('loop', 'ram', 'dm-', 'md', 'zram', 'sr')
+
+
+def _sysconf(name, default):
+    try:
+        return os.sysconf(name)
+    except (AttributeError, ValueError, OSError):
+        return default
+
+CLOCK_TICKS = _sysconf('SC_CLK_TCK', 100)
+PAGE_SIZE = _sysconf('SC_PAGE_SIZE', 4096)
+
+
+def is_supported():
+    """Whether there are all the /proc files ResourceSampler reads.
+    Other processes' io files can be missing or unreadable.
+    """
+    for name in ('stat', 'meminfo', 'diskstats', os.path.join('self', 'stat')):
+        if not os.access(os.path.join(PROC, name), os.R_OK):
+            return False
+    return True
+
+
+def _children_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _read(path):
+    fh = open(path)
+    try:
+        return fh.read()
+    finally:
+        fh.close()
+
+
+def parse_cpu_times(text):
+    """The system's CPU times in seconds, from /proc/stat."""
+    for line in text.splitlines():
+        fields = line.split()
+        if fields and fields[0] == 'cpu':
+            values = [int(value) / float(CLOCK_TICKS) for value in fields[1:]]
+            values += [0.0] * (len(CPU_FIELDS) - len(values))
+            return dict(zip(CPU_FIELDS, values))
+    return dict([(name, 0.0) for name in CPU_FIELDS])
+
+
+def parse_io_counters(text, devices=None):
+    """Bytes and seconds read and written by the disks in `devices'
+    (all but IGNORED_DEVICES if None), from /proc/diskstats.
+    """
+    counters = {'read_count': 0, 'write_count': 0, 'read_bytes': 0,
+                'write_bytes': 0, 'read_time': 0.0, 'write_time': 0.0}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 11:
+            continue
+        name = fields[2]
+        if devices is not None and name not in devices:
+            continue
+        if name.startswith(IGNORED_DEVICES):
+            continue
+        counters['read_count'] += int(fields[3])
+        counters['read_bytes'] += int(fields[5]) * 512
+        counters['read_time'] += int(fields[6]) / 1000.0
+        counters['write_count'] += int(fields[7])
+        counters['write_bytes'] += int(fields[9]) * 512
+        counters['write_time'] += int(fields[10]) / 1000.0
+    return counters
+
+
+def parse_memory(text):
+    """(total, used) bytes of memory, from /proc/meminfo."""
+    values = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) >= 2:
+            values[fields[0].rstrip(':')] = int(fields[1]) * 1024
+    total = values.get('MemTotal', 0)
+    available = values.get('MemAvailable')
+    if available is None:
+        available = values.get('MemFree', 0) + values.get('Buffers', 0) + \
+            values.get('Cached', 0)
+    return total, total - available
+
+
+def parse_process_stat(text):
+    """A process's parent pid, CPU time and that of the children it
+    has waited for, in seconds, and RSS in bytes, from
+    /proc/<pid>/stat.
+    """
+    # The command name is in parentheses, and can have spaces.
+    fields = text[text.rindex(')') + 2:].split()
+    return {
+        'ppid': int(fields[1]),
+        'cpu_time': (int(fields[11]) + int(fields[12])) / float(CLOCK_TICKS),
+        'children_cpu_time': (int(fields[13]) + int(fields[14])) / float(CLOCK_TICKS),
+        'rss': int(fields[21]) * PAGE_SIZE,
+    }
+
+
+def parse_process_io(text):
+    values = {}
+    for line in text.splitlines():
+        name, _, value = line.partition(':')
+        if name in ('read_bytes', 'write_bytes'):
+            values[name] = int(value)
+    return values
+
+
+def query_disk_devices():
+    """The names of the block devices in /sys/block, or None if there
+    isn't one.
+    """
+    try:
+        return set(os.listdir('/sys/block'))
+    except OSError:
+        return None
+
+
+def read_process(pid):
+    """parse_process_stat() for pid, or None if it's gone."""
+    try:
+        return parse_process_stat(_read(os.path.join(PROC, str(pid), 'stat')))
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def read_process_io(pid):
+    """parse_process_io() for pid, or {} if it's gone or isn't ours."""
+    try:
+        return parse_process_io(_read(os.path.join(PROC, str(pid), 'io')))
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def read_processes():
+    """{pid: read_process(pid)} for every process."""
+    processes = {}
+    for name in os.listdir(PROC):
+        if name.isdigit():
+            process = read_process(int(name))
+            if process is not None:
+                processes[int(name)] = process
+    return processes
+
+
+def query_descendants(pid, processes):
+    """The pids of the descendants of pid in `processes'."""
+    children = {}
+    for child, process in processes.items():
+        children.setdefault(process['ppid'], []).append(child)
+    descendants = []
+    pending = list(children.get(pid, []))
+    while pending:
+        child = pending.pop()
+        descendants.append(child)
+        pending.extend(children.get(child, []))
+    return descendants
+
+
+def query_tree_usage(pid, processes, with_io=False):
+    """The CPU time, RSS and, with_io, I/O of pid and its descendants
+    in `processes', or None if pid isn't there.  CPU time counts the
+    descendants that have been waited for.
+    """
+    if pid not in processes:
+        return None
+    usage = {'cpu_time': 0.0, 'rss': 0, 'read_bytes': 0, 'write_bytes': 0}
+    for member in [pid] + query_descendants(pid, processes):
+        process = processes[member]
+        usage['cpu_time'] += process['cpu_time'] + process['children_cpu_time']
+        usage['rss'] += process['rss']
+        if with_io:
+            io = read_process_io(member)
+            usage['read_bytes'] += io.get('read_bytes', 0)
+            usage['write_bytes'] += io.get('write_bytes', 0)
+    return usage
+
+
+# track_process() {{{1
+# The samplers running in this process.
+_samplers = []
+_samplers_lock = threading.Lock()
+
+
+def track_process(pid, name, command_id=None):
+    """Have the running samplers record pid's usage as `name'."""
+    with _samplers_lock:
+        samplers = list(_samplers)
+    for sampler in samplers:
+        sampler.track(pid, name, command_id)
+
+
+def untrack_process(pid):
+    with _samplers_lock:
+        samplers = list(_samplers)
+    for sampler in samplers:
+        sampler.untrack(pid)
+
+
+# ResourceSampler {{{1
+class ResourceSampler(object):
+    """Sample the system and the process tree of `pid' (this process
+    by default):
+
+        sampler = ResourceSampler(interval=1.0)
+        sampler.start()
+        sampler.begin_phase('build')
+        ...
+        sampler.finish_phase('build')
+        sampler.stop()
+        sampler.write_profile('resource-usage.json')
+    """
+    def __init__(self, interval=1.0, pid=None):
+        self.interval = interval
+        self.pid = pid or os.getpid()
+        self.start_time = None
+        self.end_time = None
+        self.cpu_count = _sysconf('SC_NPROCESSORS_ONLN', 1)
+        self.memory_total = 0
+        self.samples = []
+        # [name, start time, end time, start counters, end counters]
+        self.phases = []
+        self.commands = []
+        self.peak_rss = 0
+        self._devices = query_disk_devices()
+        self._tracked = {}
+        # pid: [children's CPU time when it started, whether another
+        # tracked process ran at the same time]
+        self._tracked_starts = {}
+        self._active_phases = []
+        self._first_counters = None
+        self._last_counters = None
+        self._final_counters = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _read_counters(self):
+        return {
+            'time': time.time(),
+            'cpu': parse_cpu_times(_read(os.path.join(PROC, 'stat'))),
+            'io': parse_io_counters(_read(os.path.join(PROC, 'diskstats')),
+                                    self._devices),
+        }
+
+    def start(self):
+        self.start_time = time.time()
+        self.memory_total = parse_memory(_read(os.path.join(PROC, 'meminfo')))[0]
+        self._last_counters = self._read_counters()
+        self._first_counters = self._last_counters
+        with _samplers_lock:
+            _samplers.append(self)
+        self._thread = threading.Thread(target=self._run, name='resource-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        with _samplers_lock:
+            if self in _samplers:
+                _samplers.remove(self)
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self.sample()
+        self.end_time = time.time()
+        self._final_counters = self._last_counters
+
+    def set_interval(self, interval):
+        self.interval = interval
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            if self._stop.is_set():
+                return
+            if self._wake.is_set():
+                # The interval changed; start waiting again.
+                self._wake.clear()
+                continue
+            try:
+                self.sample()
+            except (IOError, OSError, ValueError):
+                # e.g. /proc files that changed format; skip this one.
+                pass
+
+    def begin_phase(self, name):
+        with self._lock:
+            self.phases.append([name, time.time(), None,
+                                self._read_counters(), None])
+            self._active_phases.append(name)
+
+    def finish_phase(self, name):
+        with self._lock:
+            for phase in reversed(self.phases):
+                if phase[0] == name and phase[2] is None:
+                    phase[2] = time.time()
+                    phase[4] = self._read_counters()
+                    break
+            if name in self._active_phases:
+                self._active_phases.remove(name)
+
+    def track(self, pid, name, command_id=None):
+        with self._lock:
+            record = {
+                'pid': pid,
+                'name': name,
+                'command_id': command_id,
+                'actions': list(self._active_phases),
+                'start': time.time(),
+                'end': None,
+                'cpu_time': 0.0,
+                'peak_rss': 0,
+                'read_bytes': 0,
+                'write_bytes': 0,
+            }
+            self.commands.append(record)
+            for start in self._tracked_starts.values():
+                start[1] = True
+            self._tracked_starts[pid] = [_children_cpu_time(),
+                                         bool(self._tracked)]
+            self._tracked[pid] = record
+
+    def untrack(self, pid):
+        """Stop tracking pid, once it has been waited for."""
+        with self._lock:
+            record = self._tracked.pop(pid, None)
+            if record is None:
+                return
+            record['end'] = time.time()
+            start_cpu_time, overlapped = self._tracked_starts.pop(pid)
+            if not overlapped:
+                record['cpu_time'] = max(record['cpu_time'],
+                                         _children_cpu_time() - start_cpu_time)
+
+    def sample(self):
+        counters = self._read_counters()
+        memory_used = parse_memory(_read(os.path.join(PROC, 'meminfo')))[1]
+        processes = read_processes()
+        tree = query_tree_usage(self.pid, processes) or {'rss': 0, 'cpu_time': 0.0}
+        with self._lock:
+            last = self._last_counters
+            self._last_counters = counters
+            elapsed = counters['time'] - last['time']
+            cpu = dict([(name, counters['cpu'][name] - last['cpu'][name])
+                        for name in CPU_FIELDS])
+            total = sum(cpu.values()) or 1.0
+            for pid, record in self._tracked.items():
+                usage = query_tree_usage(pid, processes, with_io=True)
+                if usage is None:
+                    continue
+                record['cpu_time'] = max(record['cpu_time'], usage['cpu_time'])
+                record['peak_rss'] = max(record['peak_rss'], usage['rss'])
+                for name in ('read_bytes', 'write_bytes'):
+                    record[name] = max(record[name], usage[name])
+            self.peak_rss = max(self.peak_rss, tree['rss'])
+            self.samples.append({
+                'time': round(counters['time'] - self.start_time, 3),
+                'actions': list(self._active_phases),
+                'cpu_percent': round(100.0 * (total - cpu['idle'] - cpu['iowait']) / total, 1),
+                'cpu': dict([(name, round(100.0 * value / total, 1))
+                             for name, value in cpu.items()]),
+                'read_bytes': counters['io']['read_bytes'] - last['io']['read_bytes'],
+                'write_bytes': counters['io']['write_bytes'] - last['io']['write_bytes'],
+                'interval': round(elapsed, 3),
+                'memory_used': memory_used,
+                'rss': tree['rss'],
+                'cpu_time': round(tree['cpu_time'], 2),
+            })
+
+    def aggregate(self, phase=None):
+        """CPU and I/O usage over the whole run, or over the last run of
+        `phase': a dict of 'start', 'end', 'duration', 'cpu_percent',
+        'cpu_times' (seconds, by CPU_FIELDS) and 'io' (parse_io_counters()
+        differences).
+        """
+        if phase is None:
+            start = self._first_counters
+            end = self._final_counters or self._last_counters
+        else:
+            runs = [p for p in self.phases if p[0] == phase and p[4] is not None]
+            if not runs:
+                return None
+            start, end = runs[-1][3], runs[-1][4]
+        cpu_times = dict([(name, end['cpu'][name] - start['cpu'][name])
+                          for name in CPU_FIELDS])
+        total = sum(cpu_times.values())
+        if total:
+            busy = total - cpu_times['idle'] - cpu_times['iowait']
+            cpu_percent = 100.0 * busy / total
+        else:
+            cpu_percent = None
+        return {
+            'start': start['time'],
+            'end': end['time'],
+            'duration': end['time'] - start['time'],
+            'cpu_percent': cpu_percent,
+            'cpu_times': cpu_times,
+            'io': dict([(name, end['io'][name] - start['io'][name])
+                        for name in end['io']]),
+        }
+
+    def query_peak_rss(self):
+        """The highest RSS seen, in bytes: of this process tree, of this
+        process, and of its biggest child that has been waited for.
+        """
+        # ru_maxrss is in kilobytes on Linux.
+        return {
+            'tree': self.peak_rss,
+            'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+        }
+
+    def query_profile(self):
+        """Everything sampled, as a JSON-able dict.  Times are seconds
+        since start().
+        """
+        def relative(when):
+            if when is None:
+                return None
+            return round(when - self.start_time, 3)
+        phases = []
+        for name, start, end, _, _ in self.phases:
+            usage = self.aggregate(name) if end is not None else None
+            phase = {'name': name, 'start': relative(start), 'end': relative(end)}
+            if usage is not None:
+                phase.update({
+                    'duration': round(usage['duration'], 3),
+                    'cpu_percent': usage['cpu_percent'],
+                    'cpu_times': usage['cpu_times'],
+                    'io': usage['io'],
+                })
+            phases.append(phase)
+        with self._lock:
+            commands = [dict(record, start=relative(record['start']),
+                             end=relative(record['end']))
+                        for record in self.commands]
+            samples = list(self.samples)
+        return {
+            'version': PROFILE_VERSION,
+            'start': self.start_time,
+            'end': self.end_time,
+            'interval': self.interval,
+            'cpu_count': self.cpu_count,
+            'memory_total': self.memory_total,
+            'total': self.aggregate(),
+            'peak_rss': self.query_peak_rss(),
+            'phases': phases,
+            'commands': commands,
+            'samples': samples,
+        }
+
+    def write_profile(self, path):
+        fh = open(path, 'w')
+        try:
+            json.dump(self.query_profile(), fh, indent=1, sort_keys=True)
+        finally:
+            fh.close()
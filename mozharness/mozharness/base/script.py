@@ -14,18 +14,25 @@ import codecs
 from contextlib import contextmanager
 import gzip
 import inspect
+import itertools
 import os
 import platform
 import pprint
 import re
 import shutil
 import socket
+import stat
 import subprocess
 import sys
+import tarfile
+import tempfile
+import threading
 import time
 import traceback
 import urllib2
 import urlparse
+import zipfile
+import zlib
 if os.name == 'nt':
     try:
         import win32file
@@ -40,9 +47,21 @@ try:
 except ImportError:
     import json
 
+from mozharness.base.cache import ArtifactCache, DEFAULT_MAX_SIZE, VALIDATORS, \
+    copy_file
+from mozharness.base.archive import ZipIndex, extract_tar_stream, \
+    extract_zip_members, query_zip_index
 from mozharness.base.config import BaseConfig
+from mozharness.base.deleter import DeletionService, DEFAULT_WORKERS, \
+    delete_tree
+from mozharness.base.download import ConnectionPool, Download, RangeFile, \
+    RangesNotSupported
 from mozharness.base.log import SimpleFileLogger, MultiFileLogger, \
-    LogMixin, OutputParser, DEBUG, INFO, ERROR, FATAL
+    JSONLinesLogger, LogMixin, LogBuffer, OutputParser, buffer_log, \
+    log_context, set_log_context, DEBUG, INFO, WARNING, ERROR, FATAL
+from mozharness.base.parallel import Pipeline, query_num_workers
+from mozharness.base.process import OutputPump, process_group_kwargs
+from mozharness.base.resources import track_process, untrack_process
 
 
 # ScriptMixin {{{1
@@ -74,9 +93,44 @@ class ScriptMixin(object):
         else:
             self.debug("mkdir_p: %s Already exists." % path)
 
+    def query_deletion_service(self):
+        """The DeletionService that rmtree(background=True) uses.  The
+        first call also finishes deletions that earlier, dead processes
+        left behind.
+        """
+        if getattr(self, '_deletion_service', None) is None:
+            self._deletion_service = DeletionService(
+                pending_dir=self.config.get('pending_deletions_dir'),
+                num_workers=self.config.get('delete_workers', DEFAULT_WORKERS),
+                log_fn=self.info)
+            for path in self._deletion_service.sweep():
+                self.info("Deleting %s, left behind by an earlier run" % path)
+        return self._deletion_service
+
+    def wait_for_deletions(self, error_level=WARNING):
+        """Wait for the trees rmtree(background=True) is deleting.
+        Returns None for success, not None for failure
+        """
+        service = getattr(self, '_deletion_service', None)
+        if service is None:
+            return
+        pending = service.query_pending()
+        if pending:
+            self.info("Waiting for %d background deletions..." % len(pending))
+        errors = service.wait()
+        for path, exc_info in errors:
+            self.log("Unable to remove %s: %s" % (path, exc_info[1]),
+                     level=error_level)
+        if errors:
+            return -1
+
     def rmtree(self, path, log_level=INFO, error_level=ERROR,
-               exit_code=-1):
+               exit_code=-1, background=False):
         """
+        With background, a directory is renamed out of the way and
+        deleted on another thread (see query_deletion_service() and
+        wait_for_deletions()).
+
         Returns None for success, not None for failure
         """
         self.log("rmtree: %s" % path, level=log_level)
@@ -93,12 +147,24 @@ class ScriptMixin(object):
             )
         if os.path.exists(path):
             if os.path.isdir(path):
+                if background and not os.path.islink(path):
+                    try:
+                        trash_path = self.query_deletion_service().delete(path)
+                        self.log("Moved %s to %s, deleting it in the background" %
+                                 (path, trash_path), level=log_level)
+                        return
+                    except OSError, e:
+                        self.warning("Can't move %s out of the way (%s); deleting it now" %
+                                     (path, e))
+
+                def remove_tree():
+                    delete_tree(path, num_workers=self.config.get(
+                        'delete_workers', DEFAULT_WORKERS))
                 return self.retry(
-                    shutil.rmtree,
+                    remove_tree,
                     error_level=error_level,
                     error_message=error_message,
                     retry_exceptions=(OSError, ),
-                    args=(path, ),
                 )
             else:
                 return self.retry(
@@ -171,34 +237,61 @@ class ScriptMixin(object):
         else:
             return parsed.netloc
 
-    def _download_file(self, url, file_name):
+    def query_connection_pool(self):
+        """The keep-alive connections that downloads share."""
+        if getattr(self, '_connection_pool', None) is None:
+            self._connection_pool = ConnectionPool()
+        return self._connection_pool
+
+    def query_artifact_cache(self):
+        """The ArtifactCache in config['artifact_cache_dir'], or None if
+        that isn't set.
+        """
+        cache_dir = self.config.get('artifact_cache_dir')
+        if not cache_dir:
+            return None
+        if getattr(self, '_artifact_cache', None) is None:
+            self._artifact_cache = ArtifactCache(
+                cache_dir,
+                max_size=self.config.get('artifact_cache_max_size', DEFAULT_MAX_SIZE),
+                link_mode=self.config.get('artifact_cache_link_mode', 'reflink'))
+        return self._artifact_cache
+
+    def _query_url_validators(self, url):
+        """The headers that identify the current version of url, from a
+        HEAD request, or None.
+        """
+        if urlparse.urlsplit(url).scheme not in ('http', 'https'):
+            return None
+        try:
+            response = self.query_connection_pool().request(url, method='HEAD')
+        except (urllib2.URLError, socket.error), e:
+            self.info("Can't check %s for a cached copy: %s" % (url, str(e)))
+            return None
+        response.close()
+        return dict([(name, response.getheader(name)) for name in VALIDATORS])
+
+    def _download_file(self, url, file_name, segments=1, checksum=None,
+                       hash_type='sha512'):
         """ Helper script for download_file()
             """
         try:
-            f_length = None
-            f = urllib2.urlopen(url, timeout=30)
-            if f.info().get('content-length') is not None:
-                f_length = int(f.info()['content-length'])
-                got_length = 0
-            local_file = open(file_name, 'wb')
-            while True:
-                block = f.read(1024 ** 2)
-                if not block:
-                    if f_length is not None and got_length != f_length:
-                        raise urllib2.URLError("Download incomplete; content-length was %d, but only received %d" % (f_length, got_length))
-                    break
-                local_file.write(block)
-                if f_length is not None:
-                    got_length += len(block)
-            local_file.close()
+            download = Download(self.query_connection_pool(), url, file_name,
+                                segments=segments, checksum=checksum,
+                                hash_type=hash_type)
+            if download.read_state():
+                self.info("Resuming download of %s." % url)
+            download.run()
+            if download.resumed_bytes:
+                self.info("Resumed after %d bytes." % download.resumed_bytes)
             return file_name
         except urllib2.HTTPError, e:
             self.warning("Server returned status %s %s for %s" % (str(e.code), str(e), url))
             raise
         except urllib2.URLError, e:
-            self.warning("URL Error: %s" % url)
-            remote_host = urlparse.urlsplit(url)[1]
-            if remote_host:
+            self.warning("URL Error: %s: %s" % (url, str(e.reason)))
+            remote_host = urlparse.urlsplit(url).hostname
+            if remote_host and isinstance(e.reason, socket.gaierror):
                 nslookup = self.query_exe('nslookup')
                 error_list = [{
                     'substr': "server can't find %s" % remote_host,
@@ -219,8 +312,21 @@ class ScriptMixin(object):
     # TODO thinking about creating a transfer object.
     def download_file(self, url, file_name=None, parent_dir=None,
                       create_parent_dir=True, error_level=ERROR,
-                      exit_code=-1):
+                      exit_code=-1, segments=None, checksum=None,
+                      hash_type='sha512'):
         """Python wget.
+
+        Over http(s), an interrupted download is resumed on the next
+        try.  A big file can be fetched in up to `segments' parts at once
+        (by default config['download_segments'], or 1: one connection).
+        If `checksum' is set, the file's `hash_type' hex digest has to
+        match it.
+
+        If config['artifact_cache_dir'] is set, the file comes from that
+        cache when it has the same checksum, or the same version of url
+        (by ETag, Last-Modified and Content-Length), and is added to it
+        otherwise.  With config['artifact_cache_link_mode'] 'hardlink',
+        files from the cache are read-only and shared with it.
         """
         if not file_name:
             try:
@@ -233,10 +339,28 @@ class ScriptMixin(object):
             file_name = os.path.join(parent_dir, file_name)
             if create_parent_dir:
                 self.mkdir_p(parent_dir, error_level=error_level)
+        if segments is None:
+            segments = self.config.get('download_segments', 1)
+        cache = self.query_artifact_cache()
+        validators = None
+        if cache:
+            if not checksum:
+                validators = self._query_url_validators(url)
+            try:
+                method = cache.fetch(file_name, url=url, validators=validators,
+                                     checksum=checksum, hash_type=hash_type)
+            except (IOError, OSError), e:
+                self.warning("Can't read the artifact cache: %s" % str(e))
+                method = None
+            if method:
+                self.info("Using cached %s (%s) as %s." % (url, method, file_name))
+                return file_name
         self.info("Downloading %s to %s" % (url, file_name))
         status = self.retry(
             self._download_file,
             args=(url, file_name),
+            kwargs={'segments': segments, 'checksum': checksum,
+                    'hash_type': hash_type},
             failure_status=None,
             retry_exceptions=(urllib2.HTTPError, urllib2.URLError,
                               socket.timeout, socket.error),
@@ -245,8 +369,33 @@ class ScriptMixin(object):
         )
         if status == file_name:
             self.info("Downloaded %d bytes." % os.path.getsize(file_name))
+            if cache:
+                try:
+                    cache.store(file_name, url=url, validators=validators,
+                                checksum=checksum, hash_type=hash_type)
+                except (IOError, OSError), e:
+                    self.warning("Can't add %s to the artifact cache: %s" %
+                                 (file_name, str(e)))
         return status
 
+    def download_files(self, downloads, num_workers=None):
+        """Download several files at once, over shared keep-alive
+        connections, on up to num_workers threads (by default
+        config['download_workers'], or 4).
+
+        Each item of `downloads' is a dict of download_file() arguments.
+        What each download logs is logged in one piece, in order.
+        Returns the list of what download_file() returned for each.
+        """
+        if num_workers is None:
+            num_workers = self.config.get('download_workers', 4)
+
+        def download_one(kwargs, log_buffer):
+            return self.download_file(**kwargs)
+        return self._run_buffered_parallel('downloads', download_one,
+                                           [dict(kwargs) for kwargs in downloads],
+                                           num_workers)
+
     def move(self, src, dest, log_level=INFO, error_level=ERROR,
              exit_code=-1):
         self.log("Moving %s to %s" % (src, dest), level=log_level)
@@ -298,7 +447,8 @@ class ScriptMixin(object):
                 return -1
 
     def copytree(self, src, dest, overwrite='no_overwrite', log_level=INFO,
-                 error_level=ERROR):
+                 error_level=ERROR, link_mode='copy', skip_unchanged=False,
+                 symlinks=False, num_workers=None):
         """an implementation of shutil.copytree however it allows for
         dest to exist and implements different overwrite levels.
         overwrite uses:
@@ -306,49 +456,151 @@ class ScriptMixin(object):
         'overwrite_if_exists' will only overwrite destination paths that have
                    the same path names relative to the root of the src and
                    destination tree
-        'clobber' will replace the whole destination tree(clobber) if it exists"""
+        'clobber' will replace the whole destination tree(clobber) if it exists
+
+        link_mode is how files are copied:
+        'copy' copies them, like shutil.copy2
+        'reflink' makes copy-on-write clones where the file system can,
+                   and copies otherwise
+        'hardlink' hardlinks them where it can, and reflinks or copies
+                   otherwise.  src and dest then share the same files, so
+                   only use it for trees that nothing changes in place.
+
+        With skip_unchanged, destination files that have the same size and
+        mtime as the source are kept rather than copied again, like rsync.
+        With symlinks, symlinks are copied as symlinks rather than followed.
+        Files are copied on num_workers threads (see query_num_workers()).
+        """
 
-        self.info('copying tree: %s to %s' % (src, dest))
+        self.log('copying tree: %s to %s' % (src, dest), level=log_level)
+        if overwrite not in ('no_overwrite', 'overwrite_if_exists', 'clobber'):
+            self.fatal("%s is not a valid argument for param overwrite" % (overwrite))
+        if link_mode not in ('copy', 'reflink', 'hardlink'):
+            self.fatal("%s is not a valid argument for param link_mode" % (link_mode))
+        if num_workers is None:
+            num_workers = query_num_workers(self.config)
+        copies = []
+        directories = []
         try:
             if overwrite == 'clobber' or not os.path.exists(dest):
-                self.rmtree(dest)
-                shutil.copytree(src, dest)
-            elif overwrite == 'no_overwrite' or overwrite == 'overwrite_if_exists':
-                files = os.listdir(src)
-                for f in files:
-                    abs_src_f = os.path.join(src, f)
-                    abs_dest_f = os.path.join(dest, f)
-                    if not os.path.exists(abs_dest_f):
-                        if os.path.isdir(abs_src_f):
-                            self.mkdir_p(abs_dest_f)
-                            self.copytree(abs_src_f, abs_dest_f,
-                                          overwrite='clobber')
-                        else:
-                            shutil.copy2(abs_src_f, abs_dest_f)
-                    elif overwrite == 'no_overwrite':  # destination path exists
-                        if os.path.isdir(abs_src_f) and os.path.isdir(abs_dest_f):
-                            self.copytree(abs_src_f, abs_dest_f,
-                                          overwrite='no_overwrite')
-                        else:
-                            self.debug('ignoring path: %s as destination: \
-                                    %s exists' % (abs_src_f, abs_dest_f))
-                    else:  # overwrite == 'overwrite_if_exists' and destination exists
-                        self.debug('overwriting: %s with: %s' %
-                                   (abs_dest_f, abs_src_f))
-                        self.rmtree(abs_dest_f)
-
-                        if os.path.isdir(abs_src_f):
-                            self.mkdir_p(abs_dest_f)
-                            self.copytree(abs_src_f, abs_dest_f,
-                                          overwrite='overwrite_if_exists')
-                        else:
-                            shutil.copy2(abs_src_f, abs_dest_f)
+                if not skip_unchanged:
+                    self.rmtree(dest)
+                self._plan_copytree(src, dest, overwrite='clobber',
+                                    skip_unchanged=skip_unchanged,
+                                    symlinks=symlinks, copies=copies,
+                                    directories=directories)
             else:
-                self.fatal("%s is not a valid argument for param overwrite" % (overwrite))
-        except (IOError, shutil.Error):
+                self._plan_copytree(src, dest, overwrite=overwrite,
+                                    skip_unchanged=skip_unchanged,
+                                    symlinks=symlinks, copies=copies,
+                                    directories=directories)
+            methods = self._copy_files(copies, link_mode, num_workers)
+            for src_dir, dest_dir in reversed(directories):
+                shutil.copystat(src_dir, dest_dir)
+        except (IOError, OSError, shutil.Error):
             self.exception("There was an error while copying %s to %s!" % (src, dest),
                            level=error_level)
             return -1
+        self.log('copied %d files (%s)' % (
+            len(copies), ', '.join(['%s: %d' % (method, methods.count(method))
+                                    for method in sorted(set(methods))]) or 'none'),
+            level=log_level)
+
+    def _plan_copytree(self, src, dest, overwrite, skip_unchanged, symlinks,
+                       copies, directories):
+        """Make the directories and remove the paths that copytree()
+        needs to, and add the (src, dest) files to copy to `copies'.
+
+        'clobber' here makes dest the same as src, removing everything
+        in dest that isn't in src, and keeping unchanged files if
+        skip_unchanged is set.
+        """
+        if os.path.islink(dest) or (os.path.exists(dest) and not os.path.isdir(dest)):
+            os.remove(dest)
+        if not os.path.isdir(dest):
+            os.makedirs(dest)
+        directories.append((src, dest))
+        names = os.listdir(src)
+        if overwrite == 'clobber':
+            for name in set(os.listdir(dest)) - set(names):
+                self._remove_path(os.path.join(dest, name))
+        for name in names:
+            abs_src_f = os.path.join(src, name)
+            abs_dest_f = os.path.join(dest, name)
+            is_link = symlinks and os.path.islink(abs_src_f)
+            if overwrite == 'no_overwrite' and os.path.lexists(abs_dest_f):
+                if not is_link and os.path.isdir(abs_src_f) and \
+                        os.path.isdir(abs_dest_f):
+                    self._plan_copytree(abs_src_f, abs_dest_f, 'no_overwrite',
+                                        skip_unchanged, symlinks, copies,
+                                        directories)
+                else:
+                    self.debug('ignoring path: %s as destination: %s exists' %
+                               (abs_src_f, abs_dest_f))
+            elif is_link:
+                self._remove_path(abs_dest_f)
+                os.symlink(os.readlink(abs_src_f), abs_dest_f)
+            elif os.path.isdir(abs_src_f):
+                # overwrite_if_exists replaces each colliding path, so the
+                # rest of the tree is the same as src.
+                self._plan_copytree(abs_src_f, abs_dest_f, 'clobber',
+                                    skip_unchanged, symlinks, copies,
+                                    directories)
+            elif skip_unchanged and self._is_same_file_stat(abs_src_f, abs_dest_f):
+                continue
+            else:
+                if os.path.isdir(abs_dest_f) and not os.path.islink(abs_dest_f):
+                    shutil.rmtree(abs_dest_f)
+                copies.append((abs_src_f, abs_dest_f))
+
+    def _remove_path(self, path):
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.remove(path)
+
+    def _is_same_file_stat(self, src, dest):
+        """Whether dest looks like a copy of src: a file of the same
+        size and mtime (to the second, as copystat() may round it).
+        """
+        try:
+            src_stat = os.stat(src)
+            dest_stat = os.lstat(dest)
+        except OSError:
+            return False
+        return stat.S_ISREG(dest_stat.st_mode) and \
+            src_stat.st_size == dest_stat.st_size and \
+            int(src_stat.st_mtime) == int(dest_stat.st_mtime)
+
+    def _copy_files(self, copies, link_mode, num_workers=1):
+        """Copy each (src, dest) in `copies' on up to num_workers threads.
+        Returns how each was copied: 'hardlink', 'reflink' or 'copy'.
+        """
+        methods = [None] * len(copies)
+        num_workers = max(1, min(num_workers, len(copies)))
+        errors = []
+
+        def copy_run(index):
+            try:
+                for i in range(index, len(copies), num_workers):
+                    if errors:
+                        return
+                    methods[i] = copy_file(copies[i][0], copies[i][1], link_mode)
+            except:
+                errors.append(sys.exc_info())
+        threads = []
+        for index in range(1, num_workers):
+            thread = threading.Thread(target=copy_run, args=(index, ))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        copy_run(0)
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return methods
 
     def write_to_file(self, file_path, contents, verbose=True,
                       open_mode='w', create_parent_dir=False,
@@ -605,8 +857,7 @@ class ScriptMixin(object):
         """Run a command, with logging and error parsing.
 
         output_timeout is the number of seconds without output before the process
-        is killed; it requires that mozprocess is installed in the script's
-        virtualenv.
+        is killed.
 
         TODO: context_lines
         TODO: error_level_override?
@@ -621,112 +872,175 @@ class ScriptMixin(object):
         ]
         (context_lines isn't written yet)
         """
-        if output_timeout:
-            site_packages_path = self.query_python_site_packages_path()
-            sys_path = ''.join(sys.path)
-            if 'mozprocess' not in sys_path:
-                if site_packages_path not in sys_path:
-                    # check for mozprocess
-                    mozprocess_path = os.path.join(site_packages_path, 'mozprocess')
-                    if not os.access(mozprocess_path, os.F_OK):
-                        self.fatal('mozprocess required for output_timeout, but not present at %s' % mozprocess_path)
-                    # Assume if mozprocess is installed, all it's pre-req's
-                    # are present also, and add the top-level site-packages
-                    # dir to sys.path.
-                    sys.path.append(site_packages_path)
-
+        # Log records carry which command they're from.
+        command_id = self._query_next_command_id()
+        with log_context(command=command_id):
+            if success_codes is None:
+                success_codes = [0]
+            if cwd is not None:
+                if not os.path.isdir(cwd):
+                    level = ERROR
+                    if halt_on_failure:
+                        level = FATAL
+                    self.log("Can't run command %s in non-existent directory '%s'!" %
+                             (command, cwd), level=level)
+                    return -1
+                self.info("Running command: %s in %s" % (command, cwd))
+            else:
+                self.info("Running command: %s" % command)
+            if isinstance(command, list) or isinstance(command, tuple):
+                self.info("Copy/paste: %s" % subprocess.list2cmdline(command))
+            shell = True
+            if isinstance(command, list) or isinstance(command, tuple):
+                shell = False
+            if env is None:
+                if partial_env:
+                    self.info("Using partial env: %s" % pprint.pformat(partial_env))
+                    env = self.query_env(partial_env=partial_env)
+            else:
+                self.info("Using env: %s" % pprint.pformat(env))
+    
+            if output_parser is None:
+                parser = OutputParser(config=self.config, log_obj=self.log_obj,
+                                      error_list=error_list)
+            else:
+                parser = output_parser
+    
             try:
-                from mozprocess import ProcessHandler
-            except ImportError:
-                self.exception("There was an error importing mozprocess!",
-                               level=FATAL)
-
-        if success_codes is None:
-            success_codes = [0]
-        if cwd is not None:
-            if not os.path.isdir(cwd):
+                p = subprocess.Popen(command, shell=shell, stdout=subprocess.PIPE,
+                                     cwd=cwd, stderr=subprocess.STDOUT, env=env,
+                                     **process_group_kwargs())
+                track_process(p.pid, self._query_command_name(command), command_id)
+                if output_timeout:
+                    self.info("Calling %s with output_timeout %d" % (command, output_timeout))
+                pump = OutputPump(p, parser, output_timeout=output_timeout)
+                try:
+                    timed_out = pump.run()
+                    returncode = p.wait()
+                finally:
+                    untrack_process(p.pid)
+                self.debug("Read %(bytes)d bytes, %(lines)d lines of output; waited "
+                           "for the parser %(blocked)d times, "
+                           "%(blocked_seconds).2fs in all" % pump.stats)
+                if timed_out:
+                    self.error('timed out after %s seconds of no output' % output_timeout)
+            except OSError, e:
                 level = ERROR
                 if halt_on_failure:
                     level = FATAL
-                self.log("Can't run command %s in non-existent directory '%s'!" %
-                         (command, cwd), level=level)
+                self.log('caught OS error %s: %s while running %s' % (e.errno,
+                         e.strerror, command), level=level)
                 return -1
-            self.info("Running command: %s in %s" % (command, cwd))
-        else:
-            self.info("Running command: %s" % command)
-        if isinstance(command, list) or isinstance(command, tuple):
-            self.info("Copy/paste: %s" % subprocess.list2cmdline(command))
-        shell = True
-        if isinstance(command, list) or isinstance(command, tuple):
-            shell = False
-        if env is None:
-            if partial_env:
-                self.info("Using partial env: %s" % pprint.pformat(partial_env))
-                env = self.query_env(partial_env=partial_env)
-        else:
-            self.info("Using env: %s" % pprint.pformat(env))
-
-        if output_parser is None:
-            parser = OutputParser(config=self.config, log_obj=self.log_obj,
-                                  error_list=error_list)
-        else:
-            parser = output_parser
-
-        try:
-            if output_timeout:
-                def processOutput(line):
-                    parser.add_lines(line)
-
-                def onTimeout():
-                    self.info("mozprocess timed out")
-
-                p = ProcessHandler(command,
-                                   env=env,
-                                   cwd=cwd,
-                                   storeOutput=False,
-                                   onTimeout=(onTimeout,),
-                                   processOutputLine=[processOutput])
-                self.info("Calling %s with output_timeout %d" % (command, output_timeout))
-                p.run(outputTimeout=output_timeout)
-                p.wait()
-                if p.timedOut:
-                    self.error('timed out after %s seconds of no output' % output_timeout)
-                returncode = int(p.proc.returncode)
-            else:
-                p = subprocess.Popen(command, shell=shell, stdout=subprocess.PIPE,
-                                     cwd=cwd, stderr=subprocess.STDOUT, env=env)
-                loop = True
-                while loop:
-                    if p.poll() is not None:
-                        """Avoid losing the final lines of the log?"""
-                        loop = False
-                    while True:
-                        line = p.stdout.readline()
-                        if not line:
-                            break
-                        parser.add_lines(line)
-                returncode = p.returncode
-        except OSError, e:
-            level = ERROR
+    
+            return_level = INFO
+            if returncode not in success_codes:
+                return_level = ERROR
+                if throw_exception:
+                    raise subprocess.CalledProcessError(returncode, command)
+            self.log("Return code: %d" % returncode, level=return_level)
             if halt_on_failure:
-                level = FATAL
-            self.log('caught OS error %s: %s while running %s' % (e.errno,
-                     e.strerror, command), level=level)
-            return -1
-
-        return_level = INFO
-        if returncode not in success_codes:
-            return_level = ERROR
-            if throw_exception:
-                raise subprocess.CalledProcessError(returncode, command)
-        self.log("Return code: %d" % returncode, level=return_level)
-        if halt_on_failure:
-            if parser.num_errors or returncode not in success_codes:
-                self.fatal("Halting on failure while running %s" % command,
-                           exit_code=returncode)
-        if return_type == 'num_errors':
-            return parser.num_errors
-        return returncode
+                if parser.num_errors or returncode not in success_codes:
+                    self.fatal("Halting on failure while running %s" % command,
+                               exit_code=returncode)
+            if return_type == 'num_errors':
+                return parser.num_errors
+            return returncode
+
+    def _query_command_name(self, command):
+        if isinstance(command, (list, tuple)):
+            return subprocess.list2cmdline(command)
+        return command
+
+    def _query_next_command_id(self):
+        if getattr(self, '_command_ids', None) is None:
+            self._command_ids = itertools.count(1)
+        return self._command_ids.next()
+
+    def run_commands_parallel(self, commands, num_workers=None):
+        """Run several commands at once, on up to num_workers threads
+        (by default config['parallel_workers'], or the number of CPUs).
+
+        Each item of `commands' is a dict of run_command() arguments:
+
+            [{'command': ['make', '-C', 'a'], 'error_list': MakefileErrorList},
+             {'command': ['make', '-C', 'b'], 'cwd': ..., 'env': ...,
+              'return_type': 'num_errors'}]
+
+        Each command's output is kept until it finishes, then logged in
+        one piece, in the order of `commands', so the logs of different
+        commands don't interleave.
+
+        Returns the list of what run_command() returned for each command.
+        If a command is fatal (e.g. with halt_on_failure), no more
+        commands are started, and the script exits once the running
+        ones have finished and been logged.  If a command raises (e.g.
+        with throw_exception), the first such exception is raised
+        once they've all finished.
+        """
+        commands = [dict(kwargs) for kwargs in commands]
+        if num_workers is None:
+            num_workers = query_num_workers(self.config)
+
+        def run_one(kwargs, log_buffer):
+            if kwargs.get('output_parser') is None:
+                kwargs['output_parser'] = OutputParser(
+                    config=self.config, error_list=kwargs.get('error_list'))
+            # The parser logs from the output pump's thread.
+            kwargs['output_parser'].log_obj = log_buffer
+            return self.run_command(**kwargs)
+        return self._run_buffered_parallel('commands', run_one, commands,
+                                           num_workers)
+
+    def _run_buffered_parallel(self, name, function, calls, num_workers):
+        """Call function(kwargs, log_buffer) for each item of `calls' on
+        up to num_workers threads, and log what each call logged in one
+        piece, in order.  See run_commands_parallel().
+        """
+        if not calls:
+            return []
+        num_workers = max(1, min(num_workers, len(calls)))
+        buffers = [LogBuffer() for _ in calls]
+        return_values = [None] * len(calls)
+        finished = set()
+        state = {'next': 0, 'held': [], 'exc_info': None}
+
+        def run_one(index):
+            with buffer_log(buffers[index]):
+                return_values[index] = function(calls[index], buffers[index])
+
+        def flush():
+            # Called under the pipeline's lock.
+            while state['next'] in finished:
+                index = state['next']
+                if buffers[index].has_fatal:
+                    state['held'].append(index)
+                else:
+                    buffers[index].replay(self)
+                state['next'] += 1
+
+        def on_result(stage, item, result):
+            finished.add(item[0])
+            flush()
+
+        def on_exception(stage, item):
+            if state['exc_info'] is None:
+                state['exc_info'] = sys.exc_info()
+
+        self.info("Running %d %s with %d workers." %
+                  (len(calls), name, num_workers))
+        pipeline = Pipeline([(name, run_one, num_workers)],
+                            on_result=on_result, on_exception=on_exception)
+        exit_code = pipeline.run([(index, ) for index in range(len(calls))])
+        # Calls after a fatal one may not have run at all.
+        finished.update(range(len(calls)))
+        flush()
+        for index in state['held']:
+            buffers[index].replay(self)
+        if exit_code is not None:
+            self.fatal("One of the %s exited; stopping." % name, exit_code=exit_code)
+        if state['exc_info']:
+            raise state['exc_info'][0], state['exc_info'][1], state['exc_info'][2]
+        return return_values
 
     def get_output_from_command(self, command, cwd=None,
                                 halt_on_failure=False, env=None,
@@ -790,10 +1104,14 @@ class ScriptMixin(object):
             shell = False
         p = subprocess.Popen(command, shell=shell, stdout=tmp_stdout,
                              cwd=cwd, stderr=tmp_stderr, env=env)
+        track_process(p.pid, self._query_command_name(command))
         #XXX: changed from self.debug to self.log due to this error:
         #     TypeError: debug() takes exactly 1 argument (2 given)
         self.log("Temporary files: %s and %s" % (tmp_stdout_filename, tmp_stderr_filename), level=DEBUG)
-        p.wait()
+        try:
+            p.wait()
+        finally:
+            untrack_process(p.pid)
         tmp_stdout.close()
         tmp_stderr.close()
         return_level = DEBUG
@@ -859,18 +1177,131 @@ class ScriptMixin(object):
         This method allows us to extract a file regardless of its extension
         '''
         # XXX: Make sure that filename has a extension of one of our supported file formats
-        m = re.search('\.tar\.(bz2|gz)$', filename)
+        m = re.search('\.tar(?:\.(bz2|gz))?$', filename)
         if m:
             command = self.query_exe('tar', return_type='list')
-            tar_cmd = "jxfv"
-            if m.group(1) == "gz":
+            tar_cmd = "xfv"
+            if m.group(1) == "bz2":
+                tar_cmd = "jxfv"
+            elif m.group(1) == "gz":
                 tar_cmd = "zxfv"
             command.extend([tar_cmd, filename, "-C", extract_to])
             self.run_command(command, halt_on_failure=True)
+        elif filename.endswith('.zip'):
+            self.unzip(filename, extract_to, error_level=FATAL)
         else:
             # XXX implement
             pass
 
+    def _download_unpack_stream(self, url, extract_to, target_unzip_dirs=None):
+        """ Helper script for download_unpack()
+            """
+        m = re.search(r'\.tar(?:\.(bz2|gz))?$', urlparse.urlsplit(url).path)
+        if m:
+            response = self.query_connection_pool().request(url)
+            try:
+                names = extract_tar_stream(response, extract_to, m.group(1) or '')
+            except (tarfile.TarError, EOFError, zlib.error, IOError), e:
+                # Most likely a truncated download.
+                raise urllib2.URLError("Can't unpack %s: %s" % (url, str(e)))
+            finally:
+                response.close()
+            self.info("Extracted %d files from %s as it downloaded." % (len(names), url))
+            return names
+        range_file = RangeFile(self.query_connection_pool(), url)
+        range_files = [range_file]
+
+        def open_archive():
+            range_files.append(range_file.reopen())
+            return range_files[-1]
+        try:
+            members = ZipIndex.from_zip(range_file).query_members(target_unzip_dirs)
+            names = extract_zip_members(open_archive, members, extract_to,
+                                        num_workers=query_num_workers(self.config))
+        except (zipfile.BadZipfile, zlib.error), e:
+            raise urllib2.URLError("Can't unzip %s: %s" % (url, str(e)))
+        self.info("Extracted %d files from %s, fetching %d of its %d bytes." %
+                  (len(names), url, sum([f.bytes_fetched for f in range_files]),
+                   range_file.length))
+        return names
+
+    def download_unpack(self, url, extract_to, target_unzip_dirs=None,
+                        error_level=ERROR):
+        """Unpack the zip or tar(.gz/.bz2) archive at url into extract_to,
+        overwriting what's there, without keeping the archive.
+
+        Over http(s), a tarball is unpacked as it downloads, and of a zip
+        only the central directory and the members that match the
+        unzip-style wildcards in target_unzip_dirs (all of them if it's
+        None) are fetched.  If the server can't send parts of files,
+        an artifact cache is set up, or url is something else, the
+        archive is downloaded to a temporary directory and unpacked
+        from there; anything but a .tar, .tar.gz or .tar.bz2 is unzipped.
+
+        Returns None for success, not None for failure.
+        """
+        self.mkdir_p(extract_to, error_level=error_level)
+        is_archive = re.search(r'\.(zip|tar|tar\.gz|tar\.bz2)$',
+                               urlparse.urlsplit(url).path)
+        if is_archive and not self.query_artifact_cache() and \
+                urlparse.urlsplit(url).scheme in ('http', 'https'):
+            self.info("Unpacking %s into %s" % (url, extract_to))
+            try:
+                names = self.retry(
+                    self._download_unpack_stream,
+                    args=(url, extract_to),
+                    kwargs={'target_unzip_dirs': target_unzip_dirs},
+                    failure_status=None,
+                    retry_exceptions=(urllib2.HTTPError, urllib2.URLError,
+                                      socket.timeout, socket.error),
+                    error_message="Can't unpack %s into %s!" % (url, extract_to),
+                    error_level=error_level,
+                )
+            except RangesNotSupported, e:
+                self.info("%s; downloading all of it." % str(e))
+            else:
+                if names is None:
+                    return -1
+                return
+        tmp_dir = tempfile.mkdtemp(prefix='download-unpack-')
+        try:
+            file_name = self.download_file(url, parent_dir=tmp_dir,
+                                           error_level=error_level)
+            if not file_name:
+                return -1
+            if re.search(r'\.tar(\.(bz2|gz))?$', file_name):
+                self.unpack(file_name, extract_to)
+                return
+            return self.unzip(file_name, extract_to, target_unzip_dirs,
+                              error_level=error_level)
+        finally:
+            self.rmtree(tmp_dir)
+
+    def unzip(self, zip_path, extract_to, target_unzip_dirs=None,
+              num_workers=None, error_level=ERROR):
+        """Extract the members of the zip archive at zip_path that match
+        the unzip-style wildcards in target_unzip_dirs (all of them if
+        it's None) into extract_to, overwriting what's there.
+
+        The archive's index is kept in zip_path.index.json, so the next
+        unzip() only has to read the members it extracts.  Those are
+        split between num_workers threads (by default
+        config['parallel_workers'], or the number of CPUs).
+
+        Returns None for success, not None for failure.
+        """
+        if num_workers is None:
+            num_workers = query_num_workers(self.config)
+        self.info("Unzipping %s into %s" % (zip_path, extract_to))
+        try:
+            members = query_zip_index(zip_path).query_members(target_unzip_dirs)
+            names = extract_zip_members(lambda: open(zip_path, 'rb'), members,
+                                        extract_to, num_workers=num_workers)
+        except (zipfile.BadZipfile, zlib.error, IOError, OSError), e:
+            self.log("Can't unzip %s: %s" % (zip_path, str(e)), level=error_level)
+            return -1
+        self.info("Extracted %d files." % len(names))
+
 
 def PreScriptRun(func):
     """Decorator for methods that will be called before script execution.
@@ -1053,14 +1484,7 @@ class BaseScript(ScriptMixin, LogMixin, object):
                                     long_desc='%s log' % log_name,
                                     max_backups=self.config.get("log_max_rotate", 0))
 
-    def run_action(self, action):
-        if action not in self.actions:
-            self.action_message("Skipping %s step." % action)
-            return
-
-        method_name = action.replace("-", "_")
-        self.action_message("Running %s step." % action)
-
+    def _run_pre_action_listeners(self, action):
         # An exception during a pre action listener should abort execution.
         for fn, target in self._listeners['pre_action']:
             if target is not None and target != action:
@@ -1089,6 +1513,34 @@ class BaseScript(ScriptMixin, LogMixin, object):
 
                 self.fatal("Aborting due to exception in pre-action listener.")
 
+    def _run_post_action_listeners(self, action, success):
+        post_success = True
+        for fn, target in self._listeners['post_action']:
+            if target is not None and target != action:
+                continue
+
+            try:
+                self.info("Running post-action listener: %s" % fn)
+                method = getattr(self, fn)
+                method(action, success=success and self.return_code == 0)
+            except Exception:
+                post_success = False
+                self.error("Exception during post-action for %s: %s" % (
+                    action, traceback.format_exc()))
+
+        if not post_success:
+            self.fatal("Aborting due to failure in post-action listener.")
+
+    def run_action(self, action):
+        if action not in self.actions:
+            self.action_message("Skipping %s step." % action)
+            return
+
+        method_name = action.replace("-", "_")
+        set_log_context(action=action)
+        self.action_message("Running %s step." % action)
+        self._run_pre_action_listeners(action)
+
         # We always run post action listeners, even if the main routine failed.
         success = False
         try:
@@ -1098,22 +1550,124 @@ class BaseScript(ScriptMixin, LogMixin, object):
             self._possibly_run_method("postflight_%s" % method_name)
             success = True
         finally:
-            post_success = True
-            for fn, target in self._listeners['post_action']:
-                if target is not None and target != action:
-                    continue
+            self._run_post_action_listeners(action, success)
+            set_log_context(action=None)
+
+    # Pipelining {{{2
+    def query_pipeline_items(self):
+        """Scripts that can pipeline their actions return the list of
+        items (tuples) here; see run_pipeline().  None means the actions
+        always run one after the other.
+        """
+        return None
 
-                try:
-                    self.info("Running post-action listener: %s" % fn)
-                    method = getattr(self, fn)
-                    method(action, success=success and self.return_code == 0)
-                except Exception:
-                    post_success = False
-                    self.error("Exception during post-action for %s: %s" % (
-                        action, traceback.format_exc()))
+    def query_pipeline_workers(self, action):
+        """The number of threads to run `action' on in a pipeline:
+        config['pipeline_workers'], which is either a number or a dict
+        of {action: number}.
+        """
+        workers = self.config.get('pipeline_workers', 1)
+        if isinstance(workers, dict):
+            workers = workers.get(action, 1)
+        return max(1, int(workers))
+
+    def pipeline_item_failed(self, action, item, message):
+        """Record an item that failed `action' in a pipeline."""
+        self.add_failure(":".join([str(i) for i in item]), message=message)
+
+    def summarize_pipeline_action(self, action, success_count, total_count):
+        self.summarize_success_count(
+            success_count, total_count,
+            message="%s: %%d of %%d items successful." % action)
+
+    def query_action_groups(self):
+        """Split self.all_actions into the groups run() runs together.
+
+        Without config['pipeline'], every action is on its own.  With
+        it, consecutive enabled actions that all have an ACTION_item()
+        method are grouped, to be pipelined.
+        """
+        groups = []
+        pipeline = []
+        can_pipeline = self.config.get('pipeline') and \
+            self.query_pipeline_items() is not None
+        for action in self.all_actions:
+            if can_pipeline and action in self.actions and \
+                    callable(getattr(self, "%s_item" % action.replace("-", "_"), None)):
+                pipeline.append(action)
+                continue
+            if pipeline:
+                groups.append(pipeline)
+                pipeline = []
+            groups.append([action])
+        if pipeline:
+            groups.append(pipeline)
+        return groups
+
+    def run_pipeline(self, actions):
+        """Run `actions' as a pipeline.
+
+        Rather than running each action to completion before starting
+        the next, every item from query_pipeline_items() moves on to the
+        next action as soon as the last one is done with it.  For each
+        action, ACTION_item(*item) is called on its own thread(s) (see
+        query_pipeline_workers()); it returns None for success, or a
+        failure message, in which case the item is passed to
+        pipeline_item_failed() and goes no further.
+
+        The action listeners and preflight_ACTION()/postflight_ACTION()
+        methods are run as usual, but ACTION() isn't; setup that it does
+        belongs in preflight_ACTION().
+        """
+        set_log_context(action=",".join(actions))
+        for action in actions:
+            self.action_message("Running %s step (pipelined with %s)." %
+                                (action, ", ".join(actions)))
+            self._run_pre_action_listeners(action)
 
-            if not post_success:
-                self.fatal("Aborting due to failure in post-action listener.")
+        success = False
+        try:
+            for action in actions:
+                self._possibly_run_method("preflight_%s" % action.replace("-", "_"))
+
+            def on_result(action, item, result):
+                if result:
+                    self.pipeline_item_failed(action, item, result)
+
+            def on_exception(action, item):
+                self.exception("Uncaught exception in %s for %s" %
+                               (action, str(item)))
+
+            def in_action(action, function):
+                def call(*item):
+                    with log_context(action=action):
+                        return function(*item)
+                return call
+
+            stages = []
+            for action in actions:
+                function = getattr(self, "%s_item" % action.replace("-", "_"))
+                stages.append((action, in_action(action, function),
+                               self.query_pipeline_workers(action)))
+            pipeline = Pipeline(stages,
+                                queue_size=self.config.get('pipeline_queue_size', 2),
+                                on_result=on_result, on_exception=on_exception)
+            items = self.query_pipeline_items()
+            self.info("Pipelining %d items through %s." %
+                      (len(items), ", ".join(actions)))
+            exit_code = pipeline.run(items)
+            for action in actions:
+                self.summarize_pipeline_action(action, *pipeline.query_counts(action))
+            if exit_code is not None:
+                self.fatal("Pipeline exited; stopping.", exit_code=exit_code)
+
+            for action in actions:
+                self._possibly_run_method("postflight_%s" % action.replace("-", "_"))
+            success = True
+        finally:
+            for action in actions:
+                self._run_post_action_listeners(action, success)
+            set_log_context(action=None)
 
     def run(self):
         """Default run method.
@@ -1129,6 +1683,9 @@ class BaseScript(ScriptMixin, LogMixin, object):
 
         Postflight is quick testing for success after an action.
 
+        With config['pipeline'], runs of actions that can be pipelined
+        are run by run_pipeline() instead; see query_action_groups().
+
         """
         for fn in self._listeners['pre_run']:
             try:
@@ -1151,8 +1708,11 @@ class BaseScript(ScriptMixin, LogMixin, object):
 
         self.dump_config()
         try:
-            for action in self.all_actions:
-                self.run_action(action)
+            for actions in self.query_action_groups():
+                if len(actions) > 1:
+                    self.run_pipeline(actions)
+                else:
+                    self.run_action(actions[0])
         except Exception:
             self.fatal("Uncaught exception: %s" % traceback.format_exc())
         finally:
@@ -1169,6 +1729,7 @@ class BaseScript(ScriptMixin, LogMixin, object):
 
             if not post_success:
                 self.fatal("Aborting due to failure in post-run listener.")
+        self.wait_for_deletions()
         if self.config.get("copy_logs_post_run", True):
             self.copy_logs_to_upload_dir()
 
@@ -1183,7 +1744,8 @@ class BaseScript(ScriptMixin, LogMixin, object):
         Delete the working directory
         """
         dirs = self.query_abs_dirs()
-        self.rmtree(dirs['abs_work_dir'], error_level=FATAL)
+        self.rmtree(dirs['abs_work_dir'], error_level=FATAL,
+                    background=self.config.get('background_delete', True))
 
     def query_abs_dirs(self):
         """We want to be able to determine where all the important things
@@ -1237,12 +1799,16 @@ class BaseScript(ScriptMixin, LogMixin, object):
         log_type = self.config.get("log_type", "multi")
         if log_type == "multi":
             log_config['logger_name'] = 'Multi'
+        elif log_type == "json":
+            log_config['logger_name'] = 'JSONLines'
         for key in log_config.keys():
             value = self.config.get(key, None)
             if value is not None:
                 log_config[key] = value
         if log_type == "multi":
             self.log_obj = MultiFileLogger(**log_config)
+        elif log_type == "json":
+            self.log_obj = JSONLinesLogger(**log_config)
         else:
             self.log_obj = SimpleFileLogger(**log_config)
 
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""The benchmark corpus for cssfixer_bench.py, and its statistics.
+
+The corpus is generated, so it stays the same from run to run without
+megabytes of third party CSS in the tree: generate_stylesheet() strings
+together rules shaped like those of WebKit era frameworks (bootstrap
+2, jQuery Mobile), heavy on -webkit-gradient(), old flexbox, vendor
+prefixed transitions and media queries.  Real stylesheets can be added
+to a run with --css-path.
+"""
+
+import random
+
+# (name, seed, size in bytes).  "bootstrap" is the size of bootstrap
+# 2.3.2's bootstrap.css.
+BENCH_CORPUS = [
+    ('bootstrap', 1, 127 * 1024),
+    ('large', 2, 512 * 1024),
+    ('huge', 3, 2 * 1024 * 1024),
+]
+
+PHASES = ('parse', 'fixup', 'compile', 'sourcemap')
+
+_COMPONENTS = ('btn', 'navbar', 'nav', 'dropdown', 'modal', 'alert',
+               'progress', 'carousel', 'tooltip', 'popover', 'ui-bar',
+               'ui-btn', 'ui-listview', 'ui-header', 'thumbnail', 'well')
+_VARIANTS = ('', '-primary', '-info', '-success', '-warning', '-danger',
+             '-inverse', '-active', '-inner', '-a', '-b')
+_ELEMENTS = ('a', 'li', 'span', 'div', 'input', 'img', 'ul > li',
+             'li > a', '.caret', '.icon-white')
+_PSEUDOS = ('', ':hover', ':focus', ':active', '.disabled', '[disabled]',
+            ':before', ':after', ':first-child')
+_COLORS = ('#fff', '#000', '#0088cc', '#0044cc', '#e6e6e6', '#f5f5f5',
+           '#5bb75b', '#51a351', '#da4f49', '#bd362f', '#faa732',
+           'rgba(0, 0, 0, 0.15)', 'rgba(255, 255, 255, 0.2)', 'transparent')
+_MEDIA = ('(max-width: 767px)', '(min-width: 768px) and (max-width: 979px)',
+          '(min-width: 1200px)', 'print', 'screen and (-webkit-min-device-pixel-ratio: 2)')
+
+
+def _selector(r):
+    selectors = []
+    for _ in range(r.choice((1, 1, 1, 2, 3))):
+        selector = '.%s%s' % (r.choice(_COMPONENTS), r.choice(_VARIANTS))
+        if r.random() < 0.5:
+            selector += ' %s' % r.choice(_ELEMENTS)
+        selectors.append(selector + r.choice(_PSEUDOS))
+    return ',\n'.join(selectors)
+
+
+def _gradient_declarations(r):
+    start, end = r.choice(_COLORS), r.choice(_COLORS)
+    declarations = ['background-color: %s' % r.choice(_COLORS)]
+    if r.random() < 0.3 and start.startswith('#'):
+        # the fallback colour in the same declaration; an rgba() one
+        # makes createFixupGradientDeclaration() throw
+        declarations.append(
+            'background: %s -webkit-gradient(linear, 0 0, 0 100%%, from(%s), '
+            'to(%s)) repeat-x' % (start, start, end))
+    else:
+        declarations.append(
+            'background-image: -webkit-gradient(linear, 0 0, 0 100%%, '
+            'from(%s), color-stop(%d%%, %s), to(%s))' %
+            (start, r.randint(1, 99), r.choice(_COLORS), end))
+    for prefix in ('-webkit-', '-moz-', '-o-', ''):
+        declarations.append('background-image: %slinear-gradient(top, %s, %s)' %
+                            (prefix, start, end))
+    declarations.append("filter: progid:DXImageTransform.Microsoft.gradient("
+                        "startColorstr='%s', endColorstr='%s', GradientType=0)" %
+                        (start, end))
+    return declarations
+
+
+def _flexbox_declarations(r):
+    return [
+        'display: -webkit-box',
+        '-webkit-box-orient: %s' % r.choice(('horizontal', 'vertical')),
+        '-webkit-box-direction: %s' % r.choice(('normal', 'reverse')),
+        '-webkit-box-pack: %s' % r.choice(('start', 'end', 'center', 'justify')),
+        '-webkit-box-align: %s' % r.choice(('start', 'end', 'center', 'stretch')),
+        '-webkit-box-flex: %d' % r.randint(0, 3),
+    ]
+
+
+def _prefixed_declarations(r):
+    prop, value = r.choice((
+        ('border-radius', '%dpx' % r.randint(2, 8)),
+        ('box-shadow', 'inset 0 1px 0 %s, 0 1px 2px %s' %
+         (r.choice(_COLORS), r.choice(_COLORS))),
+        ('transition', 'opacity .%ds linear' % r.randint(1, 9)),
+        ('transform', 'translate(0, -%d%%)' % r.randint(1, 50)),
+        ('box-sizing', 'border-box'),
+        ('user-select', 'none'),
+    ))
+    return ['%s%s: %s' % (prefix, prop, value)
+            for prefix in ('-webkit-', '-moz-', '')]
+
+
+def _plain_declarations(r):
+    return [r.choice((
+        'color: %s' % r.choice(_COLORS),
+        'padding: %dpx %dpx' % (r.randint(0, 20), r.randint(0, 20)),
+        'margin: 0',
+        'font-size: %dpx' % r.randint(10, 24),
+        'line-height: %dpx' % r.randint(14, 30),
+        'text-shadow: 0 -1px 0 rgba(0, 0, 0, 0.25)',
+        '*zoom: 1',
+        'display: block',
+        "background-image: url('../img/glyphicons-halflings.png')",
+    )) for _ in range(r.randint(1, 6))]
+
+
+def _rule(r, indent=''):
+    declarations = _plain_declarations(r)
+    kind = r.random()
+    if kind < 0.2:
+        declarations += _gradient_declarations(r)
+    elif kind < 0.3:
+        declarations += _flexbox_declarations(r)
+    elif kind < 0.6:
+        declarations += _prefixed_declarations(r)
+    lines = ['%s%s {' % (indent, _selector(r).replace('\n', '\n' + indent))]
+    lines += ['%s  %s;' % (indent, d) for d in declarations]
+    lines.append('%s}' % indent)
+    return '\n'.join(lines)
+
+
+def _node(r):
+    kind = r.random()
+    if kind < 0.08:
+        return '@media %s {\n%s\n}' % (r.choice(_MEDIA), '\n'.join(
+            [_rule(r, '  ') for _ in range(r.randint(1, 5))]))
+    if kind < 0.1:
+        name = 'progress-bar-stripes-%d' % r.randint(0, 1000)
+        return '\n'.join([
+            '@%skeyframes %s {' % (prefix, name) +
+            '\n  from {\n    background-position: 40px 0;\n  }'
+            '\n  to {\n    background-position: 0 0;\n  }\n}'
+            for prefix in ('-webkit-', '-moz-', '')])
+    if kind < 0.13:
+        return '/* %s\n   ========================================== */' % \
+            r.choice(_COMPONENTS)
+    return _rule(r)
+
+
+def generate_stylesheet(seed, size):
+    """A stylesheet of about `size' bytes; the same one for a given
+    seed and size.
+    """
+    r = random.Random(seed)
+    nodes = []
+    length = 0
+    while length < size:
+        node = _node(r)
+        nodes.append(node)
+        length += len(node) + 1
+    return '\n'.join(nodes) + '\n'
+
+
+def median(values):
+    values = sorted(values)
+    if not values:
+        return None
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def summarize(results):
+    """Reduce the results of cssfixer_bench.js to
+    {name: {phase: (median ms, median heap bytes)}}.
+    """
+    summary = {}
+    for result in results:
+        summary[result['name']] = dict([
+            (phase, (median(times['ms']), median(times['heap_bytes'])))
+            for phase, times in result['phases'].items()])
+    return summary
+
+
+def find_regressions(summary, baseline, max_regression):
+    """Compare two summarize()d runs.  Returns (name, phase, ms,
+    baseline ms) for every phase that's more than `max_regression'
+    (a fraction, e.g. 0.1) slower than in `baseline'.
+    """
+    regressions = []
+    for name in sorted(summary):
+        if name not in baseline:
+            continue
+        for phase in sorted(summary[name]):
+            ms = summary[name][phase][0]
+            baseline_ms = baseline[name].get(phase, (None, None))[0]
+            if baseline_ms and ms > baseline_ms * (1 + max_regression):
+                regressions.append((name, phase, ms, baseline_ms))
+    return regressions
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Tree shaking for the browserify bundle in css-browserside.js.
+
+The bundle is a map of module id to [function(require, module,
+exports) {...}, {required name: module id}], run from its entry
+modules.  shake_bundle() keeps only the modules the entry modules can
+require, and replaces the ones named in `stubs' with a function that
+throws, so that e.g. css-stringify's source map support (the whole
+source-map library) and its compressing compiler don't have to be
+parsed and run every time the browser starts.
+"""
+
+from collections import OrderedDict
+import re
+try:
+    import simplejson as json
+    assert json
+except ImportError:
+    import json
+
+# The required names shake_bundle() stubs out by default: the fixer
+# only ever calls css.stringify() without options.
+DEFAULT_STUBS = {
+    './lib/compress': "css.stringify() with {compress: true}",
+    './lib/source-map-support': "css.stringify() with {sourcemap: true}",
+}
+
+_MODULE_RE = re.compile(r'(\d+):\[function\(require,module,exports\)\{')
+_DEPS_RE = re.compile(r'\},(\{[^{}]*\})\],$')
+_END_RE = re.compile(r'\},(\{[^{}]*\})\]\},\{\},\[([\d,]*)\]\)')
+_STUB = """
+  module.exports = function() {
+    throw new Error(%s);
+  };
+  """
+
+
+class BundleError(Exception):
+    pass
+
+
+def parse_bundle(text):
+    """Split the browserify bundle `text' into (prefix, modules,
+    entries, suffix), where modules is an OrderedDict of module id to
+    (source, raw dependencies JSON), in bundle order.
+    """
+    headers = list(_MODULE_RE.finditer(text))
+    if not headers:
+        raise BundleError("No browserify modules found")
+    ends = list(_END_RE.finditer(text, headers[-1].end()))
+    if not ends:
+        raise BundleError("Can't find the end of the browserify modules")
+    end = ends[-1]
+    modules = OrderedDict()
+    for header, next_header in zip(headers, headers[1:] + [None]):
+        if next_header is None:
+            source = text[header.end():end.start()]
+            deps = end.group(1)
+        else:
+            chunk = text[header.end():next_header.start()]
+            m = _DEPS_RE.search(chunk)
+            if not m:
+                raise BundleError("Can't find the dependencies of module %s" %
+                                  header.group(1))
+            source = chunk[:m.start()]
+            deps = m.group(1)
+        modules[int(header.group(1))] = (source, deps)
+    entries = [int(e) for e in end.group(2).split(',') if e]
+    return text[:headers[0].start()], modules, entries, text[end.end():]
+
+
+def format_bundle(prefix, modules, entries, suffix):
+    """The inverse of parse_bundle()."""
+    return '%s%s},{},[%s])%s' % (
+        prefix,
+        ','.join(['%d:[function(require,module,exports){%s},%s]' %
+                  (module_id, source, deps)
+                  for module_id, (source, deps) in modules.items()]),
+        ','.join([str(e) for e in entries]),
+        suffix)
+
+
+def shake_bundle(text, stubs=None):
+    """Return the bundle `text' with only the modules its entry modules
+    require, where requiring a name in `stubs' (default: DEFAULT_STUBS)
+    gives a function that throws instead.
+    """
+    if stubs is None:
+        stubs = DEFAULT_STUBS
+    prefix, modules, entries, suffix = parse_bundle(text)
+    used = set()
+    stubbed = {}
+    queue = list(entries)
+    while queue:
+        module_id = queue.pop()
+        if module_id in used:
+            continue
+        if module_id not in modules:
+            raise BundleError("Module %d isn't in the bundle" % module_id)
+        used.add(module_id)
+        for name, dep_id in json.loads(modules[module_id][1]).items():
+            if name in stubs:
+                stubbed[dep_id] = stubs[name]
+            else:
+                queue.append(dep_id)
+    shaken = OrderedDict()
+    for module_id, (source, deps) in modules.items():
+        if module_id in used:
+            shaken[module_id] = (source, deps)
+        elif module_id in stubbed:
+            message = "%s isn't in this build of css-browserside.js" % \
+                stubbed[module_id]
+            shaken[module_id] = (_STUB % json.dumps(message), '{}')
+    return format_bundle(prefix, shaken, entries, suffix)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""The content-addressed fixup cache, as used by bootstrap.fixupCache.
+
+Cache files are JSON: {"version": CACHE_VERSION, "entries": [[key,
+value], ...]}, least recently used first, where key is the SHA-1 of a
+stylesheet's bytes and value is fixup_css() of it.  Strings hold one
+byte per character, like the binary strings browser.js works with.
+"""
+
+from collections import OrderedDict
+import hashlib
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from mozharness.mozilla.cssfixer.fixup import fixup_css
+
+# Must match bootstrap.fixupCache.VERSION.
+CACHE_VERSION = 1
+
+
+def cache_key(css):
+    """The cache key for the stylesheet `css', a byte string."""
+    return hashlib.sha1(css).hexdigest()
+
+
+class FixupCache(object):
+    """An LRU cache of fixed up stylesheets, bounded to roughly
+    `max_bytes' of keys and values, if given.
+    """
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        """Returns the cached value for `key', or None."""
+        value = self.entries.pop(key, None)
+        if value is not None:
+            self.entries[key] = value
+        return value
+
+    def put(self, key, value):
+        """Add `value' as the most recently used entry, evicting the
+        least recently used ones if the cache is too big.
+
+        Returns False if `value' alone is too big to cache.
+        """
+        old_value = self.entries.pop(key, None)
+        if old_value is not None:
+            self.size -= len(key) + len(old_value)
+        entry_size = len(key) + len(value)
+        if self.max_bytes is not None and entry_size > self.max_bytes:
+            return False
+        self.entries[key] = value
+        self.size += entry_size
+        while self.max_bytes is not None and self.size > self.max_bytes:
+            old_key, old_value = self.entries.popitem(last=False)
+            self.size -= len(old_key) + len(old_value)
+        return True
+
+    def fixup(self, css):
+        """fixup_css(css), from the cache if possible."""
+        key = cache_key(css)
+        value = self.get(key)
+        if value is None:
+            value = fixup_css(css)
+            self.put(key, value)
+        return value
+
+    def dumps(self):
+        return json.dumps({
+            'version': CACHE_VERSION,
+            'entries': [[key, value.decode('latin-1')]
+                        for key, value in self.entries.items()],
+        }, separators=(',', ':'))
+
+    def loads(self, s):
+        """Add the entries of the cache file contents `s'; does nothing
+        if it's from another CACHE_VERSION.
+        """
+        data = json.loads(s)
+        if data.get('version') != CACHE_VERSION:
+            return
+        for key, value in data['entries']:
+            self.put(str(key), value.encode('latin-1'))
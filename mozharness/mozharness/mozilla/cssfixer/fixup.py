@@ -0,0 +1,633 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Port of bootstrap.createFixupRulesFromCSSFileContent().
+
+fixup_css() rewrites a stylesheet the way browser.js's TracingListener
+does on the phone: -webkit- properties and values are unprefixed, old
+flexbox and -webkit-gradient() syntax is translated, and background
+fallback colours are split out.  It reproduces the JS output exactly,
+quirks included; test_mozilla_cssfixer.py checks that against node.
+
+Known differences: property values named after Object.prototype members
+(e.g. "box-align: constructor") aren't special-cased, and astral
+characters in unicode input count as one character rather than two.
+Neither can happen with byte strings, which is what the phone sees.
+"""
+
+import re
+
+from mozharness.mozilla.cssfixer.jsutil import S, S_CHARS, DOT, END, \
+    UNDEFINED, JSError, number_to_string, parse_float, parse_int, substr, \
+    to_number, to_string, trim
+from mozharness.mozilla.cssfixer.parse import parse, CSSParseError
+from mozharness.mozilla.cssfixer.stringify import stringify
+
+# bootstrap.allW3CSSProperties
+ALL_W3C_CSS_PROPERTIES = [
+    "align-content", "align-items", "align-self", "alignment-adjust",
+    "alignment-baseline", "all", "anchor-point", "animation", "animation-delay",
+    "animation-direction", "animation-duration", "animation-fill-mode",
+    "animation-iteration-count", "animation-name", "animation-play-state",
+    "animation-timing-function", "appearance", "azimuth", "backface-visibility",
+    "background", "background-attachment", "background-clip", "background-color",
+    "background-image", "background-origin", "background-position",
+    "background-repeat", "background-size", "baseline-shift", "binding", "bleed",
+    "bookmark-label", "bookmark-level", "bookmark-state", "bookmark-target",
+    "border", "border-bottom", "border-bottom-color", "border-bottom-left-radius",
+    "border-bottom-right-radius", "border-bottom-style", "border-bottom-width",
+    "border-collapse", "border-color", "border-image", "border-image-outset",
+    "border-image-repeat", "border-image-slice", "border-image-source",
+    "border-image-width", "border-left", "border-left-color", "border-left-style",
+    "border-left-width", "border-radius", "border-right", "border-right-color",
+    "border-right-style", "border-right-width", "border-spacing", "border-style",
+    "border-top", "border-top-color", "border-top-left-radius",
+    "border-top-right-radius", "border-top-style", "border-top-width",
+    "border-width", "bottom", "box-decoration-break", "box-shadow", "box-sizing",
+    "break-after", "break-before", "break-inside", "caption-side", "chains",
+    "clear", "clip", "clip-path", "clip-rule", "color",
+    "color-interpolation-filters", "color-profile", "column-count", "column-fill",
+    "column-gap", "column-rule", "column-rule-color", "column-rule-style",
+    "column-rule-width", "column-span", "column-width", "columns", "contain",
+    "content", "counter-increment", "counter-reset", "crop", "cue", "cue-after",
+    "cue-before", "cursor", "direction", "display", "dominant-baseline",
+    "drop-initial-after-adjust", "drop-initial-after-align",
+    "drop-initial-before-adjust", "drop-initial-before-align",
+    "drop-initial-size", "drop-initial-value", "elevation", "empty-cells",
+    "filter", "flex", "flex-basis", "flex-direction", "flex-flow", "flex-grow",
+    "flex-shrink", "flex-wrap", "float", "float-offset", "flood-color",
+    "flood-opacity", "flow-from", "flow-into", "font", "font-family",
+    "font-feature-settings", "font-kerning", "font-language-override",
+    "font-size", "font-size-adjust", "font-stretch", "font-style",
+    "font-synthesis", "font-variant", "font-variant-alternates",
+    "font-variant-caps", "font-variant-east-asian", "font-variant-ligatures",
+    "font-variant-numeric", "font-variant-position", "font-weight", "grid",
+    "grid-area", "grid-auto-columns", "grid-auto-flow", "grid-auto-position",
+    "grid-auto-rows", "grid-column", "grid-column-end", "grid-column-start",
+    "grid-row", "grid-row-end", "grid-row-start", "grid-template",
+    "grid-template-areas", "grid-template-columns", "grid-template-rows",
+    "hanging-punctuation", "height", "hyphens", "icon", "image-orientation",
+    "image-resolution", "ime-mode", "inline-box-align", "justify-content",
+    "justify-items", "justify-self", "left", "letter-spacing", "lighting-color",
+    "line-break", "line-height", "line-stacking", "line-stacking-ruby",
+    "line-stacking-shift", "line-stacking-strategy", "list-style",
+    "list-style-image", "list-style-position", "list-style-type", "margin",
+    "margin-bottom", "margin-left", "margin-right", "margin-top",
+    "marker-offset", "marks", "mask", "mask-box", "mask-box-outset",
+    "mask-box-repeat", "mask-box-slice", "mask-box-source", "mask-box-width",
+    "mask-clip", "mask-image", "mask-origin", "mask-position", "mask-repeat",
+    "mask-size", "mask-source-type", "mask-type", "max-height", "max-lines",
+    "max-width", "min-height", "min-width", "move-to", "nav-down", "nav-index",
+    "nav-left", "nav-right", "nav-up", "object-fit", "object-position",
+    "opacity", "order", "orphans", "outline", "outline-color", "outline-offset",
+    "outline-style", "outline-width", "overflow", "overflow-wrap", "overflow-x",
+    "overflow-y", "padding", "padding-bottom", "padding-left", "padding-right",
+    "padding-top", "page", "page-break-after", "page-break-before",
+    "page-break-inside", "page-policy", "pause", "pause-after", "pause-before",
+    "perspective", "perspective-origin", "pitch", "pitch-range", "play-during",
+    "position", "presentation-level", "quotes", "region-fragment",
+    "rendering-intent", "resize", "rest", "rest-after", "rest-before",
+    "richness", "right", "rotation", "rotation-point", "ruby-align",
+    "ruby-overhang", "ruby-position", "ruby-span", "shape-image-threshold",
+    "shape-outside", "shape-margin", "size", "speak", "speak-as",
+    "speak-header", "speak-numeral", "speak-punctuation", "speech-rate",
+    "stress", "string-set", "tab-size", "table-layout", "target", "target-name",
+    "target-new", "target-position", "text-align", "text-align-last",
+    "text-combine-horizontal", "text-decoration", "text-decoration-color",
+    "text-decoration-line", "text-decoration-skip", "text-decoration-style",
+    "text-emphasis", "text-emphasis-color", "text-emphasis-position",
+    "text-emphasis-style", "text-height", "text-indent", "text-justify",
+    "text-orientation", "text-outline", "text-overflow", "text-shadow",
+    "text-space-collapse", "text-transform", "text-underline-position",
+    "text-wrap", "top", "transform", "transform-origin", "transform-style",
+    "transition", "transition-delay", "transition-duration",
+    "transition-property", "transition-timing-function", "unicode-bidi",
+    "vertical-align", "visibility", "voice-balance", "voice-duration",
+    "voice-family", "voice-pitch", "voice-range", "voice-rate", "voice-stress",
+    "voice-volume", "volume", "white-space", "widows", "width", "word-break",
+    "word-spacing", "word-wrap", "wrap-flow", "wrap-through", "writing-mode",
+    "z-index",
+]
+
+_W3C_PROPERTIES = frozenset(ALL_W3C_CSS_PROPERTIES)
+
+# createFixupFlexboxDeclaration()'s mappings.
+FLEXBOX_MAPPINGS = {
+    'display': {
+        'valueMap': {
+            'box': 'inline-flex',
+            'flexbox': 'flex',
+            'inline-box': 'inline-flex',
+            'inline-flexbox': 'inline-flex',
+        },
+    },
+    'box-align': {
+        'newName': 'align-items',
+        'valueMap': {
+            'start': 'flex-start',
+            'end': 'flex-end',
+        },
+    },
+    'flex-direction': {
+        'valueMap': {
+            'lr': 'row',
+            'rl': 'row-reverse',
+            'tb': 'column',
+            'bt': 'column-reverse',
+        },
+    },
+    'box-pack': {
+        'newName': 'justify-content',
+        'valueMap': {
+            'start': 'flex-start',
+            'end': 'flex-end',
+            'justify': 'space-between',
+        },
+    },
+    'box-ordinal-group': {
+        'newName': 'order',
+        'valueMap': {},
+    },
+    'box-flex': {
+        'newName': 'flex',
+        'valueMap': {},
+    },
+}
+FLEXBOX_MAPPINGS['flex-align'] = FLEXBOX_MAPPINGS['box-align']  # 2009 => 2011
+FLEXBOX_MAPPINGS['flex-order'] = FLEXBOX_MAPPINGS['box-ordinal-group']  # 2009 => 2011
+
+
+def _re(pattern, flags=0):
+    return re.compile(pattern % {'s': S, 'dot': DOT, 'end': END}, flags)
+
+_BACKGROUND_URL_RE = _re(u'(url\\((%(dot)s*)%(s)s*)-webkit-')
+_BACKGROUND_COLOR_RE = _re(u'(#\\w{3,6})%(s)s*-webkit-')
+_WEBKIT_GRADIENT_RE = _re(u'-webkit-gradient', re.I)
+_OLD_GRADIENT_RE = _re(u'-webkit-gradient%(s)s*\\(%(s)s*(linear|radial)%(s)s*(%(dot)s*)\\)(%(dot)s*)')
+_SPACES_RE = _re(u'%(s)s+')
+_TRAILING_NUMBER_RE = _re(u'(\\d+)%(end)s')
+_NUMBER_SPACE_RE = _re(u'(\\d+) ')
+_DEG_RE = _re(u'\\d+deg')
+_FUNCTION_NAME_RE = _re(u'\\b(\\w+)\\(')
+_HTML_COMMENT_START_RE = _re(u'^%(s)s*<!--')
+_HTML_COMMENT_END_RE = _re(u'-->%(s)s*%(end)s')
+
+
+def _new_declaration(prop, value):
+    return {'type': 'declaration', 'property': prop, 'value': value,
+            '_fxjsdefined': True}
+
+
+def _get(obj, name):
+    """obj.name, for the gradient parser's objects."""
+    if obj is UNDEFINED:
+        raise JSError("Cannot read properties of undefined (reading '%s')" % name)
+    return getattr(obj, name, UNDEFINED)
+
+
+def _index(array, i):
+    """array[i]"""
+    if array is UNDEFINED:
+        raise JSError("Cannot read properties of undefined (reading '%s')" % to_string(i))
+    if isinstance(array, list) and isinstance(i, (int, long)) and 0 <= i < len(array):
+        return array[i]
+    return UNDEFINED
+
+
+def _string(value, method):
+    """Check that `value' is a string before calling one of its methods."""
+    if not isinstance(value, basestring):
+        raise JSError("Cannot read properties of %s (reading '%s')" %
+                      (to_string(value), method))
+    return value
+
+
+def _string_or_array(value):
+    """For reading .length."""
+    if value is UNDEFINED:
+        raise JSError("Cannot read properties of undefined (reading 'length')")
+    return value
+
+
+def _sub_first(regex, replacement, s):
+    """s.replace(regex, replacement) for a non-global regex."""
+    return regex.sub(replacement, s, 1)
+
+
+# Helpers {{{1
+def strip_html_comments(s):
+    s = _sub_first(_HTML_COMMENT_START_RE, u'', s)
+    s = _sub_first(_HTML_COMMENT_END_RE, u'', s)
+    return s
+
+
+def trim_space_and_punc(s):
+    spec = u' ,;'
+    start = 0
+    stop = len(s) - 1
+    while len(s) > start and s[start] in spec:
+        start += 1
+    while stop >= 0 and s[stop] in spec:
+        stop -= 1
+    if start <= stop:
+        return s[start:stop + 1]
+    return u''
+
+
+def get_value_for_property(declarations, prop, prefix_agnostic):
+    for decl in declarations:
+        decl_prop = decl.get('property', UNDEFINED)
+        if decl_prop == prop or \
+                (prefix_agnostic and substr(decl_prop, 8) == prop):
+            return decl.get('value', UNDEFINED)
+    return UNDEFINED
+
+
+def has_declaration(declarations, prop, value, prefix_agnostic,
+                    check_function_name_only):
+    rx = None
+    if check_function_name_only and u'(' in value:
+        m = _FUNCTION_NAME_RE.search(value)
+        if m is None:
+            raise JSError("Cannot read properties of null (reading '1')")
+        value = m.group(1)
+        rx = re.compile(u'[%s:,]%s\\(' % (S_CHARS, value), re.I)
+    for decl in declarations:
+        decl_prop = decl.get('property', UNDEFINED)
+        if decl_prop == prop or \
+                (prefix_agnostic and substr(decl_prop, 8) == prop):
+            decl_value = decl.get('value', UNDEFINED)
+            if decl_value == value and decl_value is not UNDEFINED:
+                return True
+            if rx is not None and rx.search(to_string(decl_value)):
+                return True
+    return False
+
+
+def _pop(array):
+    """array.pop()"""
+    if array:
+        return array.pop()
+    return UNDEFINED
+
+
+class _GradientNode(object):
+    """A {} in oldGradientParser()'s output."""
+    pass
+
+
+class _GradientArray(list):
+    """A [] in oldGradientParser()'s output; like any JS array, it can
+    also be given properties.
+    """
+    pass
+
+
+def old_gradient_parser(s):
+    """Parse a legacy -webkit-gradient() call into a tree of names and
+    arguments: [{name: '-webkit-gradient', args: [{name: 'linear'}, ...]}]
+    """
+    objs = _GradientArray([_GradientNode()])
+    current = objs[0]
+    path = [objs]
+    word = []
+    for ch in s:
+        if ch not in u',()':
+            word.append(ch)
+            continue
+        # now we have a "separator" - presumably we've also got a "word" or value
+        if current is UNDEFINED:
+            raise JSError("Cannot set properties of undefined (setting 'name')")
+        current.name = trim(u''.join(word))
+        word = []
+        if ch == u'(':
+            if not hasattr(current, 'args'):
+                current.args = _GradientArray()
+            current.args.append(_GradientNode())
+            path.append(current.args)
+            current = current.args[-1]
+            path.append(current)
+        elif ch == u')':
+            _pop(path)  # drop 'current'
+            current = _pop(path)  # drop 'args' reference
+        else:
+            _pop(path)  # remove 'current' object from path
+            if path:
+                current_parent = path[-1]
+            else:
+                current_parent = objs
+            if not isinstance(current_parent, list):
+                raise JSError("current_parent.push is not a function")
+            current_parent.append(_GradientNode())
+            current = current_parent[-1]
+            path.append(current)
+    return objs
+
+
+def color_value(obj):
+    return u', '.join([
+        name is not UNDEFINED and to_string(name) or u''
+        for name in [_get(o, 'name') for o in obj]])
+
+
+# Fixups {{{1
+def create_fixup_flexbox_declaration(decl, parent):
+    propname = decl['property']
+    value = decl['value']
+    # remove -webkit- prefixing from names, values
+    if propname.startswith(u'-webkit-'):
+        propname = propname[8:]
+    if value.startswith(u'-webkit-'):
+        value = value[8:]
+
+    if propname in FLEXBOX_MAPPINGS:
+        mapping = FLEXBOX_MAPPINGS[propname]
+        if value in mapping['valueMap']:
+            value = mapping['valueMap'][value]
+        propname = mapping.get('newName') or propname
+    # box-flex:0 maps to 'none', other values need 'auto' appended
+    if propname == u'flex':
+        if to_number(decl['value']) == 0:
+            value = u'none'
+        else:
+            value = decl['value'] + u' auto'
+    # box-direction, box-orient turn into flex-direction
+    if propname in (u'box-direction', u'box-orient'):
+        if propname == u'box-direction':
+            direction = value
+            orient = get_value_for_property(parent, u'box-orient', True)
+        else:
+            orient = value
+            direction = get_value_for_property(parent, u'box-direction', True)
+        if orient == u'vertical':
+            value = u'column'
+        else:
+            value = u'row'
+        if direction == u'reverse':
+            value += u'-reverse'
+        propname = u'flex-direction'
+    return _new_declaration(propname, value)
+
+
+def create_fixup_gradient_declaration(decl, parent):
+    value = decl['value']
+    new_value = u''
+    prop = decl['property'].replace(u'-webkit-', u'', 1)
+    m = _OLD_GRADIENT_RE.search(value)
+    if m:
+        # These are function-scoped vars in the JS, so they carry over
+        # from one stop, or one gradient, to the next.
+        to_color = UNDEFINED
+        position = UNDEFINED
+        color_index = UNDEFINED
+        parts = old_gradient_parser(value)
+        for i, part in enumerate(parts):
+            grad_type = u''
+            args = _get(part, 'args')
+            if _get(part, 'name') == u'-webkit-gradient':
+                grad_type = _get(_index(args, 0), 'name')
+                new_value += to_string(grad_type) + u'-gradient('
+            stops = []
+            if grad_type == u'linear':
+                # linear gradient, args 1 and 2 tend to be start/end keywords
+                points = _SPACES_RE.split(_string(_get(_index(args, 1), 'name'), 'split')) + \
+                    _SPACES_RE.split(_string(_get(_index(args, 2), 'name'), 'split'))
+                point = lambda n: n < len(points) and points[n] or UNDEFINED
+                if point(1) == point(3):
+                    new_value += u'to ' + to_string(point(2))
+                elif point(0) == point(2):
+                    new_value += u'to ' + to_string(point(3))
+                elif point(1) == u'top':
+                    new_value += u'135deg'
+                else:
+                    new_value += u'45deg'
+            else:
+                radius = _string(_get(_index(args, 4), 'name'), 'replace')
+                center = _string(_get(_index(args, 1), 'name'), 'replace')
+                new_value += u'circle ' + \
+                    _sub_first(_TRAILING_NUMBER_RE, u'\\1px', radius) + u' at ' + \
+                    _sub_first(_TRAILING_NUMBER_RE, u'\\1px',
+                               _sub_first(_NUMBER_SPACE_RE, u'\\1px ', center))
+
+            j = grad_type == u'linear' and 3 or 5
+            while j < len(_string_or_array(args)):
+                arg = _index(args, j)
+                arg_name = _get(arg, 'name')
+                if arg_name == u'color-stop':
+                    position = _get(_index(_get(arg, 'args'), 0), 'name')
+                    color_index = 1
+                elif arg_name == u'to':
+                    position = u'100%'
+                    color_index = 0
+                elif arg_name == u'from':
+                    position = u'0%'
+                    color_index = 0
+                if u'%' not in _string(position, 'indexOf'):
+                    # original Safari syntax had 0.5 equivalent to 50%
+                    position = number_to_string(parse_float(position) * 100) + u'%'
+                color_arg = _index(_get(arg, 'args'), color_index)
+                color = _get(color_arg, 'name')
+                if _get(color_arg, 'args') is not UNDEFINED:
+                    # the color is itself a function call, like rgb()
+                    color = to_string(color) + u'(' + color_value(_get(color_arg, 'args')) + u')'
+                if arg_name == u'from':
+                    stops.insert(0, to_string(color) + u' ' + position)
+                elif arg_name == u'to':
+                    to_color = color
+                else:
+                    stops.append(to_string(color) + u' ' + position)
+                j += 1
+
+            for stop in stops:
+                new_value += u', ' + stop
+            if to_color:
+                new_value += u', ' + to_string(to_color) + u' 100%'
+            new_value += u')'
+            if i < len(parts) - 1:
+                new_value += u', '
+        # what's after the gradient (e.g. no-repeat) needs to be included
+        if m.group(3) and trim(m.group(3)) != u',':
+            new_value += u' ' + m.group(3)
+    else:
+        # Only the last of the JS's three replace()s counts, as each
+        # starts again from the original value.
+        new_value = _sub_first(
+            _DEG_RE,
+            lambda deg: number_to_string(parse_int(deg.group(0)) - 90) + u'deg',
+            value)
+    return _new_declaration(prop, new_value)
+
+
+# (background, display, flexbox, unprefixed) for each property name
+# _insert_fixup_declarations() has seen; see _fixup_dispatch().
+_FIXUP_DISPATCH = {}
+_MAX_FIXUP_DISPATCH = 4096
+
+
+def _fixup_dispatch(decl_prop):
+    """What _insert_fixup_declarations() does with a declaration of
+    property `decl_prop', worked out once per property name.
+    """
+    prop_string = to_string(decl_prop)
+    dispatch = _FIXUP_DISPATCH.get(prop_string)
+    if dispatch is None:
+        if len(_FIXUP_DISPATCH) >= _MAX_FIXUP_DISPATCH:
+            _FIXUP_DISPATCH.clear()
+        dispatch = _FIXUP_DISPATCH[prop_string] = (
+            decl_prop == u'background',
+            decl_prop == u'display',
+            u'box-' in prop_string or u'flex-' in prop_string,
+            u'-webkit-' in prop_string and substr(decl_prop, 8) or u'')
+    return dispatch
+
+
+def index_declarations(index, declarations):
+    """Add `declarations' to `index', a dict of property to its
+    declarations in order.  Comments have no property and are left out.
+    """
+    for decl in declarations:
+        prop = decl.get('property', UNDEFINED)
+        if isinstance(prop, basestring):
+            index.setdefault(prop, []).append(decl)
+    return index
+
+
+def _insert_fixup_declarations(rule):
+    if 'declarations' in rule:
+        declarations = rule['declarations']
+        fixup_declarations = []
+        # the fixup and rule declarations by property, in that order, for
+        # has_declaration() and get_value_for_property()
+        fixup_index = {}
+        rule_index = index_declarations({}, declarations)
+
+        def declarations_for(prop):
+            return fixup_index.get(prop, []) + rule_index.get(prop, [])
+
+        def add_fixup_declaration(prop, value):
+            fixup = _new_declaration(prop, value)
+            fixup_declarations.append(fixup)
+            index_declarations(fixup_index, [fixup])
+
+        for decl in declarations:
+            prop = u''
+            value = u''
+            decl_prop = decl.get('property', UNDEFINED)
+            background, display, flexbox, unprefixed = _fixup_dispatch(decl_prop)
+            # sometimes sites include a background fallback colour but in
+            # the *same* declaration as -webkit-gradient.  Split it out.
+            if background:
+                m = _BACKGROUND_URL_RE.search(decl['value'])
+                if m:
+                    add_fixup_declaration(u'background', trim_space_and_punc(m.group(1)))
+                    decl['value'] = decl['value'][:m.start()] + u'-webkit-' + \
+                        decl['value'][m.end():]
+                m = _BACKGROUND_COLOR_RE.search(decl['value'])
+                if m:
+                    add_fixup_declaration(u'background', m.group(1))
+                    decl['value'] = decl['value'][:m.start()] + u'-webkit-' + \
+                        decl['value'][m.end():]
+            decl_value = decl.get('value', UNDEFINED)
+            value_string = to_string(decl_value)
+            if (display and value_string.endswith(u'box')) or flexbox:
+                tmp = create_fixup_flexbox_declaration(decl, declarations)
+                prop = tmp['property']
+                value = tmp['value']
+            elif _WEBKIT_GRADIENT_RE.search(value_string):
+                tmp = create_fixup_gradient_declaration(decl, declarations)
+                prop = tmp['property']
+                value = tmp['value']
+            else:
+                prop = unprefixed
+                if u'-webkit-' in value_string:
+                    value = decl_value.replace(u'-webkit-', u'')
+            if not prop and not value:
+                add_fixup_declaration(decl_prop, decl_value)
+                continue
+            prop = prop or decl_prop
+            value = value or decl_value
+            # We follow the standards - better not to pseudo-standardise -webkit-something
+            if prop not in _W3C_PROPERTIES:
+                continue
+            if has_declaration(declarations_for(prop), prop, value, False, True):
+                continue
+            add_fixup_declaration(prop, value)
+            # per Gecko's reading of the spec, border-image will only
+            # appear if border-style or border-width is set..
+            if prop == u'border-image' and get_value_for_property(
+                    declarations_for(u'border-style'), u'border-style',
+                    False) is UNDEFINED:
+                add_fixup_declaration(u'border-style', u'solid')
+        if fixup_declarations:
+            rule['declarations'] = declarations + fixup_declarations
+    elif rule.get('rules'):
+        for subrule in rule['rules']:
+            _insert_fixup_declarations(subrule)
+
+
+def _clone_js_defined(rule):
+    clone = {}
+    for key, value in rule.items():
+        if isinstance(value, list) and key != 'selectors':
+            clone[key] = []
+        else:
+            clone[key] = value
+    if 'declarations' in rule:
+        for decl in rule['declarations']:
+            if decl.get('_fxjsdefined'):
+                clone['declarations'].append(decl)
+    if 'rules' in rule:
+        for subrule in rule['rules']:
+            subclone = _clone_js_defined(subrule)
+            if subclone.get('rules') or subclone.get('declarations'):
+                clone['rules'].append(subclone)
+    return clone
+
+
+def copy_js_defined_styles(sheet1, sheet2):
+    for rule in sheet1['stylesheet']['rules']:
+        clone = _clone_js_defined(rule)
+        if clone.get('declarations') or clone.get('rules'):
+            sheet2['stylesheet']['rules'].append(clone)
+
+
+# fixup_css {{{1
+def fixup_css(css):
+    """Return the stylesheet `css' as browser.js would pass it on to
+    Gecko: bootstrap.createFixupRulesFromCSSFileContent(css).
+
+    TracingListener reads the response as a binary string, so byte
+    strings are treated as latin-1 (e.g. byte 0xa0 is whitespace), and
+    the result is a byte string too.  Unicode in, unicode out.
+
+    If the stylesheet can't be parsed, it's returned unchanged.  Raises
+    JSError where the JS would throw.
+    """
+    if isinstance(css, str):
+        return fixup_css(css.decode('latin-1')).encode('latin-1')
+    try:
+        obj = parse(strip_html_comments(css))
+    except CSSParseError:
+        return css
+    return fixup_style_sheet(obj)
+
+
+def fixup_style_sheet(obj):
+    """The fixup rules for the parsed stylesheet `obj', as CSS text:
+    bootstrap.fixupStyleSheet(obj).  Changes obj.
+    """
+    return stringify(create_fixup_style_sheet(obj))
+
+
+def create_fixup_style_sheet(obj):
+    """bootstrap.createFixupStyleSheet(obj): fixup_style_sheet() before
+    stringify().
+    """
+    for rule in obj['stylesheet']['rules']:
+        _insert_fixup_declarations(rule)
+    fixup_style_sheet = {'type': 'stylesheet', 'stylesheet': {'rules': []}}
+    copy_js_defined_styles(obj, fixup_style_sheet)
+    return fixup_style_sheet
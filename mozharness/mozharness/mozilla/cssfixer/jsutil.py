@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""JavaScript semantics needed to port css-browserside.js and
+bootstrap.js faithfully.
+
+The regular expressions in the JS are translated with these building
+blocks rather than Python's own \\s, . and $, which match different
+characters.  Patterns must be compiled without re.UNICODE, so that \\w,
+\\d and \\b stay ASCII-only, as in JS.
+"""
+
+import math
+import re
+
+# JS \s: WhiteSpace and LineTerminator code points.
+JS_SPACE_CODE_POINTS = (0x09, 0x0a, 0x0b, 0x0c, 0x0d, 0x20, 0xa0, 0x1680) + \
+    tuple(range(0x2000, 0x200b)) + (0x2028, 0x2029, 0x202f, 0x205f, 0x3000, 0xfeff)
+JS_SPACE_CHARS = u''.join([unichr(c) for c in JS_SPACE_CODE_POINTS])
+# For use inside a character class.
+S_CHARS = re.escape(JS_SPACE_CHARS)
+S = u'[%s]' % S_CHARS
+# JS . (without the s flag).
+DOT = u'[^%s]' % re.escape(u''.join([unichr(c) for c in (0x0a, 0x0d, 0x2028, 0x2029)]))
+# JS $ (without the m flag) is the end of the input; Python's $ also
+# matches before a trailing newline.
+END = r'\Z'
+
+
+class Undefined(object):
+    """JS undefined."""
+    def __repr__(self):
+        return 'undefined'
+
+    def __nonzero__(self):
+        return False
+
+UNDEFINED = Undefined()
+
+
+class JSError(Exception):
+    """Raised where the JS would throw, typically a TypeError from
+    reading a property of undefined.
+    """
+    pass
+
+
+def to_string(value):
+    """String conversion, as done by JS concatenation."""
+    if value is UNDEFINED or value is None:
+        return u'undefined'
+    if isinstance(value, bool):
+        return value and u'true' or u'false'
+    if isinstance(value, (int, long, float)):
+        return number_to_string(value)
+    return value
+
+
+_TRIM_RE = re.compile(u'^%s+|%s+\\Z' % (S, S))
+
+
+def trim(s):
+    """String.prototype.trim()"""
+    return _TRIM_RE.sub(u'', s)
+
+
+def number_to_string(x):
+    """Number.prototype.toString(), following ES5 9.8.1."""
+    x = float(x)
+    if math.isnan(x):
+        return u'NaN'
+    if x == 0:
+        return u'0'
+    if math.isinf(x):
+        return x > 0 and u'Infinity' or u'-Infinity'
+    sign = x < 0 and u'-' or u''
+    # repr() gives the shortest string that round-trips, like JS.
+    r = repr(abs(x))
+    if 'e' in r:
+        mantissa, exponent = r.split('e')
+        exponent = int(exponent)
+    else:
+        mantissa, exponent = r, 0
+    if '.' in mantissa:
+        int_part, frac_part = mantissa.split('.')
+    else:
+        int_part, frac_part = mantissa, ''
+    digits = int_part + frac_part
+    stripped = digits.lstrip('0')
+    # The value is 0.<digits> * 10 ** n
+    n = len(int_part) + exponent - (len(digits) - len(stripped))
+    digits = stripped.rstrip('0')
+    k = len(digits)
+    if k <= n <= 21:
+        s = digits + '0' * (n - k)
+    elif 0 < n <= 21:
+        s = digits[:n] + '.' + digits[n:]
+    elif -6 < n <= 0:
+        s = '0.' + '0' * -n + digits
+    else:
+        e = n - 1
+        if e < 0:
+            e = '-%d' % -e
+        else:
+            e = '+%d' % e
+        if k == 1:
+            s = digits + 'e' + e
+        else:
+            s = digits[0] + '.' + digits[1:] + 'e' + e
+    return sign + unicode(s)
+
+
+_PARSE_FLOAT_RE = re.compile(
+    u'%s*([+-]?(?:Infinity|\\d+\\.?\\d*(?:[eE][+-]?\\d+)?|\\.\\d+(?:[eE][+-]?\\d+)?))' % S)
+
+
+def parse_float(s):
+    """parseFloat()"""
+    m = _PARSE_FLOAT_RE.match(to_string(s))
+    if not m:
+        return float('nan')
+    return float(m.group(1).replace('Infinity', 'inf'))
+
+
+_PARSE_INT_RE = re.compile(u'%s*([+-]?)(\\d+)' % S)
+
+
+def parse_int(s):
+    """parseInt() with the default radix, for decimal input."""
+    m = _PARSE_INT_RE.match(to_string(s))
+    if not m:
+        return float('nan')
+    value = float(long(m.group(2)))
+    if m.group(1) == '-':
+        value = -value
+    return value
+
+
+_NUMERIC_LITERAL_RE = re.compile(
+    r'(?:([+-]?)(Infinity|\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)'
+    r'|0[xX]([0-9a-fA-F]+)|0[oO]([0-7]+)|0[bB]([01]+))\Z')
+
+
+def to_number(s):
+    """ToNumber() of a string, as used by ==."""
+    s = trim(to_string(s))
+    if not s:
+        return 0.0
+    m = _NUMERIC_LITERAL_RE.match(s)
+    if not m:
+        return float('nan')
+    sign, decimal, hex_digits, oct_digits, bin_digits = m.groups()
+    if decimal is not None:
+        value = float(decimal.replace('Infinity', 'inf'))
+        if sign == '-':
+            value = -value
+        return value
+    if hex_digits is not None:
+        return float(long(hex_digits, 16))
+    if oct_digits is not None:
+        return float(long(oct_digits, 8))
+    return float(long(bin_digits, 2))
+
+
+def substr(s, start):
+    """String.prototype.substr(start) for start >= 0; reading it from
+    undefined throws.
+    """
+    if s is UNDEFINED or s is None:
+        raise JSError("Cannot read properties of undefined (reading 'substr')")
+    return s[start:]
@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Port of the css-parse module bundled in css-browserside.js.
+
+parse() returns the same AST as css.parse(), as dicts and lists, minus
+the optional position information.  It keeps the quirks of the
+original, e.g. parsing stops quietly at a stray top-level '}', and
+at-rules it doesn't know, like @font-face, are parsed as rules.
+
+The JS slices the consumed text off the front of the stylesheet after
+every match; here the patterns are matched at an index instead, which
+gives the same results in linear time.
+"""
+
+import re
+
+from mozharness.mozilla.cssfixer.jsutil import S, S_CHARS, DOT, trim
+
+
+class CSSParseError(Exception):
+    def __init__(self, msg, lineno, column):
+        Exception.__init__(self, '%s near line %d:%d' % (msg, lineno, column))
+        self.lineno = lineno
+        self.column = column
+
+
+def _re(pattern):
+    return re.compile(pattern % {'s': S, 's_chars': S_CHARS, 'dot': DOT})
+
+_OPEN_RE = _re(u'{%(s)s*')
+_CLOSE_RE = _re(u'}')
+_WHITESPACE_RE = _re(u'%(s)s*')
+_SELECTOR_RE = _re(u'([^{]+)')
+_SELECTOR_SPLIT_RE = _re(u'%(s)s*,%(s)s*')
+_PROPERTY_RE = _re(u'(\\*?[-#/*\\w]+(\\[[0-9a-z_-]+\\])?)%(s)s*')
+_COLON_RE = _re(u':%(s)s*')
+_VALUE_RE = _re(u'((?:\'(?:\\\\\'|%(dot)s)*?\'|"(?:\\\\"|%(dot)s)*?"|\\([^\\)]*?\\)|[^};])+)')
+_DECLARATION_END_RE = _re(u'[;%(s_chars)s]*')
+_KEYFRAME_RE = _re(u'((\\d+\\.\\d+|\\.\\d+|\\d+)%%?|[a-z]+)%(s)s*')
+_KEYFRAME_SEPARATOR_RE = _re(u',%(s)s*')
+_KEYFRAMES_RE = _re(u'@([-\\w]+)?keyframes *')
+_IDENTIFIER_RE = _re(u'([-\\w]+)%(s)s*')
+_SUPPORTS_RE = _re(u'@supports *([^{]+)')
+_HOST_RE = _re(u'@host *')
+_MEDIA_RE = _re(u'@media *([^{]+)')
+_PAGE_RE = _re(u'@page *')
+_DOCUMENT_RE = _re(u'@([-\\w]+)?document *([^{]+)')
+_AT_RULE_RES = dict([(name, _re(u'@%s *([^;\\n]+);' % name))
+                     for name in ('import', 'charset', 'namespace')])
+
+
+class _Parser(object):
+    def __init__(self, css):
+        self.css = css
+        self.pos = 0
+        self.lineno = 1
+        self.column = 1
+
+    def update_position(self, s):
+        lines = s.count(u'\n')
+        self.lineno += lines
+        i = s.rfind(u'\n')
+        if i != -1:
+            self.column = len(s) - i
+        else:
+            self.column += len(s)
+
+    def error(self, msg):
+        raise CSSParseError(msg, self.lineno, self.column)
+
+    def match(self, regex):
+        m = regex.match(self.css, self.pos)
+        if m is None:
+            return None
+        self.update_position(m.group(0))
+        self.pos = m.end()
+        return m
+
+    def char(self, offset=0):
+        """css.charAt(offset)"""
+        return self.css[self.pos + offset:self.pos + offset + 1]
+
+    def stylesheet(self):
+        return {
+            'type': 'stylesheet',
+            'stylesheet': {
+                'rules': self.rules(),
+            },
+        }
+
+    def open(self):
+        return self.match(_OPEN_RE)
+
+    def close(self):
+        return self.match(_CLOSE_RE)
+
+    def rules(self):
+        rules = []
+        self.whitespace()
+        self.comments(rules)
+        while self.char() != u'}':
+            node = self.atrule() or self.rule()
+            if not node:
+                break
+            rules.append(node)
+            self.comments(rules)
+        return rules
+
+    def whitespace(self):
+        self.match(_WHITESPACE_RE)
+
+    def comments(self, rules=None):
+        if rules is None:
+            rules = []
+        while True:
+            c = self.comment()
+            if not c:
+                break
+            rules.append(c)
+        return rules
+
+    def comment(self):
+        if self.char() != u'/' or self.char(1) != u'*':
+            return
+        end = self.css.find(u'*/', self.pos + 2)
+        if end == -1:
+            s = self.css[self.pos + 2:]
+            new_pos = len(self.css)
+        else:
+            s = self.css[self.pos + 2:end]
+            new_pos = end + 2
+        self.column += 2
+        self.update_position(s)
+        self.pos = new_pos
+        self.column += 2
+        self.whitespace()
+        return {
+            'type': 'comment',
+            'comment': s,
+        }
+
+    def selector(self):
+        m = self.match(_SELECTOR_RE)
+        if not m:
+            return
+        return _SELECTOR_SPLIT_RE.split(trim(m.group(0)))
+
+    def declaration(self):
+        prop = self.match(_PROPERTY_RE)
+        if not prop:
+            return
+        prop = trim(prop.group(0))
+        if not self.match(_COLON_RE):
+            self.error("property missing ':'")
+        val = self.match(_VALUE_RE)
+        if not val:
+            self.error('property missing value')
+        ret = {
+            'type': 'declaration',
+            'property': prop,
+            'value': trim(val.group(0)),
+        }
+        self.whitespace()
+        self.match(_DECLARATION_END_RE)
+        return ret
+
+    def declarations(self):
+        decls = []
+        if not self.open():
+            self.error("missing '{'")
+        self.comments(decls)
+        while True:
+            decl = self.declaration()
+            if not decl:
+                break
+            decls.append(decl)
+            self.comments(decls)
+        if not self.close():
+            self.error("missing '}'")
+        return decls
+
+    def keyframe(self):
+        vals = []
+        while True:
+            m = self.match(_KEYFRAME_RE)
+            if not m:
+                break
+            vals.append(m.group(1))
+            self.match(_KEYFRAME_SEPARATOR_RE)
+        if not vals:
+            return
+        node = {
+            'type': 'keyframe',
+            'values': vals,
+            'declarations': self.declarations(),
+        }
+        self.whitespace()
+        return node
+
+    def atkeyframes(self):
+        m = self.match(_KEYFRAMES_RE)
+        if not m:
+            return
+        vendor = m.group(1)
+        m = self.match(_IDENTIFIER_RE)
+        if not m:
+            self.error("@keyframes missing name")
+        name = m.group(1)
+        if not self.open():
+            self.error("@keyframes missing '{'")
+        frames = self.comments()
+        while True:
+            frame = self.keyframe()
+            if not frame:
+                break
+            frames.append(frame)
+            frames.extend(self.comments())
+        if not self.close():
+            self.error("@keyframes missing '}'")
+        node = {
+            'type': 'keyframes',
+            'name': name,
+            'vendor': vendor,
+            'keyframes': frames,
+        }
+        self.whitespace()
+        return node
+
+    def _atgroup(self, name, **attrs):
+        """@supports, @host, @media and @document: a prelude, then a
+        block of rules.
+        """
+        if not self.open():
+            self.error("@%s missing '{'" % name)
+        style = self.comments() + self.rules()
+        if not self.close():
+            self.error("@%s missing '}'" % name)
+        node = {'type': name}
+        node.update(attrs)
+        node['rules'] = style
+        self.whitespace()
+        return node
+
+    def atsupports(self):
+        m = self.match(_SUPPORTS_RE)
+        if not m:
+            return
+        return self._atgroup('supports', supports=trim(m.group(1)))
+
+    def athost(self):
+        if not self.match(_HOST_RE):
+            return
+        return self._atgroup('host')
+
+    def atmedia(self):
+        m = self.match(_MEDIA_RE)
+        if not m:
+            return
+        return self._atgroup('media', media=trim(m.group(1)))
+
+    def atpage(self):
+        if not self.match(_PAGE_RE):
+            return
+        sel = self.selector() or []
+        if not self.open():
+            self.error("@page missing '{'")
+        decls = self.comments()
+        while True:
+            decl = self.declaration()
+            if not decl:
+                break
+            decls.append(decl)
+            decls.extend(self.comments())
+        if not self.close():
+            self.error("@page missing '}'")
+        node = {
+            'type': 'page',
+            'selectors': sel,
+            'declarations': decls,
+        }
+        self.whitespace()
+        return node
+
+    def atdocument(self):
+        m = self.match(_DOCUMENT_RE)
+        if not m:
+            return
+        return self._atgroup('document',
+                             document=trim(m.group(2)),
+                             vendor=trim(m.group(1) or u''))
+
+    def _atrule(self, name):
+        m = self.match(_AT_RULE_RES[name])
+        if not m:
+            return
+        node = {'type': name, name: trim(m.group(1))}
+        self.whitespace()
+        return node
+
+    def atrule(self):
+        if self.char() != u'@':
+            return
+        return self.atkeyframes() \
+            or self.atmedia() \
+            or self.atsupports() \
+            or self._atrule('import') \
+            or self._atrule('charset') \
+            or self._atrule('namespace') \
+            or self.atdocument() \
+            or self.atpage() \
+            or self.athost()
+
+    def rule(self):
+        sel = self.selector()
+        if sel is None:
+            return
+        self.comments()
+        node = {
+            'type': 'rule',
+            'selectors': sel,
+            'declarations': self.declarations(),
+        }
+        self.whitespace()
+        return node
+
+
+def parse(css):
+    """Parse the unicode string `css', as css.parse(css) would.
+
+    Raises CSSParseError where css.parse() throws.
+    """
+    return _Parser(css).stylesheet()
+
+
+def parse_next(css, pos=0):
+    """Parse the top-level node at index `pos' of `css', after any
+    whitespace and comments, as css.parse(css.substr(pos), {next: true})
+    would.
+
+    Returns (node, end), where end is the index after the node and the
+    whitespace following it.  node is None where css.parse() would stop.
+    """
+    parser = _Parser(css)
+    parser.pos = pos
+    parser.whitespace()
+    parser.comments()
+    node = None
+    if parser.char() != u'}':
+        node = parser.atrule() or parser.rule()
+    return node or None, parser.pos
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Port of bootstrap.createFixupStream(): fixup_css() a piece at a time.
+
+Each top-level rule is fixed up as soon as the text read so far settles
+it, so memory use and latency follow the biggest rule rather than the
+whole stylesheet.  The pieces add up to fixup_css() of the whole text,
+except where that fails:
+
+ * from the first rule that doesn't parse on, the text is passed
+   through unchanged (fixup_css() returns all of it unchanged);
+ * a rule whose fixup would throw is passed through unchanged (fixup_css()
+   raises JSError).
+"""
+
+import re
+
+from mozharness.mozilla.cssfixer.fixup import fixup_style_sheet, \
+    _HTML_COMMENT_START_RE, _HTML_COMMENT_END_RE
+from mozharness.mozilla.cssfixer.jsutil import S, JSError
+from mozharness.mozilla.cssfixer.parse import parse_next, CSSParseError
+
+_LEADING_SPACE_RE = re.compile(u'%s*' % S)
+_LINE_TERMINATORS = u'\n\r\u2028\u2029'
+
+# css-parse's patterns all run up to the '}' ending a rule, except for
+# strings (up to the closing quote or the end of the line), parentheses
+# in values (up to ')'), and @import, @charset and @namespace (up to ';'
+# or a newline).  Those have to end before the text read so far does,
+# or more text could change the rule.
+_NODE_ENDS = [
+    (u"'", u"'" + _LINE_TERMINATORS),
+    (u'"', u'"' + _LINE_TERMINATORS),
+    (u'(', u')'),
+    (u'@', u';\n'),
+]
+
+
+def is_complete_node(css, start, end):
+    """Whether the node parse_next(css, start) found, ending at `end',
+    stays the same however css continues: bootstrap.isCompleteCSSNode().
+    """
+    if end >= len(css):
+        return False
+    for char, stops in _NODE_ENDS:
+        i = css.rfind(char, start, end)
+        if i != -1 and not [s for s in stops if css.find(s, i + 1) != -1]:
+            return False
+    return True
+
+
+class FixupStream(object):
+    """feed() unicode stylesheet text to it, and it returns the fixed
+    up text for the rules completed so far; close() returns the rest.
+    """
+    def __init__(self):
+        self.buf = u''
+        self.head = u''
+        self.started = False
+        self.done = False
+        self.separator = u''
+        self.retry_at = 0
+        self.out = []
+
+    def feed(self, css):
+        self.buf += css
+        # Parsing an unfinished rule again for every chunk would be
+        # quadratic; wait until the text has doubled.
+        if len(self.buf) >= self.retry_at:
+            self._pump(False)
+        return self._flush()
+
+    def close(self):
+        self._pump(True)
+        return self._flush()
+
+    def _flush(self):
+        out = u''.join(self.out)
+        self.out = []
+        return out
+
+    def _emit(self, css):
+        if css:
+            self.out.append(self.separator + css)
+            self.separator = u'\n\n'
+
+    def _fixup_node(self, node, css):
+        try:
+            return fixup_style_sheet({'type': 'stylesheet',
+                                      'stylesheet': {'rules': [node]}})
+        except JSError:
+            return css
+
+    def _pump(self, closing):
+        if self.done:
+            self.buf = u''
+            return
+        if not self.started:
+            # Wait to see whether it starts with "<!--".
+            space = _LEADING_SPACE_RE.match(self.buf).end()
+            if not closing and len(self.buf) - space < 4:
+                return
+            m = _HTML_COMMENT_START_RE.match(self.buf)
+            if m:
+                self.head = self.buf[:m.end()]
+                self.buf = self.buf[m.end():]
+            self.started = True
+        css = self.buf
+        if closing:
+            m = _HTML_COMMENT_END_RE.search(css)
+            if m:
+                css = css[:m.start()]
+        pos = 0
+        while True:
+            try:
+                node, end = parse_next(css, pos)
+            except CSSParseError:
+                if closing:
+                    # The rest goes through as is, like fixup_css() does
+                    # with the whole stylesheet.
+                    self._emit(self.head + self.buf[pos:])
+                    self.done = True
+                break
+            if node is None:
+                self.done = closing or end < len(css)
+                break
+            if not closing and not is_complete_node(css, pos, end):
+                break
+            self._emit(self._fixup_node(node, css[pos:end]))
+            self.head = u''
+            pos = end
+        self.buf = u'' if self.done else self.buf[pos:]
+        self.retry_at = 2 * len(self.buf)
+
+
+def fixup_css_stream(chunks):
+    """Generate fixup_css(''.join(chunks)) a piece at a time with a
+    FixupStream.  Byte strings are treated as latin-1 and give byte
+    strings, as with fixup_css().
+    """
+    stream = FixupStream()
+    binary = False
+    for chunk in chunks:
+        binary = isinstance(chunk, str)
+        if binary:
+            chunk = chunk.decode('latin-1')
+        out = stream.feed(chunk)
+        if out:
+            yield out.encode('latin-1') if binary else out
+    out = stream.close()
+    if out:
+        yield out.encode('latin-1') if binary else out
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Port of the css-stringify module bundled in css-browserside.js.
+
+Only the default (identity) compiler is ported; bootstrap.js never
+asks for compressed output or source maps.
+"""
+
+from mozharness.mozilla.cssfixer.jsutil import JSError, to_string
+
+
+class IdentityCompiler(object):
+    def __init__(self, indent=None):
+        self.indentation = indent
+        self.level = None
+
+    def compile(self, node):
+        return self.stylesheet(node)
+
+    def visit(self, node):
+        method = getattr(self, 'visit_%s' % node.get('type'), None)
+        if method is None:
+            # this[node.type] isn't a function, e.g. for @host rules.
+            raise JSError("this[node.type] is not a function (%s)" % node.get('type'))
+        return method(node)
+
+    def map_visit(self, nodes, delim=u''):
+        return delim.join([self.visit(node) for node in nodes])
+
+    def indent(self, level=None):
+        """Increase or decrease the indentation level, or return the
+        current indentation.
+        """
+        self.level = self.level or 1
+        if level is not None:
+            self.level += level
+            return u''
+        return (self.indentation or u'  ') * (self.level - 1)
+
+    def stylesheet(self, node):
+        return self.map_visit(node['stylesheet']['rules'], u'\n\n')
+
+    def visit_comment(self, node):
+        return self.indent() + u'/*' + to_string(node.get('comment')) + u'*/'
+
+    def visit_import(self, node):
+        return u'@import ' + to_string(node.get('import')) + u';'
+
+    def visit_charset(self, node):
+        return u'@charset ' + to_string(node.get('charset')) + u';'
+
+    def visit_namespace(self, node):
+        return u'@namespace ' + to_string(node.get('namespace')) + u';'
+
+    def _block(self, prelude, rules):
+        s = prelude + u' {\n' + self.indent(1)
+        s += self.map_visit(rules, u'\n\n')
+        return s + self.indent(-1) + u'\n}'
+
+    def visit_media(self, node):
+        return self._block(u'@media ' + to_string(node.get('media')), node['rules'])
+
+    def visit_document(self, node):
+        doc = u'@' + (node.get('vendor') or u'') + u'document ' + \
+            to_string(node.get('document'))
+        return self._block(doc + u' ', node['rules'])
+
+    def visit_supports(self, node):
+        return self._block(u'@supports ' + to_string(node.get('supports')), node['rules'])
+
+    def visit_keyframes(self, node):
+        s = u'@' + (node.get('vendor') or u'') + u'keyframes ' + \
+            to_string(node.get('name'))
+        s += u' {\n' + self.indent(1)
+        s += self.map_visit(node['keyframes'], u'\n')
+        return s + self.indent(-1) + u'}'
+
+    def visit_keyframe(self, node):
+        s = self.indent()
+        s += u', '.join(node['values'])
+        s += u' {\n' + self.indent(1)
+        s += self.map_visit(node['declarations'], u'\n')
+        s += self.indent(-1)
+        return s + u'\n' + self.indent() + u'}\n'
+
+    def visit_page(self, node):
+        sel = u''
+        if node['selectors']:
+            sel = u', '.join(node['selectors']) + u' '
+        s = u'@page ' + sel + u'{\n' + self.indent(1)
+        s += self.map_visit(node['declarations'], u'\n')
+        return s + self.indent(-1) + u'\n}'
+
+    def visit_rule(self, node):
+        indent = self.indent()
+        decls = node['declarations']
+        if not decls:
+            return u''
+        s = u',\n'.join([indent + sel for sel in node['selectors']])
+        s += u' {\n' + self.indent(1)
+        s += self.map_visit(decls, u'\n')
+        s += self.indent(-1)
+        return s + u'\n' + self.indent() + u'}'
+
+    def visit_declaration(self, node):
+        return self.indent() + to_string(node.get('property')) + u': ' + \
+            to_string(node.get('value')) + u';'
+
+
+def stringify(node, indent=None):
+    """css.stringify(node)"""
+    return IdentityCompiler(indent=indent).compile(node)
@@ -15,7 +15,7 @@ import sys
 
 sys.path.insert(1, os.path.dirname(os.path.dirname(sys.path[0])))
 
-from mozharness.base.errors import MakefileErrorList, SSHErrorList
+from mozharness.base.errors import MakefileErrorList
 from mozharness.base.log import FATAL
 from mozharness.base.vcs.vcsbase import MercurialScript
 from mozharness.mozilla.l10n.locales import LocalesMixin
@@ -215,26 +215,21 @@ class MultiLocaleBuild(LocalesMixin, MercurialScript):
         if not os.path.isdir(dirs['abs_objdir']):
             self.warning("%s doesn't exist! Skipping..." % dirs['abs_objdir'])
             return
-        rsync = self.query_exe('rsync')
         backup_dir = '%s-bak' % dirs['abs_objdir']
-        self.rmtree(backup_dir)
-        self.mkdir_p(backup_dir)
-        self.run_command([rsync, '-a', '--delete', '--partial',
-                          '%s/' % dirs['abs_objdir'],
-                          '%s/' % backup_dir],
-                         error_list=SSHErrorList)
+        # Reflinks rather than hardlinks: the build changes files in place.
+        self.copytree(dirs['abs_objdir'], backup_dir, overwrite='clobber',
+                      link_mode='reflink', skip_unchanged=True, symlinks=True,
+                      error_level=FATAL)
 
     def restore_objdir(self):
         dirs = self.query_abs_dirs()
-        rsync = self.query_exe('rsync')
         backup_dir = '%s-bak' % dirs['abs_objdir']
         if not os.path.isdir(dirs['abs_objdir']) or not os.path.isdir(backup_dir):
             self.warning("Both %s and %s need to exist to restore the objdir! Skipping..." % (dirs['abs_objdir'], backup_dir))
             return
-        self.run_command([rsync, '-a', '--delete', '--partial',
-                          '%s/' % backup_dir,
-                          '%s/' % dirs['abs_objdir']],
-                         error_list=SSHErrorList)
+        self.copytree(backup_dir, dirs['abs_objdir'], overwrite='clobber',
+                      link_mode='reflink', skip_unchanged=True, symlinks=True,
+                      error_level=FATAL)
 
     def upload_multi(self):
         # TODO
@@ -55,6 +55,10 @@ class PurgeMixin(object):
         for s in skip:
             cmd.extend(['--not', s])
 
+        # Count what our background deletions are about to free.
+        cmd.extend(['--pending-deletions-dir',
+                    self.query_deletion_service().pending_dir])
+
         cmd.append(basedir)
 
         # purge_builds.py can also clean up old shared hg repos if we set
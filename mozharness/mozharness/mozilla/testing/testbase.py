@@ -53,6 +53,13 @@ testing_config_options = [
      "choices": ['ondemand', 'true'],
      "help": "Download and extract crash reporter symbols.",
       }],
+    [["--artifact-cache-dir"],
+     {"action": "store",
+     "dest": "artifact_cache_dir",
+     "default": None,
+     "help": "Cache downloaded installers, test zips and symbols in this directory, "
+             "shared by the jobs on this host.",
+      }],
 ] + copy.deepcopy(virtualenv_config_options)
 
 
@@ -197,29 +204,18 @@ You can set this by:
         """Generic download+unzip.
         This is hardcoded to halt on failure.
         We should probably change some other methods to call this."""
-        dirs = self.query_abs_dirs()
-        zipfile = self.download_file(url, parent_dir=dirs['abs_work_dir'],
-                                     error_level=FATAL)
-        command = self.query_exe('unzip', return_type='list')
-        command.extend(['-q', '-o', zipfile])
-        self.run_command(command, cwd=parent_dir, halt_on_failure=True)
+        self.download_unpack(url, parent_dir, error_level=FATAL)
 
     def _extract_test_zip(self, target_unzip_dirs=None):
+        """Extract just the target_unzip_dirs of the tests zip, using
+        the member index that unzip() keeps next to it.
+        """
         dirs = self.query_abs_dirs()
-        unzip = self.query_exe("unzip")
         test_install_dir = dirs.get('abs_test_install_dir',
                                     os.path.join(dirs['abs_work_dir'], 'tests'))
         self.mkdir_p(test_install_dir)
-        # adding overwrite flag otherwise subprocess.Popen hangs on waiting for
-        # input in a hidden pipe whenever this action is run twice without
-        # clobber
-        unzip_cmd = [unzip, '-q', '-o', self.test_zip_path]
-        if target_unzip_dirs:
-            unzip_cmd.extend(target_unzip_dirs)
-        # TODO error_list
-        # unzip return code 11 is 'no matching files were found'
-        self.run_command(unzip_cmd, cwd=test_install_dir,
-                         halt_on_failure=True, success_codes=[0, 11])
+        self.unzip(self.test_zip_path, test_install_dir,
+                   target_unzip_dirs=target_unzip_dirs, error_level=FATAL)
 
     def _read_tree_config(self):
         """Reads an in-tree config file"""
@@ -278,8 +274,17 @@ You can set this by:
                 setattr(self, attr, new_url)
 
         if self.test_url:
-            self._download_test_zip()
-            self._extract_test_zip(target_unzip_dirs=target_unzip_dirs)
+            if target_unzip_dirs and not self.test_zip_path:
+                # Only fetch the part of the tests zip we need.
+                dirs = self.query_abs_dirs()
+                test_install_dir = dirs.get('abs_test_install_dir',
+                                            os.path.join(dirs['abs_work_dir'], 'tests'))
+                self.download_unpack(self.test_url, test_install_dir,
+                                     target_unzip_dirs=target_unzip_dirs,
+                                     error_level=FATAL)
+            else:
+                self._download_test_zip()
+                self._extract_test_zip(target_unzip_dirs=target_unzip_dirs)
             self._read_tree_config()
         self._download_installer()
         if self.config.get('download_symbols'):
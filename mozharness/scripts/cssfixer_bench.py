@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""cssfixer_bench.py
+
+Time the css-browserside.js parse -> fixup -> compile cycle under node,
+phase by phase, on the benchmark corpus and any --css-path stylesheets:
+
+  cssfixer_bench.py --iterations 10 --results-file bench.json
+
+It also times loading css-browserside.js, and the smaller version the
+repack ships with shake_css_browserside.
+
+Keep the results file of a known good run and pass it as --baseline to
+fail on phases that got more than --max-regression percent slower.
+"""
+
+import os
+import sys
+
+# load modules from parent dir
+sys.path.insert(1, os.path.dirname(sys.path[0]))
+
+try:
+    import simplejson as json
+    assert json
+except ImportError:
+    import json
+
+from mozharness.base.script import BaseScript
+from mozharness.mozilla.cssfixer.bench import BENCH_CORPUS, PHASES, \
+    find_regressions, generate_stylesheet, summarize
+from mozharness.mozilla.cssfixer.bundle import shake_bundle, BundleError
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+BENCH_JS = os.path.join(TOP_DIR, 'mozharness', 'external_tools', 'cssfixer_bench.js')
+
+
+# CSSFixupBench {{{1
+class CSSFixupBench(BaseScript):
+    config_options = [[
+        ["--css-path", ],
+        {"action": "extend",
+         "dest": "css_paths",
+         "help": "Stylesheet to add to the corpus"
+         }
+    ], [
+        ["--js-dir", ],
+        {"action": "store",
+         "dest": "js_dir",
+         "default": TOP_DIR,
+         "help": "Where bootstrap.js and css-browserside.js are (default: %s)" % TOP_DIR
+         }
+    ], [
+        ["--iterations", ],
+        {"action": "store",
+         "dest": "bench_iterations",
+         "type": "int",
+         "default": 5,
+         "metavar": "INT",
+         "help": "Number of timed runs per stylesheet (default: 5)"
+         }
+    ], [
+        ["--warmup", ],
+        {"action": "store",
+         "dest": "bench_warmup",
+         "type": "int",
+         "default": 1,
+         "metavar": "INT",
+         "help": "Number of untimed runs per stylesheet first (default: 1)"
+         }
+    ], [
+        ["--results-file", ],
+        {"action": "store",
+         "dest": "bench_results_file",
+         "help": "Where to write the results (default: work_dir/cssfixer-bench.json)"
+         }
+    ], [
+        ["--baseline", ],
+        {"action": "store",
+         "dest": "bench_baseline",
+         "help": "Results file to compare against"
+         }
+    ], [
+        ["--max-regression", ],
+        {"action": "store",
+         "dest": "bench_max_regression",
+         "type": "float",
+         "default": 10.0,
+         "metavar": "PERCENT",
+         "help": "How much slower than --baseline a phase may get (default: 10)"
+         }
+    ]]
+
+    def __init__(self, require_config_file=False):
+        BaseScript.__init__(self, config_options=self.config_options,
+                            all_actions=['generate-corpus',
+                                         'run-benchmark',
+                                         'summary',
+                                         ],
+                            require_config_file=require_config_file)
+
+    def query_corpus_dir(self):
+        dirs = self.query_abs_dirs()
+        return os.path.join(dirs['abs_work_dir'], 'bench-corpus')
+
+    def query_stylesheets(self):
+        """The {"name", "path"} of every stylesheet to time."""
+        stylesheets = []
+        for name, seed, size in BENCH_CORPUS:
+            stylesheets.append({'name': name, 'path': os.path.join(
+                self.query_corpus_dir(), '%s.css' % name)})
+        for path in self.config.get('css_paths', []):
+            stylesheets.append({'name': os.path.basename(path),
+                                'path': os.path.abspath(path)})
+        return stylesheets
+
+    def query_bundles(self):
+        """The {"name", "path"} of every css-browserside.js to time
+        loading; the shaken one is written by run-benchmark.
+        """
+        dirs = self.query_abs_dirs()
+        return [
+            {'name': 'css-browserside.js',
+             'path': os.path.join(self.config['js_dir'], 'css-browserside.js')},
+            {'name': 'css-browserside.js (shaken)',
+             'path': os.path.join(dirs['abs_work_dir'], 'css-browserside.shaken.js')},
+        ]
+
+    def query_results_file(self):
+        c = self.config
+        if c.get('bench_results_file'):
+            return os.path.abspath(c['bench_results_file'])
+        dirs = self.query_abs_dirs()
+        return os.path.join(dirs['abs_work_dir'], 'cssfixer-bench.json')
+
+    def _read_json(self, path):
+        contents = self.read_from_file(path, verbose=False)
+        if contents is None:
+            self.fatal("Can't read %s!" % path)
+        return json.loads(contents)
+
+    # Actions {{{2
+    def generate_corpus(self):
+        corpus_dir = self.query_corpus_dir()
+        for name, seed, size in BENCH_CORPUS:
+            path = os.path.join(corpus_dir, '%s.css' % name)
+            if self.write_to_file(path, generate_stylesheet(seed, size),
+                                  verbose=False, create_parent_dir=True) is None:
+                self.fatal("Can't write %s!" % path)
+        self.info("Wrote %d stylesheets to %s" % (len(BENCH_CORPUS), corpus_dir))
+
+    def run_benchmark(self):
+        c = self.config
+        dirs = self.query_abs_dirs()
+        manifest = os.path.join(dirs['abs_work_dir'], 'cssfixer-bench-manifest.json')
+        raw_results = os.path.join(dirs['abs_work_dir'], 'cssfixer-bench-raw.json')
+        stylesheets = self.query_stylesheets()
+        for stylesheet in stylesheets:
+            if not os.path.exists(stylesheet['path']):
+                self.fatal("%s doesn't exist; run generate-corpus first!" %
+                           stylesheet['path'])
+        bundles = self.query_bundles()
+        try:
+            shaken = shake_bundle(self.read_from_file(bundles[0]['path'],
+                                                      verbose=False) or '')
+        except BundleError, e:
+            self.fatal("Can't shake %s: %s" % (bundles[0]['path'], str(e)))
+        self.write_to_file(bundles[1]['path'], shaken, verbose=False,
+                           create_parent_dir=True)
+        self.write_to_file(manifest, json.dumps({
+            'iterations': c['bench_iterations'],
+            'warmup': c['bench_warmup'],
+            'stylesheets': stylesheets,
+            'bundles': bundles,
+        }), verbose=False, create_parent_dir=True)
+        node = self.query_exe('node')
+        # A big young generation keeps GCs out of the heap measurements.
+        self.run_command([node, '--expose-gc', '--max-semi-space-size=64', BENCH_JS,
+                          os.path.join(c['js_dir'], 'bootstrap.js'),
+                          os.path.join(c['js_dir'], 'css-browserside.js'),
+                          manifest, raw_results],
+                         halt_on_failure=True)
+        results = self._read_json(raw_results)
+        summary = summarize(results)
+        results_file = self.query_results_file()
+        if self.write_to_file(results_file,
+                              json.dumps({'summary': summary, 'results': results},
+                                         indent=2, sort_keys=True),
+                              verbose=False, create_parent_dir=True) is None:
+            self.fatal("Can't write %s!" % results_file)
+        for result in results:
+            phases = summary[result['name']]
+            self.add_summary("%s (%d bytes, %d rules): %s" % (
+                result['name'], result['bytes'], result['rules'], ', '.join([
+                    '%s %.1fms/%dKB' % (phase, phases[phase][0], phases[phase][1] // 1024)
+                    for phase in PHASES + ('startup',) if phase in phases])))
+        self.info("Results are in %s" % results_file)
+        if c.get('bench_baseline'):
+            baseline = self._read_json(c['bench_baseline'])['summary']
+            regressions = find_regressions(summary, baseline,
+                                           c['bench_max_regression'] / 100.0)
+            for name, phase, ms, baseline_ms in regressions:
+                self.add_failure(
+                    '%s %s' % (name, phase),
+                    message="%%(key)s took %.1fms, up from %.1fms!" % (ms, baseline_ms))
+            if not regressions:
+                self.add_summary("No regressions against %s." % c['bench_baseline'])
+
+
+# __main__ {{{1
+if __name__ == '__main__':
+    bench = CSSFixupBench()
+    bench.run_and_exit()
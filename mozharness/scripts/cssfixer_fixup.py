@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""cssfixer_fixup.py
+
+Apply the css-browserside.js fixups to a batch of stylesheets ahead of
+time, as browser.js would on the phone.
+
+  cssfixer_fixup.py --css-path site/css --css-path extra.css --output-dir fixed
+
+With --pack-cache, the results are also written to a cache file for
+bootstrap.fixupCache, to be inserted into the apk by the repack:
+
+  cssfixer_fixup.py --css-url-list popular-css.txt --download-css \
+      --fixup-css --pack-cache --cache-file cssfixer-cache.json
+
+With --stream, stylesheets are read and fixed up a rule at a time, as
+browser.js does with the cssfixer.streaming pref, which keeps huge
+stylesheet dumps out of memory.
+"""
+
+import os
+import sys
+import urlparse
+
+# load modules from parent dir
+sys.path.insert(1, os.path.dirname(sys.path[0]))
+
+from mozharness.base.parallel import ParallelMixin
+from mozharness.base.script import BaseScript
+from mozharness.mozilla.cssfixer.cache import cache_key, FixupCache
+from mozharness.mozilla.cssfixer.fixup import fixup_css
+from mozharness.mozilla.cssfixer.jsutil import JSError
+from mozharness.mozilla.cssfixer.stream import fixup_css_stream
+
+# How much of a stylesheet --stream reads at a time.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+# CSSFixup {{{1
+class CSSFixup(ParallelMixin, BaseScript):
+    config_options = [[
+        ["--css-path", ],
+        {"action": "extend",
+         "dest": "css_paths",
+         "help": "Stylesheet, or directory of stylesheets, to fix up"
+         }
+    ], [
+        ["--css-url", ],
+        {"action": "extend",
+         "dest": "css_urls",
+         "help": "URL of a stylesheet to download and fix up"
+         }
+    ], [
+        ["--css-url-list", ],
+        {"action": "store",
+         "dest": "css_url_list",
+         "help": "File listing stylesheet URLs to download and fix up, one per line"
+         }
+    ], [
+        ["--output-dir", ],
+        {"action": "store",
+         "dest": "fixup_output_dir",
+         "help": "Where to write the fixed up stylesheets (default: work_dir/fixed-css)"
+         }
+    ], [
+        ['--parallel-workers', ],
+        {"action": "store",
+         "dest": "parallel_workers",
+         "type": "int",
+         "metavar": "INT",
+         "help": "Number of stylesheets to fix up at once (default: number of CPUs)"
+         }
+    ], [
+        ["--cache-file", ],
+        {"action": "store",
+         "dest": "fixup_cache_file",
+         "help": "Where pack-cache writes the cache (default: output_dir/cssfixer-cache.json)"
+         }
+    ], [
+        ["--cache-max-bytes", ],
+        {"action": "store",
+         "dest": "fixup_cache_max_bytes",
+         "type": "int",
+         "metavar": "INT",
+         "help": "Limit the size of the packed cache"
+         }
+    ], [
+        ["--stream", ],
+        {"action": "store_true",
+         "dest": "fixup_stream",
+         "default": False,
+         "help": "Fix up stylesheets a rule at a time, without reading them whole"
+         }
+    ]]
+
+    def __init__(self, require_config_file=False):
+        BaseScript.__init__(self, config_options=self.config_options,
+                            all_actions=['download-css',
+                                         'fixup-css',
+                                         'pack-cache',
+                                         'summary',
+                                         ],
+                            default_actions=['download-css',
+                                             'fixup-css',
+                                             'summary',
+                                             ],
+                            require_config_file=require_config_file)
+
+    def query_output_dir(self):
+        c = self.config
+        if c.get('fixup_output_dir'):
+            return os.path.abspath(c['fixup_output_dir'])
+        dirs = self.query_abs_dirs()
+        return os.path.join(dirs['abs_work_dir'], 'fixed-css')
+
+    def query_css_urls(self):
+        c = self.config
+        urls = list(c.get('css_urls', []))
+        if c.get('css_url_list'):
+            contents = self.read_from_file(c['css_url_list'], verbose=False)
+            if contents is None:
+                self.fatal("Can't read %s!" % c['css_url_list'])
+            for line in contents.splitlines():
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    urls.append(line)
+        return urls
+
+    def query_download_items(self):
+        """The (url, path) of every stylesheet to download.  The index
+        keeps stylesheets with the same file name apart.
+        """
+        dirs = self.query_abs_dirs()
+        items = []
+        for index, url in enumerate(self.query_css_urls()):
+            name = os.path.basename(urlparse.urlparse(url).path) or 'index.css'
+            items.append((url, os.path.join(dirs['abs_work_dir'], 'downloaded-css',
+                                            '%d-%s' % (index, name))))
+        return items
+
+    def query_fixup_items(self):
+        """The (source, destination) path of every stylesheet to fix up.
+
+        Directories are searched for *.css files, and their layout is
+        kept under output_dir/<directory name>/.  Downloaded stylesheets
+        go in output_dir/downloaded-css/.
+        """
+        output_dir = self.query_output_dir()
+        items = []
+        for url, path in self.query_download_items():
+            if os.path.exists(path):
+                items.append((path, os.path.join(
+                    output_dir, 'downloaded-css', os.path.basename(path))))
+        for path in self.config.get('css_paths', []):
+            path = os.path.abspath(path)
+            if os.path.isdir(path):
+                base_dir = os.path.dirname(path)
+                for root, dirs, files in os.walk(path):
+                    dirs.sort()
+                    for name in sorted(files):
+                        if name.endswith('.css'):
+                            src = os.path.join(root, name)
+                            items.append((src, os.path.join(
+                                output_dir, os.path.relpath(src, base_dir))))
+            else:
+                items.append((path, os.path.join(output_dir,
+                                                 os.path.basename(path))))
+        return items
+
+    # These run in parallel worker processes; they return None for
+    # success or a failure message, which may use %(key)s.
+    def download_css_item(self, url, path):
+        if not self.download_file(url, file_name=os.path.basename(path),
+                                  parent_dir=os.path.dirname(path)):
+            return "Can't download %(key)s!"
+
+    def fixup_item(self, src, dest):
+        if self.config.get('fixup_stream'):
+            return self.stream_fixup_item(src, dest)
+        contents = self.read_from_file(src, verbose=False, open_mode='rb')
+        if contents is None:
+            return "Can't read %(key)s!"
+        try:
+            contents = fixup_css(contents)
+        except JSError, e:
+            # css-browserside.js would throw on the phone, too.
+            return "Can't fix up %%(key)s: %s" % str(e).replace('%', '%%')
+        if self.write_to_file(dest, contents, verbose=False, open_mode='wb',
+                              create_parent_dir=True) is None:
+            return "Can't write %s!" % dest.replace('%', '%%')
+
+    def stream_fixup_item(self, src, dest):
+        """fixup_item() with fixup_css_stream(), which doesn't throw:
+        rules that would are passed through unchanged.
+        """
+        self.mkdir_p(os.path.dirname(dest))
+        try:
+            with open(src, 'rb') as src_fh:
+                with open(dest, 'wb') as dest_fh:
+                    chunks = iter(lambda: src_fh.read(STREAM_CHUNK_SIZE), '')
+                    for css in fixup_css_stream(chunks):
+                        dest_fh.write(css)
+        except IOError, e:
+            return "Can't fix up %%(key)s: %s" % str(e).replace('%', '%%')
+
+    def _run_items(self, method_name, items, message):
+        """Run method_name(*item) for every item in parallel, and
+        record the failures, keyed by item[0].
+        """
+        results = self.run_parallel(
+            method_name, items,
+            error_message="Uncaught exception in %s for %%(key)s!" % method_name)
+        success_count = 0
+        for item, result in zip(items, results):
+            if result:
+                self.add_failure(item[0], message=result)
+            else:
+                success_count += 1
+        self.summarize_success_count(success_count, len(items), message=message)
+
+    # Actions {{{2
+    def download_css(self):
+        items = self.query_download_items()
+        if not items:
+            self.info("No stylesheets to download.")
+            return
+        self.rmtree(os.path.dirname(items[0][1]))
+        self._run_items('download_css_item', items,
+                        "Downloaded %d of %d stylesheets successfully.")
+
+    def fixup_css(self):
+        items = self.query_fixup_items()
+        if not items:
+            self.fatal("No stylesheets to fix up; specify --css-path or --css-url.")
+        self._run_items('fixup_item', items,
+                        "Fixed up %d of %d stylesheets successfully.")
+        self.info("Fixed up stylesheets are in %s" % self.query_output_dir())
+
+    def pack_cache(self):
+        """Write the results of fixup-css to the cache file, keyed by
+        the original stylesheets.  If the cache would be bigger than
+        --cache-max-bytes, the stylesheets listed first are kept.
+        """
+        c = self.config
+        if c.get('fixup_stream'):
+            # The cache stands in for the whole stylesheet fixups.
+            self.fatal("pack-cache can't be used with --stream.")
+        cache_file = c.get('fixup_cache_file') or \
+            os.path.join(self.query_output_dir(), 'cssfixer-cache.json')
+        cache = FixupCache(max_bytes=c.get('fixup_cache_max_bytes'))
+        for src, dest in reversed(self.query_fixup_items()):
+            if self.query_failure(src):
+                continue
+            css = self.read_from_file(src, verbose=False, open_mode='rb')
+            fixed_css = self.read_from_file(dest, verbose=False, open_mode='rb')
+            if css is None or fixed_css is None:
+                self.add_failure(src, message="Can't read %(key)s or its fixed up version; run fixup-css first!")
+                continue
+            if not cache.put(cache_key(css), fixed_css):
+                self.warning("%s is too big to cache." % src)
+        if self.write_to_file(cache_file, cache.dumps(), verbose=False,
+                              create_parent_dir=True) is None:
+            self.fatal("Can't write %s!" % cache_file)
+        self.add_summary("Packed %d stylesheets (%d bytes) into %s." %
+                         (len(cache), cache.size, cache_file))
+
+
+# __main__ {{{1
+if __name__ == '__main__':
+    css_fixup = CSSFixup()
+    css_fixup.run_and_exit()
@@ -9,27 +9,76 @@
 """
 
 from copy import deepcopy
+from cStringIO import StringIO
+import fnmatch
 import os
 import sys
+import zipfile
 
 # load modules from parent dir
 sys.path.insert(1, os.path.dirname(sys.path[0]))
 
-from mozharness.base.errors import ZipErrorList
-from mozharness.base.log import FATAL
+import mozharness.base.archive
+from mozharness.base.archive import rewrite_zip
+from mozharness.base.incremental import InputManifestMixin, hash_file, \
+    hash_sources
+from mozharness.base.parallel import ParallelMixin
 from mozharness.base.transfer import TransferMixin
 from mozharness.base.vcs.vcsbase import MercurialScript
+import mozharness.mozilla.cssfixer.bundle
+from mozharness.mozilla.cssfixer.bundle import shake_bundle, BundleError
+import mozharness.mozilla.cssfixer.fixup
+from mozharness.mozilla.cssfixer.fixup import fixup_css
+import mozharness.mozilla.cssfixer.jsutil
+from mozharness.mozilla.cssfixer.jsutil import JSError
+import mozharness.mozilla.cssfixer.parse
+import mozharness.mozilla.cssfixer.stringify
 from mozharness.mozilla.l10n.locales import LocalesMixin
 from mozharness.mozilla.release import ReleaseMixin
 from mozharness.mozilla.signing import MobileSigningMixin
 
 SUPPORTED_PLATFORMS = ["android"]
+OMNI_JA = "assets/omni.ja"
+SUMMARY_MESSAGES = {
+    'download': "Downloaded %d of %d installers successfully.",
+    'repack': "Repacked %d of %d installers successfully.",
+    'sign': "Signed %d of %d apks successfully.",
+    'upload-signed-bits': "Uploaded %d of %d apks successfully.",
+}
+
+# The code that makes the repacked apks, for their input manifests.
+REPACK_MODULES = [
+    sys.modules[__name__],
+    mozharness.base.archive,
+    mozharness.mozilla.cssfixer.bundle,
+    mozharness.mozilla.cssfixer.fixup,
+    mozharness.mozilla.cssfixer.jsutil,
+    mozharness.mozilla.cssfixer.parse,
+    mozharness.mozilla.cssfixer.stringify,
+]
 
 
 # MobilePartnerRepack {{{1
 class MobilePartnerRepack(LocalesMixin, ReleaseMixin, MobileSigningMixin,
-                          TransferMixin, MercurialScript):
-    config_options = []
+                          TransferMixin, ParallelMixin, InputManifestMixin,
+                          MercurialScript):
+    config_options = [[
+        ['--parallel-workers', ],
+        {"action": "store",
+         "dest": "parallel_workers",
+         "type": "int",
+         "metavar": "INT",
+         "help": "Number of installers to process at once (default: number of CPUs)"
+         }
+    ], [
+        ['--no-incremental', ],
+        {"action": "store_false",
+         "dest": "incremental_repack",
+         "default": True,
+         "help": "Clear the work folder and redo every installer, rather than "
+                 "reusing the ones whose inputs haven't changed"
+         }
+    ]]
 
     def __init__(self, require_config_file=True):
         self.release_config = {}
@@ -58,189 +107,298 @@ class MobilePartnerRepack(LocalesMixin, ReleaseMixin, MobileSigningMixin,
         s = "%s:%s" % (platform, locale)
         return super(MobilePartnerRepack, self).query_failure(s)
 
-    # Actions {{{2
+    def query_repack_items(self):
+        """The (platform, locale) pairs to repack, minus any that have
+        already failed.
+        """
+        # Installer names come from the release config; read it before
+        # the items are handed to workers.
+        self.query_release_config()
+        locales = self.query_locales()
+        items = []
+        for platform in self.config['platforms']:
+            for locale in locales:
+                if self.query_failure(platform, locale):
+                    self.warning("%s:%s had previous issues; skipping!" % (platform, locale))
+                    continue
+                items.append((platform, locale))
+        return items
 
+    def query_pipeline_items(self):
+        return self.query_repack_items()
 
-    def download(self):
-        c = self.config
+    def pipeline_item_failed(self, action, item, message):
+        platform, locale = item
+        self.add_failure(platform, locale, message=message)
+
+    def summarize_pipeline_action(self, action, success_count, total_count):
+        self.summarize_success_count(success_count, total_count,
+                                     message=SUMMARY_MESSAGES[action])
+
+    def query_installer_name(self, platform, locale):
         rc = self.query_release_config()
-        locales = self.query_locales()
         replace_dict = {
             'buildnum': rc['buildnum'],
             'version': rc['version'],
+            'platform': platform,
+            'locale': locale,
         }
-        # Clear the work folder
-        workdir = c['workdir']
-        self.rmtree(workdir)
-        self.mkdir_p(workdir)
-        success_count = total_count = 0
-        for platform in c['platforms']:
-            base_installer_name = c['installer_base_names'][platform]
-            base_url = os.path.join(c['download_base_url'], base_installer_name)
-            replace_dict['platform'] = platform
-            for locale in locales:
-                replace_dict['locale'] = locale
-                url = base_url % replace_dict
-                installer_name = base_installer_name % replace_dict
-                parent_dir = os.path.join(workdir, 'original/%s/%s' % (platform, locale))
-                file_path = os.path.join(parent_dir, installer_name)
-                self.mkdir_p(parent_dir)
-                total_count += 1
-                if self.copyfile(url, file_path):
-                    self.add_failure(platform, locale,
-                                     message="Unable to dowload %(platform)s:%(locale)s installer!")
-                else:
-                    success_count += 1
-        self.summarize_success_count(success_count, total_count,
-                                     message="Downloaded %d of %d installers successfully.")
+        return self.config['installer_base_names'][platform] % replace_dict
 
-    def _repack_apk(self,orig_path, repack_path, version):
-        """ Repack the apk with a partner update channel.
+    def query_installer_path(self, stage, platform, locale):
+        """The path of the installer for `stage' ('original', 'unsigned'
+        or 'signed').
+        """
+        return os.path.join(self.config['workdir'],
+                            '%s/%s/%s' % (stage, platform, locale),
+                            self.query_installer_name(platform, locale))
+
+    def query_repack_inputs(self, original_path):
+        """The inputs of the repacked apk made from original_path, for
+        its input manifest.
+        """
+        c = self.config
+        inputs = {
+            'original': hash_file(original_path),
+            'shake_css_browserside': bool(c.get('shake_css_browserside')),
+            'fixup_omni_css': list(c.get('fixup_omni_css', [])),
+            'tools': hash_sources(REPACK_MODULES),
+        }
+        for target_file in c['inserted_files']:
+            inputs['inserted/%s' % target_file] = hash_file(
+                "%s%s" % (c['files_directory'], target_file))
+        return inputs
+
+    def query_sign_inputs(self, unsigned_path):
+        """The inputs of the signed apk made from unsigned_path, for
+        its input manifest.
+        """
+        c = self.config
+        inputs = {
+            'unsigned': hash_file(unsigned_path),
+            'keystore': hash_file(c['keystore']),
+            'key_alias': c['key_alias'],
+        }
+        for exe in ('jarsigner', 'zipalign'):
+            path = self.query_exe(exe)
+            inputs[exe] = hash_file(self.which(path) or path)
+        return inputs
+
+    def _run_items(self, action):
+        """Run the action's ACTION_item(platform, locale) method for every
+        repack item, in parallel, and record the failures it returns.
+        """
+        method_name = "%s_item" % action.replace('-', '_')
+        items = self.query_repack_items()
+        results = self.run_parallel(
+            method_name, items,
+            error_message="Uncaught exception in %s for %%(platform)s:%%(locale)s!" % method_name)
+        success_count = 0
+        for (platform, locale), result in zip(items, results):
+            if result:
+                self.add_failure(platform, locale, message=result)
+            else:
+                success_count += 1
+        self.summarize_success_count(success_count, len(items),
+                                     message=SUMMARY_MESSAGES[action])
+
+    # Per-item steps {{{2
+    # These run in parallel worker processes, so rather than calling
+    # add_failure() they return None for success or a failure message,
+    # which may use %(platform)s and %(locale)s.
+
+    def download_item(self, platform, locale):
+        c = self.config
+        installer_name = self.query_installer_name(platform, locale)
+        url = os.path.join(c['download_base_url'], installer_name)
+        file_path = self.query_installer_path('original', platform, locale)
+        if c.get('incremental_repack') and os.path.exists(file_path) and \
+                os.path.exists(url):
+            # copyfile(copystat=True) keeps the mtime
+            src, dest = os.stat(url), os.stat(file_path)
+            if (src.st_size, int(src.st_mtime)) == (dest.st_size, int(dest.st_mtime)):
+                self.info("%s is already downloaded." % installer_name)
+                return
+        self.mkdir_p(os.path.dirname(file_path))
+        if self.copyfile(url, file_path, copystat=True):
+            return "Unable to dowload %(platform)s:%(locale)s installer!"
+
+    def _fixup_omni_css(self, omni_ja, replace):
+        """Add the stylesheets in omni.ja that match c['fixup_omni_css']
+        to `replace', with the css-browserside.js fixups already applied.
+        Returns True for success, None for failure
+        """
+        patterns = self.config.get('fixup_omni_css', [])
+        omni_zip = zipfile.ZipFile(StringIO(omni_ja))
+        try:
+            for name in omni_zip.namelist():
+                if name in replace or \
+                        not [p for p in patterns if fnmatch.fnmatch(name, p)]:
+                    continue
+                try:
+                    replace[name] = fixup_css(omni_zip.read(name))
+                except JSError, e:
+                    self.error("Can't fix up %s: %s" % (name, str(e)))
+                    return
+                self.debug("Fixed up %s" % name)
+        finally:
+            omni_zip.close()
+        return True
+
+    def _repack_apk(self, orig_path, repack_path, tmp_dir):
+        """ Repack the apk with c['inserted_files'] added to its omni.ja,
+        and the stylesheets matching c['fixup_omni_css'] fixed up.
+        With c['shake_css_browserside'], css-browserside.js is cut down
+        to the modules the fixer uses first.
+
+        The apk is streamed through rewrite_zip() once: omni.ja is
+        rebuilt in memory, the signature in META-INF/ is dropped, and
+        every other member is copied without recompressing it.
+        tmp_dir is scratch space private to this apk.
         Returns True for success, None for failure
         """
         c = self.config
-        zip_bin = self.query_exe("zip")
-        unzip_bin = self.query_exe("unzip")
         file_name = os.path.basename(orig_path)
-        tmp_dir = os.path.join(self.config['work_dir'], 'tmp')
         tmp_file = os.path.join(tmp_dir, file_name)
-        tmp_chrome_content_dir = os.path.join(tmp_dir,"chrome","chrome", "content")
-        # Error checking for each step.
-        # Ignoring the mkdir_p()s since the subsequent copyfile()s will
-        # error out if unsuccessful.
         if self.rmtree(tmp_dir):
             return
-        self.mkdir_p(tmp_chrome_content_dir)
-        if self.copyfile(orig_path, tmp_file):
-            return
-
-        if self.run_command([unzip_bin, '-q', file_name, 'assets/omni.ja'],
-                            error_list=ZipErrorList,
-                            return_type='num_errors',
-                            cwd=tmp_dir):
-            self.error("Can't extract omni.ja from %s!" % file_name)
-            return
+        self.mkdir_p(tmp_dir)
 
+        inserted = {}
         for target_file in c['inserted_files']:
             origin_file = c['files_directory']
-            if self.copyfile("%s%s" % (origin_file, target_file), "%s/%s" % (tmp_chrome_content_dir, target_file)):
+            contents = self.read_from_file("%s%s" % (origin_file, target_file),
+                                           verbose=False, open_mode='rb')
+            if contents is None:
                 self.error("Can't find file %s in %s" % (target_file, origin_file))
-            else:
-                 if self.run_command([zip_bin, '-0r', 'assets/omni.ja',
-                             'chrome/chrome/content/%s' % target_file],
-                            error_list=ZipErrorList,
-                            return_type='num_errors',
-                            cwd=tmp_dir):
-                    self.error("Can't add %s to omni.ja!" % target_file)
+                continue
+            if target_file == 'css-browserside.js' and c.get('shake_css_browserside'):
+                try:
+                    contents = shake_bundle(contents)
+                except BundleError, e:
+                    self.error("Can't shake %s: %s" % (target_file, str(e)))
                     return
+            inserted['chrome/chrome/content/%s' % target_file] = contents
 
-        if self.run_command([zip_bin, '-0r', file_name, 'assets/omni.ja'],
-                            error_list=ZipErrorList,
-                            return_type='num_errors',
-                            cwd=tmp_dir):
-            self.error("Can't re-add omni.ja to %s!" % file_name)
-            return
-        if self.unsign_apk(tmp_file):
+        self.info("Repacking %s to %s" % (orig_path, tmp_file))
+        try:
+            apk = zipfile.ZipFile(orig_path)
+            try:
+                omni_ja = apk.read(OMNI_JA)
+            finally:
+                apk.close()
+            if c.get('fixup_omni_css') and \
+                    not self._fixup_omni_css(omni_ja, inserted):
+                return
+            new_omni_ja = StringIO()
+            rewrite_zip(StringIO(omni_ja), new_omni_ja, replace=inserted)
+            rewrite_zip(orig_path, tmp_file,
+                        replace={OMNI_JA: new_omni_ja.getvalue()},
+                        remove=['META-INF/*'])
+        except (zipfile.BadZipfile, zipfile.LargeZipFile, KeyError,
+                IOError, OSError), e:
+            self.error("Can't repack %s: %s" % (file_name, str(e)))
             return
         repack_dir = os.path.dirname(repack_path)
         self.mkdir_p(repack_dir)
-        if self.copyfile(tmp_file, repack_path):
+        if self.move(tmp_file, repack_path):
             return
         return True
 
-    def repack(self):
-        c = self.config
-        rc = self.query_release_config()
-        locales = self.query_locales()
-        success_count = total_count = 0
-        for platform in c['platforms']:
-            for locale in locales:
-                installer_name = c['installer_base_names'][platform] % {'version': rc['version'], 'locale': locale}
-                if self.query_failure(platform, locale):
-                    self.warning("%s:%s had previous issues; skipping!" % (platform, locale))
-                    continue
-                original_path = os.path.join(c['workdir'], 'original/%s/%s/%s' % (platform, locale, installer_name))
-                repack_path = os.path.join(c['workdir'], 'unsigned/%s/%s/%s' % (platform, locale, installer_name))
-                total_count += 1
-                if self._repack_apk(original_path, repack_path, rc['version']):
-                    success_count += 1
-                else:
-                    self.add_failure(platform, locale,
-                                     message="Unable to repack %(platform)s:%(locale)s installer!")
-        self.summarize_success_count(success_count, total_count,
-                                     message="Repacked %d of %d installers successfully.")
+    def repack_item(self, platform, locale):
+        original_path = self.query_installer_path('original', platform, locale)
+        repack_path = self.query_installer_path('unsigned', platform, locale)
+        tmp_dir = os.path.join(self.config['work_dir'], 'tmp', platform, locale)
+        inputs = self.query_repack_inputs(original_path)
+        if self.config.get('incremental_repack') and \
+                self.is_output_current(repack_path, inputs):
+            self.info("Reusing %s; its inputs haven't changed." % repack_path)
+            return
+        if self.remove_output(repack_path) or \
+                not self._repack_apk(original_path, repack_path, tmp_dir) or \
+                self.write_input_manifest(repack_path, inputs):
+            return "Unable to repack %(platform)s:%(locale)s installer!"
 
-    def _upload(self, dir_name=""):
+    def sign_item(self, platform, locale):
         c = self.config
-        rc = self.query_release_config()
-        locales = self.query_locales()
+        unsigned_path = self.query_installer_path('unsigned', platform, locale)
+        signed_path = self.query_installer_path('signed', platform, locale)
+        signed_dir = os.path.dirname(signed_path)
+        if not os.path.exists(unsigned_path):
+            return "Missing apk %s!" % unsigned_path
+        inputs = self.query_sign_inputs(unsigned_path)
+        if c.get('incremental_repack') and \
+                self.is_output_current(signed_path, inputs):
+            self.info("Reusing %s; its inputs haven't changed." % signed_path)
+            return
+        if self.remove_output(signed_path):
+            return "Unable to remove the old %(platform)s:%(locale)s apk!"
+        self.info("Signing %s %s." % (platform, locale))
+        # Sign a copy, so the unsigned apk stays as repack left it and
+        # its input manifest stays valid.
+        tmp_path = os.path.join(c['work_dir'], 'tmp', 'sign', platform, locale,
+                                os.path.basename(unsigned_path))
+        self.mkdir_p(os.path.dirname(tmp_path))
+        if self.copyfile(unsigned_path, tmp_path):
+            return "Unable to copy %s!" % unsigned_path
+        if self.sign_apk(tmp_path, c['keystore'],
+                         c['sign_password'], c['sign_password'],
+                         c['key_alias']) != 0:
+            return "Unable to sign %(platform)s:%(locale)s apk!"
+        # verify signatures.
+        status = self.verify_android_signature(
+            tmp_path,
+            script=c['signature_verification_script'],
+            tools_dir=c['tools_dir'],
+            key_alias=c['key_alias'],
+        )
+        if status:
+            # No need to rm because upload is per-locale
+            return "Errors verifying %s binary!" % unsigned_path
+        self.mkdir_p(signed_dir)
+        if self.align_apk(tmp_path, signed_path):
+            self.rmtree(signed_dir)
+            return "Unable to align %(platform)s:%(locale)s apk!"
+        if self.write_input_manifest(signed_path, inputs):
+            return "Unable to record the inputs of %(platform)s:%(locale)s apk!"
+
+    def upload_signed_bits_item(self, platform, locale):
+        signed_path = self.query_installer_path('signed', platform, locale)
+        dest_path = os.path.join(self.config['output_dir'],
+                                 os.path.basename(signed_path))
+        if self.copyfile(signed_path, dest_path):
+            return "Unable to copy %s!" % signed_path
+
+    # Actions {{{2
+    # With --pipeline, the *_item() methods are pipelined by
+    # BaseScript.run_pipeline() and these aren't called, so setup goes in
+    # the preflight_*() methods.
+
+    def preflight_download(self):
+        # Clear the work folder, unless the repack is incremental; then
+        # the input manifests say what can be reused.
+        workdir = self.config['workdir']
+        if not self.config.get('incremental_repack'):
+            self.rmtree(workdir)
+        self.mkdir_p(workdir)
+
+    def download(self):
+        self._run_items('download')
+
+    def repack(self):
+        self._run_items('repack')
+
+    def sign(self):
+        self._run_items('sign')
+
+    def preflight_upload_signed_bits(self):
         # Clear the output folder
-        output_dir = c['output_dir']
+        output_dir = self.config['output_dir']
         self.rmtree(output_dir)
         self.mkdir_p(output_dir)
-        success_count = total_count = 0
-        for platform in c['platforms']:
-            for locale in locales:
-                installer_name = c['installer_base_names'][platform] % {'version': rc['version'], 'locale': locale}
-                signed_path = os.path.join(c['workdir'], 'signed/%s/%s/%s' % (platform, locale, installer_name))
-                dest_path = os.path.join(output_dir, installer_name)
-                total_count += 1
-                if self.copyfile(signed_path, dest_path):
-                    self.add_failure(platform, locale,
-                                     message="Unable to copy %s!" % filename)
-                    self.rmtree(signed_dir)
-                else:
-                    success_count += 1
-        self.summarize_success_count(success_count, total_count,
-                                     message="Uploaded %d of %d apks successfully.")
-
-    def sign(self):
-        c = self.config
-        rc = self.query_release_config()
-        locales = self.query_locales()
-        success_count = total_count = 0
-        for platform in c['platforms']:
-            for locale in locales:
-                installer_name = c['installer_base_names'][platform] % {'version': rc['version'], 'locale': locale}
-                if self.query_failure(platform, locale):
-                    self.warning("%s:%s had previous issues; skipping!" % (platform, locale))
-                    continue
-                unsigned_path = os.path.join(c['workdir'], 'unsigned/%s/%s/%s' % (platform, locale, installer_name))
-                signed_dir = os.path.join(c['workdir'], 'signed/%s/%s/' % (platform, locale))
-                signed_path = os.path.join(signed_dir, installer_name)
-                total_count += 1
-                self.info("Signing %s %s." % (platform, locale))
-                if not os.path.exists(unsigned_path):
-                    self.error("Missing apk %s!" % unsigned_path)
-                    continue
-                if self.sign_apk(unsigned_path, c['keystore'],
-                                 c['sign_password'], c['sign_password'],
-                                 c['key_alias']) != 0:
-                    self.add_summary("Unable to sign %s:%s apk!" % (platform, locale), level=FATAL)
-                else:
-                    # verify signatures.
-                    status = self.verify_android_signature(
-                        unsigned_path,
-                        script=c['signature_verification_script'],
-                        tools_dir=c['tools_dir'],
-                        key_alias=c['key_alias'],
-                    )
-                    if status:
-                        self.add_failure(platform, locale, message="Errors verifying %s binary!" % unsigned_path)
-                        # No need to rm because upload is per-locale
-                        continue
-                    self.mkdir_p(signed_dir)
-                    if self.align_apk(unsigned_path, signed_path):
-                        self.add_failure(platform, locale,
-                                         message="Unable to align %(platform)s%(locale)s apk!")
-                        self.rmtree(signed_dir)
-                    else:
-                        success_count += 1
-        self.summarize_success_count(success_count, total_count,
-                                     message="Signed %d of %d apks successfully.")
 
     def upload_signed_bits(self):
-        self._upload(dir_name="partner-repacks")
+        self._run_items('upload-signed-bits')
 
 
 # main {{{1
@@ -0,0 +1,60 @@
+// Run bootstrap.createFixupRulesFromCSSFileContent() under node, for
+// test_mozilla_cssfixer.py.
+//
+// Usage: node cssfixer_node.js bootstrap.js css-browserside.js [cache.json] < input.json
+//
+// input.json is a list of stylesheets; prints a list of
+// {"css": result} or {"error": message} objects. A stylesheet given as
+// a list of chunks is fed to bootstrap.createFixupStream() instead.
+//
+// Given a packed cache, the stylesheets are looked up in it with
+// bootstrap.fixupCSSFileContent() instead, and misses are {"miss": true}.
+var crypto = require('crypto');
+var fs = require('fs');
+var vm = require('vm');
+
+var sandbox = {dump: function() {}};
+sandbox.window = sandbox;
+var context = vm.createContext(sandbox);
+vm.runInContext(fs.readFileSync(process.argv[3], 'utf8') +
+                '\nwindow.cssbrowserside = cssbrowserside;', context);
+vm.runInContext(fs.readFileSync(process.argv[2], 'utf8') +
+                '\nwindow.bootstrap = bootstrap;', context);
+
+var bootstrap = sandbox.bootstrap;
+var fixup = bootstrap.createFixupRulesFromCSSFileContent;
+if (process.argv[4]) {
+    var cache = bootstrap.fixupCache;
+    // No Components here: hash with node, and skip the profile store.
+    cache.hash = function(str) {
+        return crypto.createHash('sha1').update(Buffer.from(str, 'latin1')).digest('hex');
+    };
+    cache.init = function() {};
+    cache._entries = Object.create(null);
+    cache._packed = Object.create(null);
+    cache.load(fs.readFileSync(process.argv[4], 'utf8'), true);
+    bootstrap.createFixupRulesFromCSSFileContent = function() {
+        throw new Error('miss');
+    };
+    fixup = function(str) {
+        return bootstrap.fixupCSSFileContent(str, false);
+    };
+}
+
+var input = JSON.parse(fs.readFileSync(0, 'utf8'));
+function fixupChunks(chunks) {
+    var stream = bootstrap.createFixupStream();
+    return chunks.map(stream.feed).join('') + stream.close();
+}
+
+var output = input.map(function(str) {
+    try {
+        return {css: Array.isArray(str) ? fixupChunks(str) : fixup(str)};
+    } catch (e) {
+        if (e.message === 'miss') {
+            return {miss: true};
+        }
+        return {error: String(e)};
+    }
+});
+process.stdout.write(JSON.stringify(output));
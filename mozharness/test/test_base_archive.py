@@ -0,0 +1,214 @@
+from cStringIO import StringIO
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import unittest
+import zipfile
+
+from mozharness.base.archive import ZipIndex, extract_tar_stream, \
+    extract_zip, extract_zip_members, match_members, query_zip_index, \
+    rewrite_zip, INDEX_SUFFIX
+
+
+def make_test_zip():
+    """A small apk-like archive with both stored and deflated members."""
+    buf = StringIO()
+    zf = zipfile.ZipFile(buf, 'w')
+    for name, contents, compress_type in (
+            ('META-INF/MANIFEST.MF', 'Manifest-Version: 1.0\n', zipfile.ZIP_DEFLATED),
+            ('META-INF/CERT.RSA', 'signature', zipfile.ZIP_STORED),
+            ('classes.dex', 'dex' * 1000, zipfile.ZIP_DEFLATED),
+            ('assets/omni.ja', 'old omni.ja', zipfile.ZIP_STORED),
+            ('res/icon.png', 'png', zipfile.ZIP_STORED)):
+        zinfo = zipfile.ZipInfo(name, (2013, 1, 2, 3, 4, 6))
+        zinfo.compress_type = compress_type
+        zf.writestr(zinfo, contents)
+    zf.close()
+    return buf.getvalue()
+
+
+def raw_member(zf, name):
+    zinfo = zf.getinfo(name)
+    return zinfo.CRC, zinfo.compress_size, zinfo.compress_type
+
+
+class TestRewriteZip(unittest.TestCase):
+    def setUp(self):
+        self.src = make_test_zip()
+
+    def rewrite(self, **kwargs):
+        dest = StringIO()
+        names = rewrite_zip(StringIO(self.src), dest, **kwargs)
+        return names, zipfile.ZipFile(StringIO(dest.getvalue()))
+
+    def test_copy(self):
+        names, zf = self.rewrite()
+        src = zipfile.ZipFile(StringIO(self.src))
+        self.assertEqual(names, src.namelist())
+        self.assertEqual(zf.testzip(), None)
+        for name in src.namelist():
+            self.assertEqual(zf.read(name), src.read(name))
+            self.assertEqual(raw_member(zf, name), raw_member(src, name))
+            self.assertEqual(zf.getinfo(name).date_time,
+                             src.getinfo(name).date_time)
+
+    def test_remove(self):
+        names, zf = self.rewrite(remove=['META-INF/*'])
+        self.assertEqual(zf.namelist(),
+                         ['classes.dex', 'assets/omni.ja', 'res/icon.png'])
+        self.assertEqual(zf.testzip(), None)
+
+    def test_replace(self):
+        names, zf = self.rewrite(replace={'assets/omni.ja': 'new omni.ja',
+                                          'classes.dex': 'new dex' * 100})
+        self.assertEqual(names, zipfile.ZipFile(StringIO(self.src)).namelist())
+        self.assertEqual(zf.read('assets/omni.ja'), 'new omni.ja')
+        self.assertEqual(zf.read('classes.dex'), 'new dex' * 100)
+        self.assertEqual(zf.getinfo('classes.dex').compress_type,
+                         zipfile.ZIP_DEFLATED)
+        self.assertEqual(zf.getinfo('assets/omni.ja').compress_type,
+                         zipfile.ZIP_STORED)
+        self.assertEqual(zf.testzip(), None)
+
+    def test_add(self):
+        names, zf = self.rewrite(replace={'b/new.js': 'b', 'a/new.js': 'a'})
+        self.assertEqual(names[-2:], ['a/new.js', 'b/new.js'])
+        self.assertEqual(zf.read('a/new.js'), 'a')
+        self.assertEqual(zf.getinfo('b/new.js').compress_type,
+                         zipfile.ZIP_STORED)
+        self.assertEqual(zf.testzip(), None)
+
+    def test_nested(self):
+        """Rebuild a member archive in memory, the way the partner
+        repack rebuilds omni.ja inside an apk.
+        """
+        inner = StringIO()
+        rewrite_zip(StringIO(make_test_zip()), inner,
+                    replace={'chrome/chrome/content/browser.js': 'js'})
+        names, zf = self.rewrite(replace={'assets/omni.ja': inner.getvalue()},
+                                 remove=['META-INF/*'])
+        omni_ja = zipfile.ZipFile(StringIO(zf.read('assets/omni.ja')))
+        self.assertEqual(omni_ja.read('chrome/chrome/content/browser.js'), 'js')
+        self.assertEqual(omni_ja.testzip(), None)
+
+    def test_bad_zip(self):
+        self.assertRaises(zipfile.BadZipfile, rewrite_zip,
+                          StringIO('not a zip'), StringIO())
+
+
+class NonSeekable(object):
+    def __init__(self, data):
+        self.fh = StringIO(data)
+
+    def read(self, size=-1):
+        return self.fh.read(size)
+
+
+class TestExtract(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_extract_zip(self):
+        buf = StringIO()
+        zf = zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED)
+        zinfo = zipfile.ZipInfo('bin/run.sh')
+        zinfo.external_attr = 0755 << 16L
+        zf.writestr(zinfo, '#!/bin/sh\n')
+        zf.writestr('mochitest/a/test.html', 'a' * 1000)
+        zf.writestr('reftest/b.html', 'b')
+        zf.writestr('../evil', 'evil')
+        zf.close()
+        names = extract_zip(StringIO(buf.getvalue()), self.tmpdir,
+                            ['bin/*', 'mochitest/*', '../*'])
+        self.assertEqual(names, ['bin/run.sh', 'mochitest/a/test.html'])
+        self.assertEqual(open(os.path.join(self.tmpdir, 'mochitest', 'a', 'test.html')).read(),
+                         'a' * 1000)
+        self.assertTrue(os.access(os.path.join(self.tmpdir, 'bin', 'run.sh'), os.X_OK))
+        self.assertEqual(os.path.getmtime(os.path.join(self.tmpdir, 'bin', 'run.sh')),
+                         time.mktime((1980, 1, 1, 0, 0, 0, 0, 0, -1)))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'reftest')))
+        self.assertEqual(match_members(['a', 'b/c'], None), ['a', 'b/c'])
+
+    def test_extract_tar_stream(self):
+        buf = StringIO()
+        tar = tarfile.open(fileobj=buf, mode='w:gz')
+        for name, contents in (('dir/a.txt', 'a'), ('dir/sub/b.txt', 'b' * 5000)):
+            info = tarfile.TarInfo(name)
+            info.size = len(contents)
+            tar.addfile(info, StringIO(contents))
+        info = tarfile.TarInfo('readonly')
+        info.type = tarfile.DIRTYPE
+        info.mode = 0555
+        tar.addfile(info)
+        info = tarfile.TarInfo('readonly/c.txt')
+        info.size = 1
+        tar.addfile(info, StringIO('c'))
+        tar.close()
+        names = extract_tar_stream(NonSeekable(buf.getvalue()), self.tmpdir, 'gz')
+        self.assertEqual(names, ['dir/a.txt', 'dir/sub/b.txt', 'readonly', 'readonly/c.txt'])
+        self.assertEqual(open(os.path.join(self.tmpdir, 'dir', 'sub', 'b.txt')).read(),
+                         'b' * 5000)
+        readonly = os.path.join(self.tmpdir, 'readonly')
+        self.assertEqual(open(os.path.join(readonly, 'c.txt')).read(), 'c')
+        os.chmod(readonly, 0755)
+
+
+class TestZipIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.zip_path = os.path.join(self.tmpdir, 'tests.zip')
+        self.contents = {}
+        zf = zipfile.ZipFile(self.zip_path, 'w', zipfile.ZIP_DEFLATED)
+        for directory in ('bin', 'mochitest', 'reftest'):
+            for i in range(20):
+                name = '%s/dir%d/%d.txt' % (directory, i % 3, i)
+                self.contents[name] = ('%s %d\n' % (directory, i)) * (i * 50)
+                zf.writestr(name, self.contents[name])
+        zf.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_query_zip_index(self):
+        index = query_zip_index(self.zip_path)
+        self.assertTrue(os.path.exists(self.zip_path + INDEX_SUFFIX))
+        saved = ZipIndex.load(self.zip_path + INDEX_SUFFIX, key=index.key)
+        self.assertEqual([(m.filename, m.header_offset, m.CRC, m.date_time)
+                          for m in saved.members],
+                         [(m.filename, m.header_offset, m.CRC, m.date_time)
+                          for m in index.members])
+        self.assertEqual(ZipIndex.load(self.zip_path + INDEX_SUFFIX, key=[0, 0]), None)
+        # An index saved without some of the fields isn't used.
+        old = ZipIndex(index.members, key=index.key)
+        old.FIELDS = ZipIndex.FIELDS[:-1]
+        old.save(self.zip_path + INDEX_SUFFIX)
+        self.assertEqual(ZipIndex.load(self.zip_path + INDEX_SUFFIX, key=index.key), None)
+        self.assertEqual(sorted(index.by_directory), ['bin', 'mochitest', 'reftest'])
+
+    def test_query_members(self):
+        index = query_zip_index(self.zip_path)
+        names = [m.filename for m in index.query_members(['reftest/*', 'bin/dir1/*'])]
+        self.assertEqual(sorted(names),
+                         sorted([n for n in self.contents if n.startswith('reftest/') or
+                                 n.startswith('bin/dir1/')]))
+        self.assertEqual(len(index.query_members(['*/dir2/*'])), 3 * 6)
+        self.assertEqual(len(index.query_members()), 60)
+
+    def test_extract_zip_members(self):
+        index = query_zip_index(self.zip_path)
+        members = index.query_members(['mochitest/*', 'bin/*'])
+        names = extract_zip_members(lambda: open(self.zip_path, 'rb'), members,
+                                    self.tmpdir, num_workers=3)
+        self.assertEqual(sorted(names), sorted([m.filename for m in members]))
+        for name in names:
+            self.assertEqual(open(os.path.join(self.tmpdir, name)).read(),
+                             self.contents[name])
+        for zinfo in members:
+            self.assertEqual(os.path.getmtime(os.path.join(self.tmpdir, zinfo.filename)),
+                             time.mktime(zinfo.date_time + (0, 0, -1)))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'reftest')))
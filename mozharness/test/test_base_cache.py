@@ -0,0 +1,213 @@
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+
+from mozharness.base.cache import ArtifactCache, VirtualenvCache, \
+    Wheelhouse, link_or_copy
+
+CONTENTS = 'artifact\n' * 100
+VALIDATORS = {'etag': '"abc"', 'last-modified': None, 'content-length': '900'}
+
+
+class TestArtifactCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = ArtifactCache(os.path.join(self.tmpdir, 'cache'))
+        self.src = self.path('src')
+        open(self.src, 'wb').write(CONTENTS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def test_link_or_copy(self):
+        self.assertTrue(link_or_copy(self.src, self.path('dest')) in
+                        ('reflink', 'hardlink', 'copy'))
+        self.assertEqual(open(self.path('dest'), 'rb').read(), CONTENTS)
+
+    def test_by_url(self):
+        url = 'http://example.com/a.zip'
+        self.assertEqual(self.cache.fetch(self.path('dest'), url=url,
+                                          validators=VALIDATORS), None)
+        object_path = self.cache.store(self.src, url=url, validators=VALIDATORS)
+        self.assertEqual(os.path.basename(object_path),
+                         hashlib.sha512(CONTENTS).hexdigest())
+        self.assertFalse(os.stat(object_path).st_mode & stat.S_IWUSR)
+        # The job's own file stays writable, and isn't the cache's.
+        self.assertTrue(os.stat(self.src).st_mode & stat.S_IWUSR)
+        open(self.src, 'r+b').write('changed')
+        self.assertEqual(open(object_path, 'rb').read(), CONTENTS)
+        self.assertTrue(self.cache.fetch(self.path('dest'), url=url,
+                                         validators=dict(VALIDATORS)))
+        self.assertEqual(open(self.path('dest'), 'rb').read(), CONTENTS)
+        changed = dict(VALIDATORS, etag='"def"')
+        self.assertEqual(self.cache.fetch(self.path('dest2'), url=url,
+                                          validators=changed), None)
+        self.assertEqual(self.cache.fetch(self.path('dest2'), url=url + '?x',
+                                          validators=VALIDATORS), None)
+
+    def test_fetched_file_is_the_jobs(self):
+        object_path = self.cache.store(self.src)
+        checksum = os.path.basename(object_path)
+        self.assertNotEqual(self.cache.fetch(self.path('dest'), checksum=checksum),
+                            'hardlink')
+        # e.g. making a downloaded tool executable
+        os.chmod(self.path('dest'), 0755)
+        open(self.path('dest'), 'r+b').write('changed')
+        self.assertEqual(stat.S_IMODE(os.stat(object_path).st_mode), 0444)
+        self.assertEqual(open(object_path, 'rb').read(), CONTENTS)
+        cache = ArtifactCache(self.cache.cache_dir, link_mode='hardlink')
+        self.assertEqual(cache.fetch(self.path('dest2'), checksum=checksum),
+                         'hardlink')
+        self.assertFalse(os.stat(self.path('dest2')).st_mode & stat.S_IWUSR)
+
+    def test_without_validators(self):
+        url = 'http://example.com/a.zip'
+        validators = {'etag': None, 'last-modified': None, 'content-length': '900'}
+        self.cache.store(self.src, url=url, validators=validators)
+        self.assertEqual(self.cache.fetch(self.path('dest'), url=url,
+                                          validators=validators), None)
+
+    def test_by_checksum(self):
+        sha1 = hashlib.sha1(CONTENTS).hexdigest()
+        self.cache.store(self.src, checksum=sha1, hash_type='sha1')
+        self.assertTrue(self.cache.fetch(self.path('dest'), checksum=sha1,
+                                         hash_type='sha1'))
+        self.assertEqual(open(self.path('dest'), 'rb').read(), CONTENTS)
+        self.assertEqual(self.cache.fetch(self.path('dest'), checksum='0' * 40,
+                                          hash_type='sha1'), None)
+
+    def test_evict(self):
+        paths = []
+        for i in range(3):
+            src = self.path('src%d' % i)
+            open(src, 'wb').write(CONTENTS[:-1] + str(i))
+            paths.append(self.cache.store(src))
+            # make them clearly older than the one used below
+            os.utime(paths[-1], (time.time() - 100 + i, time.time() - 100 + i))
+        self.cache.fetch(self.path('dest'), checksum=os.path.basename(paths[0]))
+        self.cache.max_size = 2 * len(CONTENTS)
+        self.assertEqual(self.cache.evict(), [paths[1]])
+        self.assertTrue(os.path.exists(paths[0]))
+        self.assertTrue(os.path.exists(paths[2]))
+
+
+class TestVirtualenvCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = VirtualenvCache(self.path('cache'))
+        self.venv = self.make_venv(self.path('venv'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, *names):
+        return os.path.join(self.tmpdir, *names)
+
+    def make_venv(self, venv):
+        os.makedirs(os.path.join(venv, 'bin'))
+        os.makedirs(os.path.join(venv, 'lib', 'site-packages'))
+        os.makedirs(os.path.join(venv, 'cache'))
+        script = os.path.join(venv, 'bin', 'pip')
+        open(script, 'wb').write('#!%s/bin/python\nimport pip\n' % venv)
+        os.chmod(script, 0755)
+        open(os.path.join(venv, 'lib', 'site-packages', 'module.py'),
+             'wb').write('x = 1\n')
+        open(os.path.join(venv, 'cache', 'module.tar.gz'), 'wb').write('x')
+        os.symlink(os.path.join(venv, 'lib'), os.path.join(venv, 'lib64'))
+        return venv
+
+    def test_fetch_relocated(self):
+        self.cache = VirtualenvCache(self.path('cache'), link_mode='hardlink')
+        self.assertEqual(self.cache.fetch('key', self.path('other')), None)
+        self.cache.store('key', self.venv, ignore=['cache'])
+        self.assertEqual(self.cache.fetch('key', self.path('other')), 3)
+        self.assertEqual(open(self.path('other', 'bin', 'pip')).read(),
+                         '#!%s/bin/python\nimport pip\n' % self.path('other'))
+        self.assertTrue(os.access(self.path('other', 'bin', 'pip'), os.X_OK))
+        self.assertEqual(os.readlink(self.path('other', 'lib64')),
+                         self.path('venv', 'lib'))
+        self.assertFalse(os.path.exists(self.path('other', 'cache')))
+        module = self.path('other', 'lib', 'site-packages', 'module.py')
+        self.assertEqual(open(module).read(), 'x = 1\n')
+        self.assertEqual(os.stat(module).st_nlink, 2)
+        self.assertEqual(os.stat(self.path('other', 'bin', 'pip')).st_nlink, 1)
+
+    def test_writes_to_fetched_files(self):
+        pth = os.path.join(self.venv, 'lib', 'site-packages', 'easy-install.pth')
+        open(pth, 'wb').write('./module.egg\n')
+        module = os.path.join('lib', 'site-packages', 'module.py')
+        for link_mode in ('reflink', 'hardlink'):
+            cache = VirtualenvCache(self.path('cache-' + link_mode),
+                                    link_mode=link_mode)
+            template = os.path.join(cache.store('key', self.venv), 'venv')
+            dest = self.path('other-' + link_mode)
+            cache.fetch('key', dest)
+            # what pip and activate scripts do
+            for rel_path in (os.path.join('bin', 'pip'),
+                             os.path.relpath(pth, self.venv)):
+                open(os.path.join(dest, rel_path), 'ab').write('# changed\n')
+                self.assertFalse('changed' in
+                                 open(os.path.join(template, rel_path)).read())
+            if link_mode != 'hardlink':
+                open(os.path.join(dest, module), 'ab').write('# changed\n')
+                self.assertEqual(open(os.path.join(template, module)).read(),
+                                 'x = 1\n')
+
+    def test_binary_reference(self):
+        open(os.path.join(self.venv, 'bin', 'launcher.exe'), 'wb').write(
+            'MZ\0%s\0' % self.venv)
+        self.cache.store('key', self.venv)
+        self.assertEqual(self.cache.fetch('key', self.path('other')), None)
+        shutil.rmtree(self.venv)
+        self.assertEqual(self.cache.fetch('key', self.venv), 5)
+        self.assertTrue(os.path.exists(os.path.join(self.venv, 'bin', 'launcher.exe')))
+
+    def test_evict(self):
+        for i in range(3):
+            self.cache.store('key%d' % i, self.venv)
+            meta_path = os.path.join(self.cache.query_template_path('key%d' % i),
+                                     'meta.json')
+            os.utime(meta_path, (time.time() - 100 + i, time.time() - 100 + i))
+        self.cache.fetch('key0', self.path('other'))
+        self.cache.max_size = 2 * self.cache.query_templates()[0][1]
+        removed = self.cache.evict()
+        self.assertEqual(len(removed), 1)
+        self.assertEqual(sorted(os.listdir(self.cache.venvs_dir)), ['key0', 'key2'])
+
+
+class TestWheelhouse(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.wheelhouse = Wheelhouse(os.path.join(self.tmpdir, 'cache'))
+        self.wheels = []
+        for name in ('mozinfo-0.7-py2-none-any.whl', 'mozfile-1.1-py2-none-any.whl'):
+            path = os.path.join(self.tmpdir, name)
+            open(path, 'wb').write(name)
+            self.wheels.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_store_fetch(self):
+        dest_dir = os.path.join(self.tmpdir, 'dest')
+        self.assertEqual(self.wheelhouse.fetch('key', dest_dir), None)
+        self.wheelhouse.store('key', self.wheels)
+        self.wheelhouse.store('other', self.wheels[1:])
+        paths = self.wheelhouse.fetch('key', dest_dir)
+        self.assertEqual([os.path.basename(path) for path in paths],
+                         [os.path.basename(path) for path in self.wheels])
+        self.assertEqual(open(paths[1]).read(), 'mozfile-1.1-py2-none-any.whl')
+        self.assertEqual(len(self.wheelhouse.cache.query_objects()), 2)
+
+    def test_evicted(self):
+        self.wheelhouse.store('key', self.wheels)
+        os.remove(self.wheelhouse.cache.lookup(
+            checksum=hashlib.sha512('mozfile-1.1-py2-none-any.whl').hexdigest()))
+        self.assertEqual(self.wheelhouse.lookup('key'), None)
@@ -1,4 +1,6 @@
 import os
+import shutil
+import tempfile
 import unittest
 
 JSON_TYPE = None
@@ -99,6 +101,95 @@ class TestParseConfigFile(unittest.TestCase):
                       '--opt-cfg', 'test/test_optional.py'])
         self.assertEqual(c._config['keep_string'], "don't change me")
 
+
+
+class TestConfigCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.cfg = os.path.join(self.tmpdir, 'cfg.py')
+        self.write_cfg("config = {'value': 'one', 'nested': {'list': [1, 2]}}")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_cfg(self, contents):
+        fh = open(self.cfg, 'w')
+        fh.write(contents)
+        fh.close()
+
+    def parse(self, *args):
+        c = config.BaseConfig(initial_config_file='test/test.py')
+        c.parse_args(['--cfg', self.cfg, '--config-cache-dir', self.cache_dir,
+                      '--cache-python-configs'] + list(args))
+        return c._config
+
+    def test_cached(self):
+        self.assertEqual(self.parse()['value'], 'one')
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        parse_config_file = config.parse_config_file
+
+        def fail(file_name, *args, **kwargs):
+            if file_name == self.cfg:
+                raise AssertionError("parsed a cached config")
+            return parse_config_file(file_name, *args, **kwargs)
+        config.parse_config_file = fail
+        try:
+            cached = self.parse()
+        finally:
+            config.parse_config_file = parse_config_file
+        self.assertEqual(cached['nested'], {'list': [1, 2]})
+
+    def test_changed_file(self):
+        self.parse()
+        # same size; only the contents tell
+        self.write_cfg("config = {'value': 'two', 'nested': {'list': [1, 2]}}")
+        os.utime(self.cfg, (0, 0))
+        self.assertEqual(self.parse()['value'], 'two')
+
+    def test_environment(self):
+        self.parse()
+        os.environ['MOZHARNESS_CONFIG_CACHE_TEST'] = '1'
+        try:
+            self.parse()
+        finally:
+            del os.environ['MOZHARNESS_CONFIG_CACHE_TEST']
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        home = os.environ.get('HOME')
+        os.environ['HOME'] = self.tmpdir
+        try:
+            self.parse()
+        finally:
+            if home is None:
+                del os.environ['HOME']
+            else:
+                os.environ['HOME'] = home
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    def test_python_configs_opt_in(self):
+        c = config.BaseConfig(initial_config_file='test/test.py')
+        c.parse_args(['--cfg', self.cfg, '--config-cache-dir', self.cache_dir])
+        self.assertEqual(c._config['value'], 'one')
+        self.assertFalse(os.path.exists(self.cache_dir))
+        json_cfg = os.path.join(self.tmpdir, 'cfg.json')
+        fh = open(json_cfg, 'w')
+        fh.write('{"value": "json"}')
+        fh.close()
+        c = config.BaseConfig(initial_config_file='test/test.py')
+        c.parse_args(['--cfg', json_cfg, '--config-cache-dir', self.cache_dir])
+        self.assertEqual(c._config['value'], 'json')
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    def test_no_config_cache(self):
+        self.assertEqual(self.parse('--no-config-cache')['value'], 'one')
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_unpicklable(self):
+        self.write_cfg("config = {'function': lambda: None}")
+        self.assertTrue(callable(self.parse()['function']))
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+
 class TestReadOnlyDict(unittest.TestCase):
     control_dict = {
         'b': '2',
@@ -245,6 +336,96 @@ class TestReadOnlyDict(unittest.TestCase):
         c['e'] = 'hey'
         self.assertEqual(c['e'], 'hey', "can't set var in ROD after deepcopy")
 
+    def test_lock_freezes_values(self):
+        r = self.get_locked_ROD()
+        self.assertTrue(all([config.is_locked(v) for v in dict.values(r)
+                             if not isinstance(v, str)]))
+        self.assertTrue(dict.__getitem__(r, 'd') is r['d'])
+        self.assertEqual(self.control_dict['d'], {'turtles': ['turtle1']})
+
+    def test_locked_source_mutate(self):
+        d = {'a': [1]}
+        r = config.ReadOnlyDict(d)
+        r.lock()
+        d['a'].append(2)
+        self.assertEqual(r['a'], (1, ))
+
+    def test_locked_dict_mutate(self):
+        r = config.ReadOnlyDict({'a': [1]})
+        r.lock()
+        with self.assertRaises(AttributeError):
+            dict(r)['a'].append(2)
+        self.assertEqual(r['a'], (1, ))
+
+    def test_locked_kwargs_mutate(self):
+        r = config.ReadOnlyDict({'a': [1]})
+        r.lock()
+
+        def f(a):
+            a.append(2)
+        with self.assertRaises(AttributeError):
+            f(**r)
+        self.assertEqual(r['a'], (1, ))
+
+    def test_lock_shares_locked_values(self):
+        r = self.get_locked_ROD()
+        c = config.ReadOnlyDict({'d': r['d'], 'x': ['y']})
+        c.lock()
+        self.assertTrue(c['d'] is r['d'])
+        self.assertEqual(c['x'], ('y', ))
+
+    def test_locked_copy(self):
+        r = self.get_locked_ROD()
+        c = r.copy()
+        with self.assertRaises(AttributeError):
+            c['d']['turtles'].append('turtle2')
+
+    def test_deepcopy_is_writable(self):
+        r = self.get_locked_ROD()
+        c = deepcopy(r)
+        c['d']['turtles'].append('turtle2')
+        c['e'][2]['turtles'].append('turtle2')
+        self.assertEqual(r['d']['turtles'], ('turtle1', ))
+        self.assertEqual(r['e'][2]['turtles'], ('turtle1', ))
+        self.assertEqual(c['e'][2]['turtles'], ['turtle1', 'turtle2'])
+
+    def test_deepcopy_dict_mutate(self):
+        r = self.get_locked_ROD()
+        d = dict(deepcopy(r))
+        d['e'].append('h')
+        d['d']['turtles'].append('turtle2')
+        self.assertEqual(r['e'][:2], ('f', 'g'))
+        self.assertEqual(len(r['e']), 3)
+        self.assertEqual(r['d']['turtles'], ('turtle1', ))
+
+    def test_deepcopy_update_mutate(self):
+        r = self.get_locked_ROD()
+        d = {}
+        d.update(deepcopy(r))
+        self.assertFalse(config.is_locked(d['d']))
+        d['d']['x'] = 1
+        d['e'][2]['turtles'].append('turtle2')
+        self.assertFalse('x' in r['d'])
+        self.assertEqual(r['e'][2]['turtles'], ('turtle1', ))
+
+    def test_deepcopy_kwargs_mutate(self):
+        r = self.get_locked_ROD()
+
+        def f(e, **kwargs):
+            e.append('h')
+            kwargs['c']['d'] = '5'
+        f(**deepcopy(r))
+        self.assertEqual(len(r['e']), 3)
+        self.assertEqual(r['c']['d'], '4')
+
+    def test_with_overrides(self):
+        r = self.get_locked_ROD()
+        o = r.with_overrides({'b': '3', 'x': ['y']})
+        self.assertEqual((o['b'], o['x'], r['b']), ('3', ('y', ), '2'))
+        self.assertTrue(o['c'] is r['c'])
+        self.assertFalse('x' in r)
+        self.assertRaises(AssertionError, o.update, {})
+
 class TestActions(unittest.TestCase):
     all_actions = ['a', 'b', 'c', 'd', 'e']
     default_actions = ['b', 'c', 'd']
@@ -0,0 +1,121 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from mozharness.base.deleter import DeletionService, delete_tree, \
+    query_pending_deletions, TRASH_SUFFIX
+import mozharness.base.deleter
+from mozharness.base.log import LogMixin
+from mozharness.base.script import ScriptMixin
+
+
+def make_tree(root, width=3, depth=3):
+    for i in range(width):
+        path = os.path.join(root, 'dir%d' % i)
+        os.makedirs(path)
+        for j in range(width):
+            open(os.path.join(path, 'file%d' % j), 'wb').write('x' * 5000)
+        if depth > 1:
+            make_tree(path, width, depth - 1)
+
+
+class DeleteScript(ScriptMixin, LogMixin):
+    def __init__(self, pending_dir):
+        self.config = {'log_to_console': False, 'global_retries': 1,
+                       'pending_deletions_dir': pending_dir}
+        self.log_obj = None
+
+
+class TestDeleteTree(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.tree = os.path.join(self.tmpdir, 'tree')
+        make_tree(self.tree)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_delete_tree(self):
+        os.symlink(self.tmpdir, os.path.join(self.tree, 'dir0', 'link'))
+        read_only = os.path.join(self.tree, 'dir1', 'dir0')
+        os.chmod(read_only, 0500)
+        progress = []
+        self.assertEqual(delete_tree(self.tree, num_workers=4,
+                                     on_progress=progress.append)[0],
+                         3 * 3 + 9 * 3 + 27 * 3 + 1)
+        self.assertFalse(os.path.exists(self.tree))
+        self.assertTrue(os.path.isdir(self.tmpdir))
+        self.assertTrue(progress[0] > 0)
+        self.assertEqual(delete_tree(self.tree), (0, 0))
+
+    def test_hardlinks_free_nothing(self):
+        path = os.path.join(self.tree, 'dir0', 'file0')
+        os.link(path, os.path.join(self.tmpdir, 'other'))
+        self.assertEqual(delete_tree(path), (1, 0))
+
+    def test_small_chunks(self):
+        chunk_size = mozharness.base.deleter.CHUNK_SIZE
+        mozharness.base.deleter.CHUNK_SIZE = 2
+        try:
+            delete_tree(self.tree, num_workers=3)
+        finally:
+            mozharness.base.deleter.CHUNK_SIZE = chunk_size
+        self.assertFalse(os.path.exists(self.tree))
+
+
+class TestDeletionService(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.tree = os.path.join(self.tmpdir, 'tree')
+        self.pending_dir = os.path.join(self.tmpdir, 'pending')
+        make_tree(self.tree)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_delete(self):
+        messages = []
+        service = DeletionService(self.pending_dir, log_fn=messages.append)
+        trash_path = service.delete(self.tree)
+        self.assertFalse(os.path.exists(self.tree))
+        self.assertTrue(trash_path.endswith(TRASH_SUFFIX))
+        self.assertEqual(os.path.dirname(trash_path), self.tmpdir)
+        self.assertEqual(service.wait(), [])
+        self.assertEqual(service.query_pending(), [])
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['pending'])
+        self.assertEqual(os.listdir(self.pending_dir), [])
+        self.assertTrue(messages[0].startswith('Deleted %s: 117 files' % trash_path))
+
+    def test_sweep(self):
+        # A deletion left behind by a process that's gone.
+        proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+        proc.wait()
+        service = DeletionService(self.pending_dir)
+        trash_path = service.query_trash_path(self.tree)
+        os.rename(self.tree, trash_path)
+        os.makedirs(self.pending_dir)
+        service._write_record(os.path.join(self.pending_dir, 'old.json'), {
+            'path': trash_path, 'pid': proc.pid, 'device': 0, 'bytes_left': 10,
+        })
+        records = query_pending_deletions(self.pending_dir)
+        self.assertEqual([(r['path'], r['alive']) for r in records],
+                         [(trash_path, False)])
+        self.assertEqual(service.sweep(), [trash_path])
+        service.wait()
+        self.assertFalse(os.path.exists(trash_path))
+        self.assertEqual(query_pending_deletions(self.pending_dir), [])
+
+    def test_rmtree_background(self):
+        s = DeleteScript(self.pending_dir)
+        self.assertEqual(s.rmtree(self.tree, background=True), None)
+        self.assertFalse(os.path.exists(self.tree))
+        self.assertEqual(s.wait_for_deletions(), None)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['pending'])
+
+    def test_rmtree(self):
+        s = DeleteScript(self.pending_dir)
+        self.assertEqual(s.rmtree(self.tree), None)
+        self.assertEqual(os.listdir(self.tmpdir), [])
@@ -0,0 +1,278 @@
+import BaseHTTPServer
+from cStringIO import StringIO
+import hashlib
+import os
+import shutil
+import SocketServer
+import tarfile
+import tempfile
+import threading
+import unittest
+import zipfile
+
+try:
+    import simplejson as json
+    assert json
+except ImportError:
+    import json
+
+from mozharness.base.archive import extract_zip
+from mozharness.base.download import ConnectionPool, Download, RangeFile, \
+    RangesNotSupported, PART_SUFFIX, STATE_SUFFIX
+from mozharness.base.log import LogMixin
+from mozharness.base.script import ScriptMixin
+
+FILES = {
+    '/small': 'small file\n' * 10,
+    '/big': ''.join([chr(i % 251) for i in range(100000)]),
+}
+
+
+def make_tests_zip():
+    buf = StringIO()
+    zf = zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED)
+    for directory in ('bin', 'mochitest', 'reftest', 'xpcshell'):
+        for i in range(10):
+            zf.writestr('%s/%d.txt' % (directory, i),
+                        ''.join([chr((i * 7 + j) % 256) for j in range(20000)]))
+    zf.close()
+    return buf.getvalue()
+
+
+def make_tarball():
+    buf = StringIO()
+    tar = tarfile.open(fileobj=buf, mode='w:bz2')
+    info = tarfile.TarInfo('emulator/avd.img')
+    info.size = 50000
+    tar.addfile(info, StringIO('x' * 50000))
+    tar.close()
+    return buf.getvalue()
+
+
+class RangeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(method='HEAD')
+
+    def do_GET(self, method='GET'):
+        server = self.server
+        server.requests.append((self.path, self.headers.get('range') or method))
+        if self.path.startswith('/redirect'):
+            self.send_response(302)
+            self.send_header('Location', self.path[len('/redirect'):])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path not in server.files:
+            self.send_error(404)
+            return
+        body = server.files[self.path]
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        start, end = 0, len(body)
+        range_header = self.headers.get('range')
+        if range_header and not server.no_ranges and self.headers.get('if-range', etag) == etag:
+            start, end = range_header.split('=')[1].split('-')
+            start, end = int(start), int(end or len(body) - 1) + 1
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end - 1, len(body)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start))
+        if not server.no_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.end_headers()
+        if method == 'HEAD':
+            return
+        if server.truncate_after is not None:
+            # Send part of the body, then drop the connection.
+            self.wfile.write(body[start:min(end, start + server.truncate_after)])
+            server.truncate_after = None
+            self.close_connection = 1
+            return
+        self.wfile.write(body[start:end])
+
+
+class RangeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections.
+        pass
+
+
+class DownloadScript(ScriptMixin, LogMixin):
+    def __init__(self):
+        self.config = {'log_to_console': False, 'global_retries': 1}
+        self.log_obj = None
+
+
+class TestDownload(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = RangeServer(('127.0.0.1', 0), RangeHandler)
+        self.server.files = dict(FILES)
+        self.server.files['/tests.zip'] = make_tests_zip()
+        self.server.files['/emulator.tar.bz2'] = make_tarball()
+        self.server.requests = []
+        self.server.truncate_after = None
+        self.server.no_ranges = False
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.pool = ConnectionPool(timeout=5)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def read(self, name):
+        return open(self.path(name), 'rb').read()
+
+    def test_download(self):
+        Download(self.pool, self.base_url + '/small', self.path('small')).run()
+        self.assertEqual(self.read('small'), FILES['/small'])
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['small'])
+
+    def test_segments(self):
+        download = Download(self.pool, self.base_url + '/big', self.path('big'),
+                            segments=4, min_segment_size=10000)
+        download.run()
+        self.assertEqual(self.read('big'), FILES['/big'])
+        ranges = sorted([r for _, r in self.server.requests if r != 'GET'])
+        self.assertEqual(ranges, ['bytes=25000-49999', 'bytes=50000-74999',
+                                  'bytes=75000-99999'])
+
+    def test_resume(self):
+        self.server.truncate_after = 30000
+        download = Download(self.pool, self.base_url + '/big', self.path('big'),
+                            block_size=1000)
+        self.assertRaises(Exception, download.run)
+        self.assertFalse(os.path.exists(self.path('big')))
+        state = json.load(open(self.path('big') + STATE_SUFFIX))
+        self.assertEqual(state['segments'], [[0, 100000, 30000]])
+        download = Download(self.pool, self.base_url + '/big', self.path('big'))
+        download.run()
+        self.assertEqual(download.resumed_bytes, 30000)
+        self.assertEqual(self.server.requests[-1], ('/big', 'bytes=30000-99999'))
+        self.assertEqual(self.read('big'), FILES['/big'])
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['big'])
+
+    def test_changed_on_server(self):
+        self.server.truncate_after = 30000
+        download = Download(self.pool, self.base_url + '/big', self.path('big'))
+        self.assertRaises(Exception, download.run)
+        self.server.files['/big'] = FILES['/small'] * 1000
+        Download(self.pool, self.base_url + '/big', self.path('big')).run()
+        self.assertEqual(self.read('big'), FILES['/small'] * 1000)
+
+    def test_redirect_and_keep_alive(self):
+        for i in range(3):
+            Download(self.pool, self.base_url + '/redirect/small',
+                     self.path('small%d' % i)).run()
+            self.assertEqual(self.read('small%d' % i), FILES['/small'])
+        self.assertEqual(self.pool.connections_made, 1)
+
+    def test_checksum(self):
+        s = DownloadScript()
+        url = self.base_url + '/small'
+        sha512 = hashlib.sha512(FILES['/small']).hexdigest()
+        self.assertEqual(s.download_file(url, parent_dir=self.tmpdir, checksum=sha512),
+                         self.path('small'))
+        os.remove(self.path('small'))
+        self.assertEqual(s.download_file(url, parent_dir=self.tmpdir, checksum='0' * 128),
+                         None)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_not_found(self):
+        s = DownloadScript()
+        self.assertEqual(s.download_file(self.base_url + '/missing',
+                                         parent_dir=self.tmpdir), None)
+
+    def test_file_url(self):
+        source = self.path('source')
+        open(source, 'wb').write(FILES['/small'])
+        s = DownloadScript()
+        self.assertEqual(s.download_file('file://' + source, file_name='copy',
+                                         parent_dir=self.tmpdir),
+                         self.path('copy'))
+        self.assertEqual(self.read('copy'), FILES['/small'])
+        self.assertFalse(os.path.exists(self.path('copy') + PART_SUFFIX))
+
+    def test_download_files(self):
+        s = DownloadScript()
+        downloads = [{'url': self.base_url + name, 'parent_dir': self.tmpdir}
+                     for name in ('/small', '/big', '/missing')]
+        self.assertEqual(s.download_files(downloads, num_workers=2),
+                         [self.path('small'), self.path('big'), None])
+        self.assertEqual(self.read('big'), FILES['/big'])
+        self.assertTrue(s.query_connection_pool().connections_made <= 2)
+
+    def test_artifact_cache(self):
+        s = DownloadScript()
+        s.config['artifact_cache_dir'] = self.path('cache')
+        url = self.base_url + '/big'
+        self.assertEqual(s.download_file(url, file_name='one', parent_dir=self.tmpdir),
+                         self.path('one'))
+        self.assertEqual(s.download_file(url, file_name='two', parent_dir=self.tmpdir),
+                         self.path('two'))
+        self.assertEqual(self.read('two'), FILES['/big'])
+        self.assertEqual([method for _, method in self.server.requests],
+                         ['HEAD', 'GET', 'HEAD'])
+        self.server.files['/big'] = FILES['/small']
+        s.download_file(url, file_name='three', parent_dir=self.tmpdir)
+        self.assertEqual(self.read('three'), FILES['/small'])
+        self.assertEqual(self.server.requests[-1], ('/big', 'GET'))
+
+    def test_range_file(self):
+        range_file = RangeFile(self.pool, self.base_url + '/tests.zip',
+                               block_size=30000)
+        names = extract_zip(range_file, self.path('tests'), ['mochitest/*'])
+        self.assertEqual(names, ['mochitest/%d.txt' % i for i in range(10)])
+        self.assertEqual(self.read('tests/mochitest/3.txt'),
+                         zipfile.ZipFile(StringIO(self.server.files['/tests.zip'])).read('mochitest/3.txt'))
+        self.assertTrue(range_file.bytes_fetched < range_file.length / 2)
+        self.server.no_ranges = True
+        self.assertRaises(RangesNotSupported, RangeFile, self.pool,
+                          self.base_url + '/tests.zip')
+
+    def test_download_unpack(self):
+        s = DownloadScript()
+        self.assertEqual(s.download_unpack(self.base_url + '/tests.zip', self.path('tests'),
+                                           target_unzip_dirs=['bin/*', 'reftest/*']), None)
+        self.assertEqual(sorted(os.listdir(self.path('tests'))), ['bin', 'reftest'])
+        self.assertFalse([method for _, method in self.server.requests if method == 'GET'])
+        self.assertEqual(s.download_unpack(self.base_url + '/emulator.tar.bz2',
+                                           self.path('emulator')), None)
+        self.assertEqual(self.read('emulator/emulator/avd.img'), 'x' * 50000)
+        self.assertEqual(s.download_unpack(self.base_url + '/missing.zip',
+                                           self.path('missing')), -1)
+
+    def test_download_unpack_without_ranges(self):
+        self.server.no_ranges = True
+        s = DownloadScript()
+        self.assertEqual(s.download_unpack(self.base_url + '/tests.zip', self.path('tests'),
+                                           target_unzip_dirs=['xpcshell/*']), None)
+        self.assertEqual(os.listdir(self.path('tests')), ['xpcshell'])
+        self.assertEqual(len(os.listdir(self.path('tests/xpcshell'))), 10)
+
+    def test_download_unpack_file_url(self):
+        source = self.path('emulator.tar')
+        tar = tarfile.open(source, 'w')
+        tar.add(__file__, 'emulator/test.py')
+        tar.close()
+        s = DownloadScript()
+        self.assertEqual(s.download_unpack('file://' + source,
+                                           self.path('emulator')), None)
+        self.assertEqual(self.read('emulator/emulator/test.py'),
+                         open(__file__, 'rb').read())
@@ -0,0 +1,89 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from mozharness.base.incremental import InputManifestMixin, hash_file, \
+    hash_sources
+import mozharness.base.incremental
+from mozharness.base.log import LogMixin
+from mozharness.base.script import ScriptMixin
+
+
+class ManifestScript(InputManifestMixin, ScriptMixin, LogMixin):
+    def __init__(self):
+        self.config = {'log_to_console': False}
+        self.log_obj = None
+
+
+class TestHashing(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_hash_file(self):
+        path = os.path.join(self.tmpdir, 'a')
+        contents = 'x' * (3 * mozharness.base.incremental.HASH_BLOCK_SIZE + 5)
+        open(path, 'wb').write(contents)
+        self.assertEqual(hash_file(path), hashlib.sha1(contents).hexdigest())
+        self.assertEqual(hash_file(os.path.join(self.tmpdir, 'missing')), None)
+
+    def test_hash_sources(self):
+        self.assertEqual(hash_sources([mozharness.base.incremental]),
+                         hash_sources([mozharness.base.incremental]))
+        self.assertNotEqual(hash_sources([mozharness.base.incremental]),
+                            hash_sources([unittest]))
+
+
+class TestInputManifestMixin(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.s = ManifestScript()
+        self.output = os.path.join(self.tmpdir, 'out.apk')
+        self.inputs = {'original': 'abc', 'shake': True, 'files': ['a', 'b']}
+        open(self.output, 'wb').write('apk')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_no_manifest(self):
+        self.assertFalse(self.s.is_output_current(self.output, self.inputs))
+
+    def test_current(self):
+        self.assertEqual(self.s.write_input_manifest(self.output, self.inputs), None)
+        self.assertTrue(self.s.is_output_current(self.output, dict(self.inputs)))
+
+    def test_tuple_inputs(self):
+        # e.g. LockedTuples from a locked config; JSON has lists.
+        self.s.write_input_manifest(self.output, self.inputs)
+        self.assertTrue(self.s.is_output_current(
+            self.output, dict(self.inputs, files=('a', 'b'))))
+
+    def test_changed_inputs(self):
+        self.s.write_input_manifest(self.output, self.inputs)
+        inputs = dict(self.inputs, original='def')
+        self.assertFalse(self.s.is_output_current(self.output, inputs))
+        del inputs['original']
+        self.assertFalse(self.s.is_output_current(self.output, inputs))
+
+    def test_changed_output(self):
+        self.s.write_input_manifest(self.output, self.inputs)
+        open(self.output, 'wb').write('signed apk')
+        self.assertFalse(self.s.is_output_current(self.output, self.inputs))
+        os.remove(self.output)
+        self.assertFalse(self.s.is_output_current(self.output, self.inputs))
+
+    def test_bad_manifest(self):
+        self.s.write_input_manifest(self.output, self.inputs)
+        open(self.s.query_input_manifest_path(self.output), 'w').write('{')
+        self.assertFalse(self.s.is_output_current(self.output, self.inputs))
+
+    def test_remove_output(self):
+        self.s.write_input_manifest(self.output, self.inputs)
+        self.assertEqual(self.s.remove_output(self.output), None)
+        self.assertFalse(os.path.exists(self.output))
+        self.assertFalse(os.path.exists(self.s.query_input_manifest_path(self.output)))
+        self.assertEqual(self.s.remove_output(self.output), None)
@@ -1,6 +1,8 @@
 import os
+import re
 import shutil
 import subprocess
+import sys
 import unittest
 
 import mozharness.base.log as log
@@ -35,5 +37,169 @@ class TestLog(unittest.TestCase):
         self.assertTrue(os.path.exists(get_log_file_path()))
         del(l)
 
+
+class TestErrorListMatcher(unittest.TestCase):
+    error_list = [
+        {'substr': 'command not found', 'level': log.ERROR},
+        {'regex': re.compile(r'make\[\d+\]: \*\*\* \[.*\] Error \d+'), 'level': log.ERROR},
+        {'regex': re.compile(r':\d+: warning:'), 'level': log.WARNING},
+        {'regex': re.compile(r'(?i)abort'), 'level': log.ERROR},
+        {'substr': 'Error', 'level': log.WARNING},
+        {'regex': re.compile(r'x|y'), 'level': log.WARNING},
+    ]
+
+    def test_match(self):
+        m = log.ErrorListMatcher(self.error_list)
+        self.assertEqual(m.match(u'gcc -c foo.c'), None)
+        self.assertEqual(m.match(u'sh: foo: command not found'), 0)
+        self.assertEqual(m.match(u'ABORTING'), 3)
+        self.assertEqual(m.match(u'y'), 5)
+
+    def test_first_match_wins(self):
+        m = log.ErrorListMatcher(self.error_list)
+        self.assertEqual(m.match(u'make[1]: *** [all] Error 2'), 1)
+        self.assertEqual(m.match(u'a.c:1: warning: Error'), 2)
+        self.assertEqual(m.match(u'Error: abort'), 3)
+
+    def test_literals(self):
+        m = log.ErrorListMatcher(self.error_list)
+        # the regexes without a literal are checked on every line
+        self.assertEqual(m.unfiltered, [3, 5])
+        self.assertEqual(log._required_literal(self.error_list[1]['regex']),
+                         u']: *** [')
+
+
+class TestOutputParser(unittest.TestCase):
+    def test_levels(self):
+        parser = log.OutputParser(config={}, log_obj=None, log_output=False,
+                                  error_list=TestErrorListMatcher.error_list)
+        parser.add_lines(['ok', 'a.c:1: warning: x', 'make[2]: *** [a] Error 1'])
+        self.assertEqual(parser.num_warnings, 1)
+        self.assertEqual(parser.num_errors, 1)
+        self.assertEqual(parser.worst_log_level, log.ERROR)
+
+    def test_error_list_changed(self):
+        parser = log.OutputParser(config={}, log_obj=None, log_output=False,
+                                  error_list=[])
+        parser.add_lines('Error')
+        parser.error_list.append({'substr': 'Error', 'level': log.ERROR})
+        parser.add_lines('Error')
+        parser.error_list = [{'substr': 'Warn', 'level': log.WARNING}]
+        parser.add_lines('Warning')
+        self.assertEqual((parser.num_errors, parser.num_warnings), (1, 1))
+
 if __name__ == '__main__':
     unittest.main()
+
+
+class Logged(log.LogMixin):
+    def __init__(self, log_obj=None):
+        self.config = {'log_to_console': False}
+        self.log_obj = log_obj
+        self.fatals = []
+
+    def _post_fatal(self, message=None, exit_code=None):
+        self.fatals.append(exit_code)
+
+
+class TestLogBuffer(unittest.TestCase):
+    def test_buffer_log(self):
+        kept = log.LogBuffer()
+        l = Logged()
+        with log.buffer_log(kept):
+            l.info('one')
+            l.error('two')
+        l.info('three')
+        self.assertEqual(kept.records, [('one', log.INFO, -1),
+                                        ('two', log.ERROR, -1)])
+
+    def test_fatal(self):
+        kept = log.LogBuffer()
+        l = Logged(log_obj=kept)
+        self.assertRaises(SystemExit, l.fatal, 'oops', exit_code=3)
+        self.assertTrue(kept.has_fatal)
+        replayed = log.LogBuffer()
+        try:
+            kept.replay(Logged(log_obj=replayed))
+        except SystemExit, e:
+            self.assertEqual(e.code, 3)
+        else:
+            self.fail("replaying a fatal message didn't exit")
+        self.assertEqual(replayed.records, [('oops', log.FATAL, 3)])
+        self.assertEqual(kept.records, [])
+
+    def test_replay_keeps_context(self):
+        kept = log.LogBuffer()
+        with log.log_context(command=7):
+            Logged(log_obj=kept).info('output')
+        replayed = []
+
+        class Recorder(object):
+            def log_message(self, message, **kwargs):
+                replayed.append((message, log.query_log_context().get('command')))
+        kept.replay(Logged(log_obj=Recorder()))
+        self.assertEqual(replayed, [('output', 7)])
+
+
+class TestJSONLinesLogger(unittest.TestCase):
+    def setUp(self):
+        clean_log_dir()
+
+    def tearDown(self):
+        log.set_log_context(action=None)
+        clean_log_dir()
+
+    def test_records(self):
+        l = log.JSONLinesLogger(log_dir=tmp_dir, log_name=log_name,
+                                log_to_console=False, log_level=log.DEBUG)
+        log.set_log_context(action='build')
+        with log.log_context(command=2):
+            l.log_message('one\ntwo', level=log.WARNING)
+        l.log_message('\xe9', level=log.DEBUG)
+        l.log_message('ignored', level=log.IGNORE)
+        l.close()
+        records = list(log.read_json_log(os.path.join(tmp_dir, 'test.jsonl')))
+        self.assertTrue(records[0]['line'].startswith('JSONLinesLogger online'))
+        self.assertEqual([(r['level'], r['action'], r['command'], r['line'])
+                          for r in records[1:]],
+                         [('warning', 'build', 2, 'one'),
+                          ('warning', 'build', 2, 'two'),
+                          ('debug', 'build', None, u'\ufffd')])
+
+    def test_query_log_context_is_a_copy(self):
+        log.set_log_context(action='build')
+        context = log.query_log_context()
+        # e.g. what OutputPump hands its consumer thread
+        log.set_log_context(action='test')
+        self.assertEqual(context, {'action': 'build'})
+        context['action'] = 'other'
+        self.assertEqual(log.query_log_context(), {'action': 'test'})
+
+    def test_fatal_flushes(self):
+        l = log.JSONLinesLogger(log_dir=tmp_dir, log_name=log_name,
+                                log_to_console=False, flush_interval=60)
+        self.assertRaises(SystemExit, l.log_message, 'oops', level=log.FATAL,
+                          exit_code=3)
+        records = list(log.read_json_log(os.path.join(tmp_dir, 'test.jsonl')))
+        self.assertEqual([r['line'] for r in records[-2:]], ['oops', 'Exiting 3'])
+        l.close()
+
+    def test_rebuild_logs(self):
+        l = log.JSONLinesLogger(log_dir=tmp_dir, log_name=log_name,
+                                log_to_console=False, log_level=log.DEBUG)
+        l.log_message('detail', level=log.DEBUG)
+        l.log_message('problem', level=log.ERROR)
+        l.close()
+        paths = log.rebuild_logs(os.path.join(tmp_dir, 'test.jsonl'), log_level=log.DEBUG)
+        self.assertEqual(paths[log.WARNING], os.path.abspath(get_log_file_path(log.WARNING)))
+        self.assertEqual(open(paths['raw']).read().splitlines()[1:],
+                         ['detail', 'problem'])
+        self.assertEqual(open(get_log_file_path(log.WARNING)).read().splitlines()[0][8:],
+                         '    ERROR - problem')
+        self.assertEqual(len(open(get_log_file_path(log.DEBUG)).read().splitlines()), 3)
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'mozharness.base.log', '--log-level', 'error',
+             '--log-name', 'again', os.path.join(tmp_dir, 'test.jsonl')])
+        self.assertEqual(len(output.splitlines()), 4)
+        self.assertEqual(open(os.path.join(tmp_dir, 'again_error.log')).read(),
+                         open(get_log_file_path(log.ERROR)).read())
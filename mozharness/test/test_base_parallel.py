@@ -1,6 +1,8 @@
+import os
 import unittest
 
-from mozharness.base.parallel import ChunkingMixin
+from mozharness.base.log import LogMixin
+from mozharness.base.parallel import ChunkingMixin, ParallelMixin, Pipeline
 
 class TestChunkingMixin(unittest.TestCase):
     def setUp(self):
@@ -23,3 +25,100 @@ class TestChunkingMixin(unittest.TestCase):
         self.assertEquals(self.c.query_chunked_list(thing, 1, 3), [1,3,6])
         self.assertEquals(self.c.query_chunked_list(thing, 2, 3), [4,3])
         self.assertEquals(self.c.query_chunked_list(thing, 3, 3), [2,6])
+
+
+class ParallelScript(ParallelMixin, LogMixin):
+    def __init__(self, parallel_workers=None):
+        self.config = {'parallel_workers': parallel_workers,
+                       'log_to_console': False}
+        self.log_obj = None
+        self.calls = []
+
+    def square(self, x):
+        self.calls.append(x)
+        return x * x
+
+    def pid(self, x):
+        return os.getpid()
+
+    def broken(self, x):
+        if x == 2:
+            raise ValueError(x)
+
+    def fatal_item(self, x):
+        if x == 2:
+            self.fatal("can't handle %d" % x)
+        self.calls.append(x)
+
+
+class TestParallelMixin(unittest.TestCase):
+    def test_query_parallel_workers(self):
+        self.assertEquals(ParallelScript(3).query_parallel_workers(), 3)
+        self.assertTrue(ParallelScript().query_parallel_workers() >= 1)
+
+    def test_serial(self):
+        s = ParallelScript(1)
+        self.assertEquals(s.run_parallel('square', [(1,), (2,), (3,)]), [1, 4, 9])
+        self.assertEquals(s.calls, [1, 2, 3])
+
+    def test_parallel(self):
+        s = ParallelScript(4)
+        items = [(i,) for i in range(20)]
+        self.assertEquals(s.run_parallel('square', items), [i * i for i in range(20)])
+        # The calls happened in the workers.
+        self.assertEquals(s.calls, [])
+        pids = s.run_parallel('pid', items)
+        self.assertFalse(os.getpid() in pids)
+
+    def test_exception(self):
+        for workers in (1, 2):
+            s = ParallelScript(workers)
+            self.assertEquals(s.run_parallel('broken', [(1,), (2,), (3,)],
+                                             error_message="oops"),
+                              [None, "oops", None])
+
+    def test_fatal(self):
+        s = ParallelScript(1)
+        self.assertRaises(SystemExit, s.run_parallel, 'fatal_item',
+                          [(1,), (2,), (3,)])
+        # The other items still ran.
+        self.assertEquals(s.calls, [1, 3])
+
+
+class TestPipeline(unittest.TestCase):
+    def test_pipeline(self):
+        results = []
+        stages = [
+            ('double', lambda x: None, 2),
+            ('odd', lambda x: x % 2 and "%d is odd" % x or None, 3),
+            ('last', lambda x: None, 1),
+        ]
+        pipeline = Pipeline(stages, queue_size=1,
+                            on_result=lambda *args: results.append(args))
+        self.assertEquals(pipeline.run([(i,) for i in range(10)]), None)
+        self.assertEquals(pipeline.query_counts('double'), (10, 10))
+        self.assertEquals(pipeline.query_counts('odd'), (5, 10))
+        self.assertEquals(pipeline.query_counts('last'), (5, 5))
+        self.assertEquals(sorted([r[1][0] for r in results if r[0] == 'last']),
+                          [0, 2, 4, 6, 8])
+        self.assertEquals(len(results), 25)
+
+    def test_exception(self):
+        def broken(x):
+            raise ValueError(x)
+        exceptions = []
+        pipeline = Pipeline([('broken', broken, 1), ('never', None, 1)],
+                            on_exception=lambda *args: exceptions.append(args),
+                            error_message="oops")
+        self.assertEquals(pipeline.run([(1,), (2,)]), None)
+        self.assertEquals(exceptions, [('broken', (1,)), ('broken', (2,))])
+        self.assertEquals(pipeline.query_counts('broken'), (0, 2))
+        self.assertEquals(pipeline.query_counts('never'), (0, 0))
+
+    def test_exit(self):
+        def exits(x):
+            if x == 1:
+                raise SystemExit(3)
+        pipeline = Pipeline([('exits', exits, 1)])
+        self.assertEquals(pipeline.run([(0,), (1,), (2,)]), 3)
+        self.assertEquals(pipeline.query_counts('exits'), (1, 2))
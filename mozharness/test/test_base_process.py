@@ -0,0 +1,79 @@
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+from mozharness.base.process import OutputPump, process_group_kwargs
+
+
+class ListParser(object):
+    def __init__(self, delay=0):
+        self.lines = []
+        self.delay = delay
+
+    def add_lines(self, lines):
+        if self.delay:
+            time.sleep(self.delay)
+        self.lines.extend(lines)
+
+
+class BrokenParser(object):
+    def add_lines(self, lines):
+        raise ValueError(lines)
+
+
+def popen(code):
+    return subprocess.Popen([sys.executable, '-c', code],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+
+class TestOutputPump(unittest.TestCase):
+    def test_lines(self):
+        p = popen("import sys; sys.stdout.write('a\\n\\nb\\r\\n' + 'c' * 100000)")
+        parser = ListParser()
+        pump = OutputPump(p, parser, chunk_size=1000)
+        self.assertFalse(pump.run())
+        self.assertEqual(p.wait(), 0)
+        self.assertEqual(parser.lines, ['a', '', 'b\r', 'c' * 100000])
+        self.assertEqual(pump.stats['lines'], 4)
+        self.assertEqual(pump.stats['bytes'], 100006)
+
+    def test_backpressure(self):
+        p = popen("for i in range(2000): print i")
+        parser = ListParser(delay=0.01)
+        pump = OutputPump(p, parser, chunk_size=16, queue_size=2)
+        pump.run()
+        self.assertEqual(parser.lines, [str(i) for i in range(2000)])
+        self.assertTrue(pump.stats['blocked'])
+        self.assertTrue(pump.stats['max_queued'] <= 2)
+
+    def test_output_timeout(self):
+        p = popen("import sys, time; print 'hi'; sys.stdout.flush(); time.sleep(30)")
+        parser = ListParser()
+        start = time.time()
+        self.assertTrue(OutputPump(p, parser, output_timeout=1).run())
+        self.assertTrue(time.time() - start < 10)
+        self.assertNotEqual(p.wait(), 0)
+        self.assertEqual(parser.lines, ['hi'])
+
+    @unittest.skipIf(os.name == "nt", "Not for Windows")
+    def test_output_timeout_kills_grandchildren(self):
+        # The sleep is the shell's child; it holds the pipe open too.
+        p = subprocess.Popen("echo $$; sleep 30; echo done", shell=True,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                             **process_group_kwargs())
+        parser = ListParser()
+        start = time.time()
+        self.assertTrue(OutputPump(p, parser, output_timeout=1).run())
+        self.assertNotEqual(p.wait(), 0)
+        # Nothing in the group is left to keep stdout open.
+        self.assertEqual(p.stdout.read(), '')
+        self.assertTrue(time.time() - start < 10)
+        self.assertEqual(parser.lines, [str(p.pid)])
+
+    def test_parser_exception(self):
+        p = popen("for i in range(100000): print i")
+        self.assertRaises(ValueError, OutputPump(p, BrokenParser(),
+                                                 chunk_size=100).run)
+        self.assertEqual(p.wait(), 0)
@@ -1,10 +1,28 @@
 import os
+import shutil
+import sys
+import tempfile
 import unittest
 
 import mozharness.base.python as python
+from mozharness.base.log import LogMixin
+from mozharness.base.script import ScriptMixin
 
 here = os.path.dirname(os.path.abspath(__file__))
 
+
+class VirtualenvScript(python.VirtualenvMixin, ScriptMixin, LogMixin):
+    def __init__(self, work_dir):
+        super(VirtualenvScript, self).__init__()
+        self.config = {'log_to_console': False, 'virtualenv_path': 'venv',
+                       'virtualenv_modules': ['mozinfo', {'name': 'mozbase',
+                                                          'url': 'mozbase'}]}
+        self.log_obj = None
+        self.work_dir = work_dir
+
+    def query_abs_dirs(self):
+        return {'abs_work_dir': self.work_dir}
+
 class TestVirtualenvMixin(unittest.TestCase):
     def test_package_versions(self):
         example = os.path.join(here, 'pip-freeze.example.txt')
@@ -32,5 +50,169 @@ class TestVirtualenvMixin(unittest.TestCase):
         self.assertEqual(packages, expected)
 
 
+class TestVirtualenvCacheKey(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmpdir, 'mozbase'))
+        self.source = os.path.join(self.tmpdir, 'mozbase', 'setup.py')
+        open(self.source, 'w').write('pass\n')
+        self.requirements = os.path.join(self.tmpdir, 'requirements.txt')
+        open(self.requirements, 'w').write('mozinfo==0.7\n')
+        self.script = VirtualenvScript(self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def query_key(self):
+        c = self.script.config
+        return self.script.query_virtualenv_cache_key(
+            ['virtualenv'], c['virtualenv_modules'], ['requirements.txt'])
+
+    def test_key(self):
+        key = self.query_key()
+        self.assertEqual(key, self.query_key())
+        open(self.requirements, 'w').write('mozinfo==0.8\n')
+        changed_requirements = self.query_key()
+        self.assertNotEqual(key, changed_requirements)
+        open(self.source, 'w').write('import os\n')
+        self.assertNotEqual(changed_requirements, self.query_key())
+        key = self.query_key()
+        self.script.config['mozinfo_url'] = 'http://example.com/mozinfo.tar.gz'
+        self.assertNotEqual(key, self.query_key())
+        key = self.query_key()
+        self.script.register_virtualenv_module('psutil==0.7.1', optional=True)
+        self.assertNotEqual(key, self.query_key())
+
+    def test_requirements_sources(self):
+        config_dir = os.path.join(self.tmpdir, 'tests', 'config')
+        os.makedirs(config_dir)
+        for name in ('mozfile', 'mozinfo', 'mozinfo/mozinfo.egg-info'):
+            os.makedirs(os.path.join(self.tmpdir, 'tests', 'mozbase', name))
+        mozfile = os.path.join(self.tmpdir, 'tests', 'mozbase', 'mozfile', 'setup.py')
+        mozinfo = os.path.join(self.tmpdir, 'tests', 'mozbase', 'mozinfo', 'setup.py')
+        open(mozfile, 'w').write('pass\n')
+        open(mozinfo, 'w').write('pass\n')
+        open(os.path.join(config_dir, 'mozbase_requirements.txt'), 'w').write(
+            '-r more_requirements.txt\n../mozbase/mozfile\nmozcrash==0.1\n')
+        open(os.path.join(config_dir, 'more_requirements.txt'), 'w').write(
+            '# mozinfo\n-e ../mozbase/mozinfo  # comment\n')
+        requirements = [os.path.join('tests', 'config', 'mozbase_requirements.txt')]
+
+        def query_key():
+            return self.script.query_virtualenv_cache_key(['virtualenv'], [], requirements)
+        key = query_key()
+        # Only the times change, e.g. when a tests zip is unpacked again.
+        os.utime(mozfile, (0, 0))
+        self.assertEqual(key, query_key())
+        open(os.path.join(self.tmpdir, 'tests', 'mozbase', 'mozinfo',
+                          'mozinfo.egg-info', 'PKG-INFO'), 'w').write('x')
+        self.assertEqual(key, query_key())
+        open(mozfile, 'w').write('import os\n')
+        changed_mozfile = query_key()
+        self.assertNotEqual(key, changed_mozfile)
+        open(mozinfo, 'w').write('import os\n')
+        self.assertNotEqual(changed_mozfile, query_key())
+
+
+# Builds a <name>-1.0 wheel and a "common" dependency wheel for each
+# module (mozprofile also gets a mozfile-0.9 one), freezes what's in
+# the freeze file, and logs its arguments.
+FAKE_PIP = """#!/bin/sh
+echo "$@" >> "%(log)s"
+if [ "$1" = freeze ]; then
+    cat "%(freeze)s" 2>/dev/null
+fi
+if [ "$1" = wheel ]; then
+    dir=$3
+    shift 3
+    for arg; do
+        touch "$dir/$arg-1.0-py2-none-any.whl" "$dir/common-1.0-py2-none-any.whl"
+        if [ "$arg" = mozprofile ]; then
+            touch "$dir/mozfile-0.9-py2-none-any.whl"
+        fi
+    done
+fi
+"""
+
+
+class TestInstallModules(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.pip_log = os.path.join(self.tmpdir, 'pip.log')
+        self.freeze = os.path.join(self.tmpdir, 'freeze.txt')
+        bin_dir = os.path.join(self.tmpdir, 'venv', 'bin')
+        lib_dir = os.path.join(self.tmpdir, 'venv', 'lib')
+        os.makedirs(bin_dir)
+        os.makedirs(lib_dir)
+        open(os.path.join(lib_dir, 'wheel.py'), 'w').write('')
+        self.write_script(os.path.join(bin_dir, 'pip'),
+                          FAKE_PIP % {'log': self.pip_log, 'freeze': self.freeze})
+        self.write_script(os.path.join(bin_dir, 'python'),
+                          '#!/bin/sh\nPYTHONPATH=%s exec %s "$@"\n' %
+                          (lib_dir, sys.executable))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        python.VirtualenvMixin.python_paths.clear()
+
+    def write_script(self, path, contents):
+        open(path, 'w').write(contents)
+        os.chmod(path, 0755)
+
+    def install(self, modules=('mozinfo', 'mozfile')):
+        python.VirtualenvMixin.python_paths.clear()
+        script = VirtualenvScript(self.tmpdir)
+        script.config['wheelhouse_dir'] = os.path.join(self.tmpdir, 'wheelhouse')
+        if os.path.exists(self.pip_log):
+            os.remove(self.pip_log)
+        installs = [{'module': module} for module in modules]
+        installs.append({'module': 'mozdevice', 'editable': True})
+        results = script.install_modules(installs, num_workers=2)
+        self.assertEqual(results, [None] * len(installs))
+        self.assertEqual(sorted(set([module for module, _, _ in script._install_times])),
+                         sorted(list(modules) + ['mozdevice']))
+        return [line.split() for line in open(self.pip_log)]
+
+    def query_wheel_installs(self, commands):
+        return sorted([[os.path.basename(arg) for arg in c[3:]]
+                       for c in commands if c[1:2] == ['--no-index']])
+
+    def test_wheelhouse(self):
+        commands = self.install()
+        self.assertEqual(sorted([c[-1] for c in commands if c[0] == 'wheel']),
+                         ['mozfile', 'mozinfo'])
+        # mozinfo comes first, so it installs the shared dependency.
+        installs = self.query_wheel_installs(commands)
+        self.assertEqual(installs, [['common-1.0-py2-none-any.whl',
+                                     'mozinfo-1.0-py2-none-any.whl'],
+                                    ['mozfile-1.0-py2-none-any.whl']])
+        self.assertEqual(commands[-1][-2:], ['-e', 'mozdevice'])
+        commands = self.install()
+        self.assertFalse([c for c in commands if c[0] == 'wheel'])
+        self.assertEqual(len([c for c in commands if c[1:2] == ['--no-index']]), 2)
+        self.assertEqual([name for name in os.listdir(self.tmpdir)
+                          if name.startswith('tmp')], [])
+
+    def test_installed_projects(self):
+        # common is already there at the wheel's version; mozfile is
+        # an editable checkout.
+        open(self.freeze, 'w').write('common==1.0\n-e /src/mozfile#egg=mozfile-dev\n')
+        commands = self.install(['mozinfo', 'mozfile'])
+        self.assertEqual(self.query_wheel_installs(commands),
+                         [['mozinfo-1.0-py2-none-any.whl']])
+        self.assertTrue(['install', 'mozfile'] in [c[:1] + c[-1:] for c in commands])
+
+    def test_version_conflict(self):
+        # mozprofile's mozfile-0.9 mustn't replace the mozfile-1.0 that
+        # mozfile installs; pip decides whether mozprofile can use it.
+        commands = self.install(['mozfile', 'mozprofile'])
+        installs = self.query_wheel_installs(commands)
+        self.assertEqual(installs, [['common-1.0-py2-none-any.whl',
+                                     'mozfile-1.0-py2-none-any.whl']])
+        self.assertTrue(['install', 'mozprofile'] in [c[:1] + c[-1:] for c in commands])
+        self.assertFalse([c for c in commands if 'mozfile-0.9-py2-none-any.whl' in
+                          [os.path.basename(arg) for arg in c]])
+
+
 if __name__ == '__main__':
     unittest.main()
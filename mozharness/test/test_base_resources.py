@@ -0,0 +1,184 @@
+import os
+import shutil
+import subprocess
+import sys
+import unittest
+
+try:
+    import simplejson as json
+    assert json
+except ImportError:
+    import json
+
+from mozharness.base import python, resources
+from mozharness.base.python import ResourceMonitoringMixin, VirtualenvMixin
+from mozharness.base.resources import ResourceSampler, track_process, \
+    untrack_process
+from mozharness.base.script import BaseScript
+
+# Uses about 0.4s of CPU time, and 20MB.
+BUSY = [sys.executable, '-c',
+        'import time\nx = "x" * 20000000\nt = time.time()\n'
+        'while time.time() - t < 0.4: pass']
+
+PROC_STAT = """cpu  100 0 50 800 50 0 0 0 0 0
+cpu0 50 0 25 400 25 0 0 0 0 0
+intr 12345
+"""
+
+DISKSTATS = """   8       0 sda 100 0 2000 30 50 0 1000 20 0 40 50
+   8       1 sda1 90 0 1800 25 50 0 1000 20 0 35 45
+   7       0 loop0 10 0 80 1 0 0 0 0 0 1 1
+"""
+
+MEMINFO = """MemTotal:        1000 kB
+MemFree:          100 kB
+MemAvailable:     400 kB
+"""
+
+
+class TestParsers(unittest.TestCase):
+    def test_cpu_times(self):
+        times = resources.parse_cpu_times(PROC_STAT)
+        self.assertEqual(times['user'], 100.0 / resources.CLOCK_TICKS)
+        self.assertEqual(times['iowait'], 50.0 / resources.CLOCK_TICKS)
+
+    def test_io_counters(self):
+        counters = resources.parse_io_counters(DISKSTATS, set(['sda', 'loop0']))
+        self.assertEqual((counters['read_bytes'], counters['write_bytes']),
+                         (2000 * 512, 1000 * 512))
+        self.assertEqual(counters['read_time'], 0.03)
+
+    def test_memory(self):
+        self.assertEqual(resources.parse_memory(MEMINFO), (1024000, 614400))
+
+    def test_process_stat(self):
+        fields = ['S', '1'] + ['0'] * 9 + ['10', '20', '30', '40'] + \
+            ['0'] * 6 + ['5']
+        process = resources.parse_process_stat('42 (a (b) c) %s' % ' '.join(fields))
+        self.assertEqual(process['ppid'], 1)
+        self.assertEqual(process['cpu_time'], 30.0 / resources.CLOCK_TICKS)
+        self.assertEqual(process['children_cpu_time'], 70.0 / resources.CLOCK_TICKS)
+        self.assertEqual(process['rss'], 5 * resources.PAGE_SIZE)
+
+    def test_tree_usage(self):
+        processes = {
+            1: {'ppid': 0, 'cpu_time': 1.0, 'children_cpu_time': 0.0, 'rss': 1},
+            2: {'ppid': 1, 'cpu_time': 2.0, 'children_cpu_time': 0.5, 'rss': 2},
+            3: {'ppid': 2, 'cpu_time': 3.0, 'children_cpu_time': 0.0, 'rss': 4},
+            4: {'ppid': 1, 'cpu_time': 4.0, 'children_cpu_time': 0.0, 'rss': 8},
+        }
+        self.assertEqual(sorted(resources.query_descendants(2, processes)), [3])
+        usage = resources.query_tree_usage(2, processes)
+        self.assertEqual((usage['cpu_time'], usage['rss']), (5.5, 6))
+        self.assertEqual(resources.query_tree_usage(5, processes), None)
+
+
+class ResourceScript(ResourceMonitoringMixin, BaseScript):
+    def __init__(self):
+        super(ResourceScript, self).__init__(
+            config={'resource_sample_interval': 0.05, 'log_to_console': False},
+            all_actions=['busy'], initial_config_file='test/test.json')
+
+    def busy(self):
+        self.run_command(BUSY)
+
+
+class VirtualenvResourceScript(VirtualenvMixin, ResourceMonitoringMixin, BaseScript):
+    def __init__(self):
+        super(VirtualenvResourceScript, self).__init__(
+            config={'log_to_console': False}, all_actions=['busy'],
+            initial_config_file='test/test.json')
+
+    def busy(self):
+        pass
+
+
+class TestSystemResourceMonitor(unittest.TestCase):
+    def setUp(self):
+        self.is_supported = python.is_resource_sampling_supported
+        python.is_resource_sampling_supported = lambda: False
+
+    def tearDown(self):
+        python.is_resource_sampling_supported = self.is_supported
+        if os.path.isdir('test_logs'):
+            shutil.rmtree('test_logs')
+
+    def test_fallback(self):
+        s = VirtualenvResourceScript()
+        self.assertEqual(s._resource_monitor, None)
+        self.assertEqual(sorted([m[0] for m in s._virtualenv_modules]),
+                         ['mozsystemmonitor==0.0.0', 'psutil==0.7.1'])
+        # It only starts after create-virtualenv.
+        s.run()
+        self.assertEqual(s._resource_monitor, None)
+
+
+class BrokenSampler(ResourceSampler):
+    def start(self):
+        raise IOError(2, 'No such file or directory', '/proc/meminfo')
+
+
+class TestBrokenSampler(unittest.TestCase):
+    def setUp(self):
+        self.is_supported = python.is_resource_sampling_supported
+        python.is_resource_sampling_supported = lambda: True
+        python.ResourceSampler = BrokenSampler
+
+    def tearDown(self):
+        python.is_resource_sampling_supported = self.is_supported
+        python.ResourceSampler = ResourceSampler
+        if os.path.isdir('test_logs'):
+            shutil.rmtree('test_logs')
+
+    def test_fallback(self):
+        s = VirtualenvResourceScript()
+        self.assertFalse(s._resource_sampling)
+        self.assertEqual(s._resource_monitor, None)
+        self.assertEqual(sorted([m[0] for m in s._virtualenv_modules]),
+                         ['mozsystemmonitor==0.0.0', 'psutil==0.7.1'])
+
+
+class TestResourceSampler(unittest.TestCase):
+    def setUp(self):
+        if not resources.is_supported():
+            raise unittest.SkipTest("no /proc")
+
+    def test_sampler(self):
+        sampler = ResourceSampler(interval=0.05)
+        sampler.start()
+        sampler.begin_phase('busy')
+        proc = subprocess.Popen(BUSY)
+        track_process(proc.pid, 'busy')
+        proc.wait()
+        untrack_process(proc.pid)
+        sampler.finish_phase('busy')
+        sampler.stop()
+        self.assertFalse(sampler in resources._samplers)
+        command = sampler.commands[0]
+        self.assertEqual((command['name'], command['actions']), ('busy', ['busy']))
+        self.assertTrue(command['cpu_time'] > 0.1)
+        self.assertTrue(command['peak_rss'] > 20000000)
+        self.assertTrue(command['end'] >= command['start'])
+        usage = sampler.aggregate('busy')
+        self.assertTrue(usage['duration'] >= 0.4)
+        self.assertTrue(sampler.aggregate()['duration'] >= usage['duration'])
+        self.assertTrue(len(sampler.samples) > 3)
+        self.assertTrue(['busy'] in [s['actions'] for s in sampler.samples])
+        profile = json.loads(json.dumps(sampler.query_profile()))
+        self.assertEqual([p['name'] for p in profile['phases']], ['busy'])
+        self.assertTrue(profile['peak_rss']['tree'] > 20000000)
+
+    def test_script(self):
+        s = ResourceScript()
+        try:
+            s.run()
+            path = os.path.join(s.query_abs_dirs()['abs_log_dir'],
+                                'resource-usage.json')
+            profile = json.load(open(path))
+            self.assertEqual([p['name'] for p in profile['phases']], ['busy'])
+            self.assertTrue(profile['commands'][0]['cpu_time'] > 0.1)
+            self.assertEqual(profile['commands'][0]['actions'], ['busy'])
+        finally:
+            if os.path.isdir('test_logs'):
+                shutil.rmtree('test_logs')
@@ -2,6 +2,7 @@ import gc
 import mock
 import os
 import re
+import threading
 import types
 import unittest
 PYWIN32 = False
@@ -192,6 +193,16 @@ class TestHelperFunctions(unittest.TestCase):
                                             cwd="test_dir"), 0,
                          msg="run_command('cat file') did not exit 0")
 
+    def test_run_command_output_timeout(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        parser = log.OutputParser(config=self.s.config, log_obj=self.s.log_obj,
+                                  log_output=False,
+                                  error_list=[{'substr': 'hi', 'level': WARNING}])
+        self.assertNotEqual(self.s.run_command("echo hi; sleep 30",
+                                               output_parser=parser,
+                                               output_timeout=1), 0)
+        self.assertEqual(parser.num_warnings, 1)
+
     def test_move1(self):
         self._create_temp_file()
         self.s = script.BaseScript(initial_config_file='test/test.json')
@@ -341,6 +352,17 @@ class TestScriptLogging(unittest.TestCase):
         self.assertTrue(info_logsize > 0,
                         msg="initial info logfile missing/size 0")
 
+    def test_json_log(self):
+        self.s = script.BaseScript(config={'log_type': 'json',
+                                           'log_to_console': False},
+                                   initial_config_file='test/test.json')
+        self.s.run_command(['echo', 'one'])
+        self.s.run_command('echo two')
+        self.s.log_obj.close()
+        records = [r for r in log.read_json_log("test_logs/test.jsonl")
+                   if r['line'].strip() in ('one', 'two')]
+        self.assertEqual([r['command'] for r in records], [1, 2])
+
     def test_add_summary_info(self):
         self.s = script.BaseScript(config={'log_type': 'multi'},
                                    initial_config_file='test/test.json')
@@ -708,6 +730,225 @@ class TestScriptDecorators(unittest.TestCase):
         self.assertEqual(len(self.s.post_run_2_args), 1)
 
 
+# TestRunCommandsParallel {{{1
+class RecordingLogger(object):
+    def __init__(self):
+        self.messages = []
+
+    def log_message(self, message, level=INFO, exit_code=-1, post_fatal_callback=None):
+        self.messages.append((message, level))
+        if level == FATAL:
+            raise SystemExit(exit_code)
+
+
+class ParallelCommandsObj(script.ScriptMixin, log.LogMixin):
+    def __init__(self):
+        super(ParallelCommandsObj, self).__init__()
+        self.log_obj = RecordingLogger()
+        self.config = {'parallel_workers': 3}
+        self.env = None
+
+
+class TestRunCommandsParallel(unittest.TestCase):
+    def setUp(self):
+        self.s = ParallelCommandsObj()
+
+    def output_of(self, name):
+        return [i for i, (message, _) in enumerate(self.s.log_obj.messages)
+                if name in message]
+
+    def test_grouped_output(self):
+        commands = [{'command': "echo %s1; sleep %s; echo %s2; exit %d" %
+                     (name, delay, name, code)}
+                    for name, delay, code in (('aa', 0.6, 0), ('bb', 0.1, 2), ('cc', 0.3, 0))]
+        self.assertEqual(self.s.run_commands_parallel(commands), [0, 2, 0])
+        previous = -1
+        for name in ('aa', 'bb', 'cc'):
+            indexes = self.output_of(name)
+            # "Running command" and the two lines of output.
+            self.assertEqual(len(indexes), 3)
+            self.assertEqual(indexes, range(indexes[0], indexes[0] + 3))
+            self.assertTrue(indexes[0] > previous)
+            previous = indexes[-1]
+
+    def test_num_errors(self):
+        error_list = [{'substr': 'oops', 'level': ERROR}]
+        commands = [{'command': "echo oops; echo oops", 'error_list': error_list,
+                     'return_type': 'num_errors'},
+                    {'command': "echo fine", 'error_list': error_list,
+                     'return_type': 'num_errors'},
+                    {'command': "echo oops", 'error_list': error_list}]
+        self.assertEqual(self.s.run_commands_parallel(commands, num_workers=2),
+                         [2, 0, 0])
+        self.assertEqual(self.s.run_commands_parallel([]), [])
+
+    def test_halt_on_failure(self):
+        commands = [{'command': "exit 1", 'halt_on_failure': True},
+                    {'command': "sleep 0.3; echo still-logged"}]
+        self.assertRaises(SystemExit, self.s.run_commands_parallel, commands)
+        messages = self.s.log_obj.messages
+        self.assertEqual(messages[-1][1], FATAL)
+        self.assertTrue(self.output_of('still-logged'))
+
+
+class PipelinedScript(script.BaseScript):
+    def __init__(self, *args, **kwargs):
+        self.events = []
+        self.shipped = threading.Event()
+        super(PipelinedScript, self).__init__(
+            all_actions=['fetch', 'build', 'ship', 'summary'],
+            initial_config_file='test/test.json', *args, **kwargs)
+
+    def query_pipeline_items(self):
+        return [('a',), ('b',), ('c',), ('d',)]
+
+    @script.PostScriptAction
+    def post_action(self, action, success=None):
+        self.events.append(('post', action, success))
+
+    def preflight_fetch(self):
+        self.events.append(('preflight', 'fetch'))
+
+    def fetch_item(self, name):
+        if name == 'd':
+            # Only finishes if 'a' can get through the whole pipeline
+            # before every item is fetched.
+            self.shipped.wait(10)
+            if not self.shipped.is_set():
+                return "Timed out"
+        self.events.append(('fetch', name))
+
+    def build_item(self, name):
+        if name == 'b':
+            return "Can't build %(key)s!"
+        self.events.append(('build', name))
+
+    def ship_item(self, name):
+        self.events.append(('ship', name))
+        self.shipped.set()
+
+    def fetch(self):
+        self.events.append(('fetch',))
+
+    def build(self):
+        self.events.append(('build',))
+
+    def ship(self):
+        self.events.append(('ship',))
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        cleanup()
+        self.s = None
+
+    def tearDown(self):
+        if hasattr(self, 's') and isinstance(self.s, object):
+            del self.s
+        cleanup()
+
+    def test_no_pipeline(self):
+        self.s = PipelinedScript()
+        self.assertEqual(self.s.query_action_groups(),
+                         [['fetch'], ['build'], ['ship'], ['summary']])
+        self.s.run()
+        self.assertEqual([e for e in self.s.events if e[0] != 'post'],
+                         [('preflight', 'fetch'), ('fetch',), ('build',), ('ship',)])
+
+    def test_pipeline(self):
+        self.s = PipelinedScript(config={'pipeline': True})
+        self.assertEqual(self.s.query_action_groups(),
+                         [['fetch', 'build', 'ship'], ['summary']])
+        self.s.run()
+        events = self.s.events
+        self.assertEqual(events[0], ('preflight', 'fetch'))
+        self.assertTrue(events.index(('ship', 'a')) < events.index(('fetch', 'd')))
+        for name in 'acd':
+            self.assertTrue(('ship', name) in events)
+        self.assertFalse(('ship', 'b') in events)
+        self.assertEqual(self.s.failures, ['b'])
+        self.assertEqual(self.s.summary_list[0]['message'], "Can't build b!")
+        self.assertEqual([m['message'] for m in self.s.summary_list[1:]],
+                         ["fetch: 4 of 4 items successful.",
+                          "build: 3 of 4 items successful.",
+                          "ship: 3 of 3 items successful."])
+        self.assertEqual([e[1] for e in events if e[0] == 'post'],
+                         ['fetch', 'build', 'ship', 'summary'])
+
+    def test_pipeline_skips_disabled_actions(self):
+        self.s = PipelinedScript(config={'pipeline': True},
+                                 default_actions=['fetch', 'ship'])
+        self.assertEqual(self.s.query_action_groups(),
+                         [['fetch'], ['build'], ['ship'], ['summary']])
+
+
+# TestCopytree {{{1
+class TestCopytree(unittest.TestCase):
+    def setUp(self):
+        cleanup()
+        self.s = ParallelCommandsObj()
+        self.src = os.path.join('test_dir', 'src')
+        self.dest = os.path.join('test_dir', 'dest')
+        for name, contents in (('a', 'a'), ('sub/b', 'b'), ('sub/deeper/c', 'c')):
+            self.write(os.path.join(self.src, name), contents)
+        os.symlink('a', os.path.join(self.src, 'link'))
+
+    def tearDown(self):
+        cleanup()
+
+    def write(self, path, contents):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').write(contents)
+
+    def read(self, name):
+        return open(os.path.join(self.dest, name)).read()
+
+    def test_link_modes(self):
+        for link_mode in ('copy', 'reflink', 'hardlink'):
+            self.assertEqual(self.s.copytree(self.src, self.dest, overwrite='clobber',
+                                             link_mode=link_mode, num_workers=2), None)
+            self.assertEqual(self.read('sub/deeper/c'), 'c')
+            self.assertEqual(self.read('link'), 'a')
+            self.assertFalse(os.path.islink(os.path.join(self.dest, 'link')))
+        self.assertTrue(os.path.samefile(os.path.join(self.src, 'a'),
+                                         os.path.join(self.dest, 'a')))
+
+    def test_skip_unchanged(self):
+        self.s.copytree(self.src, self.dest, symlinks=True)
+        self.assertEqual(os.readlink(os.path.join(self.dest, 'link')), 'a')
+        src_b = os.path.join(self.src, 'sub', 'b')
+        self.assertEqual(int(os.stat(src_b).st_mtime),
+                         int(os.stat(os.path.join(self.dest, 'sub', 'b')).st_mtime))
+        # Same size and mtime: kept.
+        self.write(os.path.join(self.dest, 'a'), 'A')
+        os.utime(os.path.join(self.dest, 'a'), (0, os.stat(os.path.join(self.src, 'a')).st_mtime))
+        self.write(src_b, 'bb')
+        self.write(os.path.join(self.dest, 'stale'), 'x')
+        self.s.copytree(self.src, self.dest, overwrite='clobber', skip_unchanged=True,
+                        symlinks=True)
+        self.assertEqual(self.read('a'), 'A')
+        self.assertEqual(self.read('sub/b'), 'bb')
+        self.assertFalse(os.path.exists(os.path.join(self.dest, 'stale')))
+
+    def test_overwrite_levels(self):
+        self.write(os.path.join(self.dest, 'a'), 'old a')
+        self.write(os.path.join(self.dest, 'sub', 'old'), 'old')
+        self.write(os.path.join(self.dest, 'other'), 'other')
+        self.s.copytree(self.src, self.dest, overwrite='no_overwrite')
+        self.assertEqual(self.read('a'), 'old a')
+        self.assertEqual(self.read('sub/b'), 'b')
+        self.assertEqual(self.read('sub/old'), 'old')
+        self.s.copytree(self.src, self.dest, overwrite='overwrite_if_exists')
+        self.assertEqual(self.read('a'), 'a')
+        self.assertFalse(os.path.exists(os.path.join(self.dest, 'sub', 'old')))
+        self.assertEqual(self.read('other'), 'other')
+
+    def test_error(self):
+        self.assertEqual(self.s.copytree(os.path.join('test_dir', 'missing'),
+                                         self.dest), -1)
+
+
 # main {{{1
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,500 @@
+from cStringIO import StringIO
+from distutils.spawn import find_executable
+import imp
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+
+from mozharness.mozilla.cssfixer.bench import find_regressions, \
+    generate_stylesheet, summarize, PHASES
+from mozharness.mozilla.cssfixer.bundle import format_bundle, \
+    parse_bundle, shake_bundle
+from mozharness.mozilla.cssfixer.cache import cache_key, FixupCache, \
+    CACHE_VERSION
+from mozharness.mozilla.cssfixer.fixup import fixup_css, old_gradient_parser
+from mozharness.mozilla.cssfixer.jsutil import JSError, number_to_string, \
+    to_number
+from mozharness.mozilla.cssfixer.parse import parse, CSSParseError
+from mozharness.mozilla.cssfixer.stream import fixup_css_stream, FixupStream
+
+TOP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+BOOTSTRAP_JS = os.path.join(TOP_DIR, 'bootstrap.js')
+CSS_BROWSERSIDE_JS = os.path.join(TOP_DIR, 'css-browserside.js')
+NODE_HELPER = os.path.join(os.path.dirname(__file__), 'helper_files',
+                           'cssfixer_node.js')
+BENCH_JS = os.path.join(TOP_DIR, 'mozharness', 'external_tools',
+                        'cssfixer_bench.js')
+NODE = find_executable('node')
+REPACK_SCRIPT = os.path.join(os.path.dirname(__file__), '..', 'scripts',
+                             'mobile_cssfixer_repack.py')
+
+GOLDEN = (
+    ("a { display: -webkit-box; -webkit-box-orient: vertical; "
+     "-webkit-box-direction: reverse; -webkit-box-pack: justify; "
+     "-webkit-box-flex: 0 }",
+     "a {\n  display: inline-flex;\n  flex-direction: column-reverse;\n"
+     "  justify-content: space-between;\n  flex: none;\n}"),
+    ("a { background: #fff -webkit-gradient(linear, left top, left bottom, "
+     "from(#fff), color-stop(0.5, rgba(0, 0, 0, 0.5)), to(#000)) no-repeat }",
+     "a {\n  background: #fff;\n  background: linear-gradient(to bottom, "
+     "#fff 0%, rgba(0, 0, 0, 0.5) 50%, #000 100%)  no-repeat;\n}"),
+    ("a { background-image: -webkit-gradient(radial, 50% 50%, 0, 50% 50%, "
+     "100, from(red), to(blue)) }",
+     "a {\n  background-image: radial-gradient(circle 100px at 50% 50%, "
+     "red 0%, blue 100%);\n}"),
+    ("a { background: url(a.png) -webkit-linear-gradient(top, red, blue) }",
+     "a {\n  background: url(a.png);\n"
+     "  background: linear-gradient(top, red, blue);\n}"),
+    ("a { -webkit-border-image: url(b.png) 30 round; "
+     "-webkit-transform: rotate(45deg); transform: rotate(10deg) }",
+     "a {\n  border-image: url(b.png) 30 round;\n  border-style: solid;\n"
+     "  transform: rotate(45deg);\n  transform: rotate(10deg);\n}"),
+    ("@media screen { a { -webkit-transition: -webkit-transform 1s } }\n"
+     "@-webkit-keyframes x { from { color: red } }",
+     "@media screen {\n  a {\n    transition: transform 1s;\n  }\n}"),
+    # comments in declarations are copied as declarations
+    ("a { color: red; /* note */ }",
+     "a {\n  color: red;\n  undefined: undefined;\n}"),
+    ("<!-- a { -webkit-user-select: none } -->", ""),
+    # unparseable stylesheets are passed through
+    ("a { color: red", "a { color: red"),
+)
+
+# Fragments for generating random stylesheets.
+FRAGMENTS = (
+    'a', ' ', '\n', '\xa0', '{', '}', ';', ':', ',', '(', ')', '/*', '*/',
+    '"', "'", '\\', '@media screen', '@-webkit-keyframes x', '@page',
+    '@document url(x)', '@supports (x)', '@import "a";', '@font-face',
+    '<!--', '-->', '0%', 'from', 'to', '-webkit-', 'display', 'box',
+    '-webkit-box', 'box-flex', 'box-orient', 'box-direction', 'flex-order',
+    'vertical', 'reverse', '0', '0x0', 'background', 'url(a.png)', '#fff',
+    '-webkit-gradient(', 'linear', 'radial', 'left top', '0 100%',
+    'from(#fff)', 'to(#000)', 'color-stop(0.5, red)', 'rgb(1,2,3)',
+    'no-repeat', '45deg', 'border-image', 'transform', 'rotate(', '\xe9',
+)
+DECLARATIONS = (
+    '-webkit-box-flex: 1', 'display: -webkit-box', 'display:box',
+    '-webkit-box-orient: horizontal', '-webkit-box-direction: reverse',
+    '-webkit-box-align: start', '-webkit-flex-order: 2',
+    'background: #123 -webkit-gradient(linear, 0 0, 0 100%, from(#fff), '
+    'color-stop(30%, rgba(1,2,3,0.5)), to(#f6f6f6)) no-repeat',
+    'background: -webkit-gradient(linear, left top, right bottom, '
+    'color-stop(0, red), color-stop(1,blue)), url(x.png)',
+    'background-image: -webkit-gradient(radial, 10 20, 0, 10 20, 5, '
+    'from(red), to(blue))',
+    'background: -webkit-linear-gradient(45deg, red, blue)',
+    '-webkit-border-image: url(x.png) 30 30 round', 'border-style: dashed',
+    '-webkit-transition: -webkit-transform 1s', 'color: red', '/* c */',
+)
+
+
+def random_stylesheet(r):
+    if r.random() < 0.5:
+        return ''.join([r.choice(FRAGMENTS) for _ in range(r.randint(1, 30))])
+    decls = [r.choice(DECLARATIONS) for _ in range(r.randint(1, 5))]
+    rule = '%s { %s }' % (r.choice(['a', 'p, div']), '; '.join(decls))
+    if r.random() < 0.3:
+        rule = '@media screen {\n%s\n}' % rule
+    return rule
+
+
+def random_chunks(stylesheet, r):
+    chunks = []
+    while stylesheet:
+        size = r.choice([1, 2, 5, 20, 1000])
+        chunks.append(stylesheet[:size])
+        stylesheet = stylesheet[size:]
+    return chunks
+
+
+def node_fixup(stylesheets, cache_file=None, bundle=CSS_BROWSERSIDE_JS):
+    """Run bootstrap.createFixupRulesFromCSSFileContent() under node, or
+    look the stylesheets up in a packed cache.
+    """
+    args = [NODE, NODE_HELPER, BOOTSTRAP_JS, bundle]
+    if cache_file:
+        args.append(cache_file)
+    proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    output = proc.communicate(json.dumps(
+        [decode(s) for s in stylesheets]))[0]
+    return json.loads(output)
+
+
+def decode(stylesheet):
+    """A stylesheet, or list of chunks, as JSON-able unicode."""
+    if isinstance(stylesheet, list):
+        return [decode(chunk) for chunk in stylesheet]
+    return stylesheet.decode('latin-1')
+
+
+def python_fixup(stylesheet):
+    try:
+        return {'css': fixup_css(stylesheet).decode('latin-1')}
+    except JSError:
+        return {'error': 'JSError'}
+
+
+class TestJSUtil(unittest.TestCase):
+    def test_number_to_string(self):
+        for number, expected in ((50.0, '50'), (0.5 * 100, '50'),
+                                 (0.07 * 100, '7.000000000000001'),
+                                 (-0.0, '0'), (1e21, '1e+21'),
+                                 (1.5e-7, '1.5e-7'), (0.000001, '0.000001'),
+                                 (float('nan'), 'NaN')):
+            self.assertEqual(number_to_string(number), expected)
+
+    def test_to_number(self):
+        self.assertEqual(to_number(u' 0x0 '), 0)
+        self.assertEqual(to_number(u''), 0)
+        self.assertNotEqual(to_number(u'-0x0'), 0)
+
+
+class TestParse(unittest.TestCase):
+    def test_rules(self):
+        sheet = parse(u'a, b { color: red; }\n@media x { c { d: e } }')
+        rules = sheet['stylesheet']['rules']
+        self.assertEqual(rules[0], {
+            'type': 'rule',
+            'selectors': [u'a', u'b'],
+            'declarations': [{'type': 'declaration', 'property': u'color',
+                              'value': u'red'}],
+        })
+        self.assertEqual(rules[1]['media'], u'x')
+        self.assertEqual(rules[1]['rules'][0]['selectors'], [u'c'])
+
+    def test_error(self):
+        self.assertRaises(CSSParseError, parse, u'a { b }')
+
+    def test_old_gradient_parser(self):
+        parts = old_gradient_parser(u'-webkit-gradient(linear, from(red))')
+        self.assertEqual(parts[0].name, u'-webkit-gradient')
+        self.assertEqual([a.name for a in parts[0].args], [u'linear', u'from'])
+        self.assertEqual(parts[0].args[1].args[0].name, u'red')
+
+
+class TestFixup(unittest.TestCase):
+    def test_golden(self):
+        for stylesheet, expected in GOLDEN:
+            self.assertEqual(fixup_css(stylesheet), expected)
+
+    def test_unicode(self):
+        self.assertEqual(fixup_css(u'a { -webkit-transform: \u2028r\xe9 }'),
+                         u'a {\n  transform: r\xe9;\n}')
+        self.assertEqual(fixup_css(u'a{-webkit-border-radius:1px}'),
+                         u'a {\n  border-radius: 1px;\n}')
+
+    def test_latin1(self):
+        # readBytes() gives the JS a binary string; \xa0 is whitespace.
+        self.assertEqual(fixup_css('a {\xa0-webkit-transform:\xa0x\xe9\xa0}'),
+                         'a {\n  transform: x\xe9;\n}')
+
+    def test_throws(self):
+        self.assertRaises(JSError, fixup_css, 'a { b: -webkit-gradient(linear) }')
+
+    def test_large_rule(self):
+        # Fixups already in the rule or added earlier are skipped.
+        declarations = ['-webkit-border-radius: %dpx' % (i % 1000)
+                        for i in range(3000)]
+        declarations[10:10] = ['/* x */ border-radius: 5px',
+                               '-webkit-border-image: url(a.png) 1']
+        expected = ['border-radius: %dpx;' % i for i in range(10) if i != 5] + \
+            ['undefined: undefined;', 'border-radius: 5px;',
+             'border-image: url(a.png) 1;', 'border-style: solid;'] + \
+            ['border-radius: %dpx;' % i for i in range(10, 1000)]
+        self.assertEqual(fixup_css('a { %s }' % '; '.join(declarations)),
+                         'a {\n  %s\n}' % '\n  '.join(expected))
+
+
+class TestFixupStream(unittest.TestCase):
+    def test_golden(self):
+        r = random.Random(6)
+        for stylesheet, expected in GOLDEN[:-1]:
+            for _ in range(10):
+                chunks = random_chunks(stylesheet, r)
+                self.assertEqual(''.join(fixup_css_stream(chunks)), expected,
+                                 "Mismatch for %r" % chunks)
+
+    def test_incremental(self):
+        stream = FixupStream()
+        self.assertEqual(stream.feed(u'a { -webkit-transform: none }\nb {'),
+                         u'a {\n  transform: none;\n}')
+        self.assertEqual(stream.feed(u' -webkit-order: 1 }'), u'')
+        self.assertEqual(stream.close(), u'\n\nb {\n  order: 1;\n}')
+
+    def test_unfinished(self):
+        # More text could still close the string, or the parentheses.
+        for css in (u'a { content: "x; -webkit-order: 1 } b {}',
+                    u'a { b: url(x; -webkit-order: 1 } b {}'):
+            self.assertEqual(FixupStream().feed(css), u'')
+
+    def test_parse_error(self):
+        chunks = ['<!-- a { -webkit-order: 1 }\n', 'b { c: d', ' -->']
+        self.assertEqual(''.join(fixup_css_stream(chunks)),
+                         'a {\n  order: 1;\n}\n\nb { c: d -->')
+        chunks = ['<!-', '- a { c: d']
+        self.assertEqual(''.join(fixup_css_stream(chunks)), ''.join(chunks))
+
+    def test_throws(self):
+        chunks = ['a { b: -webkit-gradient(linear) }\n', 'c { -webkit-order: 1 }']
+        self.assertEqual(''.join(fixup_css_stream(chunks)),
+                         'a { b: -webkit-gradient(linear) }\n\n\n'
+                         'c {\n  order: 1;\n}')
+
+
+class TestFixupCache(unittest.TestCase):
+    def test_lru(self):
+        cache = FixupCache(max_bytes=3 * 41)
+        for key in ('a' * 40, 'b' * 40, 'c' * 40):
+            self.assertTrue(cache.put(key, 'x'))
+        cache.get('a' * 40)
+        cache.put('d' * 40, 'x')
+        self.assertEqual(cache.entries.keys(), ['c' * 40, 'a' * 40, 'd' * 40])
+        self.assertEqual(cache.size, 3 * 41)
+        self.assertFalse(cache.put('e' * 40, 'x' * 100))
+        self.assertEqual(len(cache), 3)
+
+    def test_fixup(self):
+        cache = FixupCache()
+        css = 'a { -webkit-transform: none }'
+        self.assertEqual(cache.fixup(css), fixup_css(css))
+        self.assertEqual(cache.get(cache_key(css)), fixup_css(css))
+
+    def test_dumps(self):
+        cache = FixupCache()
+        cache.put(cache_key('a'), '\xe9\xa0')
+        cache.put(cache_key('b'), '')
+        other = FixupCache()
+        other.loads(cache.dumps())
+        self.assertEqual(other.entries, cache.entries)
+        data = json.loads(cache.dumps())
+        data['version'] = CACHE_VERSION + 1
+        other = FixupCache()
+        other.loads(json.dumps(data))
+        self.assertEqual(len(other), 0)
+
+
+class TestBench(unittest.TestCase):
+    def test_generate_stylesheet(self):
+        css = generate_stylesheet(1, 20000)
+        self.assertEqual(css, generate_stylesheet(1, 20000))
+        self.assertTrue(20000 <= len(css) < 25000)
+        self.assertNotEqual(fixup_css(css), css)
+
+    def test_regressions(self):
+        def results(ms):
+            return [{'name': 'a', 'phases': dict([
+                (phase, {'ms': [ms, 1, ms], 'heap_bytes': [0, 2, 4]})
+                for phase in PHASES])}]
+        baseline = json.loads(json.dumps(summarize(results(10))))
+        self.assertEqual(summarize(results(10))['a']['parse'], (10, 2))
+        self.assertEqual(find_regressions(summarize(results(10.5)), baseline, 0.1), [])
+        self.assertEqual(find_regressions(summarize(results(12)), baseline, 0.1),
+                         [('a', phase, 12, 10) for phase in sorted(PHASES)])
+
+
+class TestBundle(unittest.TestCase):
+    def setUp(self):
+        with open(CSS_BROWSERSIDE_JS) as fh:
+            self.bundle = fh.read()
+
+    def test_round_trip(self):
+        self.assertEqual(format_bundle(*parse_bundle(self.bundle)), self.bundle)
+
+    def test_shake(self):
+        shaken = shake_bundle(self.bundle)
+        prefix, modules, entries, suffix = parse_bundle(shaken)
+        # css, css-parse, css-stringify, its compiler and identity compiler,
+        # and stubs for compress and source-map-support.
+        self.assertEqual(modules.keys(), range(1, 9))
+        self.assertEqual(entries, [1])
+        self.assertTrue('SourceMapGenerator' not in shaken)
+        self.assertTrue("isn't in this build" in modules[8][0])
+        self.assertEqual(shake_bundle(shaken), shaken)
+
+
+class TestNodeParity(unittest.TestCase):
+    def setUp(self):
+        if not NODE:
+            self.skipTest("node isn't installed")
+
+    def test_golden(self):
+        stylesheets = [stylesheet for stylesheet, _ in GOLDEN]
+        for stylesheet, expected in zip(stylesheets, node_fixup(stylesheets)):
+            self.assertEqual(python_fixup(stylesheet), expected)
+
+    def test_random(self):
+        r = random.Random(4)
+        stylesheets = [random_stylesheet(r) for _ in range(500)]
+        for stylesheet, expected in zip(stylesheets, node_fixup(stylesheets)):
+            if 'error' in expected:
+                expected = {'error': 'JSError'}
+            self.assertEqual(python_fixup(stylesheet), expected,
+                             "Mismatch for %r" % stylesheet)
+
+    def test_stream(self):
+        r = random.Random(7)
+        streams = []
+        for _ in range(300):
+            stylesheet = '\n'.join([random_stylesheet(r)
+                                     for _ in range(r.randint(1, 4))])
+            streams.append(random_chunks(stylesheet, r))
+        for chunks, expected in zip(streams, node_fixup(streams)):
+            self.assertEqual({'css': ''.join(fixup_css_stream(chunks)).decode('latin-1')},
+                             expected, "Mismatch for %r" % chunks)
+
+    def test_bench(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'bench.css')
+            with open(path, 'w') as fh:
+                fh.write(generate_stylesheet(1, 5000))
+            manifest = os.path.join(tmp_dir, 'manifest.json')
+            with open(manifest, 'w') as fh:
+                json.dump({'iterations': 2, 'stylesheets': [
+                    {'name': 'bench', 'path': path}]}, fh)
+            output = os.path.join(tmp_dir, 'results.json')
+            subprocess.check_call([NODE, '--expose-gc', BENCH_JS, BOOTSTRAP_JS,
+                                   CSS_BROWSERSIDE_JS, manifest, output])
+            with open(output) as fh:
+                results = json.load(fh)
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertEqual(results[0]['name'], 'bench')
+        for phase in PHASES:
+            self.assertEqual(len(results[0]['phases'][phase]['ms']), 2)
+
+    def test_shaken_bundle(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            bundle = os.path.join(tmp_dir, 'css-browserside.js')
+            with open(CSS_BROWSERSIDE_JS) as fh:
+                shaken = shake_bundle(fh.read())
+            with open(bundle, 'w') as fh:
+                fh.write(shaken)
+            stylesheets = [stylesheet for stylesheet, _ in GOLDEN]
+            results = node_fixup(stylesheets, bundle=bundle)
+        finally:
+            shutil.rmtree(tmp_dir)
+        for (stylesheet, expected), result in zip(GOLDEN, results):
+            self.assertEqual(result, {'css': expected})
+
+    def test_packed_cache(self):
+        """bootstrap.fixupCache serves the results in a packed cache
+        from FixupCache.
+        """
+        stylesheets = [stylesheet for stylesheet, _ in GOLDEN]
+        cache = FixupCache()
+        for stylesheet in stylesheets[:-1]:
+            cache.fixup(stylesheet)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            cache_file = os.path.join(tmp_dir, 'cssfixer-cache.json')
+            with open(cache_file, 'w') as fh:
+                fh.write(cache.dumps())
+            results = node_fixup(stylesheets, cache_file=cache_file)
+        finally:
+            shutil.rmtree(tmp_dir)
+        for (stylesheet, expected), result in zip(GOLDEN[:-1], results):
+            self.assertEqual(result, {'css': expected})
+        self.assertEqual(results[-1], {'miss': True})
+
+    def test_js_lru(self):
+        script = """
+            var bootstrap = require(%s);
+            var cache = bootstrap.fixupCache;
+            cache._entries = Object.create(null);
+            cache.maxBytes = 9;
+            cache._insert('a', 'xx', true);
+            cache._insert('b', 'xx', false);
+            cache._insert('c', 'xx', true);
+            cache.get('a');
+            cache._insert('d', 'xx', true);
+            process.stdout.write(cache.serialize());
+        """ % json.dumps(BOOTSTRAP_JS)
+        # bootstrap.js isn't a module; export it for require().
+        proc = subprocess.Popen(
+            [NODE, '-e', "require.extensions['.js'] = function(module, path) {"
+             "module._compile(require('fs').readFileSync(path, 'utf8') + "
+             "'\\nmodule.exports = bootstrap;', path); };" + script],
+            stdout=subprocess.PIPE)
+        data = json.loads(proc.communicate()[0])
+        self.assertEqual(data, {'version': CACHE_VERSION,
+                                'entries': [['c', 'xx'], ['a', 'xx'], ['d', 'xx']]})
+
+
+class TestMobilePartnerRepack(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.download_dir = os.path.join(self.tmpdir, 'download')
+        os.makedirs(self.download_dir)
+        omni_ja = StringIO()
+        zf = zipfile.ZipFile(omni_ja, 'w')
+        zf.writestr('chrome/skin/a.css', 'a { -webkit-order: 1 }')
+        zf.close()
+        zf = zipfile.ZipFile(os.path.join(self.download_dir, 'fennec.en-US.apk'), 'w')
+        zf.writestr('assets/omni.ja', omni_ja.getvalue())
+        zf.writestr('META-INF/CERT.RSA', 'signature')
+        zf.close()
+        self.files_dir = os.path.join(self.tmpdir, 'files') + os.sep
+        os.makedirs(self.files_dir)
+        open(os.path.join(self.files_dir, 'bootstrap.js'), 'w').write('// js\n')
+        work_dir = os.path.join(self.tmpdir, 'work')
+        self.cfg = os.path.join(self.tmpdir, 'repack.json')
+        json.dump({
+            'log_name': 'partner_repack',
+            'base_work_dir': self.tmpdir,
+            'work_dir': 'work',
+            'workdir': work_dir,
+            'locales': ['en-US'],
+            'platforms': ['android'],
+            'installer_base_names': {'android': 'fennec.%(locale)s.apk'},
+            'download_base_url': self.download_dir,
+            'files_directory': self.files_dir,
+            'inserted_files': ['bootstrap.js'],
+            'fixup_omni_css': ['chrome/skin/*.css'],
+            'parallel_workers': 1,
+            'version': '1.0', 'buildnum': 1,
+            'ftp_server': '', 'ftp_user': '', 'ftp_ssh_key': '',
+            'aus_server': '', 'aus_user': '', 'aus_ssh_key': '',
+        }, open(self.cfg, 'w'))
+        self.module = imp.load_source('mobile_cssfixer_repack', REPACK_SCRIPT)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def repack(self, rebuilds=True):
+        argv = sys.argv
+        sys.argv = [REPACK_SCRIPT, '--cfg', self.cfg, '--no-config-cache',
+                    '--download', '--repack']
+        try:
+            script = self.module.MobilePartnerRepack()
+        finally:
+            sys.argv = argv
+        self.assertTrue(isinstance(script.config['fixup_omni_css'], tuple))
+        repacked = []
+        repack_apk = script._repack_apk
+
+        def _repack_apk(*args):
+            repacked.append(args[0])
+            return repack_apk(*args)
+        script._repack_apk = _repack_apk
+        try:
+            script.run()
+        except SystemExit, e:
+            self.assertEqual(e.code, 0)
+        self.assertEqual(len(repacked), int(rebuilds))
+        return os.path.join(self.tmpdir, 'work', 'unsigned', 'android', 'en-US',
+                            'fennec.en-US.apk')
+
+    def test_incremental_repack(self):
+        unsigned = self.repack()
+        omni_ja = zipfile.ZipFile(StringIO(zipfile.ZipFile(unsigned).read('assets/omni.ja')))
+        self.assertEqual(omni_ja.read('chrome/skin/a.css'), 'a {\n  order: 1;\n}')
+        # The config is locked, and the manifest reads it back as JSON.
+        self.assertEqual(self.repack(rebuilds=False), unsigned)
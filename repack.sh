@@ -1,4 +1,4 @@
 #!/bin/bash
 cd ~/cssfixer
-mozharness/scripts/mobile_cssfixer_repack.py --cfg repack_config.py
+mozharness/scripts/mobile_cssfixer_repack.py --cfg repack_config.py "$@"
 
@@ -20,7 +20,13 @@ config = {
         "android": APK_BASE_NAME,
     },
     "download_base_url": DOWNLOAD_BASE_URL,
-    "inserted_files": ["browser.js", "bootstrap.js", "css-browserside.js"],
+    # cssfixer-cache.json is the packed fixup cache; rebuild it with
+    # mozharness/scripts/cssfixer_fixup.py --pack-cache
+    "inserted_files": ["browser.js", "bootstrap.js", "css-browserside.js", "cssfixer-cache.json"],
+    # stylesheets in omni.ja to fix up at repack time, e.g. ["chrome/skin/*.css"]
+    "fixup_omni_css": [],
+    # ship css-browserside.js without the source map and compressing compiler code it never uses
+    "shake_css_browserside": True,
     "default_actions": [ "download", "repack", "sign", "upload-signed-bits", "summary"],
 
     "release_config_file": "%srelease-fennec-mozilla-release.py" % BUILD_HOME,